@@ -0,0 +1,195 @@
+"""
+Admission Control for LLM-backed endpoints
+Keeps upstream LLM traffic inside provider rate limits and sheds excess
+load quickly so callers can fall back to deterministic output.
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+import metrics
+
+
+class Overloaded(Exception):
+    """Raised when a request is shed instead of being admitted"""
+
+    def __init__(self, message: str, reason: str = "overloaded"):
+        super().__init__(message)
+        self.reason = reason
+
+
+class TokenBucket:
+    """
+    Classic token bucket: `rate` tokens per second, holding at most `capacity`.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def try_acquire(self, tokens: float = 1) -> float:
+        """
+        Take `tokens` if available.
+
+        Returns:
+            0.0 on success, otherwise the seconds until enough tokens accumulate
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return 0.0
+            return (tokens - self._tokens) / self.rate
+
+    def wait_time(self, tokens: float = 1) -> float:
+        """Seconds until `tokens` are available, without taking them"""
+        with self._lock:
+            available = min(self.capacity, self._tokens + (time.monotonic() - self._updated) * self.rate)
+            return max(0.0, (tokens - available) / self.rate)
+
+
+class AdmissionController:
+    """
+    Admission control for one upstream LLM provider.
+
+    A request is admitted when it holds:
+        1. a slot in the bounded wait queue (otherwise shed immediately),
+        2. its patient's semaphore (one LLM workflow per patient by default),
+        3. a global concurrency slot,
+        4. `cost` tokens from the provider's token bucket.
+    Anything that cannot be admitted within `max_wait_seconds` is shed.
+    A cost above the bucket's burst could never be admitted, so it is clamped
+    to the burst (with a warning). Decisions are counted in
+    medtwin_llm_admission_decisions_total.
+    """
+
+    def __init__(self, name: str, rate_per_second: float = 5.0, burst: float = 10.0,
+                 max_concurrent: int = 8, per_patient_limit: int = 1,
+                 max_waiting: int = 16, max_wait_seconds: float = 2.0):
+        self.name = name
+        self.bucket = TokenBucket(rate_per_second, burst)
+        self.max_concurrent = max_concurrent
+        self.per_patient_limit = per_patient_limit
+        self.max_waiting = max_waiting
+        self.max_wait_seconds = max_wait_seconds
+
+        self._global = threading.BoundedSemaphore(max_concurrent)
+        self._lock = threading.Lock()
+        self._patients: Dict[str, list] = {}  # patient_id -> [semaphore, refcount]
+        self._waiting = 0
+        self._in_flight = 0
+        self.admitted = 0
+        self.shed = 0
+        self._clamped_costs = set()
+
+    def _effective_cost(self, cost: float) -> float:
+        if cost <= self.bucket.capacity:
+            return cost
+        if cost not in self._clamped_costs:
+            self._clamped_costs.add(cost)
+            print(f"⚠️  {self.name}: request cost {cost} exceeds the burst of {self.bucket.capacity}; "
+                  f"admitting it at cost {self.bucket.capacity} (raise the burst to avoid this)")
+        return self.bucket.capacity
+
+    def _record(self, decision: str, reason: str):
+        # Called with self._lock held
+        if decision == "admitted":
+            self.admitted += 1
+        else:
+            self.shed += 1
+        metrics.LLM_ADMISSION_DECISIONS.labels(self.name, decision, reason).inc()
+
+    def would_shed(self, patient_id: Optional[str] = None, cost: float = 1) -> bool:
+        """
+        Cheap pre-check: True if a new request would (very likely) be shed right now,
+        because the wait queue is full, the token bucket can't supply `cost` within
+        max_wait_seconds, or `patient_id` already has per_patient_limit workflows.
+        Global concurrency is not checked: slots free up as workflows finish.
+        """
+        with self._lock:
+            if self._waiting >= self.max_waiting:
+                return True
+            entry = self._patients.get(patient_id) if patient_id is not None else None
+            if entry and entry[1] >= self.per_patient_limit:
+                return True
+        return self.bucket.wait_time(self._effective_cost(cost)) > self.max_wait_seconds
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "waiting": self._waiting,
+                "in_flight": self._in_flight,
+                "admitted": self.admitted,
+                "shed": self.shed
+            }
+
+    @contextmanager
+    def admit(self, patient_id: str, cost: float = 1):
+        """
+        Hold an admission slot for the duration of the block.
+
+        Raises:
+            Overloaded: if the request is shed
+        """
+        cost = self._effective_cost(cost)
+        with self._lock:
+            if self._waiting >= self.max_waiting:
+                self._record("shed", "queue_full")
+                raise Overloaded(f"{self.name}: wait queue full", "queue_full")
+            self._waiting += 1
+            entry = self._patients.setdefault(patient_id, [threading.Semaphore(self.per_patient_limit), 0])
+            entry[1] += 1
+
+        deadline = time.monotonic() + self.max_wait_seconds
+        patient_held = global_held = admitted = False
+        try:
+            patient_held = entry[0].acquire(timeout=max(0.0, deadline - time.monotonic()))
+            if not patient_held:
+                raise Overloaded(f"{self.name}: patient {patient_id} already has an LLM request in flight",
+                                 "patient_busy")
+
+            global_held = self._global.acquire(timeout=max(0.0, deadline - time.monotonic()))
+            if not global_held:
+                raise Overloaded(f"{self.name}: concurrency limit reached", "concurrency")
+
+            while True:
+                delay = self.bucket.try_acquire(cost)
+                if delay == 0.0:
+                    break
+                if time.monotonic() + delay > deadline:
+                    raise Overloaded(f"{self.name}: rate limit reached", "rate_limit")
+                time.sleep(delay)
+
+            admitted = True
+            with self._lock:
+                self._waiting -= 1
+                self._in_flight += 1
+                self._record("admitted", "none")
+
+            yield
+        except Overloaded as e:
+            if not admitted:
+                with self._lock:
+                    self._record("shed", e.reason)
+            raise
+        finally:
+            with self._lock:
+                if admitted:
+                    self._in_flight -= 1
+                else:
+                    self._waiting -= 1
+                entry[1] -= 1
+                if entry[1] == 0:
+                    self._patients.pop(patient_id, None)
+            if global_held:
+                self._global.release()
+            if patient_held:
+                entry[0].release()
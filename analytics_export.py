@@ -0,0 +1,273 @@
+"""
+Columnar Analytics Export for MedTwin
+Appends new AgentData rows to a partitioned Parquet dataset so cohort reports and
+model recalibration can scan full histories column-wise without touching the
+live SQLite file.
+
+Layout (hive partitioning, one set of files per exported id range):
+    analytics/agent_data/agent_type=LegacyCSV/month=2025-01/part-1-50000-0.parquet
+    analytics/_watermark.json     {"last_id": 50000, ...}
+
+Known clinical payload fields (database.CLINICAL_FIELDS) are flattened into typed
+columns using the generated columns SQLite already maintains, so payloads are
+never decoded in Python; the raw payload is kept as a JSON string column.
+
+Each run only reads rows with id > watermark, in short read transactions of
+--chunk-size rows (WAL readers don't block API writers). File names are derived
+from the id range, so a run interrupted before the watermark is saved rewrites
+the same files instead of duplicating rows.
+
+Requires pyarrow; query() also needs duckdb (pip install -r requirements-analytics.txt).
+
+Usage:
+    python analytics_export.py                 # export rows added since the last run
+    python analytics_export.py --full          # delete the dataset and re-export everything
+    python analytics_export.py --query "SELECT agent_type, count(*) FROM agent_data GROUP BY 1"
+"""
+
+import argparse
+import json
+import os
+import shutil
+import time
+from typing import Dict, List, Optional
+
+from sqlalchemy import String, select, type_coerce
+
+from database import engine, AgentData, CLINICAL_FIELDS
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+    PYARROW_AVAILABLE = True
+except ImportError:
+    PYARROW_AVAILABLE = False
+
+try:
+    import duckdb
+    DUCKDB_AVAILABLE = True
+except ImportError:
+    DUCKDB_AVAILABLE = False
+
+EXPORT_DIR = os.environ.get("MEDTWIN_ANALYTICS_DIR", "analytics")
+DATASET_NAME = "agent_data"
+WATERMARK_FILE = "_watermark.json"
+PARTITION_COLUMNS = ["agent_type", "month"]
+
+
+def _require_pyarrow():
+    if not PYARROW_AVAILABLE:
+        raise RuntimeError("pyarrow is required for the analytics export (pip install pyarrow)")
+
+
+def export_schema():
+    """Arrow schema of the exported rows (partition columns included)"""
+    _require_pyarrow()
+    arrow_types = {int: pa.int64(), float: pa.float64(), str: pa.string()}
+    fields = [
+        pa.field("id", pa.int64(), nullable=False),
+        pa.field("patient_id", pa.string()),
+        pa.field("agent_type", pa.string()),
+        pa.field("month", pa.string()),
+        pa.field("timestamp", pa.timestamp("us")),
+    ]
+    for field, (_, type_) in CLINICAL_FIELDS.items():
+        fields.append(pa.field(field, arrow_types[type_().python_type]))
+    fields.append(pa.field("data_payload", pa.string()))
+    return pa.schema(fields)
+
+
+def dataset_path(export_dir: Optional[str] = None) -> str:
+    return os.path.join(export_dir or EXPORT_DIR, DATASET_NAME)
+
+
+# ============================================================
+# WATERMARK
+# ============================================================
+
+def read_watermark(export_dir: Optional[str] = None) -> Dict:
+    path = os.path.join(export_dir or EXPORT_DIR, WATERMARK_FILE)
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {"last_id": 0, "rows": 0}
+
+
+def write_watermark(watermark: Dict, export_dir: Optional[str] = None):
+    """Replace the watermark atomically, after the files it covers are written"""
+    directory = export_dir or EXPORT_DIR
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, WATERMARK_FILE)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(watermark, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+# ============================================================
+# EXPORT
+# ============================================================
+
+def _chunk_query(after_id: int, limit: int):
+    table = AgentData.__table__
+    return select(
+        table.c.id,
+        table.c.patient_id,
+        table.c.agent_type,
+        table.c.timestamp,
+        *(table.c[field] for field in CLINICAL_FIELDS),
+        type_coerce(table.c.data_payload, String),  # raw JSON text, not decoded
+    ).where(table.c.id > after_id).order_by(table.c.id).limit(limit)
+
+
+def _to_arrow(rows: List, schema):
+    columns: Dict[str, list] = {name: [] for name in schema.names}
+    clinical = list(CLINICAL_FIELDS)
+    for row in rows:
+        row_id, patient_id, agent_type, timestamp = row[:4]
+        columns["id"].append(row_id)
+        columns["patient_id"].append(patient_id)
+        columns["agent_type"].append(agent_type or "unknown")
+        columns["month"].append(timestamp.strftime("%Y-%m") if timestamp else "unknown")
+        columns["timestamp"].append(timestamp)
+        for field, value in zip(clinical, row[4:-1]):
+            columns[field].append(value)
+        columns["data_payload"].append(row[-1])
+    return pa.table(columns, schema=schema)
+
+
+def export_agent_data(export_dir: Optional[str] = None, chunk_size: int = 50000, full: bool = False,
+                      bind=None) -> Dict:
+    """
+    Append AgentData rows newer than the watermark to the Parquet dataset.
+
+    Args:
+        export_dir: dataset root (default MEDTWIN_ANALYTICS_DIR or ./analytics)
+        chunk_size: rows per read transaction and per written file set
+        full: delete the existing dataset and watermark first
+
+    Returns:
+        {"rows": rows exported by this run, "last_id": new watermark, "elapsed_seconds": ...}
+    """
+    _require_pyarrow()
+    bind = bind or engine
+    export_dir = export_dir or EXPORT_DIR
+    root = dataset_path(export_dir)
+    start = time.perf_counter()
+
+    if full:
+        shutil.rmtree(root, ignore_errors=True)
+        write_watermark({"last_id": 0, "rows": 0}, export_dir)
+
+    watermark = read_watermark(export_dir)
+    schema = export_schema()
+    exported = 0
+    while True:
+        # Short read transaction per chunk so WAL checkpoints aren't held back
+        with bind.connect() as conn:
+            rows = conn.execute(_chunk_query(watermark["last_id"], chunk_size)).all()
+        if not rows:
+            break
+
+        first_id, last_id = rows[0][0], rows[-1][0]
+        pq.write_to_dataset(
+            _to_arrow(rows, schema),
+            root,
+            partition_cols=PARTITION_COLUMNS,
+            basename_template=f"part-{first_id}-{last_id}-{{i}}.parquet",
+            existing_data_behavior="overwrite_or_ignore",
+        )
+        exported += len(rows)
+        watermark = {
+            "last_id": last_id,
+            "rows": watermark.get("rows", 0) + len(rows),
+            "updated_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        }
+        write_watermark(watermark, export_dir)
+        print(f"   ... exported ids {first_id}-{last_id} ({exported} rows this run)")
+
+        if len(rows) < chunk_size:
+            break
+
+    return {
+        "rows": exported,
+        "last_id": watermark["last_id"],
+        "total_rows": watermark.get("rows", 0),
+        "elapsed_seconds": round(time.perf_counter() - start, 3),
+    }
+
+
+# ============================================================
+# QUERY HELPERS
+# ============================================================
+
+def open_dataset(export_dir: Optional[str] = None):
+    """The exported history as a pyarrow Dataset (filter/project before loading)"""
+    _require_pyarrow()
+    return ds.dataset(
+        dataset_path(export_dir),
+        format="parquet",
+        partitioning=ds.partitioning(
+            pa.schema([("agent_type", pa.string()), ("month", pa.string())]), flavor="hive"
+        ),
+    )
+
+
+def load_columns(columns: List[str], filter=None, export_dir: Optional[str] = None):
+    """
+    Read only the given columns into a pandas DataFrame.
+
+    Example:
+        load_columns(["patient_id", "hba1c"], filter=ds.field("hba1c") > 9)
+    """
+    return open_dataset(export_dir).to_table(columns=columns, filter=filter).to_pandas()
+
+
+def query(sql: str, export_dir: Optional[str] = None):
+    """
+    Run SQL with DuckDB over the exported dataset, exposed as the view agent_data.
+
+    Example:
+        query("SELECT month, avg(hba1c) FROM agent_data GROUP BY month ORDER BY month")
+    """
+    if not DUCKDB_AVAILABLE:
+        raise RuntimeError("duckdb is required for SQL queries on the export (pip install duckdb)")
+    pattern = os.path.join(dataset_path(export_dir), "**", "*.parquet").replace("'", "''")
+    with duckdb.connect() as conn:
+        conn.execute(
+            f"CREATE VIEW agent_data AS SELECT * FROM read_parquet('{pattern}', hive_partitioning = true)"
+        )
+        return conn.execute(sql).df()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dir", default=EXPORT_DIR, help="dataset root (default: %(default)s)")
+    parser.add_argument("--chunk-size", type=int, default=50000)
+    parser.add_argument("--full", action="store_true", help="re-export the whole history")
+    parser.add_argument("--query", help="run SQL over the export (DuckDB) instead of exporting")
+    args = parser.parse_args()
+
+    if args.query:
+        print(query(args.query, args.dir).to_string(index=False))
+        return
+
+    if not PYARROW_AVAILABLE:
+        print("❌ Error: pyarrow is not installed (pip install pyarrow)")
+        return
+
+    since = "full" if args.full else f"after id {read_watermark(args.dir)['last_id']}"
+    print(f"🚀 Exporting AgentData -> {dataset_path(args.dir)} ({since})")
+    result = export_agent_data(args.dir, chunk_size=args.chunk_size, full=args.full)
+    if result["rows"]:
+        rate = result["rows"] / max(result["elapsed_seconds"], 1e-9)
+        print(f"🎉 Exported {result['rows']} rows in {result['elapsed_seconds']:.1f}s "
+              f"({rate:.0f} rows/s); watermark at id {result['last_id']}")
+    else:
+        print(f"✅ Already up to date (watermark at id {result['last_id']})")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,54 +3,113 @@ FastAPI Backend for MedTwin Digital Twin System
 Provides REST API endpoints for patient twin operations
 """
 
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, HTTPException, Depends, Request, WebSocket, WebSocketDisconnect
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple
+from collections import OrderedDict
 from datetime import datetime
-from sqlalchemy.orm import Session
-from database import get_db, Patient, AgentData
+import json
+import math
+import threading
+import time
+import uuid
+from sqlalchemy import func, insert, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import get_async_db, engine, async_engine, SessionLocal, AsyncSessionLocal, Patient, AgentData, PatientLatestState, ACTION_PLAN_AGENT_TYPE, LAB_MEASUREMENT_FIELDS, migrate_db
 from digital_twin import DiabetesTwin
-from simulation_engine import GlucoseSimulator, RiskAssessor
+from simulation_engine import GlucoseSimulator, RiskAssessor, build_feature_columns
+from jobs import JobQueue
+from lab_reference import interpret_lab_value, interpret_panel, interpret_column, lab_legend
+from lab_parser import canonical_analyte, parse_lab_report, to_agent_payload
+from admission import AdmissionController, Overloaded
+from cohort import CohortFilterError, cohort_query, cohort_count_query
+from write_behind import WriteBehindWriter, DURABILITY_MODES
+from timeseries import GlucoseWriteBuffer, glucose_range_query, latest_glucose_query, merge_readings, first_lab_measurement_query, lab_trend_query, now_ms
+import metrics
 
 # --- AGENT INTEGRATION ---
 import sys
 import os
+from contextlib import asynccontextmanager
 
 # Add GradProject to path to import agents
 sys.path.append(os.path.join(os.path.dirname(__file__), "GradProject"))
 
-try:
-    from medtwin_agents import initialize_deepseek, AnalysisAgent, PlanningAgent, PredictionAgent, NotifierAgent
-    
-    # Initialize Agents (Try to get key from env, else use placeholder)
-    # The user should set DEEPSEEK_API_KEY in their environment
-    api_key = os.environ.get("DEEPSEEK_API_KEY") 
-    print(f"DEBUG: Read API Name: '{api_key}'") # Debug print 
-    if not api_key:
-        print("⚠️  WARNING: DEEPSEEK_API_KEY not found. Agent features may fail or return mocks.")
-        # fallback for demo if needed, or let it fail
-    
-    llm = initialize_deepseek(api_key)
-    analysis_agent = AnalysisAgent(llm)
-    planning_agent = PlanningAgent(llm)
-    prediction_agent = PredictionAgent(llm)  # Added for organ-specific forecasting
-    
-    AGENTS_AVAILABLE = True
-except ImportError as e:
-    print(f"⚠️  Agent Import Failed: {e}")
-    AGENTS_AVAILABLE = False
-except Exception as e:
-    print(f"⚠️  Agent Initialization Failed: {e}")
-    AGENTS_AVAILABLE = False
+# Agents are built lazily on first LLM use: importing LangChain and creating
+# the DeepSeek client is the slowest part of startup and most requests
+# (twin, risks, simulation) never need it.
+AGENTS_AVAILABLE: Optional[bool] = None  # None = not initialized yet
+analysis_agent = None
+planning_agent = None
+prediction_agent = None
+notifier_agent = None
+_agents_lock = threading.Lock()
+
+
+def agents_available() -> bool:
+    """Initialize the DeepSeek agents on first call (thread-safe). Returns availability."""
+    global AGENTS_AVAILABLE, analysis_agent, planning_agent, prediction_agent, notifier_agent
+    if AGENTS_AVAILABLE is not None:
+        return AGENTS_AVAILABLE
+    
+    with _agents_lock:
+        if AGENTS_AVAILABLE is not None:
+            return AGENTS_AVAILABLE
+        try:
+            from medtwin_agents import initialize_deepseek, AnalysisAgent, PlanningAgent, PredictionAgent, NotifierAgent
+            
+            # The user should set DEEPSEEK_API_KEY in their environment
+            api_key = os.environ.get("DEEPSEEK_API_KEY")
+            if not api_key:
+                print("⚠️  WARNING: DEEPSEEK_API_KEY not found. Agent features may fail or return mocks.")
+            
+            llm = initialize_deepseek(api_key)
+            analysis_agent = AnalysisAgent(llm)
+            planning_agent = PlanningAgent(llm)
+            prediction_agent = PredictionAgent(llm)  # Added for organ-specific forecasting
+            notifier_agent = NotifierAgent(llm)
+            AGENTS_AVAILABLE = True
+        except ImportError as e:
+            print(f"⚠️  Agent Import Failed: {e}")
+            AGENTS_AVAILABLE = False
+        except Exception as e:
+            print(f"⚠️  Agent Initialization Failed: {e}")
+            AGENTS_AVAILABLE = False
+    return AGENTS_AVAILABLE
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Startup diagnostics and optional agent warm-up; flush buffers on shutdown"""
+    for directory in ("assets", "models"):
+        if not os.path.exists(directory):
+            print(f"⚠️  '{directory}' directory not found. 3D models may fail to load.")
+    
+    if os.environ.get("MEDTWIN_WARM_AGENTS", "0") == "1":
+        # Warm up in the background so the server accepts traffic immediately
+        threading.Thread(target=agents_available, name="medtwin-agent-warmup", daemon=True).start()
+    
+    # Migrations: latest state and lab history tables (backfilled on first run)
+    await run_in_threadpool(migrate_db)
+    
+    yield
+    
+    # Write any buffered rows and CGM readings before the process exits
+    agent_data_writer.stop()
+    glucose_buffer.stop()
+    plan_jobs.shutdown(wait=False)
+
 
 # Initialize FastAPI app
 app = FastAPI(
     title="MedTwin API",
     description="Digital Twin API for Diabetes Type 2 Management",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 
@@ -63,18 +122,75 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Request latency per route template (patient IDs are not used as labels)
+@app.middleware("http")
+async def record_request_latency(request: Request, call_next):
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        route = request.scope.get("route")
+        metrics.HTTP_REQUEST_SECONDS.labels(
+            request.method,
+            route.path if route else "unmatched",
+            status
+        ).observe(time.perf_counter() - start)
+
+metrics.instrument_engine(engine)
+metrics.instrument_engine(async_engine.sync_engine)
+
 # MOUNT STATIC ASSETS
 # Matches index.html's expectation of ./assets/...
 if os.path.exists("assets"):
     app.mount("/assets", StaticFiles(directory="assets"), name="assets")
-else:
-    print("⚠️  'assets' directory not found. 3D models may fail to load.")
 
 # MOUNT MODELS directory (Critical for 3D visualization)
 if os.path.exists("models"):
     app.mount("/models", StaticFiles(directory="models"), name="models")
-else:
-    print("⚠️  'models' directory not found. 3D models will fail to load.")
+
+# CGM readings are buffered in memory and appended to glucose_readings in batches
+glucose_buffer = GlucoseWriteBuffer(
+    flush_interval=float(os.environ.get("MEDTWIN_CGM_FLUSH_SECONDS", "1.0"))
+)
+
+# add-data rows go through one writer thread that commits them in groups.
+# MEDTWIN_WRITE_DURABILITY: "commit" acknowledges after the row's batch is committed,
+# "enqueue" acknowledges as soon as it is queued (faster, but lost on a crash).
+agent_data_writer = WriteBehindWriter(
+    AgentData.__table__,
+    "agent_data",
+    max_batch=int(os.environ.get("MEDTWIN_WRITE_BATCH", "500")),
+    max_delay=float(os.environ.get("MEDTWIN_WRITE_DELAY_MS", "2")) / 1000,
+    max_queue=int(os.environ.get("MEDTWIN_WRITE_QUEUE", "10000"))
+)
+WRITE_DURABILITY = os.environ.get("MEDTWIN_WRITE_DURABILITY", "commit")
+
+
+# Admission control for LLM-backed endpoints (one controller per upstream provider).
+# Requests that can't be admitted quickly are shed and get the deterministic fallback.
+llm_admission = AdmissionController(
+    "deepseek",
+    rate_per_second=float(os.environ.get("MEDTWIN_LLM_RATE", "5")),
+    burst=float(os.environ.get("MEDTWIN_LLM_BURST", "10")),
+    max_concurrent=int(os.environ.get("MEDTWIN_LLM_MAX_CONCURRENT", "8")),
+    per_patient_limit=int(os.environ.get("MEDTWIN_LLM_PER_PATIENT", "2")),
+    max_waiting=int(os.environ.get("MEDTWIN_LLM_MAX_WAITING", "16")),
+    max_wait_seconds=float(os.environ.get("MEDTWIN_LLM_MAX_WAIT_SECONDS", "2.0"))
+)
+
+# Approximate LLM calls per workflow (token bucket cost)
+# severity + recommendations; narratives add PredictionAgent.llm_calls, action plans PlanningAgent.llm_calls
+ANALYSIS_LLM_CALLS = 2
+SCHEDULE_LLM_CALLS = 1
+
+LLM_ADMISSION_STATE = metrics.gauge(
+    "medtwin_llm_admission_requests",
+    "LLM workflows currently waiting for or holding admission",
+    ("state",)
+)
 
 # Database is now used instead of CSV
 # df = pd.read_csv('diabetes_dataset.csv')
@@ -101,6 +217,35 @@ class SimulationRequest(BaseModel):
     months: int = 6
 
 
+class BatchRequest(BaseModel):
+    """Request model for multi-patient batch endpoints"""
+    patient_ids: List[str]
+    years_ahead: int = 5
+
+
+class LabInterpretRequest(BaseModel):
+    """One patient's panel and/or whole cohort columns to interpret"""
+    panel: Optional[Dict[str, float]] = None                     # {"HbA1c": 7.2, "BMI": 31.0}
+    columns: Optional[Dict[str, List[Optional[float]]]] = None   # {"HbA1c": [6.1, 7.4, ...]}
+
+class CohortRequest(BaseModel):
+    """Population screening filters, e.g. ["HbA1c > 9", "LDL > 160"]"""
+    filters: List[str]
+    fields: Optional[List[str]] = None   # columns to return (default: the filtered fields)
+    latest_only: bool = True             # current values, or any historical record
+    limit: int = 1000
+
+class BatchSimulationRequest(BaseModel):
+    """Request model for multi-patient lifestyle simulation"""
+    patient_ids: List[str]
+    lifestyle_changes: LifestyleChanges
+    months: int = 6
+
+
+class MedicationScheduleRequest(BaseModel):
+    medications: List[Dict]  # NotifierAgent medication dicts: name, dosage, frequency, timing, instructions
+
+
 class MealSimulationRequest(BaseModel):
     """Request model for meal simulation"""
     patient_id: str
@@ -151,187 +296,261 @@ def twin_to_qa_data(twin: DiabetesTwin) -> Dict:
         "Condition": "Type 2 Diabetes Mellitus"
     }
 
-def interpret_lab_value(name: str, value: float, unit: str = "") -> Dict:
+async def get_latest_record(patient_id: str, db: AsyncSession) -> PatientLatestState:
+    """
+    Get a patient's current clinical state: all AgentData payloads merged in time
+    order (derived records are skipped). A primary-key lookup on patient_latest_state.
     """
-    Interpret a lab value and provide user-friendly explanation
+    latest_record = await db.get(PatientLatestState, patient_id)
     
-    Args:
-        name: Lab test name (e.g., "HbA1c", "LDL Cholesterol")
-        value: Numeric value of the lab result
-        unit: Unit of measurement (e.g., "%", "mg/dL")
+    # Only on a miss: tell unknown patients apart from patients without records
+    if not latest_record and not await db.get(Patient, patient_id):
+        raise HTTPException(status_code=404, detail=f"Patient {patient_id} not found in database")
+        
+    if not latest_record:
+        # Should not happen if migration ran
+        raise HTTPException(status_code=404, detail="No medical records found for patient")
+    
+    return latest_record
+
+
+async def get_or_create_twin(patient_id: str, db: AsyncSession) -> DiabetesTwin:
+    """Get twin from database by loading latest agent data"""
+    with metrics.TWIN_BUILD_SECONDS.time():
+        latest_record = await get_latest_record(patient_id, db)
+        
+        # 3. Create Twin from JSON payload
+        # logic: The payload structure matches exactly what df.iloc[i].to_dict() returned
+        patient_data = latest_record.data_payload
+        twin = DiabetesTwin(patient_id=patient_id, patient_data=patient_data)
+        
+        # 4. Apply the latest CGM reading: this process's glucose stream (no DB hit), else the
+        #    newest stored reading (after a restart, or when another worker received the stream)
+        latest_glucose = glucose_buffer.latest(patient_id)
+        metrics.record_cache("latest_glucose", latest_glucose is not None)
+        if not latest_glucose:
+            latest_glucose = (await db.execute(latest_glucose_query(patient_id))).first()
+        if latest_glucose:
+            twin.update_latest_glucose(*latest_glucose)
+    
+    return twin
+
+
+MAX_BATCH_PATIENTS = 500
+
+
+async def load_latest_payloads(patient_ids: List[str], db: AsyncSession):
+    """
+    Load the latest clinical payload for many patients with a single IN query.
     
     Returns:
-        Dictionary with interpretation including status, target, and explanation
-    """
-    
-    # Define lab value reference ranges and interpretations
-    lab_standards = {
-        "HbA1c": {
-            "unit": "%",
-            "normal_range": (4.0, 5.6),
-            "diabetes_target": (0, 7.0),
-            "ranges": [
-                (0, 5.7, "EXCELLENT", "🟢", "Normal - no diabetes"),
-                (5.7, 6.4, "PREDIABETES", "🟡", "Prediabetic range - lifestyle changes needed"),
-                (6.5, 7.0, "CONTROLLED", "🟢", "Diabetes is well-controlled (at ADA target)"),
-                (7.0, 8.0, "SUBOPTIMAL", "🟡", "Above target - medication adjustment may help"),
-                (8.0, 9.0, "POOR", "🟠", "Poor control - need treatment intensification"),
-                (9.0, 15.0, "CRITICAL", "🔴", "Very high - urgent intervention required")
-            ]
-        },
-        "Fasting Glucose": {
-            "unit": "mg/dL",
-            "normal_range": (70, 100),
-            "diabetes_target": (80, 130),
-            "ranges": [
-                (0, 70, "LOW", "🟡", "Risk of hypoglycemia - check with doctor"),
-                (70, 100, "NORMAL", "🟢", "Normal fasting glucose"),
-                (100, 125, "PREDIABETES", "🟡", "Elevated - prediabetic range"),
-                (126, 180, "HIGH", "🟠", "Elevated - indicates poor diabetes control"),
-                (180, 600, "VERY HIGH", "🔴", "Severely elevated - urgent attention needed")
-            ]
-        },
-        "LDL Cholesterol": {
-            "unit": "mg/dL",
-            "normal_range": (0, 100),
-            "diabetes_target": (0, 100),
-            "ranges": [
-                (0, 100, "OPTIMAL", "🟢", "Optimal for diabetes patients"),
-                (100, 129, "NEAR OPTIMAL", "🟢", "Near optimal - acceptable for most"),
-                (130, 159, "BORDERLINE HIGH", "🟡", "Consider statin therapy"),
-                (160, 189, "HIGH", "🟠", "High - statin strongly recommended"),
-                (190, 400, "VERY HIGH", "🔴", "Very high - aggressive lipid management needed")
-            ]
-        },
-        "HDL Cholesterol": {
-            "unit": "mg/dL",
-            "normal_range": (40, 150),
-            "diabetes_target": (40, 150),
-            "ranges": [
-                (0, 40, "LOW", "🟠", "Low HDL increases heart disease risk"),
-                (40, 59, "ACCEPTABLE", "🟡", "Acceptable but could be higher"),
-                (60, 150, "OPTIMAL", "🟢", "Optimal - protective against heart disease")
-            ]
-        },
-        "Blood Pressure (Systolic)": {
-            "unit": "mmHg",
-            "normal_range": (90, 120),
-            "diabetes_target": (0, 130),
-            "ranges": [
-                (0, 90, "LOW", "🟡", "Low blood pressure - monitor for dizziness"),
-                (90, 120, "NORMAL", "🟢", "Normal blood pressure"),
-                (120, 130, "ELEVATED", "🟡", "Elevated - lifestyle changes recommended"),
-                (130, 140, "STAGE 1 HTN", "🟠", "Stage 1 hypertension - medication may be needed"),
-                (140, 180, "STAGE 2 HTN", "🔴", "Stage 2 hypertension - medication required"),
-                (180, 250, "CRISIS", "🔴", "Hypertensive crisis - seek immediate care")
-            ]
-        },
-        "Total Cholesterol": {
-            "unit": "mg/dL",
-            "normal_range": (0, 200),
-            "diabetes_target": (0, 200),
-            "ranges": [
-                (0, 200, "DESIRABLE", "🟢", "Desirable level"),
-                (200, 239, "BORDERLINE HIGH", "🟡", "Borderline - lifestyle changes recommended"),
-                (240, 500, "HIGH", "🔴", "High - medication likely needed")
-            ]
-        },
-        "GGT": {
-            "unit": "U/L",
-            "normal_range": (0, 35),
-            "diabetes_target": (0, 40),
-            "ranges": [
-                (0, 35, "NORMAL", "🟢", "Normal liver enzyme level"),
-                (35, 50, "MILDLY ELEVATED", "🟡", "Mildly elevated - monitor kidney/liver function"),
-                (50, 100, "ELEVATED", "🟠", "Elevated - may indicate kidney stress"),
-                (100, 300, "HIGH", "🔴", "High - nephrology consultation recommended")
-            ]
-        },
-        "Serum Urate": {
-            "unit": "mg/dL",
-            "normal_range": (3.5, 7.0),
-            "diabetes_target": (0, 6.0),
-            "ranges": [
-                (0, 6.0, "NORMAL", "🟢", "Normal uric acid level"),
-                (6.0, 7.0, "BORDERLINE", "🟡", "Borderline - monitor for kidney issues"),
-                (7.0, 10.0, "HIGH", "🟠", "High - increases kidney disease risk"),
-                (10.0, 20.0, "VERY HIGH", "🔴", "Very high - urgent kidney function assessment needed")
-            ]
-        },
-        "BMI": {
-            "unit": "kg/m²",
-            "normal_range": (18.5, 24.9),
-            "diabetes_target": (18.5, 24.9),
-            "ranges": [
-                (0, 18.5, "UNDERWEIGHT", "🟡", "Underweight - nutritional assessment needed"),
-                (18.5, 24.9, "NORMAL", "🟢", "Normal weight"),
-                (25.0, 29.9, "OVERWEIGHT", "🟡", "Overweight - 5-10% weight loss beneficial"),
-                (30.0, 34.9, "OBESE CLASS I", "🟠", "Obesity - significant diabetes risk"),
-                (35.0, 80.0, "OBESE CLASS II+", "🔴", "Severe obesity - intensive intervention needed")
-            ]
-        }
-    }
+        (found_ids, payloads, missing_ids) - found_ids/payloads keep request order
+    """
+    if len(patient_ids) > MAX_BATCH_PATIENTS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_PATIENTS} patients per batch")
     
-    # Get lab standard or return basic interpretation if not defined
-    if name not in lab_standards:
-        return {
-            "value": value,
-            "unit": unit,
-            "status": "UNKNOWN",
-            "icon": "ℹ️",
-            "explanation": f"Value: {value} {unit}"
-        }
+    unique_ids = list(dict.fromkeys(patient_ids))
+    rows = (await db.execute(
+        select(PatientLatestState.patient_id, PatientLatestState.data_payload)
+        .where(PatientLatestState.patient_id.in_(unique_ids))
+    )).all()
     
-    lab = lab_standards[name]
+    by_patient = {patient_id: payload for patient_id, payload in rows}
+    found_ids = [pid for pid in unique_ids if pid in by_patient]
+    missing_ids = [pid for pid in unique_ids if pid not in by_patient]
+    return found_ids, [by_patient[pid] for pid in found_ids], missing_ids
+
+
+def build_narrative_input(twin: DiabetesTwin, risks: Dict, organ_functions: Dict,
+                          years_ahead: int, projected_hba1c: float):
+    """
+    Build the AnalysisAgent input for the cognitive narrative.
     
-    # Find which range the value falls into
-    status = "UNKNOWN"
-    icon = "ℹ️"
-    explanation = ""
+    Returns:
+        (agent_input, simulation_context, header) - header prefixes the streamed text
+    """
+    base_hba1c = twin.metabolic_profile.hba1c_percent
     
-    for range_min, range_max, range_status, range_icon, range_explanation in lab["ranges"]:
-        if range_min <= value < range_max:
-            status = range_status
-            icon = range_icon
-            explanation = range_explanation
-            break
+    if years_ahead > 0:
+        # FUTURE SIMULATION: Construct comprehensive projected data for the agent
+        sim_context = f"FUTURE SIMULATION: {years_ahead} YEARS FROM NOW (Year {2025 + years_ahead})"
+        
+        # Build detailed future patient profile
+        qa_data = {
+            # Projected values
+            "Projected HbA1c": f"{round(projected_hba1c, 1)}%",
+            "Projected Fasting Glucose": f"{int(twin.metabolic_profile.fasting_glucose_mgdl * (1 + years_ahead * 0.04))} mg/dL",
+            "Condition": "Type 2 Diabetes Mellitus - Unmanaged Progression",
+            
+            # Organ Function Status
+            "Pancreas Function": f"{int(organ_functions['pancreas'] * 100)}% (Beta-cell capacity)",
+            "Kidney Function": f"{int(organ_functions['kidneys'] * 100)}% (Estimated GFR proxy)",
+            "Heart Function": f"{int(organ_functions['heart'] * 100)}%",
+            "Eye Health": f"{int(organ_functions['eyes'] * 100)}% (Retinal integrity)",
+            "Nerve Function": f"{int(organ_functions['nerves'] * 100)}% (Peripheral sensation)",
+            
+            # Risk Scores
+            "Retinopathy Risk": f"{risks['retinopathy']['risk_level'].upper()} ({risks['retinopathy']['risk_score']}/100)",
+            "Nephropathy Risk": f"{risks['nephropathy']['risk_level'].upper()} ({risks['nephropathy']['risk_score']}/100)",
+            "Cardiovascular Risk": f"{risks['cardiovascular']['risk_level'].upper()} ({risks['cardiovascular']['risk_score']}/100)",
+            "Neuropathy Risk": f"{risks['neuropathy']['risk_level'].upper()} ({risks['neuropathy']['risk_score']}/100)",
+            
+            # Current patient context
+            "Patient Age": f"{twin.demographics.age + years_ahead} years (will be)",
+            "Current HbA1c": f"{base_hba1c}%",
+            "Blood Pressure": f"{twin.complications_status.bp_systolic}/{twin.complications_status.bp_diastolic} mmHg",
+            "BMI": f"{twin.demographics.bmi:.1f}",
+            "Smoking Status": twin.lifestyle.smoking_status,
+            "LDL Cholesterol": f"{twin.complications_status.cholesterol_ldl} mg/dL"
+        }
+        header = f"🧠 COGNITIVE BRAIN ANALYSIS ({2025 + years_ahead}):\n"
+    else:
+        # CURRENT STATE ANALYSIS - Use comprehensive patient data with CALCULATED risk levels
+        sim_context = None
+        qa_data = twin_to_qa_data(twin)
+        
+        # Add calculated risk levels for consistency with visualization
+        qa_data["Retinopathy Risk"] = f"{risks['retinopathy']['risk_level'].upper()} ({risks['retinopathy']['risk_score']}/100)"
+        qa_data["Nephropathy Risk"] = f"{risks['nephropathy']['risk_level'].upper()} ({risks['nephropathy']['risk_score']}/100)"
+        qa_data["Cardiovascular Risk"] = f"{risks['cardiovascular']['risk_level'].upper()} ({risks['cardiovascular']['risk_score']}/100)"
+        qa_data["Neuropathy Risk"] = f"{risks['neuropathy']['risk_level'].upper()} ({risks['neuropathy']['risk_score']}/100)"
+        header = "🧠 COGNITIVE BRAIN ANALYSIS:\n"
     
-    return {
-        "value": value,
-        "unit": lab["unit"],
-        "status": status,
-        "icon": icon,
-        "normal_range": f"{lab['normal_range'][0]}-{lab['normal_range'][1]} {lab['unit']}",
-        "diabetes_target": f"< {lab['diabetes_target'][1]} {lab['unit']}" if name in ["HbA1c", "LDL Cholesterol", "Blood Pressure (Systolic)"] else f"{lab['diabetes_target'][0]}-{lab['diabetes_target'][1]} {lab['unit']}",
-        "explanation": explanation
+    agent_input = {
+        "condition_type": "diabetes",
+        "qa_data": qa_data
     }
+    return agent_input, sim_context, header
 
 
-def get_or_create_twin(patient_id: str, db: Session) -> DiabetesTwin:
-    """Get twin from database by loading latest agent data"""
-    
-    # 1. Check if patient exists
-    patient = db.query(Patient).filter(Patient.id == patient_id).first()
-    if not patient:
-        raise HTTPException(status_code=404, detail=f"Patient {patient_id} not found in database")
+def build_fallback_narrative(twin: DiabetesTwin, risks: Dict, organ_functions: Dict,
+                             years_ahead: int, projected_hba1c: float) -> str:
+    """Deterministic, patient-specific assessment used before (or instead of) the LLM narrative"""
+    base_hba1c = twin.metabolic_profile.hba1c_percent
     
-    # 2. Get latest medical data (Flexible JSON)
-    # We look for the most recent data payload (could be from CSV import or updates)
-    latest_record = db.query(AgentData)\
-        .filter(AgentData.patient_id == patient_id)\
-        .order_by(AgentData.timestamp.desc())\
-        .first()
+    if years_ahead > 0:
+        highest_risk_organ = max(risks.items(), key=lambda x: x[1]['risk_score'])[0]
+        risk_score = risks[highest_risk_organ]['risk_score']
+        function_pct = int(organ_functions.get(highest_risk_organ.replace('cardiovascular', 'heart').replace('nephropathy', 'kidneys').replace('retinopathy', 'eyes'), 0.5) * 100)
+        future_year = 2025 + years_ahead
         
-    if not latest_record:
-        # Should not happen if migration ran
-        raise HTTPException(status_code=404, detail="No medical records found for patient")
+        # Patient-specific fallback messages
+        if highest_risk_organ == 'cardiovascular':
+            organ_name = 'Heart'
+            specific_msg = f"Cardiovascular risk score: {risk_score}/100. LDL: {twin.complications_status.cholesterol_ldl} mg/dL needs aggressive management."
+        elif highest_risk_organ == 'nephropathy':
+            organ_name = 'Kidneys'
+            specific_msg = f"Nephropathy risk score: {risk_score}/100. GGT: {twin.complications_status.ggt} U/L. ACE inhibitor consideration warranted."
+        elif highest_risk_organ == 'retinopathy':
+            organ_name = 'Eyes'
+            specific_msg = f"Retinopathy risk score: {risk_score}/100. BP: {twin.complications_status.bp_systolic}/{twin.complications_status.bp_diastolic} contributing to risk."
+        elif highest_risk_organ == 'neuropathy':
+            organ_name = 'Nerves'
+            specific_msg = f"Neuropathy risk score: {risk_score}/100. Duration exposure and HbA1c of {projected_hba1c:.1f}% are primary drivers."
+        else:
+            organ_name = highest_risk_organ.title()
+            specific_msg = f"Risk score: {risk_score}/100"
+        
+        return (
+            f"⚠️ PROJECTION ({future_year}):\n"
+            f"Primary Concern: {organ_name} - Function at {function_pct}%\n"
+            f"{specific_msg}\n\n"
+            f"• HbA1c: {base_hba1c}% → {projected_hba1c:.1f}% (+{projected_hba1c - base_hba1c:.1f}%)\n"
+            f"• Pancreas Function: {int(organ_functions['pancreas'] * 100)}%\n"
+            f"• Overall Control: {'POOR' if projected_hba1c >= 9 else 'FAIR' if projected_hba1c >= 7 else 'GOOD'}"
+        )
     
-    # 3. Create Twin from JSON payload
-    # logic: The payload structure matches exactly what df.iloc[i].to_dict() returned
-    patient_data = latest_record.data_payload
-    twin = DiabetesTwin(patient_id=patient_id, patient_data=patient_data)
+    # Current state fallback
+    control_status = "POOR" if base_hba1c >= 9 else "FAIR" if base_hba1c >= 7 else "GOOD"
+    highest_risk = max(risks.items(), key=lambda x: x[1]['risk_score'])
     
-    return twin
+    return (
+        f"📊 CURRENT ASSESSMENT:\n"
+        f"Glycemic Control: {control_status} (HbA1c: {base_hba1c}%)\n"
+        f"Fasting Glucose: {twin.metabolic_profile.fasting_glucose_mgdl} mg/dL\n"
+        f"Highest Risk: {highest_risk[0].title()} ({highest_risk[1]['risk_level'].upper()})\n\n"
+        f"Key Metrics:\n"
+        f"• BP: {twin.complications_status.bp_systolic}/{twin.complications_status.bp_diastolic} mmHg\n"
+        f"• LDL: {twin.complications_status.cholesterol_ldl} mg/dL\n"
+        f"• BMI: {twin.demographics.bmi:.1f}"
+    )
+
+
+# Pending LLM narratives, keyed by narrative_id.
+# Each entry is consumed once by the SSE stream; unclaimed entries expire.
+NARRATIVE_TTL_SECONDS = 300
+MAX_PENDING_NARRATIVES = 1000
+_pending_narratives: "OrderedDict[str, Dict]" = OrderedDict()
+_narratives_lock = threading.Lock()
+
+
+def register_narrative(patient_id: str, narrative: Dict) -> str:
+    """Store the inputs for a narrative and return its id"""
+    narrative_id = uuid.uuid4().hex
+    now = time.monotonic()
+    with _narratives_lock:
+        # Drop expired entries, then the oldest ones if we are over capacity
+        while _pending_narratives:
+            oldest_id, oldest = next(iter(_pending_narratives.items()))
+            if now - oldest["created"] < NARRATIVE_TTL_SECONDS and len(_pending_narratives) < MAX_PENDING_NARRATIVES:
+                break
+            _pending_narratives.pop(oldest_id)
+        _pending_narratives[narrative_id] = {**narrative, "patient_id": patient_id, "created": now}
+    return narrative_id
+
+
+def claim_narrative(patient_id: str, narrative_id: str) -> Optional[Dict]:
+    """Remove and return a pending narrative (None if unknown, expired or for another patient)"""
+    with _narratives_lock:
+        narrative = _pending_narratives.get(narrative_id)
+        if not narrative or narrative["patient_id"] != patient_id:
+            return None
+        del _pending_narratives[narrative_id]
+    if time.monotonic() - narrative["created"] >= NARRATIVE_TTL_SECONDS:
+        return None
+    return narrative
+
+
+def narrative_queue_depth() -> int:
+    with _narratives_lock:
+        return len(_pending_narratives)
+
+
+def format_sse(event: str, data: Dict) -> str:
+    """Format one Server-Sent Events message"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def sse_response(events) -> StreamingResponse:
+    """Wrap an SSE event generator; proxies must not buffer it"""
+    return StreamingResponse(
+        events,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+def llm_text_events(patient_id: str, cost: int, make_chunks, fallback: str, agent_method: Tuple[str, str],
+                    agents_ready: bool = True):
+    """
+    SSE events for one streamed agent completion:
+    token {"text"} per chunk, fallback {"text", "reason"} if the LLM is offline,
+    shed or fails, then done. make_chunks() is only called once admitted.
+    Failures count in medtwin_llm_fallbacks_total under agent_method (agent, method).
+    """
+    if not agents_ready:
+        yield format_sse("fallback", {"text": fallback, "reason": "offline"})
+    else:
+        try:
+            with llm_admission.admit(patient_id, cost=cost):
+                for chunk in make_chunks():
+                    yield format_sse("token", {"text": chunk})
+        except Overloaded:
+            yield format_sse("fallback", {"text": fallback, "reason": "overloaded"})
+        except Exception:
+            metrics.LLM_FALLBACKS.labels(*agent_method).inc()
+            yield format_sse("fallback", {"text": fallback, "reason": "error"})
+    yield format_sse("done", {})
 
 
 # ============================================================================
@@ -346,24 +565,53 @@ def root():
     return {"status": "error", "message": "index.html not found"}
 
 
+PLAN_JOBS = metrics.gauge("medtwin_plan_jobs", "Action plan jobs by status", ("status",))
+BACKGROUND_QUEUE_DEPTH = metrics.gauge(
+    "medtwin_background_queue_depth",
+    "Items waiting in in-process queues",
+    ("queue",)
+)
+
+
+def collect_runtime_metrics():
+    """Copy admission, job and buffer state into gauges at scrape time"""
+    admission = llm_admission.stats()
+    LLM_ADMISSION_STATE.labels("waiting").set(admission["waiting"])
+    LLM_ADMISSION_STATE.labels("in_flight").set(admission["in_flight"])
+    for status, count in plan_jobs.stats().items():
+        PLAN_JOBS.labels(status).set(count)
+    BACKGROUND_QUEUE_DEPTH.labels("cgm_buffer").set(glucose_buffer.pending())
+    BACKGROUND_QUEUE_DEPTH.labels("agent_data_writer").set(agent_data_writer.pending())
+    BACKGROUND_QUEUE_DEPTH.labels("pending_narratives").set(narrative_queue_depth())
+
+
+metrics.REGISTRY.add_collector(collect_runtime_metrics)
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    """Prometheus scrape endpoint"""
+    return PlainTextResponse(metrics.REGISTRY.render(), media_type=metrics.CONTENT_TYPE)
+
+
 @app.get("/patients")
 @app.get("/patients")
-def list_patients(limit: int = 10, db: Session = Depends(get_db)):
+async def list_patients(limit: int = 10, db: AsyncSession = Depends(get_async_db)):
     """Get list of available patients"""
     patients_list = []
     
     # Query patients
-    db_patients = db.query(Patient).limit(limit).all()
+    db_patients = (await db.execute(select(Patient).limit(limit))).scalars().all()
+    
+    # Latest data for these patients, one primary-key IN lookup
+    states = dict((await db.execute(
+        select(PatientLatestState.patient_id, PatientLatestState.data_payload)
+        .where(PatientLatestState.patient_id.in_([p.id for p in db_patients]))
+    )).all())
     
     for p in db_patients:
-        # Get latest data for this patient
-        latest = db.query(AgentData)\
-            .filter(AgentData.patient_id == p.id)\
-            .order_by(AgentData.timestamp.desc())\
-            .first()
-            
-        if latest and latest.data_payload:
-            data = latest.data_payload
+        data = states.get(p.id)
+        if data:
             patients_list.append({
                 "patient_id": p.id,
                 "age": int(data.get('Age', 0)),
@@ -372,7 +620,7 @@ def list_patients(limit: int = 10, db: Session = Depends(get_db)):
             })
     
     # Get total count
-    total = db.query(Patient).count()
+    total = (await db.execute(select(func.count()).select_from(Patient))).scalar()
     
     return {
         "total_patients": total,
@@ -382,18 +630,18 @@ def list_patients(limit: int = 10, db: Session = Depends(get_db)):
 
 
 @app.get("/twin/{patient_id}")
-def get_twin(patient_id: str, db: Session = Depends(get_db)):
+async def get_twin(patient_id: str, db: AsyncSession = Depends(get_async_db)):
     """
     Get complete digital twin for a patient
     
     Example: GET /twin/DM_00001
     """
-    twin = get_or_create_twin(patient_id, db)
+    twin = await get_or_create_twin(patient_id, db)
     return twin.to_dict()
 
 
 @app.post("/twin/simulate")
-def simulate_lifestyle_changes(request: SimulationRequest, db: Session = Depends(get_db)):
+async def simulate_lifestyle_changes(request: SimulationRequest, db: AsyncSession = Depends(get_async_db)):
     """
     Simulate HbA1c changes based on lifestyle modifications
     
@@ -408,7 +656,7 @@ def simulate_lifestyle_changes(request: SimulationRequest, db: Session = Depends
         "months": 6
     }
     """
-    twin = get_or_create_twin(request.patient_id, db)
+    twin = await get_or_create_twin(request.patient_id, db)
     
     # Convert Pydantic model to dict, excluding None values
     changes = {k: v for k, v in request.lifestyle_changes.dict().items() if v is not None}
@@ -429,7 +677,7 @@ def simulate_lifestyle_changes(request: SimulationRequest, db: Session = Depends
 
 
 @app.post("/twin/meal-response")
-def simulate_meal(request: MealSimulationRequest, db: Session = Depends(get_db)):
+async def simulate_meal(request: MealSimulationRequest, db: AsyncSession = Depends(get_async_db)):
     """
     Simulate glucose response to a meal
     
@@ -441,7 +689,7 @@ def simulate_meal(request: MealSimulationRequest, db: Session = Depends(get_db))
         "hours": 4
     }
     """
-    twin = get_or_create_twin(request.patient_id, db)
+    twin = await get_or_create_twin(request.patient_id, db)
     
     # Calculate insulin resistance
     resistance = GlucoseSimulator.calculate_insulin_resistance(twin)
@@ -464,13 +712,13 @@ def simulate_meal(request: MealSimulationRequest, db: Session = Depends(get_db))
 
 
 @app.get("/twin/{patient_id}/risks")
-def get_complication_risks(patient_id: str, years_ahead: int = 5, db: Session = Depends(get_db)):
+async def get_complication_risks(patient_id: str, years_ahead: int = 5, db: AsyncSession = Depends(get_async_db)):
     """
     Get long-term complication risk predictions
     
     Example: GET /twin/DM_00001/risks?years_ahead=5
     """
-    twin = get_or_create_twin(patient_id, db)
+    twin = await get_or_create_twin(patient_id, db)
     
     risks = RiskAssessor.predict_complication_risk(twin, years_ahead)
     
@@ -486,13 +734,164 @@ def get_complication_risks(patient_id: str, years_ahead: int = 5, db: Session =
     }
 
 
+@app.post("/twin/batch/risks")
+async def batch_complication_risks(request: BatchRequest, db: AsyncSession = Depends(get_async_db)):
+    """
+    Complication risks for many patients in one call (columnar response)
+    
+    Example:
+    POST /twin/batch/risks
+    {"patient_ids": ["DM_00001", "DM_00002"], "years_ahead": 5}
+    """
+    patient_ids, payloads, missing = await load_latest_payloads(request.patient_ids, db)
+    columns = {"patient_id": patient_ids}
+    
+    if payloads:
+        features = build_feature_columns(payloads)
+        risks = RiskAssessor.predict_complication_risk_batch(features, request.years_ahead)
+        columns["hba1c"] = features["hba1c"].tolist()
+        for complication, values in risks.items():
+            columns[f"{complication}_score"] = values["risk_score"].tolist()
+            columns[f"{complication}_level"] = values["risk_level"].tolist()
+    
+    return {
+        "years_ahead": request.years_ahead,
+        "count": len(patient_ids),
+        "missing": missing,
+        "columns": columns
+    }
+
+
+@app.post("/twin/batch/organ-function")
+async def batch_organ_function(request: BatchRequest, db: AsyncSession = Depends(get_async_db)):
+    """
+    Predicted organ function levels (0.0-1.0) for many patients (columnar response)
+    
+    Example:
+    POST /twin/batch/organ-function
+    {"patient_ids": ["DM_00001", "DM_00002"], "years_ahead": 3}
+    """
+    patient_ids, payloads, missing = await load_latest_payloads(request.patient_ids, db)
+    columns = {"patient_id": patient_ids}
+    
+    if payloads:
+        features = build_feature_columns(payloads)
+        organs = RiskAssessor.predict_organ_function_batch(features, request.years_ahead)
+        for organ, values in organs.items():
+            columns[organ] = [round(v, 2) for v in values.tolist()]
+    
+    return {
+        "years_ahead": request.years_ahead,
+        "count": len(patient_ids),
+        "missing": missing,
+        "columns": columns
+    }
+
+
+@app.post("/twin/batch/simulate")
+async def batch_simulate_lifestyle_changes(request: BatchSimulationRequest, db: AsyncSession = Depends(get_async_db)):
+    """
+    Apply one lifestyle scenario to many patients and predict HbA1c (columnar response)
+    
+    Example:
+    POST /twin/batch/simulate
+    {"patient_ids": ["DM_00001", "DM_00002"], "lifestyle_changes": {"weight_loss_kg": 10}, "months": 6}
+    """
+    patient_ids, payloads, missing = await load_latest_payloads(request.patient_ids, db)
+    changes = {k: v for k, v in request.lifestyle_changes.dict().items() if v is not None}
+    columns = {"patient_id": patient_ids}
+    
+    if payloads:
+        features = build_feature_columns(payloads)
+        predicted = GlucoseSimulator.predict_hba1c_change_batch(features, changes, request.months)
+        columns["current_hba1c"] = features["hba1c"].tolist()
+        columns["predicted_hba1c"] = [round(v, 2) for v in predicted.tolist()]
+        columns["change"] = [round(v, 2) for v in (predicted - features["hba1c"]).tolist()]
+    
+    return {
+        "months": request.months,
+        "lifestyle_changes": changes,
+        "count": len(patient_ids),
+        "missing": missing,
+        "columns": columns
+    }
+
+
+@app.post("/labs/interpret")
+def interpret_labs(request: LabInterpretRequest):
+    """
+    Interpret a lab panel and/or cohort columns against the reference bands
+    
+    Example:
+    POST /labs/interpret
+    {"panel": {"HbA1c": 6.45, "BMI": 24.95},
+     "columns": {"LDL Cholesterol": [95, 131, 201]}}
+    """
+    response = {"panel": {}, "columns": {}, "legend": {}, "unknown": []}
+    
+    if request.panel:
+        response["panel"] = interpret_panel(request.panel)
+        response["unknown"].extend(
+            name for name, result in response["panel"].items() if "normal_range" not in result
+        )
+    
+    for name, values in (request.columns or {}).items():
+        column = interpret_column(name, values)
+        if column is None:
+            response["unknown"].append(name)
+            continue
+        response["columns"][name] = column
+        response["legend"][name] = lab_legend(name)
+    
+    return response
+
+
+MAX_COHORT_ROWS = 100000
+
+
+@app.post("/cohort")
+async def query_cohort(request: CohortRequest, db: AsyncSession = Depends(get_async_db)):
+    """
+    Population screening over the indexed clinical columns.
+    
+    Example:
+    POST /cohort
+    {"filters": ["HbA1c > 9", "LDL > 160"], "fields": ["hba1c", "ldl", "age"], "limit": 500}
+    
+    Returns the total number of matching patients and up to `limit` rows as columns.
+    """
+    if not 0 <= request.limit <= MAX_COHORT_ROWS:
+        raise HTTPException(status_code=400, detail=f"limit must be between 0 and {MAX_COHORT_ROWS}")
+    try:
+        count_query = cohort_count_query(request.filters, request.latest_only)
+        rows_query = cohort_query(request.filters, request.fields, request.latest_only, request.limit)
+    except CohortFilterError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    total = (await db.execute(count_query)).scalar()
+    result = await db.execute(rows_query)
+    names = list(result.keys())
+    rows = result.all()
+    
+    return {
+        "filters": request.filters,
+        "latest_only": request.latest_only,
+        "count": total,
+        "returned": len(rows),
+        "columns": {
+            name: [row[i].isoformat() if name == "timestamp" and row[i] else row[i] for row in rows]
+            for i, name in enumerate(names)
+        }
+    }
+
+
 @app.get("/twin/{patient_id}/visualization-data")
-def get_visualization_data(patient_id: str, years_ahead: int = 0, db: Session = Depends(get_db)):
+async def get_visualization_data(patient_id: str, years_ahead: int = 0, db: AsyncSession = Depends(get_async_db)):
     """
     Get aggregated data specifically for the 3D Visualization frontend
     Updates predicted organ function based on years_ahead simulation
     """
-    twin = get_or_create_twin(patient_id, db)
+    twin = await get_or_create_twin(patient_id, db)
     base_hba1c = twin.metabolic_profile.hba1c_percent
     
     # Get organ function levels (personalized degradation)
@@ -536,154 +935,34 @@ def get_visualization_data(patient_id: str, years_ahead: int = 0, db: Session =
             return 'green'
     
     # Cognitive Analysis (Agent-Powered)
-    cognitive_msg = "Cognitive Agent unavailable (Check API Key)"
+    # The deterministic assessment is returned immediately; the LLM narrative
+    # is registered under a narrative_id and streamed separately over SSE.
+    cognitive_msg = build_fallback_narrative(twin, risks, organ_functions, years_ahead, projected_hba1c)
+    narrative_id = None
+    narrative_status = "offline"
     
-    if AGENTS_AVAILABLE:
-        try:
-            if years_ahead > 0:
-                # FUTURE SIMULATION: Construct comprehensive projected data for the agent
-                sim_context = f"FUTURE SIMULATION: {years_ahead} YEARS FROM NOW (Year {2025 + years_ahead})"
-                
-                print(f"\n🧠 [DEBUG] Calling DeepSeek Agent for FUTURE prediction: Year {2025 + years_ahead}")
-                print(f"   Projected HbA1c: {projected_hba1c:.1f}%, Pancreas: {organ_functions['pancreas']*100:.0f}%")
-                
-                # Build detailed future patient profile
-                future_qa_data = {
-                    # Projected values
-                    "Projected HbA1c": f"{round(projected_hba1c, 1)}%",
-                    "Projected Fasting Glucose": f"{int(twin.metabolic_profile.fasting_glucose_mgdl * (1 + years_ahead * 0.04))} mg/dL",
-                    "Condition": "Type 2 Diabetes Mellitus - Unmanaged Progression",
-                    
-                    # Organ Function Status
-                    "Pancreas Function": f"{int(organ_functions['pancreas'] * 100)}% (Beta-cell capacity)",
-                    "Kidney Function": f"{int(organ_functions['kidneys'] * 100)}% (Estimated GFR proxy)",
-                    "Heart Function": f"{int(organ_functions['heart'] * 100)}%",
-                    "Eye Health": f"{int(organ_functions['eyes'] * 100)}% (Retinal integrity)",
-                    "Nerve Function": f"{int(organ_functions['nerves'] * 100)}% (Peripheral sensation)",
-                    
-                    # Risk Scores
-                    "Retinopathy Risk": f"{risks['retinopathy']['risk_level'].upper()} ({risks['retinopathy']['risk_score']}/100)",
-                    "Nephropathy Risk": f"{risks['nephropathy']['risk_level'].upper()} ({risks['nephropathy']['risk_score']}/100)",
-                    "Cardiovascular Risk": f"{risks['cardiovascular']['risk_level'].upper()} ({risks['cardiovascular']['risk_score']}/100)",
-                    "Neuropathy Risk": f"{risks['neuropathy']['risk_level'].upper()} ({risks['neuropathy']['risk_score']}/100)",
-                    
-                    # Current patient context
-                    "Patient Age": f"{twin.demographics.age + years_ahead} years (will be)",
-                    "Current HbA1c": f"{base_hba1c}%",
-                    "Blood Pressure": f"{twin.complications_status.bp_systolic}/{twin.complications_status.bp_diastolic} mmHg",
-                    "BMI": f"{twin.demographics.bmi:.1f}",
-                    "Smoking Status": twin.lifestyle.smoking_status,
-                    "LDL Cholesterol": f"{twin.complications_status.cholesterol_ldl} mg/dL"
-                }
-                
-                agent_input = {
-                    "condition_type": "diabetes",
-                    "qa_data": future_qa_data
-                }
-                
-                # Invoke agent with simulation context
-                analysis = analysis_agent.analyze(agent_input, simulation_context=sim_context)
-                print(f"✅ [DEBUG] DeepSeek response received for Year {2025 + years_ahead}")
-                cognitive_msg = f"🧠 COGNITIVE BRAIN ANALYSIS ({2025 + years_ahead}):\n{analysis.get('recommendations', 'Analysis failed')}"
-            
-            else:
-                # CURRENT STATE ANALYSIS - Use comprehensive patient data with CALCULATED risk levels
-                print(f"\n🧠 [DEBUG] Calling DeepSeek Agent for CURRENT state (Year 2025)")
-                qa_data = twin_to_qa_data(twin)
-                
-                # Add calculated risk levels for consistency with visualization
-                qa_data["Retinopathy Risk"] = f"{risks['retinopathy']['risk_level'].upper()} ({risks['retinopathy']['risk_score']}/100)"
-                qa_data["Nephropathy Risk"] = f"{risks['nephropathy']['risk_level'].upper()} ({risks['nephropathy']['risk_score']}/100)"
-                qa_data["Cardiovascular Risk"] = f"{risks['cardiovascular']['risk_level'].upper()} ({risks['cardiovascular']['risk_score']}/100)"
-                qa_data["Neuropathy Risk"] = f"{risks['neuropathy']['risk_level'].upper()} ({risks['neuropathy']['risk_score']}/100)"
-                
-                agent_input = {
-                    "condition_type": "diabetes",
-                    "qa_data": qa_data
-                }
-                analysis = analysis_agent.analyze(agent_input)
-                print(f"✅ [DEBUG] DeepSeek response received for current state")
-                cognitive_msg = f"🧠 COGNITIVE BRAIN ANALYSIS:\n{analysis.get('recommendations', 'Analysis failed')}"
-
-        except Exception as e:
-            print(f"Agent Error: {e}")
-            # FALLBACK: Use patient-specific dynamic messages
-            if years_ahead > 0:
-                highest_risk_organ = max(risks.items(), key=lambda x: x[1]['risk_score'])[0]
-                risk_score = risks[highest_risk_organ]['risk_score']
-                function_pct = int(organ_functions.get(highest_risk_organ.replace('cardiovascular', 'heart').replace('nephropathy', 'kidneys').replace('retinopathy', 'eyes'), 0.5) * 100)
-                future_year = 2025 + years_ahead
-                
-                # Patient-specific fallback messages
-                if highest_risk_organ == 'cardiovascular':
-                    organ_name = 'Heart'
-                    specific_msg = f"Cardiovascular risk score: {risk_score}/100. LDL: {twin.complications_status.cholesterol_ldl} mg/dL needs aggressive management."
-                elif highest_risk_organ == 'nephropathy':
-                    organ_name = 'Kidneys'
-                    specific_msg = f"Nephropathy risk score: {risk_score}/100. GGT: {twin.complications_status.ggt} U/L. ACE inhibitor consideration warranted."
-                elif highest_risk_organ == 'retinopathy':
-                    organ_name = 'Eyes'
-                    specific_msg = f"Retinopathy risk score: {risk_score}/100. BP: {twin.complications_status.bp_systolic}/{twin.complications_status.bp_diastolic} contributing to risk."
-                elif highest_risk_organ == 'neuropathy':
-                    organ_name = 'Nerves'
-                    specific_msg = f"Neuropathy risk score: {risk_score}/100. Duration exposure and HbA1c of {projected_hba1c:.1f}% are primary drivers."
-                else:
-                    organ_name = highest_risk_organ.title()
-                    specific_msg = f"Risk score: {risk_score}/100"
-                
-                cognitive_msg = (
-                    f"⚠️ PROJECTION ({future_year}):\n"
-                    f"Primary Concern: {organ_name} - Function at {function_pct}%\n"
-                    f"{specific_msg}\n\n"
-                    f"• HbA1c: {base_hba1c}% → {projected_hba1c:.1f}% (+{projected_hba1c - base_hba1c:.1f}%)\n"
-                    f"• Pancreas Function: {int(organ_functions['pancreas'] * 100)}%\n"
-                    f"• Overall Control: {'POOR' if projected_hba1c >= 9 else 'FAIR' if projected_hba1c >= 7 else 'GOOD'}"
-                )
-            else:
-                # Current state fallback
-                control_status = "POOR" if base_hba1c >= 9 else "FAIR" if base_hba1c >= 7 else "GOOD"
-                highest_risk = max(risks.items(), key=lambda x: x[1]['risk_score'])
-                
-                cognitive_msg = (
-                    f"📊 CURRENT ASSESSMENT:\n"
-                    f"Glycemic Control: {control_status} (HbA1c: {base_hba1c}%)\n"
-                    f"Fasting Glucose: {twin.metabolic_profile.fasting_glucose_mgdl} mg/dL\n"
-                    f"Highest Risk: {highest_risk[0].title()} ({highest_risk[1]['risk_level'].upper()})\n\n"
-                    f"Key Metrics:\n"
-                    f"• BP: {twin.complications_status.bp_systolic}/{twin.complications_status.bp_diastolic} mmHg\n"
-                    f"• LDL: {twin.complications_status.cholesterol_ldl} mg/dL\n"
-                    f"• BMI: {twin.demographics.bmi:.1f}"
-                )
-    else:
+    agents_ready = await run_in_threadpool(agents_available)
+    if agents_ready and llm_admission.would_shed(patient_id, cost=ANALYSIS_LLM_CALLS + prediction_agent.llm_calls):
+        # LLM capacity exhausted: serve the deterministic assessment only
+        narrative_status = "shed"
+    elif agents_ready:
+        narrative_status = "pending"
+        agent_input, sim_context, header = build_narrative_input(
+            twin, risks, organ_functions, years_ahead, projected_hba1c
+        )
+        narrative_id = register_narrative(patient_id, {
+            "agent_input": agent_input,
+            "simulation_context": sim_context,
+            "header": header,
+            "fallback": cognitive_msg,
+            "current_severity": 'HIGH' if base_hba1c >= 9 else 'MODERATE' if base_hba1c >= 7 else 'LOW'
+        })
+    if not agents_ready:
         # Fallback if agents didn't even import
         cognitive_msg = (
             f"Cognitive System Offline.\n"
             f"Patient HbA1c: {base_hba1c}% | Projected: {projected_hba1c:.1f}%"
         )
-    
-    # Add AI-powered organ predictions if PredictionAgent is available
-    ai_predictions = {}
-    if AGENTS_AVAILABLE:
-        try:
-            # Get comprehensive organ impact prediction from PredictionAgent
-            organ_prediction = prediction_agent.predict_organ_impact('diabetes', qa_data)
-            progression_prediction = prediction_agent.predict_progression(
-                'diabetes', 
-                qa_data, 
-                current_severity='HIGH' if base_hba1c >= 9 else 'MODERATE' if base_hba1c >= 7 else 'LOW'
-            )
-            
-            ai_predictions = {
-                "organ_impact": organ_prediction,
-                "progression": progression_prediction
-            }
-            print(f"✅ [DEBUG] PredictionAgent generated organ-specific forecasts")
-        except Exception as e:
-            print(f"⚠️ PredictionAgent Error: {e}")
-            ai_predictions = {
-                "organ_impact": {"affected_organs": [], "systemic_risks": "Prediction unavailable"},
-                "progression": {"worsening": False, "progression_forecast": "Unable to predict", "risk_factors": []}
-            }
 
     return {
         "patient_id": patient_id,
@@ -732,7 +1011,10 @@ def get_visualization_data(patient_id: str, years_ahead: int = 0, db: Session =
             "highest_risk_organ": max(risks.items(), key=lambda x: x[1]['risk_score'])[0],
             "cognitive_prediction": cognitive_msg
         },
-        "ai_predictions": ai_predictions,  # Added: Organ-specific AI forecasts from PredictionAgent
+        "narrative_status": narrative_status,  # "pending" (stream available), "shed" or "offline"
+        "narrative_id": narrative_id,  # Stream the LLM narrative from /twin/{patient_id}/narrative/{narrative_id}
+        "narrative_url": f"/twin/{patient_id}/narrative/{narrative_id}" if narrative_id else None,
+        "ai_predictions": {},  # Organ-specific AI forecasts arrive on the narrative stream ("predictions" event)
         "lab_interpretations": {  # NEW: User-friendly lab value explanations
             "hba1c": interpret_lab_value("HbA1c", twin.metabolic_profile.hba1c_percent),
             "fasting_glucose": interpret_lab_value("Fasting Glucose", twin.metabolic_profile.fasting_glucose_mgdl),
@@ -747,65 +1029,304 @@ def get_visualization_data(patient_id: str, years_ahead: int = 0, db: Session =
     }
 
 
-@app.get("/twin/{patient_id}/action-plan")
-def get_action_plan(patient_id: str, db: Session = Depends(get_db)):
+@app.get("/twin/{patient_id}/narrative/{narrative_id}")
+def stream_narrative(patient_id: str, narrative_id: str):
     """
-    Generate actionable treatment plan using PlanningAgent
+    Stream the LLM cognitive analysis for a /visualization-data response (Server-Sent Events)
+    
+    Events:
+        token       - {"text": "..."} narrative chunks as the model produces them
+        fallback    - {"text": "..."} deterministic assessment if the LLM fails
+        predictions - PredictionAgent organ impact / progression forecasts
+        done        - end of stream
     """
-    twin = get_or_create_twin(patient_id, db)
+    narrative = claim_narrative(patient_id, narrative_id)
+    if not narrative:
+        raise HTTPException(status_code=404, detail="Narrative not found or expired")
     
-    if not AGENTS_AVAILABLE:
-        return {
-            "status": "unavailable",
-            "message": "AI Agents not initialized. Action planning requires DeepSeek API.",
-            "fallback_plan": {
-                "short_term": ["Monitor blood glucose daily", "Take prescribed medications", "Track diet"],
-                "long_term": ["Schedule 3-month HbA1c recheck", "Aim for HbA1c < 7%"]
-            }
-        }
+    fallback_predictions = {
+        "organ_impact": {"affected_organs": [], "systemic_risks": "Prediction unavailable"},
+        "progression": {"worsening": False, "progression_forecast": "Unable to predict", "risk_factors": []}
+    }
     
-    try:
-        # Prepare data for analysis
-        qa_data = twin_to_qa_data(twin)
+    def llm_events():
+        agent_input = narrative["agent_input"]
         
-        # Get risk assessments
-        risks = RiskAssessor.predict_complication_risk(twin, years_ahead=0)
+        # Failures are counted (LLM errors in medtwin_llm_errors_total by the agents,
+        # every replaced result in medtwin_llm_fallbacks_total), not logged per request
+        try:
+            yield format_sse("token", {"text": narrative["header"]})
+            for chunk in analysis_agent.analyze_stream(agent_input, simulation_context=narrative["simulation_context"]):
+                yield format_sse("token", {"text": chunk})
+        except Exception:
+            metrics.LLM_FALLBACKS.labels("AnalysisAgent", "analyze_stream").inc()
+            yield format_sse("fallback", {"text": narrative["fallback"]})
         
+        try:
+            # Organ impact and progression forecasts from PredictionAgent
+            progression, organ_impact = prediction_agent.predict_all(
+                'diabetes', agent_input["qa_data"], current_severity=narrative["current_severity"]
+            )
+            ai_predictions = {
+                "organ_impact": organ_impact,
+                "progression": progression
+            }
+        except Exception:
+            metrics.LLM_FALLBACKS.labels("PredictionAgent", "predict_all").inc()
+            ai_predictions = fallback_predictions
+        yield format_sse("predictions", ai_predictions)
+    
+    def event_stream():
+        try:
+            with llm_admission.admit(patient_id, cost=ANALYSIS_LLM_CALLS + prediction_agent.llm_calls):
+                yield from llm_events()
+        except Overloaded:
+            # Shed (counted by the admission controller): answer with the deterministic assessment instead of waiting
+            yield format_sse("fallback", {"text": narrative["fallback"], "reason": "overloaded"})
+            yield format_sse("predictions", fallback_predictions)
+        yield format_sse("done", {"narrative_id": narrative_id})
+    
+    return sse_response(event_stream())
+
+
+@app.get("/twin/{patient_id}/recommendations/stream")
+async def stream_recommendations(patient_id: str, db: AsyncSession = Depends(get_async_db)):
+    """
+    Stream AnalysisAgent recommendations for the patient's current state (Server-Sent Events)
+    
+    Events:
+        token    - {"text": "..."} recommendation chunks as the model produces them
+        fallback - {"text": "...", "reason": "offline" | "overloaded" | "error"} deterministic assessment
+        done     - end of stream
+    """
+    twin = await get_or_create_twin(patient_id, db)
+    risks = RiskAssessor.predict_complication_risk(twin, years_ahead=0)
+    organ_functions = RiskAssessor.predict_organ_function(twin, 0)
+    hba1c = twin.metabolic_profile.hba1c_percent
+    fallback = build_fallback_narrative(twin, risks, organ_functions, 0, hba1c)
+    agent_input, _, _ = build_narrative_input(twin, risks, organ_functions, 0, hba1c)
+    
+    # Hand the pooled connection back before a stream that can take seconds
+    await db.close()
+    agents_ready = await run_in_threadpool(agents_available)
+    return sse_response(llm_text_events(
+        patient_id, ANALYSIS_LLM_CALLS, lambda: analysis_agent.analyze_stream(agent_input), fallback,
+        ("AnalysisAgent", "analyze_stream"), agents_ready
+    ))
+
+
+@app.post("/twin/{patient_id}/medication-schedule/stream")
+async def stream_medication_schedule(patient_id: str, request: MedicationScheduleRequest,
+                                     db: AsyncSession = Depends(get_async_db)):
+    """
+    Stream a NotifierAgent medication schedule (Server-Sent Events: token / fallback / done)
+    The fallback is the plain medication list.
+    """
+    await get_latest_record(patient_id, db)  # 404 for unknown patients
+    medications = request.medications
+    fallback = "\n".join(
+        f"• {med.get('name', '')} - {med.get('dosage', '')} - {med.get('frequency', '')}" for med in medications
+    ) or "No medications scheduled."
+    
+    await db.close()
+    agents_ready = await run_in_threadpool(agents_available)
+    return sse_response(llm_text_events(
+        patient_id, SCHEDULE_LLM_CALLS, lambda: notifier_agent.create_medication_schedule_stream(medications),
+        fallback, ("NotifierAgent", "create_medication_schedule_stream"), agents_ready
+    ))
+
+
+# Action plans run on a bounded background worker pool.
+# Identical in-flight requests (same patient + data version) share one job.
+PLAN_JOB_WORKERS = int(os.environ.get("MEDTWIN_PLAN_WORKERS", "4"))
+PLAN_SYNC_TIMEOUT_SECONDS = 120
+MAX_JOB_WAIT_SECONDS = 30
+plan_jobs = JobQueue(max_workers=PLAN_JOB_WORKERS)
+
+FALLBACK_ACTION_PLAN = {
+    "short_term": [
+        "Monitor blood glucose twice daily",
+        "Take prescribed medications as scheduled",
+        "Track carbohydrate intake",
+        "Check blood pressure weekly"
+    ],
+    "long_term": [
+        "Schedule comprehensive diabetes exam in 3 months",
+        "Target HbA1c < 7.0%",
+        "Aim for 5-10% body weight reduction if overweight"
+    ]
+}
+
+
+def job_fallback(job) -> Dict:
+    """Fallback response for a failed or shed action-plan job"""
+    shed = job.error and job.error.startswith(llm_admission.name + ":")
+    return {
+        "status": "overloaded" if shed else "error",
+        "message": job.error,
+        "fallback_plan": FALLBACK_ACTION_PLAN
+    }
+
+
+async def find_stored_plan(patient_id: str, data_version: int, db: AsyncSession) -> Optional[Dict]:
+    """Return the stored action plan for this data version, if one was already generated"""
+    stored = (await db.execute(
+        select(AgentData)
+        .where(AgentData.patient_id == patient_id)
+        .where(AgentData.agent_type == ACTION_PLAN_AGENT_TYPE)
+        .order_by(AgentData.timestamp.desc())
+        .limit(1)
+    )).scalar_one_or_none()
+    if stored and stored.data_payload and stored.data_payload.get("data_version") == data_version:
+        return stored.data_payload
+    return None
+
+
+def run_action_plan(patient_id: str, data_version: int, qa_data: Dict) -> Dict:
+    """Job body: AnalysisAgent -> PlanningAgent, then persist the plan as AgentData"""
+    with llm_admission.admit(patient_id, cost=ANALYSIS_LLM_CALLS + planning_agent.llm_calls):
         # Get analysis from AnalysisAgent first
         analysis_result = analysis_agent.analyze({"condition_type": "diabetes", "qa_data": qa_data})
         
         # Create comprehensive plan using PlanningAgent
         treatment_plan = planning_agent.create_comprehensive_plan(analysis_result)
-        
-        return {
-            "status": "success",
-            "patient_id": patient_id,
-            "condition": "diabetes",
-            "severity": "MODERATE", # You could calculate this dynamically
-            "short_term_plan": treatment_plan.get("short_term_plan", {}),
-            "long_term_plan": treatment_plan.get("long_term_plan", {}),
-            "created_at": datetime.now().isoformat()
-        }
     
-    except Exception as e:
-        print(f"❌ PlanningAgent Error: {e}")
+    plan = {
+        "status": "success",
+        "patient_id": patient_id,
+        "condition": "diabetes",
+        "severity": treatment_plan.get("severity", "MODERATE"),
+        "short_term_plan": treatment_plan.get("short_term_plan", {}),
+        "long_term_plan": treatment_plan.get("long_term_plan", {}),
+        "data_version": data_version,
+        "created_at": datetime.now().isoformat()
+    }
+    
+    # Store the finished plan so repeated views are free
+    db = SessionLocal()
+    try:
+        db.add(AgentData(
+            patient_id=patient_id,
+            agent_type=ACTION_PLAN_AGENT_TYPE,
+            data_payload=plan,
+            timestamp=datetime.utcnow()
+        ))
+        db.commit()
+    finally:
+        db.close()
+    
+    return plan
+
+
+async def submit_action_plan_job(patient_id: str, db: AsyncSession):
+    """
+    Return (stored_plan, None) if a plan exists for the patient's current data,
+    otherwise (None, (job, created)) for the queued or in-flight job.
+    """
+    latest_record = await get_latest_record(patient_id, db)
+    data_version = latest_record.source_id
+    
+    stored = await find_stored_plan(patient_id, data_version, db)
+    metrics.record_cache("action_plan", stored is not None)
+    if stored:
+        return stored, None
+    
+    twin = DiabetesTwin(patient_id=patient_id, patient_data=latest_record.data_payload)
+    qa_data = twin_to_qa_data(twin)
+    job, created = plan_jobs.submit((patient_id, data_version), run_action_plan, patient_id, data_version, qa_data)
+    metrics.record_cache("action_plan_job", not created)  # hit = joined an in-flight job
+    return None, (job, created)
+
+
+@app.get("/twin/{patient_id}/action-plan")
+async def get_action_plan(patient_id: str, db: AsyncSession = Depends(get_async_db)):
+    """
+    Generate actionable treatment plan using PlanningAgent
+    Served from the stored plan when the patient's data hasn't changed.
+    The wait for a running plan is awaited on the event loop, so it doesn't
+    hold a threadpool worker that cheap endpoints need.
+    """
+    if not await run_in_threadpool(agents_available):
+        await get_latest_record(patient_id, db)  # 404 for unknown patients
         return {
-            "status": "error",
-            "message": str(e),
+            "status": "unavailable",
+            "message": "AI Agents not initialized. Action planning requires DeepSeek API.",
             "fallback_plan": {
-                "short_term": [
-                    "Monitor blood glucose twice daily",
-                    "Take prescribed medications as scheduled",
-                    "Track carbohydrate intake",
-                    "Check blood pressure weekly"
-                ],
-                "long_term": [
-                    "Schedule comprehensive diabetes exam in 3 months",
-                    "Target HbA1c < 7.0%",
-                    "Aim for 5-10% body weight reduction if overweight"
-                ]
+                "short_term": ["Monitor blood glucose daily", "Take prescribed medications", "Track diet"],
+                "long_term": ["Schedule 3-month HbA1c recheck", "Aim for HbA1c < 7%"]
             }
         }
+    
+    # Not per patient: a request for a plan already being generated joins that job
+    if llm_admission.would_shed(cost=ANALYSIS_LLM_CALLS + planning_agent.llm_calls):
+        # A stored plan for the current data needs no LLM capacity
+        latest_record = await get_latest_record(patient_id, db)
+        stored = await find_stored_plan(patient_id, latest_record.source_id, db)
+        if stored:
+            return stored
+        return {
+            "status": "overloaded",
+            "message": "Action planning is at capacity. Showing the standard plan.",
+            "fallback_plan": FALLBACK_ACTION_PLAN
+        }
+    
+    stored, submitted = await submit_action_plan_job(patient_id, db)
+    if stored:
+        return stored
+    
+    # Hand the pooled connection back before a wait that can take minutes
+    await db.close()
+    
+    job, _ = submitted
+    if not await job.wait_async(PLAN_SYNC_TIMEOUT_SECONDS):
+        return {"status": "pending", "job_id": job.id, "poll_url": f"/jobs/{job.id}"}
+    
+    if job.status == "error":
+        print(f"❌ PlanningAgent Error: {job.error}")
+        return job_fallback(job)
+    return job.result
+
+
+@app.post("/twin/{patient_id}/action-plan/jobs", status_code=202)
+async def create_action_plan_job(patient_id: str, db: AsyncSession = Depends(get_async_db)):
+    """
+    Queue action-plan generation and return immediately.
+    Poll GET /jobs/{job_id} (optionally with ?wait=seconds) for the result.
+    """
+    if not await run_in_threadpool(agents_available):
+        raise HTTPException(status_code=503, detail="AI Agents not initialized. Action planning requires DeepSeek API.")
+    
+    stored, submitted = await submit_action_plan_job(patient_id, db)
+    if stored:
+        return {"job_id": None, "status": "done", "result": stored, "deduplicated": False}
+    
+    job, created = submitted
+    return {
+        "job_id": job.id,
+        "status": job.status,
+        "deduplicated": not created,
+        "poll_url": f"/jobs/{job.id}"
+    }
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str, wait: float = 0):
+    """
+    Get the status/result of a background job.
+    With ?wait=N the request blocks up to N seconds (max 30) until the job finishes.
+    """
+    job = plan_jobs.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    
+    if wait > 0:
+        await job.wait_async(min(wait, MAX_JOB_WAIT_SECONDS))
+    
+    response = job.to_dict()
+    if job.status == "error":
+        response.update(job_fallback(job))
+        response["status"] = "error"
+    return response
 
 
 class AgentDataInput(BaseModel):
@@ -813,11 +1334,16 @@ class AgentDataInput(BaseModel):
     data_payload: Dict
 
 @app.post("/twin/{patient_id}/add-data")
-def add_flexible_data(patient_id: str, input_data: AgentDataInput, db: Session = Depends(get_db)):
+async def add_flexible_data(patient_id: str, input_data: AgentDataInput, durability: Optional[str] = None,
+                            db: AsyncSession = Depends(get_async_db)):
     """
     Store ANY data from ANY agent efficiently.
     This uses the Flexible JSON Schema.
     
+    Rows are committed in groups by the write-behind writer. ?durability=commit
+    (default, see MEDTWIN_WRITE_DURABILITY) waits for the commit; ?durability=enqueue
+    returns as soon as the row is queued.
+    
     Example:
     POST /twin/DM_00001/add-data
     {
@@ -826,37 +1352,397 @@ def add_flexible_data(patient_id: str, input_data: AgentDataInput, db: Session =
     }
     """
     # Verify patient exists
-    patient = db.query(Patient).filter(Patient.id == patient_id).first()
+    patient = await db.get(Patient, patient_id)
     if not patient:
          raise HTTPException(status_code=404, detail="Patient not found")
          
-    # Create new record
-    new_record = AgentData(
-        patient_id=patient_id,
-        agent_type=input_data.agent_type,
-        data_payload=input_data.data_payload,
-        timestamp=datetime.utcnow()
-    )
+    durability = durability or WRITE_DURABILITY
+    if durability not in DURABILITY_MODES:
+        raise HTTPException(status_code=400, detail=f"durability must be one of {', '.join(DURABILITY_MODES)}")
+    
+    # Don't hold a connection while waiting for the group commit
+    await db.close()
+    
+    record = {
+        "patient_id": patient_id,
+        "agent_type": input_data.agent_type,
+        "data_payload": input_data.data_payload,
+        "timestamp": datetime.utcnow()
+    }
+    try:
+        committed = await agent_data_writer.write(record, durability)
+    except Overloaded as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
     
-    db.add(new_record)
-    db.commit()
+    return {
+        "status": "success",
+        "message": f"Added records for {input_data.agent_type}",
+        "committed": committed
+    }
+
+
+LAB_REPORT_AGENT_TYPE = "LabReport"
+
+
+class LabReportInput(BaseModel):
+    report_text: str
+    store: bool = True
+
+
+@app.post("/twin/{patient_id}/lab-report")
+async def add_lab_report(patient_id: str, input_data: LabReportInput, db: AsyncSession = Depends(get_async_db)):
+    """
+    Parse a text lab report locally (no LLM) and store the structured results.
+
+    Twin fields found in the report (HbA1c, LDL/HDL/Total cholesterol, fasting
+    glucose, GGT, urate, BMI, blood pressure) are merged into the patient's
+    current state, so the twin picks them up; every parsed result is kept under "lab_results".
+    Lines the parser couldn't read are returned as "unparsed".
+    """
+    report = parse_lab_report(input_data.report_text)
+    await get_latest_record(patient_id, db)  # 404 for unknown patients
+
+    stored = False
+    if input_data.store and report.records:
+        db.add(AgentData(
+            patient_id=patient_id,
+            agent_type=LAB_REPORT_AGENT_TYPE,
+            data_payload=to_agent_payload(report),
+            timestamp=datetime.utcnow()
+        ))
+        await db.commit()
+        stored = True
+
+    return {
+        "patient_id": patient_id,
+        "stored": stored,
+        "results": [r.to_dict() for r in report.records],
+        "abnormalities": [r.describe() for r in report.abnormal],
+        "metadata": report.metadata,
+        "unparsed": [{"line": number, "text": text} for number, text in report.unparsed]
+    }
+
+
+
+# NDJSON bulk ingestion settings
+INGEST_CHUNK_SIZE = 5000
+MAX_REPORTED_INGEST_ERRORS = 1000
+
+
+def ingest_ndjson_chunk(lines: List, default_agent_type: Optional[str]) -> Dict:
+    """
+    Validate one chunk of NDJSON lines and insert the valid rows.
     
-    return {"status": "success", "message": f"Added records for {input_data.agent_type}"}
+    Args:
+        lines: List of (line_number, raw_bytes)
+        default_agent_type: agent_type used when a line doesn't set one
+    
+    Returns:
+        {"inserted": int, "errors": [{"line": n, "error": "..."}]}
+    """
+    rows = []
+    errors = []
+    
+    for line_number, raw in lines:
+        try:
+            record = json.loads(raw)
+        except ValueError as e:
+            errors.append({"line": line_number, "error": f"Invalid JSON: {e}"})
+            continue
+        
+        if not isinstance(record, dict):
+            errors.append({"line": line_number, "error": "Each line must be a JSON object"})
+            continue
+        
+        patient_id = record.get("patient_id")
+        agent_type = record.get("agent_type", default_agent_type)
+        data_payload = record.get("data_payload")
+        
+        if not isinstance(patient_id, str) or not patient_id:
+            errors.append({"line": line_number, "error": "Missing 'patient_id'"})
+            continue
+        if not isinstance(agent_type, str) or not agent_type:
+            errors.append({"line": line_number, "error": "Missing 'agent_type'"})
+            continue
+        if not isinstance(data_payload, dict):
+            errors.append({"line": line_number, "error": "'data_payload' must be a JSON object"})
+            continue
+        
+        timestamp = datetime.utcnow()
+        if record.get("timestamp") is not None:
+            try:
+                timestamp = datetime.fromisoformat(str(record["timestamp"]).replace("Z", "+00:00")).replace(tzinfo=None)
+            except ValueError:
+                errors.append({"line": line_number, "error": f"Invalid timestamp: {record['timestamp']}"})
+                continue
+        
+        rows.append((line_number, {
+            "patient_id": patient_id,
+            "agent_type": agent_type,
+            "data_payload": data_payload,
+            "timestamp": timestamp
+        }))
+    
+    if not rows:
+        return {"inserted": 0, "errors": errors}
+    
+    # One transaction per chunk: patient check (single IN query) + executemany insert
+    with engine.begin() as conn:
+        chunk_ids = {row["patient_id"] for _, row in rows}
+        known_ids = set(conn.execute(
+            select(Patient.id).where(Patient.id.in_(chunk_ids))
+        ).scalars())
+        
+        valid = []
+        for line_number, row in rows:
+            if row["patient_id"] in known_ids:
+                valid.append(row)
+            else:
+                errors.append({"line": line_number, "error": f"Patient {row['patient_id']} not found"})
+        
+        if valid:
+            conn.execute(insert(AgentData.__table__), valid)
+    
+    return {"inserted": len(valid), "errors": errors}
+
 
+@app.post("/twin/ingest/ndjson")
+async def ingest_agent_data_ndjson(request: Request, agent_type: Optional[str] = None):
+    """
+    Bulk-ingest AgentData records streamed as NDJSON (one JSON object per line).
+    
+    Each line: {"patient_id": "DM_00001", "agent_type": "LabResults",
+                "data_payload": {...}, "timestamp": "2025-01-01T08:00:00"}
+    agent_type may be given once as a query parameter; timestamp is optional.
+    
+    Lines are parsed as the body arrives and committed in chunks of INGEST_CHUNK_SIZE.
+    Invalid lines are reported by line number and do not abort the stream.
+    """
+    started = time.perf_counter()
+    received = 0
+    inserted = 0
+    errors = []
+    error_count = 0
+    
+    pending = []
+    buffer = b""
+    line_number = 0
+    
+    async def flush(chunk):
+        nonlocal inserted, error_count
+        result = await run_in_threadpool(ingest_ndjson_chunk, chunk, agent_type)
+        inserted += result["inserted"]
+        error_count += len(result["errors"])
+        room = MAX_REPORTED_INGEST_ERRORS - len(errors)
+        if room > 0:
+            errors.extend(sorted(result["errors"], key=lambda e: e["line"])[:room])
+    
+    async for body_chunk in request.stream():
+        buffer += body_chunk
+        *complete, buffer = buffer.split(b"\n")
+        for raw in complete:
+            line_number += 1
+            if raw.strip():
+                received += 1
+                pending.append((line_number, raw))
+            if len(pending) >= INGEST_CHUNK_SIZE:  # per line: one body chunk can hold many DB chunks
+                await flush(pending)
+                pending = []
+    
+    if buffer.strip():
+        line_number += 1
+        received += 1
+        pending.append((line_number, buffer))
+    if pending:
+        await flush(pending)
+    
+    elapsed = time.perf_counter() - started
+    return {
+        "status": "success" if error_count == 0 else "partial",
+        "received": received,
+        "inserted": inserted,
+        "failed": error_count,
+        "errors": errors,
+        "errors_truncated": error_count > len(errors),
+        "elapsed_seconds": round(elapsed, 3),
+        "records_per_second": round(inserted / elapsed) if elapsed > 0 else None
+    }
+
+
+# Plausible CGM readings: timestamps from 2000-01-01 up to a day ahead (device clock skew),
+# glucose within what any sensor reports (mg/dL)
+CGM_MIN_TS_MS = 946684800000
+CGM_MAX_CLOCK_SKEW_MS = 24 * 3600 * 1000
+CGM_VALUE_RANGE = (10.0, 1000.0)
+
+
+def parse_cgm_message(message: Dict) -> List:
+    """
+    Parse a CGM WebSocket message into (ts_ms, value) readings.
+    
+    Accepted shapes:
+        {"value": 142}                              - timestamped on receipt
+        {"ts": 1735689600000, "value": 142}         - epoch milliseconds
+        {"ts": "2025-01-01T08:00:00Z", "value": 142}
+        {"readings": [[1735689600000, 142], ...]}
+    
+    Raises ValueError/TypeError/KeyError for malformed or implausible readings
+    (non-integer or out-of-range timestamps, non-finite or out-of-range values).
+    """
+    def to_ms(ts):
+        if ts is None:
+            return now_ms()
+        if isinstance(ts, bool) or not isinstance(ts, (int, str)):
+            raise TypeError(f"ts must be epoch milliseconds (int) or an ISO 8601 string, got {ts!r}")
+        if isinstance(ts, str):
+            ts = int(datetime.fromisoformat(ts.replace("Z", "+00:00")).timestamp() * 1000)
+        if not CGM_MIN_TS_MS <= ts <= now_ms() + CGM_MAX_CLOCK_SKEW_MS:
+            raise ValueError(f"ts {ts} is outside the accepted range")
+        return ts
+    
+    def to_mgdl(value):
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            raise TypeError(f"value must be a number, got {value!r}")
+        value = float(value)
+        if not math.isfinite(value) or not CGM_VALUE_RANGE[0] <= value <= CGM_VALUE_RANGE[1]:
+            raise ValueError(f"value {value} is outside {CGM_VALUE_RANGE[0]:g}-{CGM_VALUE_RANGE[1]:g} mg/dL")
+        return value
+    
+    if "readings" in message:
+        return [(to_ms(ts), to_mgdl(value)) for ts, value in message["readings"]]
+    return [(to_ms(message.get("ts")), to_mgdl(message["value"]))]
+
+
+@app.websocket("/ws/cgm/{patient_id}")
+async def cgm_stream(websocket: WebSocket, patient_id: str):
+    """
+    Real-time continuous glucose monitor ingestion.
+    
+    Devices send JSON messages (see parse_cgm_message) and receive an ack
+    with the number of accepted readings. Readings are buffered and written
+    in batches; the patient's twin sees the latest value immediately.
+    """
+    await websocket.accept()
+    async with AsyncSessionLocal() as db:
+        patient = await db.get(Patient, patient_id)
+    if not patient:
+        await websocket.close(code=4404, reason="Patient not found")
+        return
+    
+    try:
+        while True:
+            message = await websocket.receive_json()
+            try:
+                readings = parse_cgm_message(message)
+            except (KeyError, TypeError, ValueError) as e:
+                await websocket.send_json({"status": "error", "error": f"Invalid reading: {e}"})
+                continue
+            
+            try:
+                glucose_buffer.append(patient_id, readings)
+            except Overloaded as e:
+                await websocket.send_json({"status": "overloaded", "error": str(e)})
+                continue
+            latest_ts, latest_value = glucose_buffer.latest(patient_id)
+            await websocket.send_json({
+                "status": "ok",
+                "accepted": len(readings),
+                "latest": {"ts_ms": latest_ts, "value_mgdl": latest_value}
+            })
+    except WebSocketDisconnect:
+        pass
+
+
+@app.get("/twin/{patient_id}/glucose")
+async def get_glucose_readings(patient_id: str, start_ms: int = 0, end_ms: Optional[int] = None,
+                               db: AsyncSession = Depends(get_async_db)):
+    """
+    CGM readings for a patient as compact columns
+    Includes readings still waiting in the write buffer.
+    
+    Example: GET /twin/DM_00001/glucose?start_ms=1735689600000
+    """
+    stored = [tuple(row) for row in await db.execute(glucose_range_query(patient_id, start_ms, end_ms))]
+    readings = merge_readings(stored, glucose_buffer.pending_readings(patient_id, start_ms, end_ms))
+    
+    if not readings and not await db.get(Patient, patient_id):
+        raise HTTPException(status_code=404, detail=f"Patient {patient_id} not found in database")
+    
+    return {
+        "patient_id": patient_id,
+        "count": len(readings),
+        "ts_ms": [ts for ts, _ in readings],
+        "value_mgdl": [value for _, value in readings]
+    }
+
+
+MAX_TREND_POINTS = 2000
+
+
+def resolve_analyte(name: str) -> str:
+    """Analyte name as stored in lab_measurements (accepts payload keys and common spellings)"""
+    if name in LAB_MEASUREMENT_FIELDS:
+        return LAB_MEASUREMENT_FIELDS[name][0]
+    return canonical_analyte(name) or name
+
+
+@app.get("/twin/{patient_id}/trend")
+async def get_lab_trend(patient_id: str, analyte: str, start_ms: Optional[int] = None,
+                        end_ms: Optional[int] = None, max_points: int = 200,
+                        db: AsyncSession = Depends(get_async_db)):
+    """
+    Lab history for one analyte as compact columns, downsampled in SQL to at most
+    max_points time buckets (mean value, with min/max and the number of measurements).
+    Defaults to the patient's whole history for that analyte.
+    
+    Example: GET /twin/DM_00001/trend?analyte=HbA1c&max_points=100
+    """
+    if not 1 <= max_points <= MAX_TREND_POINTS:
+        raise HTTPException(status_code=400, detail=f"max_points must be between 1 and {MAX_TREND_POINTS}")
+    
+    name = resolve_analyte(analyte)
+    if end_ms is None:
+        end_ms = now_ms()
+    if start_ms is None:
+        start_ms = (await db.execute(first_lab_measurement_query(patient_id, name))).scalar()
+    
+    rows = []
+    bucket_ms = None
+    if start_ms is not None and start_ms <= end_ms:
+        bucket_ms = max(1, -(-(end_ms - start_ms + 1) // max_points))  # ceiling division
+        rows = (await db.execute(lab_trend_query(patient_id, name, start_ms, end_ms, bucket_ms))).all()
+    
+    if not rows and not await db.get(Patient, patient_id):
+        raise HTTPException(status_code=404, detail=f"Patient {patient_id} not found in database")
+    
+    return {
+        "patient_id": patient_id,
+        "analyte": name,
+        "unit": rows[0][5] if rows else None,
+        "start_ms": start_ms,
+        "end_ms": end_ms,
+        "bucket_ms": bucket_ms,
+        "count": sum(row[4] for row in rows),
+        "ts_ms": [row[0] for row in rows],
+        "value": [round(row[1], 2) for row in rows],
+        "min": [row[2] for row in rows],
+        "max": [row[3] for row in rows],
+        "n": [row[4] for row in rows]
+    }
 
 
 class MedicationInput(BaseModel):
     drugs: List[str]
 
 @app.post("/twin/{patient_id}/simulate-medication")
-def simulate_medication(patient_id: str, input_data: MedicationInput, db: Session = Depends(get_db)):
+async def simulate_medication(patient_id: str, input_data: MedicationInput, db: AsyncSession = Depends(get_async_db)):
     """
     Simulate the effect of medications ("What-If" Scenario).
     Returns predicted HbA1c AND prevented risks.
     """
     from simulation_engine import MedicationSimulator, RiskAssessor
     
-    twin = get_or_create_twin(patient_id, db)
+    twin = await get_or_create_twin(patient_id, db)
     current_hba1c = twin.metabolic_profile.hba1c_percent
     
     # 1. Simulate Drug Effect (HbA1c Drop)
@@ -43,13 +43,6 @@ st.markdown("""
         padding: 1rem;
         margin-bottom: 1rem;
     }
-    .analysis-box {
-        background-color: #e8f4f8;
-        border-left: 4px solid #1f77b4;
-        padding: 1rem;
-        border-radius: 5px;
-        margin: 1rem 0;
-    }
 </style>
 """, unsafe_allow_html=True)
 
@@ -427,15 +420,10 @@ with st.sidebar:
             
             # Generate Schedule Button
             if st.button("📅 Generate Full Schedule", type="secondary"):
-                with st.spinner("Creating medication schedule..."):
-                    schedule = st.session_state.notifier_agent.create_medication_schedule(
-                        st.session_state.medications
-                    )
-                    
-                    # Display in main area
-                    st.session_state.show_schedule = True
-                    st.session_state.generated_schedule = schedule
-                    st.rerun()
+                # Generated (streamed) in the main area
+                st.session_state.show_schedule = True
+                st.session_state.generated_schedule = None
+                st.rerun()
         else:
             st.info("No medications added yet")
     else:
@@ -634,10 +622,15 @@ if "show_schedule" not in st.session_state:
 if "generated_schedule" not in st.session_state:
     st.session_state.generated_schedule = ""
 
-if st.session_state.show_schedule and st.session_state.generated_schedule:
+if st.session_state.show_schedule:
     st.markdown("---")
     st.markdown("### 📅 Your Medication Schedule")
-    st.markdown(st.session_state.generated_schedule)
+    if st.session_state.generated_schedule is None:
+        st.session_state.generated_schedule = st.write_stream(
+            st.session_state.notifier_agent.create_medication_schedule_stream(st.session_state.medications)
+        )
+    else:
+        st.markdown(st.session_state.generated_schedule)
     
     if st.session_state.calendar_connected:
         st.success(f"✅ Automatic reminders are active for {st.session_state.patient_email}")
@@ -666,146 +659,147 @@ if not st.session_state.interview_complete:
 
         # Get AI response
         with st.chat_message("assistant"):
-            with st.spinner("Analyzing..."):
-                try:
+            try:
+                with st.spinner("Analyzing..."):
                     # Start or continue interview
                     if not st.session_state.interview_started:
                         response = st.session_state.qa_agent.start_interview(prompt)
                         st.session_state.interview_started = True
                     else:
                         response = st.session_state.qa_agent.continue_interview(prompt)
+                
+                st.markdown(response)
+                st.session_state.messages.append({"role": "assistant", "content": response})
+                
+                # Check if interview is complete
+                if st.session_state.qa_agent.interview_complete:
+                    st.session_state.interview_complete = True
+                    
+                    # Get analysis (severity first; the recommendations stream in below)
+                    with st.spinner("Generating medical analysis..."):
+                        collected_data = st.session_state.qa_agent.get_collected_data()
+                        analysis, recommendation_chunks = st.session_state.analysis_agent.analyze_with_stream(collected_data)
+                    
+                    # Display analysis
+                    st.divider()
+                    st.markdown("### 📊 Medical Analysis")
+                    
+                    col1, col2, col3 = st.columns(3)
+                    with col1:
+                        st.metric("Condition", analysis['condition'].replace('_', ' ').title())
+                    with col2:
+                        severity_color = {
+                            "LOW": "🟢",
+                            "MODERATE": "🟡",
+                            "HIGH": "🟠",
+                            "CRITICAL": "🔴"
+                        }
+                        st.metric("Severity", f"{severity_color.get(analysis['severity'], '⚪')} {analysis['severity']}")
+                    with col3:
+                        if analysis.get('gold_group'):
+                            st.metric("Classification", analysis['gold_group'])
                     
-                    st.markdown(response)
-                    st.session_state.messages.append({"role": "assistant", "content": response})
+                    st.markdown("### 💊 Recommendations")
+                    with st.container(border=True):
+                        analysis["recommendations"] = st.write_stream(recommendation_chunks)
                     
-                    # Check if interview is complete
-                    if st.session_state.qa_agent.interview_complete:
-                        st.session_state.interview_complete = True
+                    # Generate prediction
+                    with st.spinner("Generating disease prediction..."):
+                        prediction = st.session_state.prediction_agent.generate_comprehensive_prediction(analysis)
                         
-                        # Get analysis
-                        with st.spinner("Generating medical analysis..."):
-                            collected_data = st.session_state.qa_agent.get_collected_data()
-                            analysis = st.session_state.analysis_agent.analyze(collected_data)
-                            
-                            # Display analysis
-                            st.divider()
-                            st.markdown("### 📊 Medical Analysis")
-                            
-                            col1, col2, col3 = st.columns(3)
-                            with col1:
-                                st.metric("Condition", analysis['condition'].replace('_', ' ').title())
-                            with col2:
-                                severity_color = {
-                                    "LOW": "🟢",
-                                    "MODERATE": "🟡",
-                                    "HIGH": "🟠",
-                                    "CRITICAL": "🔴"
-                                }
-                                st.metric("Severity", f"{severity_color.get(analysis['severity'], '⚪')} {analysis['severity']}")
-                            with col3:
-                                if analysis.get('gold_group'):
-                                    st.metric("Classification", analysis['gold_group'])
-                            
-                            st.markdown("### 💊 Recommendations")
-                            st.markdown(f'<div class="analysis-box">{analysis["recommendations"]}</div>', unsafe_allow_html=True)
-                            
-                            # Generate prediction
-                            with st.spinner("Generating disease prediction..."):
-                                prediction = st.session_state.prediction_agent.generate_comprehensive_prediction(analysis)
-                                
-                                st.divider()
-                                st.markdown("### 🔮 Disease Prediction & Organ Impact")
-                                
-                                # Worsening Prediction
-                                worsening = prediction['worsening_prediction']
-                                if worsening.get('worsening'):
-                                    st.error(f"⚠️ Warning: Case appears to be worsening")
-                                else:
-                                    st.success(f"✅ Status: Case appears stable/manageable")
-                                
-                                st.markdown(f"**Forecast:** {worsening.get('progression_forecast')}")
-                                
-                                if worsening.get('risk_factors'):
-                                    st.markdown("**Risk Factors:**")
-                                    for risk in worsening['risk_factors']:
-                                        st.markdown(f"- {risk}")
-                                
-                                # Organ Impact
-                                st.markdown("#### 🫁 Organ Impact Assessment")
-                                organs = prediction['organ_impact_prediction'].get('affected_organs', [])
-                                if organs:
-                                    for organ in organs:
-                                        risk_color = "red" if "high" in organ.get('risk_level', '').lower() else "orange"
-                                        st.markdown(f"**:{risk_color}[{organ.get('organ')}]** ({organ.get('risk_level')})")
-                                        st.caption(f"{organ.get('impact_description')}")
-                                else:
-                                    st.info("No immediate organ impact detected.")
-                            
-                            # Generate treatment plan
-                            with st.spinner("Creating personalized treatment plan..."):
-                                plan = st.session_state.planning_agent.create_comprehensive_plan(analysis)
-                                
-                                st.divider()
-                                st.markdown("### 📋 Treatment Plan")
-                                
-                                # Short-term plan
-                                st.markdown("#### 🎯 Short-Term Plan (1-7 days)")
-                                
-                                col1, col2, col3 = st.columns(3)
-                                with col1:
-                                    st.markdown("**Daily Actions**")
-                                    for action in plan['short_term_plan']['daily_actions']:
-                                        st.markdown(f"✓ {action}")
-                                
-                                with col2:
-                                    st.markdown("**Monitoring**")
-                                    for item in plan['short_term_plan']['monitoring']:
-                                        st.markdown(f"📊 {item}")
-                                
-                                with col3:
-                                    st.markdown("**⚠️ Red Flags**")
-                                    for flag in plan['short_term_plan']['red_flags']:
-                                        st.markdown(f"🚨 {flag}")
-                                
-                                # Long-term plan
-                                st.markdown("#### 🎯 Long-Term Plan (1-3 months)")
-                                
-                                col1, col2, col3 = st.columns(3)
-                                with col1:
-                                    st.markdown("**Lifestyle Changes**")
-                                    for change in plan['long_term_plan']['lifestyle_changes']:
-                                        st.markdown(f"🌱 {change}")
-                                
-                                with col2:
-                                    st.markdown("**Follow-up Schedule**")
-                                    for appt in plan['long_term_plan']['follow_up_schedule']:
-                                        st.markdown(f"📅 {appt}")
-                                
-                                with col3:
-                                    st.markdown("**Goals**")
-                                    for goal in plan['long_term_plan']['goals']:
-                                        st.markdown(f"🎯 {goal}")
-                            
-                            st.success("✅ Complete consultation finished! Click 'New Interview' in the sidebar to start another.")
-                
-                except Exception as e:
-                    # Show detailed error information
-                    st.error(f"❌ Error: {str(e)}")
-                    st.error(f"Error Type: {type(e).__name__}")
+                        st.divider()
+                        st.markdown("### 🔮 Disease Prediction & Organ Impact")
+                        
+                        # Worsening Prediction
+                        worsening = prediction['worsening_prediction']
+                        if worsening.get('worsening'):
+                            st.error(f"⚠️ Warning: Case appears to be worsening")
+                        else:
+                            st.success(f"✅ Status: Case appears stable/manageable")
+                        
+                        st.markdown(f"**Forecast:** {worsening.get('progression_forecast')}")
+                        
+                        if worsening.get('risk_factors'):
+                            st.markdown("**Risk Factors:**")
+                            for risk in worsening['risk_factors']:
+                                st.markdown(f"- {risk}")
+                        
+                        # Organ Impact
+                        st.markdown("#### 🫁 Organ Impact Assessment")
+                        organs = prediction['organ_impact_prediction'].get('affected_organs', [])
+                        if organs:
+                            for organ in organs:
+                                risk_color = "red" if "high" in organ.get('risk_level', '').lower() else "orange"
+                                st.markdown(f"**:{risk_color}[{organ.get('organ')}]** ({organ.get('risk_level')})")
+                                st.caption(f"{organ.get('impact_description')}")
+                        else:
+                            st.info("No immediate organ impact detected.")
                     
-                    # Show more details in expander
-                    with st.expander("🔍 Error Details (for debugging)"):
-                        import traceback
-                        st.code(traceback.format_exc())
+                    # Generate treatment plan
+                    with st.spinner("Creating personalized treatment plan..."):
+                        plan = st.session_state.planning_agent.create_comprehensive_plan(analysis)
+                        
+                        st.divider()
+                        st.markdown("### 📋 Treatment Plan")
+                        
+                        # Short-term plan
+                        st.markdown("#### 🎯 Short-Term Plan (1-7 days)")
+                        
+                        col1, col2, col3 = st.columns(3)
+                        with col1:
+                            st.markdown("**Daily Actions**")
+                            for action in plan['short_term_plan']['daily_actions']:
+                                st.markdown(f"✓ {action}")
+                        
+                        with col2:
+                            st.markdown("**Monitoring**")
+                            for item in plan['short_term_plan']['monitoring']:
+                                st.markdown(f"📊 {item}")
+                        
+                        with col3:
+                            st.markdown("**⚠️ Red Flags**")
+                            for flag in plan['short_term_plan']['red_flags']:
+                                st.markdown(f"🚨 {flag}")
+                        
+                        # Long-term plan
+                        st.markdown("#### 🎯 Long-Term Plan (1-3 months)")
+                        
+                        col1, col2, col3 = st.columns(3)
+                        with col1:
+                            st.markdown("**Lifestyle Changes**")
+                            for change in plan['long_term_plan']['lifestyle_changes']:
+                                st.markdown(f"🌱 {change}")
+                        
+                        with col2:
+                            st.markdown("**Follow-up Schedule**")
+                            for appt in plan['long_term_plan']['follow_up_schedule']:
+                                st.markdown(f"📅 {appt}")
+                        
+                        with col3:
+                            st.markdown("**Goals**")
+                            for goal in plan['long_term_plan']['goals']:
+                                st.markdown(f"🎯 {goal}")
                     
-                    st.warning("💡 Common fixes:")
-                    st.markdown("""
-                    - Check your API key is correct
-                    - Verify you have credits: https://platform.deepseek.com/billing
-                    - Try clicking 'New Interview' in the sidebar
-                    - Check your internet connection
-                    """)
-                    st.info("Please try again or start a new interview.")
+                    st.success("✅ Complete consultation finished! Click 'New Interview' in the sidebar to start another.")
+            
+            except Exception as e:
+                # Show detailed error information
+                st.error(f"❌ Error: {str(e)}")
+                st.error(f"Error Type: {type(e).__name__}")
+                
+                # Show more details in expander
+                with st.expander("🔍 Error Details (for debugging)"):
+                    import traceback
+                    st.code(traceback.format_exc())
+                
+                st.warning("💡 Common fixes:")
+                st.markdown("""
+                - Check your API key is correct
+                - Verify you have credits: https://platform.deepseek.com/billing
+                - Try clicking 'New Interview' in the sidebar
+                - Check your internet connection
+                """)
+                st.info("Please try again or start a new interview.")
 else:
     st.info("✅ Interview complete! Click 'New Interview' in the sidebar to start a new consultation.")
 
@@ -0,0 +1,171 @@
+"""
+Agent mode benchmark: sequential vs concurrent vs fused LLM calls
+
+Runs PredictionAgent.generate_comprehensive_prediction and
+PlanningAgent.create_comprehensive_plan in each mode against a mock LLM, for
+real patients' qa_data (api.twin_to_qa_data on diabetes_dataset.csv rows).
+
+The mock replies with fixed JSON of realistic size and sleeps like a hosted
+chat model: a fixed round trip (--base-ms, network + time to first token) plus
+output tokens at --tokens-per-second. It reports usage_metadata like the real
+client, counting tokens approximately (one per word or punctuation mark), so the
+token columns compare modes rather than predict the provider's bill.
+
+A measurement tool, not a test (test_agent_modes.py covers the modes with an
+instant fake LLM): at the defaults each patient takes about 30 s of simulated
+LLM time across the six agent/mode runs.
+
+Usage:
+    python bench_agent_modes.py                        # 2 patients, 800 ms + 50 tok/s
+    python bench_agent_modes.py --patients 20 --base-ms 1500 --tokens-per-second 30
+"""
+
+import argparse
+import json
+import re
+import statistics
+import threading
+import time
+
+import pandas as pd
+from langchain_core.messages import AIMessage
+
+from medtwin_agents import PlanningAgent, PredictionAgent, PLAN_MODES, PREDICTION_MODES
+
+PROGRESSION = {
+    "worsening": True,
+    "progression_forecast": (
+        "Without intensified treatment, sustained hyperglycemia at this HbA1c is likely to accelerate "
+        "microvascular damage over the next 2-5 years, with rising albuminuria and early retinopathy; "
+        "blood pressure and lipid levels add to the macrovascular risk."
+    ),
+    "risk_factors": ["Elevated HbA1c", "Stage 2 hypertension", "Obesity", "Low physical activity",
+                     "Family history of diabetes"]
+}
+ORGAN_IMPACT = {
+    "affected_organs": [
+        {"organ": "Kidneys", "risk_level": "HIGH",
+         "impact_description": "Hyperglycemia and hypertension damage glomeruli, leading to diabetic nephropathy."},
+        {"organ": "Eyes", "risk_level": "MODERATE",
+         "impact_description": "Retinal microvascular damage may progress to diabetic retinopathy."},
+        {"organ": "Heart", "risk_level": "HIGH",
+         "impact_description": "Accelerated atherosclerosis raises the risk of coronary artery disease."},
+        {"organ": "Nerves", "risk_level": "MODERATE",
+         "impact_description": "Peripheral neuropathy may cause numbness and foot ulcer risk."}
+    ],
+    "systemic_risks": "Cardiovascular events, chronic kidney disease and peripheral vascular disease."
+}
+SHORT_TERM = {
+    "daily_actions": ["Check fasting glucose every morning", "Take medications as prescribed",
+                      "Walk 20-30 minutes after meals", "Limit refined carbohydrates"],
+    "monitoring": ["Fasting and post-meal glucose", "Blood pressure twice daily", "Foot inspection"],
+    "red_flags": ["Glucose above 300 mg/dL", "Chest pain or shortness of breath", "Confusion or fainting"]
+}
+LONG_TERM = {
+    "lifestyle_changes": ["Lose 5-10% of body weight", "150 minutes of moderate activity per week",
+                          "Mediterranean-style diet", "Stop smoking if applicable"],
+    "follow_up_schedule": ["HbA1c in 3 months", "Kidney function and urine albumin in 3 months",
+                           "Dilated eye exam within 6 months"],
+    "goals": ["HbA1c below 7%", "Blood pressure below 130/80 mmHg", "LDL below 100 mg/dL"]
+}
+
+_TOKEN = re.compile(r"\w+|[^\w\s]")
+
+
+def count_tokens(text: str) -> int:
+    return len(_TOKEN.findall(text))
+
+
+class MockLLM:
+    """Chat model stand-in: canned JSON by prompt type, hosted-model latency, usage counts"""
+
+    def __init__(self, base_seconds: float, tokens_per_second: float):
+        self.base_seconds = base_seconds
+        self.tokens_per_second = tokens_per_second
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.calls = self.input_tokens = self.output_tokens = 0
+
+    def _reply(self, prompt: str) -> dict:
+        if '"progression": {' in prompt:
+            return {"progression": PROGRESSION, "organ_impact": ORGAN_IMPACT}
+        if '"short_term_plan": {' in prompt:
+            return {"short_term_plan": SHORT_TERM, "long_term_plan": LONG_TERM}
+        if "disease progression" in prompt:
+            return PROGRESSION
+        if "organs are at risk" in prompt:
+            return ORGAN_IMPACT
+        if "SHORT-TERM" in prompt:
+            return SHORT_TERM
+        return LONG_TERM
+
+    def invoke(self, prompt: str):
+        content = "```json\n" + json.dumps(self._reply(prompt), indent=2) + "\n```"
+        usage = {"input_tokens": count_tokens(prompt), "output_tokens": count_tokens(content)}
+        usage["total_tokens"] = usage["input_tokens"] + usage["output_tokens"]
+        time.sleep(self.base_seconds + usage["output_tokens"] / self.tokens_per_second)
+        with self._lock:
+            self.calls += 1
+            self.input_tokens += usage["input_tokens"]
+            self.output_tokens += usage["output_tokens"]
+        return AIMessage(content=content, usage_metadata=usage)
+
+
+def load_qa_data(patients: int):
+    from api import twin_to_qa_data
+    from digital_twin import DiabetesTwin
+
+    df = pd.read_csv("diabetes_dataset.csv", nrows=patients)
+    return [
+        twin_to_qa_data(DiabetesTwin(patient_id=f"DM_{i:05d}", patient_data=row))
+        for i, row in enumerate(df.to_dict("records"))
+    ]
+
+
+def run_mode(llm: MockLLM, call, qa_datas):
+    llm.reset()
+    latencies = []
+    for qa_data in qa_datas:
+        start = time.perf_counter()
+        call({"condition": "diabetes", "severity": "HIGH", "qa_data": qa_data})
+        latencies.append(time.perf_counter() - start)
+    n = len(qa_datas)
+    return {
+        "mean": statistics.mean(latencies),
+        "calls": llm.calls / n,
+        "input": llm.input_tokens / n,
+        "output": llm.output_tokens / n,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--patients", type=int, default=2)
+    parser.add_argument("--base-ms", type=float, default=800)
+    parser.add_argument("--tokens-per-second", type=float, default=50)
+    args = parser.parse_args()
+
+    qa_datas = load_qa_data(args.patients)
+    llm = MockLLM(args.base_ms / 1000, args.tokens_per_second)
+    print(f"📊 {args.patients} patients, mock LLM: {args.base_ms:.0f} ms + {args.tokens_per_second:.0f} output tok/s")
+
+    benches = [
+        ("PredictionAgent", PREDICTION_MODES,
+         lambda mode: PredictionAgent(llm, mode).generate_comprehensive_prediction),
+        ("PlanningAgent", PLAN_MODES,
+         lambda mode: PlanningAgent(llm, mode).create_comprehensive_plan),
+    ]
+    for name, modes, make_call in benches:
+        print(f"\n{name:16} {'seconds':>8} {'vs seq':>7} {'calls':>6} {'in tok':>7} {'out tok':>8}")
+        baseline = None
+        for mode in modes:
+            result = run_mode(llm, make_call(mode), qa_datas)
+            baseline = baseline or result["mean"]
+            print(f"{mode:16} {result['mean']:8.2f} {result['mean'] / baseline:6.0%} {result['calls']:6.1f} "
+                  f"{result['input']:7.0f} {result['output']:8.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,225 @@
+"""
+Concurrency benchmark: async (aiosqlite) vs sync (threadpool) database path
+
+Starts two uvicorn servers against the same medtwin.db:
+    async - handlers are `async def` on AsyncSession (api.get_or_create_twin)
+    sync  - the previous `def` handlers on a blocking Session in the threadpool
+and drives both with the same number of concurrent clients.
+
+Two scenarios are measured:
+    /twin/{id}          - DB read + twin build only
+    /twin/{id}/assess   - the same plus an upstream wait (simulated LLM call,
+                          --upstream-ms), which is where a threadpool worker per
+                          request caps concurrency and the event loop does not
+
+Usage:
+    python bench_async_db.py                      # 200 clients, 15 s per run
+    python bench_async_db.py --clients 200 --seconds 30 --upstream-ms 2500
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+
+import httpx
+from fastapi import Depends, FastAPI, HTTPException
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from database import get_db, get_async_db, SessionLocal, Patient, AgentData, DERIVED_AGENT_TYPES
+from digital_twin import DiabetesTwin
+
+UPSTREAM_SECONDS = float(os.environ.get("BENCH_UPSTREAM_MS", "1000")) / 1000
+
+
+# ============================================================
+# BASELINE: previous sync handlers (blocking Session in the threadpool)
+# ============================================================
+
+sync_app = FastAPI(title="MedTwin sync baseline")
+
+
+def sync_get_twin(patient_id: str, db: Session) -> DiabetesTwin:
+    patient = db.query(Patient).filter(Patient.id == patient_id).first()
+    if not patient:
+        raise HTTPException(status_code=404, detail=f"Patient {patient_id} not found in database")
+    latest_record = db.query(AgentData)\
+        .filter(AgentData.patient_id == patient_id)\
+        .filter(AgentData.agent_type.notin_(DERIVED_AGENT_TYPES))\
+        .order_by(AgentData.timestamp.desc())\
+        .first()
+    return DiabetesTwin(patient_id=patient_id, patient_data=latest_record.data_payload)
+
+
+@sync_app.get("/twin/{patient_id}")
+def sync_twin(patient_id: str, db: Session = Depends(get_db)):
+    return sync_get_twin(patient_id, db).to_dict()
+
+
+@sync_app.get("/twin/{patient_id}/assess")
+def sync_assess(patient_id: str, db: Session = Depends(get_db)):
+    twin = sync_get_twin(patient_id, db)
+    db.close()  # release the pooled connection; the worker thread stays busy
+    time.sleep(UPSTREAM_SECONDS)  # blocking LLM client call
+    return {"patient_id": patient_id, "hba1c": twin.metabolic_profile.hba1c_percent}
+
+
+# ============================================================
+# ASYNC: current handlers (AsyncSession on the event loop)
+# ============================================================
+
+async_app = FastAPI(title="MedTwin async")
+
+
+@async_app.get("/twin/{patient_id}")
+async def async_twin(patient_id: str, db: AsyncSession = Depends(get_async_db)):
+    from api import get_or_create_twin
+    return (await get_or_create_twin(patient_id, db)).to_dict()
+
+
+@async_app.get("/twin/{patient_id}/assess")
+async def async_assess(patient_id: str, db: AsyncSession = Depends(get_async_db)):
+    from api import get_or_create_twin
+    twin = await get_or_create_twin(patient_id, db)
+    await db.close()  # release the pooled connection before the upstream wait
+    await asyncio.sleep(UPSTREAM_SECONDS)  # awaited LLM client call (ainvoke)
+    return {"patient_id": patient_id, "hba1c": twin.metabolic_profile.hba1c_percent}
+
+
+# ============================================================
+# LOAD GENERATOR
+# ============================================================
+
+def sample_patient_ids(limit: int = 1000):
+    db = SessionLocal()
+    try:
+        return [row[0] for row in db.query(Patient.id).limit(limit).all()]
+    finally:
+        db.close()
+
+
+async def http_get(reader, writer, host: str, path: str) -> int:
+    """Minimal keep-alive HTTP/1.1 GET (keeps the load generator's own CPU cost low)"""
+    writer.write(f"GET {path} HTTP/1.1\r\nHost: {host}\r\n\r\n".encode())
+    await writer.drain()
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError("connection closed")
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b""):
+            break
+        name, _, value = line.partition(b":")
+        if name.strip().lower() == b"content-length":
+            length = int(value)
+    await reader.readexactly(length)
+    return int(status_line.split()[1])
+
+
+async def run_load(host: str, port: int, path: str, patient_ids, clients: int, seconds: float):
+    latencies = []
+    errors = 0
+    deadline = time.perf_counter() + seconds
+
+    async def worker():
+        nonlocal errors
+        reader = writer = None
+        while time.perf_counter() < deadline:
+            url = path.replace("{id}", random.choice(patient_ids))
+            start = time.perf_counter()
+            try:
+                if writer is None:
+                    reader, writer = await asyncio.open_connection(host, port)
+                status = await http_get(reader, writer, host, url)
+            except (OSError, ConnectionError, asyncio.IncompleteReadError):
+                errors += 1
+                writer = None
+                continue
+            if status != 200:
+                errors += 1
+                continue
+            latencies.append(time.perf_counter() - start)
+        if writer is not None:
+            writer.close()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(clients)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+
+    def pct(p):
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000 if latencies else float("nan")
+
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": len(latencies) / elapsed,
+        "p50_ms": pct(0.50),
+        "p95_ms": pct(0.95),
+        "p99_ms": pct(0.99),
+        "mean_ms": statistics.mean(latencies) * 1000 if latencies else float("nan")
+    }
+
+
+def start_server(app_path: str, port: int, upstream_ms: float) -> subprocess.Popen:
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", app_path, "--port", str(port), "--log-level", "warning"],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        env={**os.environ, "BENCH_UPSTREAM_MS": str(upstream_ms),
+             "PYTHONPATH": os.path.dirname(os.path.abspath(__file__))}
+    )
+    for _ in range(100):
+        try:
+            httpx.get(f"http://127.0.0.1:{port}/docs", timeout=1)
+            return process
+        except httpx.HTTPError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError(f"{app_path} did not start on port {port}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=200)
+    parser.add_argument("--seconds", type=float, default=15)
+    parser.add_argument("--upstream-ms", type=float, default=1000)
+    parser.add_argument("--port", type=int, default=8101)
+    args = parser.parse_args()
+
+    patient_ids = sample_patient_ids()
+    if not patient_ids:
+        print("❌ No patients in medtwin.db (run import_csv_to_db.py first)")
+        return
+
+    print(f"📊 {args.clients} concurrent clients, {args.seconds:.0f}s per run, upstream wait {args.upstream_ms:.0f} ms")
+    results = {}
+    for mode, port in (("sync", args.port), ("async", args.port + 1)):
+        server = start_server(f"bench_async_db:{mode}_app", port, args.upstream_ms)
+        try:
+            for path in ("/twin/{id}", "/twin/{id}/assess"):
+                asyncio.run(run_load("127.0.0.1", port, path, patient_ids, args.clients, 2))  # warm-up
+                results[(path, mode)] = asyncio.run(
+                    run_load("127.0.0.1", port, path, patient_ids, args.clients, args.seconds)
+                )
+        finally:
+            server.terminate()
+            server.wait()
+
+    for path in ("/twin/{id}", "/twin/{id}/assess"):
+        print(f"\nGET {path}")
+        print(f"{'':6} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7}")
+        for mode in ("sync", "async"):
+            r = results[(path, mode)]
+            print(f"{mode:6} {r['rps']:8.0f} {r['p50_ms']:8.1f} {r['p95_ms']:8.1f} {r['p99_ms']:8.1f} {r['errors']:7d}")
+        print(f"async/sync throughput: {results[(path, 'async')]['rps'] / results[(path, 'sync')]['rps']:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
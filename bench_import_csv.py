@@ -0,0 +1,132 @@
+"""
+Import benchmark: chunked bulk importer vs the previous row-by-row script
+
+Builds an N-row CSV (rows of diabetes_dataset.csv sampled with replacement) and
+imports it into fresh databases in a temporary directory:
+    legacy   - the previous import_csv_to_db.py: df.iterrows(), one Patient
+               lookup query and one ORM add per row, a single commit
+    bulk     - import_csv_to_db.migrate_csv_to_sqlite (chunked executemany,
+               ON CONFLICT DO NOTHING, content-hash ledger)
+    re-run   - the bulk importer again on the same CSV (every row unchanged)
+
+The legacy script is run on --legacy-rows rows and its rate extrapolated to N
+(it slows down further as the session grows, so the estimate is generous).
+
+Usage:
+    python bench_import_csv.py                         # 1,000,000 rows, legacy on 20,000
+    python bench_import_csv.py --rows 200000 --legacy-rows 200000
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import pandas as pd
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+# ============================================================
+# BASELINE: previous import_csv_to_db.py
+# ============================================================
+
+def legacy_import(csv_path: str, limit: int):
+    from datetime import datetime
+    from database import init_db, SessionLocal, Patient, AgentData
+
+    init_db()
+    df = pd.read_csv(csv_path, nrows=limit)
+    db = SessionLocal()
+    try:
+        for index, row in df.iterrows():
+            patient_id = f"DM_{index:05d}"
+            patient = db.query(Patient).filter(Patient.id == patient_id).first()
+            if not patient:
+                db.add(Patient(id=patient_id, created_at=datetime.utcnow()))
+            db.add(AgentData(
+                patient_id=patient_id,
+                agent_type="LegacyCSV",
+                data_payload=row.to_dict(),
+                timestamp=datetime.utcnow()
+            ))
+        db.commit()
+    finally:
+        db.close()
+
+
+def bulk_import(csv_path: str, chunk_size: int):
+    from import_csv_to_db import migrate_csv_to_sqlite
+    migrate_csv_to_sqlite(csv_path, chunk_size)
+
+
+# ============================================================
+# RUNNER
+# ============================================================
+
+def make_csv(path: str, rows: int):
+    source = pd.read_csv(os.path.join(REPO_DIR, "diabetes_dataset.csv"), index_col=0)
+    # Written with its index like the original, so the first column is the row number again
+    source.sample(n=rows, replace=True, random_state=42).reset_index(drop=True).to_csv(path)
+
+
+def timed_run(workdir: str, code: str) -> float:
+    """Run code in a fresh interpreter with workdir as cwd (medtwin.db is created there)"""
+    os.makedirs(workdir, exist_ok=True)
+    env = dict(os.environ, PYTHONPATH=REPO_DIR)
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "-c", code], cwd=workdir, env=env, check=True, stdout=subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+
+def count_rows(workdir: str) -> int:
+    import sqlite3
+    with sqlite3.connect(os.path.join(workdir, "medtwin.db")) as conn:
+        return conn.execute("SELECT count(*) FROM agent_data").fetchone()[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--legacy-rows", type=int, default=20_000)
+    parser.add_argument("--chunk-size", type=int, default=20_000)
+    parser.add_argument("--dir", help="work directory (default: a temporary one)")
+    args = parser.parse_args()
+
+    workdir = args.dir or tempfile.mkdtemp(prefix="medtwin-import-bench-")
+    os.makedirs(workdir, exist_ok=True)
+    csv_path = os.path.join(workdir, "patients.csv")
+    print(f"📊 Building {args.rows:,}-row CSV in {workdir}")
+    make_csv(csv_path, args.rows)
+
+    legacy_rows = min(args.legacy_rows, args.rows)
+    print(f"🚀 legacy script on {legacy_rows:,} rows")
+    legacy_seconds = timed_run(
+        os.path.join(workdir, "legacy"),
+        f"import bench_import_csv as b; b.legacy_import({csv_path!r}, {legacy_rows})"
+    )
+    legacy_rate = legacy_rows / legacy_seconds
+
+    print(f"🚀 bulk importer on {args.rows:,} rows")
+    bulk_code = f"import bench_import_csv as b; b.bulk_import({csv_path!r}, {args.chunk_size})"
+    bulk_dir = os.path.join(workdir, "bulk")
+    bulk_seconds = timed_run(bulk_dir, bulk_code)
+    imported = count_rows(bulk_dir)
+    print("🚀 bulk importer re-run (unchanged CSV)")
+    rerun_seconds = timed_run(bulk_dir, bulk_code)
+    after_rerun = count_rows(bulk_dir)
+
+    print(f"\n{'':8} {'rows':>10} {'seconds':>9} {'rows/s':>9}")
+    print(f"{'legacy':8} {legacy_rows:>10,} {legacy_seconds:9.1f} {legacy_rate:9.0f}")
+    print(f"{'bulk':8} {args.rows:>10,} {bulk_seconds:9.1f} {args.rows / bulk_seconds:9.0f}")
+    print(f"{'re-run':8} {args.rows:>10,} {rerun_seconds:9.1f} {args.rows / rerun_seconds:9.0f}")
+    print(f"legacy extrapolated to {args.rows:,} rows: {args.rows / legacy_rate:.0f}s "
+          f"({args.rows / legacy_rate / bulk_seconds:.1f}x slower than bulk)")
+    print(f"agent_data rows: {imported:,} after import, {after_rerun:,} after re-run "
+          f"({'✅ idempotent' if imported == after_rerun else '❌ duplicates'})")
+
+
+if __name__ == "__main__":
+    main()
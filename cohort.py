@@ -0,0 +1,155 @@
+"""
+Cohort Queries for MedTwin
+Compiles population filters such as "HbA1c > 9" and "LDL >= 160" into SQL over
+the indexed clinical columns (database.CLINICAL_FIELDS), so screening queries are
+index range scans and never parse payloads.
+"""
+
+import operator
+import re
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+from sqlalchemy import func, or_, select
+
+from database import AgentData, PatientLatestState, CLINICAL_FIELDS, DERIVED_AGENT_TYPES
+
+
+OPERATORS = {
+    ">": operator.gt,
+    ">=": operator.ge,
+    "<": operator.lt,
+    "<=": operator.le,
+    "=": operator.eq,
+    "==": operator.eq,
+    "!=": operator.ne,
+}
+
+# Column names, payload keys and common spellings -> column name
+FIELD_ALIASES: Dict[str, str] = {}
+for _field, (_key, _) in CLINICAL_FIELDS.items():
+    FIELD_ALIASES[_field] = _field
+    FIELD_ALIASES[_key.lower()] = _field
+FIELD_ALIASES.update({
+    "a1c": "hba1c",
+    "glucose": "fasting_glucose",
+    "fasting glucose": "fasting_glucose",
+    "fbg": "fasting_glucose",
+    "ldl cholesterol": "ldl",
+    "hdl cholesterol": "hdl",
+    "cholesterol": "total_cholesterol",
+    "total cholesterol": "total_cholesterol",
+    "systolic": "systolic_bp",
+    "sbp": "systolic_bp",
+    "diastolic": "diastolic_bp",
+    "dbp": "diastolic_bp",
+    "urate": "serum_urate",
+    "uric acid": "serum_urate",
+    "gender": "sex",
+})
+
+FILTER_PATTERN = re.compile(
+    r"^\s*(?P<field>[A-Za-z][A-Za-z0-9_ ]*?)\s*(?P<op>>=|<=|!=|==|=|>|<)\s*(?P<value>.+?)\s*$"
+)
+
+Filter = Union[str, Tuple[str, str, object]]
+
+
+class CohortFilterError(ValueError):
+    """A cohort filter that can't be compiled (unknown field, operator or value)"""
+
+
+def resolve_field(name: str) -> str:
+    field = FIELD_ALIASES.get(name.strip().lower())
+    if field is None:
+        raise CohortFilterError(f"Unknown field '{name}'. Available: {', '.join(CLINICAL_FIELDS)}")
+    return field
+
+
+def parse_filter(expression: Filter) -> Tuple[str, str, object]:
+    """
+    "HbA1c > 9" or ("HbA1c", ">", 9) -> ("hba1c", ">", 9.0)
+    Values are converted to the column's type; text values may be quoted ("Sex = 'Female'").
+    """
+    if isinstance(expression, str):
+        match = FILTER_PATTERN.match(expression)
+        if not match:
+            raise CohortFilterError(f"Can't parse filter '{expression}' (expected e.g. 'HbA1c > 9')")
+        name, op, value = match.group("field"), match.group("op"), match.group("value")
+    else:
+        try:
+            name, op, value = expression
+        except (TypeError, ValueError):
+            raise CohortFilterError(f"Filter must be a string or (field, op, value), got {expression!r}")
+
+    field = resolve_field(name)
+    if op not in OPERATORS:
+        raise CohortFilterError(f"Unknown operator '{op}' (use one of {', '.join(OPERATORS)})")
+
+    python_type = CLINICAL_FIELDS[field][1]().python_type
+    if python_type is str:
+        value = str(value).strip().strip("'\"")
+    else:
+        try:
+            value = float(value)
+        except (TypeError, ValueError):
+            raise CohortFilterError(f"'{field}' needs a number, got {value!r}")
+    return field, op, value
+
+
+def compile_filters(filters: Iterable[Filter], model=PatientLatestState) -> List:
+    """SQL conditions on the model's clinical columns, one per filter"""
+    conditions = []
+    for expression in filters:
+        field, op, value = parse_filter(expression)
+        conditions.append(OPERATORS[op](getattr(model, field), value))
+    return conditions
+
+
+def _source(latest_only: bool):
+    """Current state per patient, or every clinical AgentData record"""
+    return PatientLatestState if latest_only else AgentData
+
+
+def _clinical_records():
+    """AgentData rows that aren't derived agent output (agent_type may be NULL)"""
+    return or_(AgentData.agent_type.is_(None), AgentData.agent_type.notin_(DERIVED_AGENT_TYPES))
+
+
+def cohort_query(filters: Sequence[Filter], fields: Optional[Sequence[str]] = None,
+                 latest_only: bool = True, limit: Optional[int] = None):
+    """
+    SELECT patient_id plus the requested fields for rows matching every filter.
+
+    Args:
+        filters: e.g. ["HbA1c > 9", "LDL > 160"]
+        fields: columns to return (default: the filtered fields)
+        latest_only: match each patient's current values (default), or any
+            historical record (rows then also carry their timestamp)
+        limit: maximum number of rows (in index order, not sorted by patient)
+    """
+    model = _source(latest_only)
+    conditions = compile_filters(filters, model)
+    if fields is None:
+        fields = list(dict.fromkeys(parse_filter(f)[0] for f in filters))
+    else:
+        fields = [resolve_field(f) for f in fields]
+
+    columns = [model.patient_id]
+    if not latest_only:
+        columns.append(model.timestamp)
+    query = select(*columns, *(getattr(model, f) for f in fields)).where(*conditions)
+    if not latest_only:
+        query = query.where(_clinical_records())
+    if limit is not None:
+        query = query.limit(limit)
+    return query
+
+
+def cohort_count_query(filters: Sequence[Filter], latest_only: bool = True):
+    """SELECT the number of patients matching every filter"""
+    if latest_only:
+        return select(func.count()).select_from(PatientLatestState)\
+            .where(*compile_filters(filters, PatientLatestState))
+    return select(func.count(func.distinct(AgentData.patient_id)))\
+        .where(*compile_filters(filters, AgentData))\
+        .where(_clinical_records())
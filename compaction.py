@@ -0,0 +1,346 @@
+"""
+History Compaction for MedTwin
+Folds old AgentData rows into compressed per-period archive blocks
+(agent_data_archive) and deletes them from agent_data.
+
+Encoding of a block ("delta-v1", optionally "+zlib"):
+    {"v": 1,
+     "patients": [...], "types": [...],          # per-block dictionaries
+     "rows": [[patient, type, id, ts_us, set, del], ...]}
+  - rows are ordered by (patient_id, timestamp, id)
+  - top-level payload keys are ids from the global payload_keys table
+  - set/del are a JSON-patch style delta against the same patient's previous
+    payload in the block (the first one against {}); del is omitted when empty
+  - a payload that isn't a JSON object is stored as [.., null, payload]
+
+Nothing is lost: archived_history() / patient_history() give back the original
+rows, and the latest-state / lab-measurement rebuilds read the archive too.
+patient_latest_state and lab_measurements are untouched, so current-state reads
+and trends stay primary-key lookups. History-wide cohort queries
+(cohort latest_only=False) only see rows still in agent_data. The most recent
+row of each derived type (e.g. ActionPlan) per patient is never archived.
+
+Usage:
+    python compaction.py                    # archive rows older than 90 days
+    python compaction.py --days 30 --vacuum # then VACUUM to give the space back to the OS
+"""
+
+import argparse
+import heapq
+import json
+import os
+import time
+import zlib
+from datetime import datetime, timedelta
+from typing import Dict, Iterator, List, Optional
+
+from sqlalchemy import func, insert, select, text
+
+from database import engine, Base, AgentData, AgentDataArchive, PayloadKey, DERIVED_AGENT_TYPES, _strict_json
+
+ENCODING = "delta-v1"
+ENCODING_ZLIB = "delta-v1+zlib"
+DEFAULT_OLDER_THAN_DAYS = int(os.environ.get("MEDTWIN_COMPACT_AFTER_DAYS", "90"))
+DEFAULT_BLOCK_ROWS = 2000
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+def _to_us(timestamp: Optional[datetime]) -> Optional[int]:
+    if timestamp is None:
+        return None
+    delta = timestamp - _EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1_000_000 + delta.microseconds
+
+
+def _from_us(ts_us: Optional[int]) -> Optional[datetime]:
+    return None if ts_us is None else _EPOCH + timedelta(microseconds=ts_us)
+
+
+def _same(a, b) -> bool:
+    """Equal as JSON (1 vs 1.0 vs True count as different)"""
+    if type(a) is not type(b):
+        return False
+    if isinstance(a, (dict, list)):
+        return json.dumps(a, sort_keys=True) == json.dumps(b, sort_keys=True)
+    return a == b
+
+
+# ============================================================
+# ENCODING
+# ============================================================
+
+class KeyDictionary:
+    """payload_keys loaded in memory; new keys are inserted on first use"""
+
+    def __init__(self, conn):
+        self.ids: Dict[str, int] = {}
+        self.keys: Dict[int, str] = {}
+        for key_id, key in conn.execute(select(PayloadKey.id, PayloadKey.key)):
+            self.ids[key] = key_id
+            self.keys[key_id] = key
+
+    def id_for(self, conn, key: str) -> int:
+        key_id = self.ids.get(key)
+        if key_id is None:
+            key_id = conn.execute(insert(PayloadKey).values(key=key)).inserted_primary_key[0]
+            self.ids[key] = key_id
+            self.keys[key_id] = key
+        return key_id
+
+
+def encode_block(conn, rows: List, keys: KeyDictionary, compress: bool = True):
+    """
+    Encode (id, patient_id, agent_type, payload, timestamp) rows, sorted by
+    (patient_id, timestamp, id), as one archive block.
+
+    Returns:
+        (encoding, bytes)
+    """
+    patients: Dict[str, int] = {}
+    types: Dict[Optional[str], int] = {}
+    encoded = []
+    previous_patient, previous = None, None
+    for row_id, patient_id, agent_type, payload, timestamp in rows:
+        if patient_id != previous_patient:
+            previous_patient, previous = patient_id, {}
+        head = [
+            patients.setdefault(patient_id, len(patients)),
+            types.setdefault(agent_type, len(types)),
+            row_id,
+            _to_us(timestamp),
+        ]
+        if not isinstance(payload, dict):
+            encoded.append(head + [None, payload])
+            previous = {}
+            continue
+        changed = {
+            str(keys.id_for(conn, key)): value
+            for key, value in payload.items()
+            if key not in previous or not _same(previous[key], value)
+        }
+        removed = [keys.id_for(conn, key) for key in previous if key not in payload]
+        encoded.append(head + ([changed, removed] if removed else [changed]))
+        previous = payload
+
+    document = {"v": 1, "patients": list(patients), "types": list(types), "rows": encoded}
+    data = json.dumps(_strict_json(document), separators=(",", ":")).encode()
+    if compress:
+        return ENCODING_ZLIB, zlib.compress(data, 9)
+    return ENCODING, data
+
+
+def decode_block(encoding: str, data: bytes, keys: Dict[int, str]) -> List[Dict]:
+    """Rows of an archive block as dicts (id, patient_id, agent_type, timestamp, data_payload)"""
+    if encoding == ENCODING_ZLIB:
+        data = zlib.decompress(data)
+    elif encoding != ENCODING:
+        raise ValueError(f"Unknown archive encoding '{encoding}'")
+    document = json.loads(data)
+
+    rows = []
+    previous_patient, previous = None, {}
+    for entry in document["rows"]:
+        patient_index, type_index, row_id, ts_us, changed = entry[:5]
+        if patient_index != previous_patient:
+            previous_patient, previous = patient_index, {}
+        if changed is None:
+            payload = entry[5]
+            previous = {}
+        else:
+            removed = {keys[key_id] for key_id in entry[5]} if len(entry) > 5 else ()
+            payload = {key: value for key, value in previous.items() if key not in removed}
+            payload.update((keys[int(key_id)], value) for key_id, value in changed.items())
+            previous = payload
+        rows.append({
+            "id": row_id,
+            "patient_id": document["patients"][patient_index],
+            "agent_type": document["types"][type_index],
+            "timestamp": _from_us(ts_us),
+            "data_payload": payload,
+        })
+    return rows
+
+
+# ============================================================
+# READING
+# ============================================================
+
+def _load_keys(conn) -> Dict[int, str]:
+    return dict(conn.execute(select(PayloadKey.id, PayloadKey.key)).all())
+
+
+def _block_rows(conn, block_ids: List[int], keys: Dict[int, str]) -> Iterator[Dict]:
+    for block_id in block_ids:
+        encoding, data = conn.execute(
+            select(AgentDataArchive.encoding, AgentDataArchive.payload).where(AgentDataArchive.id == block_id)
+        ).one()
+        yield from decode_block(encoding, data, keys)
+
+
+def archived_history(conn, patient_id: Optional[str] = None) -> Iterator[Dict]:
+    """
+    Archived rows in (patient_id, timestamp, id) order.
+    Blocks are decoded one at a time (one per period at once for a full scan).
+    """
+    keys = _load_keys(conn)
+    archive = AgentDataArchive.__table__
+    if patient_id is not None:
+        block_ids = conn.execute(
+            select(archive.c.id)
+            .where(archive.c.first_patient_id <= patient_id, archive.c.last_patient_id >= patient_id)
+        ).scalars().all()
+        rows = [row for row in _block_rows(conn, block_ids, keys) if row["patient_id"] == patient_id]
+        rows.sort(key=lambda row: (row["timestamp"] or datetime.min, row["id"]))
+        yield from rows
+        return
+
+    # Within a period blocks are in patient order, so each period is a sorted stream
+    streams = []
+    for period in conn.execute(select(archive.c.period).distinct().order_by(archive.c.period)).scalars().all():
+        block_ids = conn.execute(
+            select(archive.c.id).where(archive.c.period == period)
+            .order_by(archive.c.first_patient_id, archive.c.first_id)
+        ).scalars().all()
+        streams.append(_block_rows(conn, block_ids, keys))
+    yield from heapq.merge(
+        *streams, key=lambda row: (row["patient_id"], row["timestamp"] or datetime.min, row["id"])
+    )
+
+
+def patient_history(patient_id: str, bind=None) -> List[Dict]:
+    """A patient's full AgentData history (archived and live), oldest first"""
+    bind = bind or engine
+    history = AgentData.__table__
+    with bind.connect() as conn:
+        archived = list(archived_history(conn, patient_id)) \
+            if bind.dialect.has_table(conn, AgentDataArchive.__tablename__) else []
+        live = [
+            {"id": row_id, "patient_id": patient_id, "agent_type": agent_type,
+             "timestamp": timestamp, "data_payload": payload}
+            for row_id, agent_type, payload, timestamp in conn.execute(
+                select(history.c.id, history.c.agent_type, history.c.data_payload, history.c.timestamp)
+                .where(history.c.patient_id == patient_id)
+                .order_by(history.c.timestamp, history.c.id)
+            )
+        ]
+    return list(heapq.merge(archived, live, key=lambda row: (row["timestamp"] or datetime.min, row["id"])))
+
+
+# ============================================================
+# COMPACTION
+# ============================================================
+
+def _eligible_rows_query(cutoff: datetime):
+    """ids and periods of rows to archive, in block order"""
+    history = AgentData.__table__
+    latest_derived = select(func.max(history.c.id))\
+        .where(history.c.agent_type.in_(DERIVED_AGENT_TYPES))\
+        .group_by(history.c.patient_id, history.c.agent_type)
+    period = func.strftime("%Y-%m", history.c.timestamp)
+    return select(history.c.id, period)\
+        .where(history.c.timestamp < cutoff)\
+        .where(history.c.id.notin_(latest_derived))\
+        .order_by(period, history.c.patient_id, history.c.timestamp, history.c.id)
+
+
+def _blocks(eligible: List, block_rows: int) -> Iterator[List[int]]:
+    """Split (id, period) rows into blocks of ids that never span two periods"""
+    block, block_period = [], None
+    for row_id, period in eligible:
+        if block and (period != block_period or len(block) >= block_rows):
+            yield block
+            block = []
+        block.append(row_id)
+        block_period = period
+    if block:
+        yield block
+
+
+def compact_history(bind=None, older_than_days: int = DEFAULT_OLDER_THAN_DAYS,
+                    block_rows: int = DEFAULT_BLOCK_ROWS, compress: bool = True) -> Dict:
+    """
+    Move AgentData rows older than the cutoff into archive blocks, one transaction per block.
+
+    Returns:
+        {"rows": rows archived, "blocks": blocks written,
+         "payload_bytes": JSON size of the archived payloads, "archive_bytes": size of the blocks}
+    """
+    bind = bind or engine
+    Base.metadata.create_all(bind, tables=[PayloadKey.__table__, AgentDataArchive.__table__])
+    history = AgentData.__table__
+    cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+
+    with bind.connect() as conn:
+        eligible = conn.execute(_eligible_rows_query(cutoff)).all()
+        keys = KeyDictionary(conn)
+
+    stats = {"rows": 0, "blocks": 0, "payload_bytes": 0, "archive_bytes": 0}
+    for block_ids in _blocks(eligible, block_rows):
+        with bind.begin() as conn:
+            rows = conn.execute(
+                select(history.c.id, history.c.patient_id, history.c.agent_type,
+                       history.c.data_payload, history.c.timestamp,
+                       func.length(history.c.data_payload))
+                .where(history.c.id.in_(block_ids))
+                .order_by(history.c.patient_id, history.c.timestamp, history.c.id)
+            ).all()
+            if not rows:
+                continue
+            encoding, data = encode_block(conn, [row[:5] for row in rows], keys, compress)
+            conn.execute(insert(AgentDataArchive).values(
+                period=rows[0][4].strftime("%Y-%m") if rows[0][4] else "unknown",
+                first_patient_id=rows[0][1],
+                last_patient_id=rows[-1][1],
+                first_id=min(row[0] for row in rows),
+                last_id=max(row[0] for row in rows),
+                row_count=len(rows),
+                encoding=encoding,
+                payload=data,
+                created_at=datetime.utcnow(),
+            ))
+            conn.execute(history.delete().where(history.c.id.in_(block_ids)))
+        stats["rows"] += len(rows)
+        stats["blocks"] += 1
+        stats["payload_bytes"] += sum(row[5] or 0 for row in rows)
+        stats["archive_bytes"] += len(data)
+    return stats
+
+
+def vacuum(bind=None):
+    """Rewrite the database file so deleted pages are returned to the OS"""
+    bind = bind or engine
+    with bind.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text("VACUUM"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--days", type=int, default=DEFAULT_OLDER_THAN_DAYS,
+                        help="archive rows older than this many days (default: %(default)s)")
+    parser.add_argument("--block-rows", type=int, default=DEFAULT_BLOCK_ROWS)
+    parser.add_argument("--no-compress", action="store_true", help="store blocks without zlib")
+    parser.add_argument("--vacuum", action="store_true", help="VACUUM afterwards to shrink the file")
+    args = parser.parse_args()
+
+    print(f"🚀 Compacting AgentData rows older than {args.days} days")
+    start = time.perf_counter()
+    stats = compact_history(older_than_days=args.days, block_rows=args.block_rows,
+                            compress=not args.no_compress)
+    if not stats["rows"]:
+        print("✅ Nothing to compact")
+    else:
+        ratio = stats["payload_bytes"] / max(stats["archive_bytes"], 1)
+        print(f"✅ Archived {stats['rows']} rows into {stats['blocks']} blocks: "
+              f"{stats['payload_bytes'] / 1e6:.1f} MB of JSON -> {stats['archive_bytes'] / 1e6:.1f} MB ({ratio:.1f}x)")
+
+    if args.vacuum:
+        path = engine.url.database
+        size_before = os.path.getsize(path)
+        vacuum()
+        print(f"✅ VACUUM: {size_before / 1e6:.1f} MB -> {os.path.getsize(path) / 1e6:.1f} MB")
+    print(f"🎉 Done in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
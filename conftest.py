@@ -0,0 +1,53 @@
+"""
+Shared pytest fixtures for the MedTwin tests
+
+The tests never touch ./medtwin.db: MEDTWIN_DB_PATH points database.py at a
+scratch file before anything imports it. `temp_db` recreates that file for
+each test (all tables and triggers), and `patients_db` adds the first rows
+of diabetes_dataset.csv through the real importer.
+"""
+
+import glob
+import os
+import tempfile
+
+import pytest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DATASET = os.path.join(HERE, "diabetes_dataset.csv")
+TEST_DB_PATH = os.path.join(tempfile.mkdtemp(prefix="medtwin-test-"), "medtwin.db")
+os.environ["MEDTWIN_DB_PATH"] = TEST_DB_PATH
+
+
+def _reset_engines():
+    """Drop pooled connections and delete the scratch database"""
+    from database import engine, async_engine
+    engine.dispose()
+    async_engine.sync_engine.dispose(close=False)  # aiosqlite connections belong to a closed loop
+    for path in glob.glob(TEST_DB_PATH + "*"):
+        os.remove(path)
+
+
+@pytest.fixture
+def temp_db(tmp_path, monkeypatch):
+    import database
+
+    assert database.DB_PATH == TEST_DB_PATH, "database was imported before conftest set MEDTWIN_DB_PATH"
+    monkeypatch.chdir(tmp_path)  # for files the code under test writes next to the database
+    _reset_engines()
+    database.init_db()
+    yield tmp_path
+    _reset_engines()
+
+
+@pytest.fixture
+def patients_db(temp_db):
+    """temp_db with 5 patients (DM_00000 - DM_00004) imported from the dataset"""
+    import pandas as pd
+    from import_csv_to_db import migrate_csv_to_sqlite
+
+    csv_path = temp_db / "patients.csv"
+    pd.read_csv(DATASET, nrows=5).to_csv(csv_path, index=False)
+    stats = migrate_csv_to_sqlite(str(csv_path))
+    assert stats["inserted"] == 5
+    return csv_path
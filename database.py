@@ -1,25 +1,146 @@
-from sqlalchemy import create_engine, Column, Integer, String, Float, DateTime, JSON, ForeignKey
+from sqlalchemy import bindparam, create_engine, event, insert, inspect, literal_column, or_, select, text, Column, Computed, Integer, String, Float, DateTime, JSON, LargeBinary, ForeignKey, Index
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
 from datetime import datetime
+import hashlib
+import heapq
+import itertools
+import json
+import math
 import os
 
-# Create SQLite database file in current directory
-SQLALCHEMY_DATABASE_URL = "sqlite:///./medtwin.db"
+# Create SQLite database file in current directory (MEDTWIN_DB_PATH overrides, e.g. for tests)
+DB_PATH = os.environ.get("MEDTWIN_DB_PATH", "./medtwin.db")
+SQLALCHEMY_DATABASE_URL = f"sqlite:///{DB_PATH}"
+ASYNC_DATABASE_URL = f"sqlite+aiosqlite:///{DB_PATH}"
 
-# Create engine
+# Connection pool sizing (shared by the sync and async engines)
+DB_POOL_SIZE = int(os.environ.get("MEDTWIN_DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.environ.get("MEDTWIN_DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = float(os.environ.get("MEDTWIN_DB_POOL_TIMEOUT", "30"))
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    """
+    WAL lets readers run alongside the single writer; NORMAL sync is safe under WAL
+    and avoids an fsync per commit. busy_timeout waits for the write lock instead of
+    failing immediately with "database is locked".
+    """
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA busy_timeout=5000")
+    cursor.close()
+
+
+def _strict_json(value):
+    """Replace NaN/Infinity (pandas' missing values) with null so SQLite's JSON functions accept the payload"""
+    if isinstance(value, float) and not math.isfinite(value):
+        return None
+    if isinstance(value, dict):
+        return {k: _strict_json(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_strict_json(v) for v in value]
+    return value
+
+
+def json_serializer(value) -> str:
+    return json.dumps(_strict_json(value))
+
+
+def payload_hash(agent_type: str, payload, strict: bool = False) -> str:
+    """
+    Content hash of a record (key order and NaN/null spelling don't matter).
+    strict=True skips the NaN cleanup for payloads known to contain none.
+    """
+    if not strict:
+        payload = _strict_json(payload)
+    canonical = json.dumps([agent_type, payload], sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+# Create engine (sync: scripts, background jobs, bulk ingestion)
 engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
+    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}, json_serializer=json_serializer,
+    pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW, pool_timeout=DB_POOL_TIMEOUT
+)
+event.listen(engine, "connect", _set_sqlite_pragmas)
+
+# Async engine (aiosqlite) for the FastAPI request handlers
+async_engine = create_async_engine(
+    ASYNC_DATABASE_URL, json_serializer=json_serializer,
+    pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW, pool_timeout=DB_POOL_TIMEOUT
 )
+event.listen(async_engine.sync_engine, "connect", _set_sqlite_pragmas)
 
-# Create session factory
+# Create session factories
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
 
 # Base class for models
 Base = declarative_base()
 
+# Agent types that store derived outputs (not patient measurements).
+# They are skipped when rebuilding a patient's twin from AgentData.
+ACTION_PLAN_AGENT_TYPE = "ActionPlan"
+DERIVED_AGENT_TYPES = (ACTION_PLAN_AGENT_TYPE,)
+
+# Agent type of the baseline records imported from diabetes_dataset.csv
+LEGACY_CSV_AGENT_TYPE = "LegacyCSV"
+
 # --- MODELS ---
 
+# Key clinical fields of data_payload: column name -> (payload key, type)
+CLINICAL_FIELDS = {
+    "age": ("Age", Integer),
+    "sex": ("Sex", String),
+    "bmi": ("BMI", Float),
+    "hba1c": ("HbA1c", Float),
+    "fasting_glucose": ("Fasting_Blood_Glucose", Float),
+    "systolic_bp": ("Blood_Pressure_Systolic", Float),
+    "diastolic_bp": ("Blood_Pressure_Diastolic", Float),
+    "total_cholesterol": ("Cholesterol_Total", Float),
+    "ldl": ("Cholesterol_LDL", Float),
+    "hdl": ("Cholesterol_HDL", Float),
+    "ggt": ("GGT", Float),
+    "serum_urate": ("Serum_Urate", Float),
+}
+
+
+def _payload_field(key: str, type_) -> Column:
+    """
+    Virtual generated column over one data_payload field.
+    Rows whose payload isn't valid JSON read as NULL instead of failing.
+    """
+    return Column(type_, Computed(
+        f"CASE WHEN json_valid(data_payload) THEN json_extract(data_payload, '$.\"{key}\"') END",
+        persisted=False
+    ))
+
+
+# AgentData: the fields as indexed generated columns, so cohort filters (cohort.py)
+# run as index range scans instead of parsing every payload.
+GeneratedClinicalFields = type("GeneratedClinicalFields", (), {
+    name: _payload_field(key, type_) for name, (key, type_) in CLINICAL_FIELDS.items()
+})
+
+# PatientLatestState: the same fields as plain columns, copied by the trigger from the
+# inserted row's generated columns. Generated columns here would re-parse the merged
+# payload for every index on every update (every CGM reading).
+ClinicalFields = type("ClinicalFields", (), {
+    name: Column(type_) for name, (_, type_) in CLINICAL_FIELDS.items()
+})
+
+
+def _clinical_indexes(table_name: str) -> tuple:
+    """Partial indexes (non-NULL values only) on the ClinicalFields columns"""
+    return tuple(
+        Index(f"ix_{table_name}_{field}", field, sqlite_where=text(f"{field} IS NOT NULL"))
+        for field in CLINICAL_FIELDS
+    )
+
+
 class Patient(Base):
     """
     Core Patient Identity Table.
@@ -33,12 +154,15 @@ class Patient(Base):
     # Relationships
     agent_data = relationship("AgentData", back_populates="patient", cascade="all, delete-orphan")
 
-class AgentData(Base):
+class AgentData(GeneratedClinicalFields, Base):
     """
     The "Flexible Bucket" Table.
     Stores any data payload from any agent (Nutrition, Lab, Prediction, etc.)
     """
     __tablename__ = "agent_data"
+    __table_args__ = (
+        Index("ix_agent_data_patient_timestamp", "patient_id", "timestamp"),
+    ) + _clinical_indexes("agent_data")
 
     id = Column(Integer, primary_key=True, index=True)
     patient_id = Column(String, ForeignKey("patients.id"))
@@ -50,11 +174,507 @@ class AgentData(Base):
     # Relationships
     patient = relationship("Patient", back_populates="agent_data")
 
+class PatientLatestState(ClinicalFields, Base):
+    """
+    Materialized current state per patient.
+    Every clinical AgentData insert is merged into data_payload (top-level keys)
+    by the trg_agent_data_latest_state trigger, in the same transaction, so reading
+    a patient's current data is a primary-key lookup however long their history is.
+    The ClinicalFields columns hold the latest non-null value of each key field.
+    """
+    __tablename__ = "patient_latest_state"
+    __table_args__ = _clinical_indexes("patient_latest_state")
+
+    patient_id = Column(String, ForeignKey("patients.id"), primary_key=True)
+    source_id = Column(Integer, nullable=False)   # agent_data.id of the last merged row
+    data_payload = Column(JSON)                   # merged payload of all clinical rows
+    updated_at = Column(DateTime)                 # timestamp of the last merged row
+
+class LabMeasurement(Base):
+    """
+    Normalized lab history, one typed row per analyte value.
+    Filled from AgentData payloads by the trg_agent_data_lab_measurements trigger.
+    Clustered by (patient, analyte, time) and carrying value/unit in the row, so a
+    trend is one range scan of the primary key with no JSON decoding.
+    """
+    __tablename__ = "lab_measurements"
+    __table_args__ = {"sqlite_with_rowid": False}
+
+    patient_id = Column(String, ForeignKey("patients.id"), primary_key=True)
+    analyte = Column(String, primary_key=True)       # canonical name, e.g. "HbA1c", "LDL Cholesterol"
+    measured_at = Column(Integer, primary_key=True)  # Unix epoch milliseconds (AgentData.timestamp)
+    source_id = Column(Integer, primary_key=True)    # agent_data.id the value came from
+    value = Column(Float, nullable=False)
+    unit = Column(String)
+
+class PayloadKey(Base):
+    """
+    Key dictionary for archived payloads (append-only).
+    Archive blocks store top-level payload keys as these ids instead of repeating the names.
+    """
+    __tablename__ = "payload_keys"
+
+    id = Column(Integer, primary_key=True)
+    key = Column(String, nullable=False, unique=True)
+
+class AgentDataArchive(Base):
+    """
+    Compacted AgentData history (see compaction.py).
+    One block per period holds up to a few thousand old rows, ordered by patient and time,
+    with each payload stored as a delta against the same patient's previous payload
+    (keys from payload_keys) and the whole block zlib-compressed.
+    """
+    __tablename__ = "agent_data_archive"
+    __table_args__ = (
+        Index("ix_agent_data_archive_patients", "first_patient_id", "last_patient_id"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    period = Column(String, nullable=False)          # "YYYY-MM" of the rows' timestamps
+    first_patient_id = Column(String, nullable=False)
+    last_patient_id = Column(String, nullable=False)
+    first_id = Column(Integer)                       # smallest / largest agent_data.id in the block
+    last_id = Column(Integer)
+    row_count = Column(Integer, nullable=False)
+    encoding = Column(String, nullable=False)        # e.g. "delta-v1+zlib"
+    payload = Column(LargeBinary, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class ImportedRecord(Base):
+    """
+    Ledger of bulk-imported records (import_csv_to_db.py): one row per
+    (patient, payload_hash) ever imported, so re-importing an unchanged record
+    is a no-op, even after its AgentData row was compacted into the archive.
+    """
+    __tablename__ = "imported_records"
+    __table_args__ = {"sqlite_with_rowid": False}
+
+    patient_id = Column(String, ForeignKey("patients.id"), primary_key=True)
+    content_hash = Column(String, primary_key=True)
+    imported_at = Column(DateTime)
+
+class SourceFingerprint(Base):
+    """
+    Fingerprint of each source CSV row as last synced (import_csv_to_db.py).
+    A sync compares them with the file chunk by chunk, so rows whose fingerprint
+    is unchanged are skipped without being parsed into payloads or written.
+    """
+    __tablename__ = "source_fingerprints"
+    __table_args__ = {"sqlite_with_rowid": False}
+
+    source_row = Column(Integer, primary_key=True)  # CSV row number (row 42 -> DM_00042)
+    patient_id = Column(String, ForeignKey("patients.id"), nullable=False)
+    fingerprint = Column(Integer, nullable=False)   # 64-bit hash of the row's column values
+    content_hash = Column(String, nullable=False)   # payload_hash() of the row as last synced
+    synced_at = Column(DateTime)
+
+class GlucoseReading(Base):
+    """
+    Append-only CGM time series.
+    One compact (timestamp, value) row per reading, clustered by patient and time.
+    """
+    __tablename__ = "glucose_readings"
+    __table_args__ = {"sqlite_with_rowid": False}
+
+    patient_id = Column(String, ForeignKey("patients.id"), primary_key=True)
+    ts_ms = Column(Integer, primary_key=True)  # Unix epoch milliseconds
+    value = Column(Float, nullable=False)      # mg/dL
+
+# --- LATEST STATE ---
+
+_DERIVED_SQL = ", ".join(f"'{agent_type}'" for agent_type in DERIVED_AGENT_TYPES)
+
+# Top-level keys of the new payload overwrite the state's (like {**state, **payload}),
+# and the clinical columns keep the latest non-null value,
+# so a partial record (one lab, one glucose reading) updates only what it carries.
+# json_each returns SQL values, so JSON literals/containers are turned back into JSON.
+# Rows older than the current state are ignored; payloads that aren't JSON objects replace it.
+_CLINICAL_COLUMNS_SQL = ", ".join(CLINICAL_FIELDS)
+_NEW_CLINICAL_SQL = ", ".join(f"NEW.{field}" for field in CLINICAL_FIELDS)
+_MERGE_CLINICAL_SQL = ",\n        ".join(
+    f"{field} = COALESCE(excluded.{field}, patient_latest_state.{field})" for field in CLINICAL_FIELDS
+)
+
+LATEST_STATE_TRIGGER = f"""
+CREATE TRIGGER IF NOT EXISTS trg_agent_data_latest_state
+AFTER INSERT ON agent_data
+WHEN NEW.agent_type IS NULL OR NEW.agent_type NOT IN ({_DERIVED_SQL})
+BEGIN
+    INSERT INTO patient_latest_state (patient_id, source_id, data_payload, updated_at, {_CLINICAL_COLUMNS_SQL})
+    VALUES (NEW.patient_id, NEW.id, NEW.data_payload, NEW.timestamp, {_NEW_CLINICAL_SQL})
+    ON CONFLICT (patient_id) DO UPDATE SET
+        data_payload = CASE
+            WHEN json_valid(patient_latest_state.data_payload) AND json_valid(excluded.data_payload)
+                 AND json_type(patient_latest_state.data_payload) = 'object'
+                 AND json_type(excluded.data_payload) = 'object'
+            THEN (
+                SELECT json_group_object(key, CASE type
+                    WHEN 'true' THEN json('true')
+                    WHEN 'false' THEN json('false')
+                    WHEN 'null' THEN json('null')
+                    WHEN 'object' THEN json(value)
+                    WHEN 'array' THEN json(value)
+                    ELSE value END)
+                FROM (
+                    SELECT key, value, type FROM json_each(patient_latest_state.data_payload)
+                    WHERE key NOT IN (SELECT key FROM json_each(excluded.data_payload))
+                    UNION ALL
+                    SELECT key, value, type FROM json_each(excluded.data_payload)
+                )
+            )
+            ELSE excluded.data_payload
+        END,
+        source_id = excluded.source_id,
+        updated_at = excluded.updated_at,
+        {_MERGE_CLINICAL_SQL}
+    WHERE COALESCE(excluded.updated_at, '') >= COALESCE(patient_latest_state.updated_at, '');
+END
+"""
+
+
+def _has_archive(conn) -> bool:
+    return inspect(conn).has_table(AgentDataArchive.__tablename__) and \
+        conn.execute(select(AgentDataArchive.id).limit(1)).first() is not None
+
+
+def _archived_rows(conn):
+    """(id, patient_id, payload, timestamp) of clinical rows compacted out of agent_data"""
+    from compaction import archived_history  # compaction imports this module
+    for row in archived_history(conn):
+        if row["agent_type"] not in DERIVED_AGENT_TYPES:
+            yield row["id"], row["patient_id"], row["data_payload"], row["timestamp"]
+
+
+def backfill_latest_state(bind=None, batch_size: int = 1000) -> int:
+    """
+    Rebuild patient_latest_state from the full AgentData history (archived blocks included).
+    Rows are replayed per patient in (timestamp, id) order, as the trigger would have merged them.
+
+    Returns:
+        Number of patients written
+    """
+    bind = bind or engine
+    table = PatientLatestState.__table__
+    history = AgentData.__table__
+    rows_query = select(history.c.id, history.c.patient_id, history.c.data_payload, history.c.timestamp)\
+        .where(or_(history.c.agent_type.is_(None), history.c.agent_type.notin_(DERIVED_AGENT_TYPES)))\
+        .order_by(history.c.patient_id, history.c.timestamp, history.c.id)
+
+    written = 0
+    with bind.begin() as conn:
+        conn.execute(table.delete())
+        rows = conn.execute(rows_query)
+        if _has_archive(conn):
+            rows = heapq.merge(_archived_rows(conn), rows, key=lambda row: (row[1], row[3] or datetime.min, row[0]))
+        batch, state = [], None
+        for row_id, patient_id, payload, timestamp in rows:
+            if state is None or state["patient_id"] != patient_id:
+                if state is not None:
+                    batch.append(state)
+                state = {"patient_id": patient_id, "data_payload": {}}
+            if isinstance(payload, dict) and isinstance(state["data_payload"], dict):
+                state["data_payload"] = {**state["data_payload"], **payload}
+            else:
+                state["data_payload"] = payload
+            for field, (key, _) in CLINICAL_FIELDS.items():
+                value = payload.get(key) if isinstance(payload, dict) else None
+                if value is not None and value == value:  # not null/NaN
+                    state[field] = value
+                else:
+                    state.setdefault(field, None)
+            state["source_id"] = row_id
+            state["updated_at"] = timestamp
+            if len(batch) >= batch_size:
+                conn.execute(table.insert(), batch)
+                written += len(batch)
+                batch = []
+        if state is not None:
+            batch.append(state)
+        if batch:
+            conn.execute(table.insert(), batch)
+            written += len(batch)
+    return written
+
+
+def ensure_latest_state(bind=None) -> bool:
+    """
+    Migration: create patient_latest_state, its trigger and the (patient_id, timestamp)
+    index on existing databases, and backfill the table if it is empty while
+    AgentData already has history.
+
+    Returns:
+        True if the table was backfilled
+    """
+    bind = bind or engine
+    if not inspect(bind).has_table(AgentData.__tablename__):
+        return False  # fresh database: init_db creates everything
+    PatientLatestState.__table__.create(bind=bind, checkfirst=True)
+    for index in AgentData.__table__.indexes:
+        index.create(bind=bind, checkfirst=True)
+    with bind.begin() as conn:
+        conn.execute(text("DROP TRIGGER IF EXISTS trg_agent_data_latest_state"))  # pick up definition changes
+        conn.execute(text(LATEST_STATE_TRIGGER))
+        needs_backfill = conn.execute(select(PatientLatestState.patient_id).limit(1)).first() is None \
+            and conn.execute(select(AgentData.id).limit(1)).first() is not None
+    if needs_backfill:
+        count = backfill_latest_state(bind)
+        print(f"✅ Backfilled patient_latest_state for {count} patients")
+    return needs_backfill
+
+
+# --- LAB MEASUREMENTS ---
+
+# Twin payload keys that are measurements: payload key -> (analyte, unit).
+# Analyte names match lab_parser's canonical names, so values from a parsed
+# report's "lab_results" and from its top-level twin fields line up.
+LAB_MEASUREMENT_FIELDS = {
+    "HbA1c": ("HbA1c", "%"),
+    "Fasting_Blood_Glucose": ("Fasting Glucose", "mg/dL"),
+    "Cholesterol_Total": ("Total Cholesterol", "mg/dL"),
+    "Cholesterol_LDL": ("LDL Cholesterol", "mg/dL"),
+    "Cholesterol_HDL": ("HDL Cholesterol", "mg/dL"),
+    "GGT": ("GGT", "U/L"),
+    "Serum_Urate": ("Serum Urate", "mg/dL"),
+    "BMI": ("BMI", "kg/m²"),
+    "Waist_Circumference": ("Waist Circumference", "cm"),
+    "Blood_Pressure_Systolic": ("Blood Pressure (Systolic)", "mmHg"),
+    "Blood_Pressure_Diastolic": ("Blood Pressure (Diastolic)", "mmHg"),
+}
+
+_EPOCH_MS_SQL = "CAST(ROUND((julianday({ts}) - 2440587.5) * 86400000) AS INTEGER)"
+_EPOCH = datetime(1970, 1, 1)
+
+
+def epoch_ms(timestamp: datetime) -> int:
+    """Python equivalent of _EPOCH_MS_SQL for a naive UTC datetime"""
+    return round((timestamp - _EPOCH).total_seconds() * 1000)
+
+
+_FIELDS_SQL = " UNION ALL ".join(
+    f"SELECT '$.\"{key}\"' AS path, '{analyte}' AS analyte, '{unit}' AS unit"
+    for key, (analyte, unit) in LAB_MEASUREMENT_FIELDS.items()
+)
+
+# Numeric twin fields, then every {"analyte", "value", "unit"} entry of "lab_results"
+# (lab_parser reports). The same analyte from both places in one row is kept once.
+LAB_MEASUREMENTS_TRIGGER = f"""
+CREATE TRIGGER IF NOT EXISTS trg_agent_data_lab_measurements
+AFTER INSERT ON agent_data
+WHEN (NEW.agent_type IS NULL OR NEW.agent_type NOT IN ({_DERIVED_SQL}))
+     AND json_valid(NEW.data_payload) AND json_type(NEW.data_payload) = 'object'
+BEGIN
+    INSERT OR IGNORE INTO lab_measurements (patient_id, analyte, measured_at, source_id, value, unit)
+    SELECT NEW.patient_id, f.analyte, {_EPOCH_MS_SQL.format(ts="NEW.timestamp")}, NEW.id,
+           json_extract(NEW.data_payload, f.path), f.unit
+    FROM ({_FIELDS_SQL}) AS f
+    WHERE json_type(NEW.data_payload, f.path) IN ('integer', 'real');
+
+    INSERT OR IGNORE INTO lab_measurements (patient_id, analyte, measured_at, source_id, value, unit)
+    SELECT NEW.patient_id, json_extract(r.value, '$.analyte'), {_EPOCH_MS_SQL.format(ts="NEW.timestamp")}, NEW.id,
+           json_extract(r.value, '$.value'), COALESCE(json_extract(r.value, '$.unit'), '')
+    FROM json_each(NEW.data_payload, '$.lab_results') AS r
+    WHERE json_type(NEW.data_payload, '$.lab_results') = 'array'
+      AND json_type(r.value, '$.analyte') = 'text'
+      AND json_type(r.value, '$.value') IN ('integer', 'real');
+END
+"""
+
+
+def _is_number(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value)
+
+
+def extract_measurements(row_id: int, patient_id: str, payload, measured_at: int) -> list:
+    """LabMeasurement rows for one AgentData payload (what the trigger inserts)"""
+    if not isinstance(payload, dict):
+        return []
+    rows = {}
+    for key, (analyte, unit) in LAB_MEASUREMENT_FIELDS.items():
+        if _is_number(payload.get(key)):
+            rows[analyte] = (payload[key], unit)
+    results = payload.get("lab_results")
+    if isinstance(results, list):
+        for result in results:
+            if isinstance(result, dict) and isinstance(result.get("analyte"), str) and _is_number(result.get("value")):
+                rows.setdefault(result["analyte"], (result["value"], result.get("unit") or ""))
+    return [
+        {"patient_id": patient_id, "analyte": analyte, "measured_at": measured_at,
+         "source_id": row_id, "value": float(value), "unit": unit}
+        for analyte, (value, unit) in rows.items()
+    ]
+
+
+def backfill_lab_measurements(bind=None, batch_size: int = 5000) -> int:
+    """
+    Rebuild lab_measurements from the full AgentData history (archived blocks included).
+    Payloads are decoded in Python, so legacy rows stored with NaN are included too.
+
+    Returns:
+        Number of measurements written
+    """
+    bind = bind or engine
+    table = LabMeasurement.__table__
+    history = AgentData.__table__
+    measured_at = literal_column(_EPOCH_MS_SQL.format(ts="agent_data.timestamp"))
+    rows_query = select(history.c.id, history.c.patient_id, history.c.data_payload, measured_at)\
+        .where(or_(history.c.agent_type.is_(None), history.c.agent_type.notin_(DERIVED_AGENT_TYPES)))
+
+    written = 0
+    with bind.begin() as conn:
+        conn.execute(table.delete())
+        rows = conn.execute(rows_query)
+        if _has_archive(conn):
+            rows = itertools.chain(rows, (
+                (row_id, patient_id, payload, epoch_ms(timestamp))
+                for row_id, patient_id, payload, timestamp in _archived_rows(conn)
+            ))
+        batch = []
+        for row_id, patient_id, payload, ts_ms in rows:
+            batch.extend(extract_measurements(row_id, patient_id, payload, ts_ms))
+            if len(batch) >= batch_size:
+                conn.execute(insert(table).prefix_with("OR IGNORE"), batch)
+                written += len(batch)
+                batch = []
+        if batch:
+            conn.execute(insert(table).prefix_with("OR IGNORE"), batch)
+            written += len(batch)
+    return written
+
+
+def ensure_lab_measurements(bind=None) -> bool:
+    """
+    Migration: create lab_measurements and its trigger on existing databases,
+    and backfill the table if it is empty while AgentData already has history.
+
+    Returns:
+        True if the table was backfilled
+    """
+    bind = bind or engine
+    if not inspect(bind).has_table(AgentData.__tablename__):
+        return False  # fresh database: init_db creates everything
+    LabMeasurement.__table__.create(bind=bind, checkfirst=True)
+    with bind.begin() as conn:
+        conn.execute(text("DROP TRIGGER IF EXISTS trg_agent_data_lab_measurements"))  # pick up definition changes
+        conn.execute(text(LAB_MEASUREMENTS_TRIGGER))
+        needs_backfill = conn.execute(select(LabMeasurement.patient_id).limit(1)).first() is None \
+            and conn.execute(select(AgentData.id).limit(1)).first() is not None
+    if needs_backfill:
+        count = backfill_lab_measurements(bind)
+        print(f"✅ Backfilled lab_measurements with {count} values")
+    return needs_backfill
+
+
+def normalize_legacy_payloads(bind=None, batch_size: int = 1000) -> int:
+    """
+    Rewrite payloads stored before strict JSON serialization (NaN tokens) so
+    SQLite's JSON functions, and therefore the clinical columns, can read them.
+
+    Returns:
+        Number of rows rewritten
+    """
+    bind = bind or engine
+    history = AgentData.__table__
+    rows_query = select(history.c.id, history.c.data_payload)\
+        .where(text("NOT json_valid(agent_data.data_payload)"))
+
+    rewritten = 0
+    with bind.begin() as conn:
+        rows = conn.execute(rows_query).all()
+        for start in range(0, len(rows), batch_size):
+            batch = [{"row_id": row_id, "payload": payload} for row_id, payload in rows[start:start + batch_size]]
+            conn.execute(
+                history.update().where(history.c.id == bindparam("row_id")).values(data_payload=bindparam("payload")),
+                batch
+            )
+            rewritten += len(batch)
+    return rewritten
+
+
+def ensure_import_ledger(bind=None):
+    """
+    Migration: create imported_records and, if it is empty while CSV-imported
+    AgentData rows exist, record their hashes so a re-import skips them.
+    """
+    bind = bind or engine
+    if not inspect(bind).has_table(AgentData.__tablename__):
+        return
+    ImportedRecord.__table__.create(bind=bind, checkfirst=True)
+
+    history = AgentData.__table__
+    with bind.begin() as conn:
+        if conn.execute(select(ImportedRecord.patient_id).limit(1)).first() is not None:
+            return
+        rows = conn.execute(
+            select(history.c.patient_id, history.c.agent_type, history.c.data_payload, history.c.timestamp)
+            .where(history.c.agent_type == LEGACY_CSV_AGENT_TYPE)
+        )
+        ledger = {}
+        for patient_id, agent_type, payload, timestamp in rows:
+            key = (patient_id, payload_hash(agent_type, payload))
+            ledger.setdefault(key, timestamp)
+        if ledger:
+            conn.execute(insert(ImportedRecord.__table__), [
+                {"patient_id": patient_id, "content_hash": digest, "imported_at": timestamp}
+                for (patient_id, digest), timestamp in ledger.items()
+            ])
+            print(f"✅ Recorded {len(ledger)} previously imported records in imported_records")
+
+
+def ensure_clinical_fields(bind=None):
+    """
+    Migration: add the clinical columns and their indexes to existing agent_data /
+    patient_latest_state tables. Generated columns on agent_data are VIRTUAL, so they
+    can be added with ALTER TABLE; new state columns are filled by a state rebuild.
+    """
+    bind = bind or engine
+    if not inspect(bind).has_table(AgentData.__tablename__):
+        return
+
+    rebuild_state = added = False
+    for model in (AgentData, PatientLatestState):
+        table = model.__table__
+        if not inspect(bind).has_table(table.name):
+            continue
+        existing = {column["name"] for column in inspect(bind).get_columns(table.name)}
+        missing = [field for field in CLINICAL_FIELDS if field not in existing]
+        with bind.begin() as conn:
+            for field in missing:
+                column = table.c[field]
+                definition = f"{field} {column.type.compile(bind.dialect)}"
+                if column.computed is not None:
+                    definition += f" GENERATED ALWAYS AS ({column.computed.sqltext}) VIRTUAL"
+                conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {definition}"))
+        for index in table.indexes:
+            index.create(bind=bind, checkfirst=True)
+        if missing:
+            added = True
+            print(f"✅ Added {len(missing)} indexed clinical columns to {table.name}")
+            if model is AgentData:
+                count = normalize_legacy_payloads(bind)
+                print(f"✅ Rewrote {count} legacy payloads as strict JSON")
+            rebuild_state = rebuild_state or model is PatientLatestState
+
+    if rebuild_state:
+        backfill_latest_state(bind)
+    if added:
+        with bind.begin() as conn:
+            conn.execute(text("ANALYZE"))  # index statistics so the planner picks the most selective filter
+
+
+def migrate_db(bind=None):
+    """Bring an existing database up to date (tables, triggers, backfills)"""
+    ensure_import_ledger(bind)
+    ensure_clinical_fields(bind)
+    ensure_latest_state(bind)
+    ensure_lab_measurements(bind)
+
+
 # --- UTILS ---
 
 def init_db():
     """Create tables if they don't exist"""
     Base.metadata.create_all(bind=engine)
+    migrate_db()
 
 def get_db():
     """Dependency for FastAPI"""
@@ -63,3 +683,8 @@ def get_db():
         yield db
     finally:
         db.close()
+
+async def get_async_db():
+    """Async dependency for FastAPI (request handlers)"""
+    async with AsyncSessionLocal() as db:
+        yield db
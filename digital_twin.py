@@ -186,6 +186,20 @@ class DiabetesTwin:
         
         # Initialize empty medication history (can be populated later)
         self.medications = MedicationHistory()
+        
+        # Latest CGM reading (updated incrementally from the glucose stream)
+        self.latest_glucose: Optional[Dict] = None
+    
+    def update_latest_glucose(self, ts_ms: int, value_mgdl: float):
+        """Apply a new CGM reading to the twin (older readings are ignored)"""
+        if self.latest_glucose and ts_ms < self.latest_glucose["ts_ms"]:
+            return
+        self.latest_glucose = {
+            "ts_ms": ts_ms,
+            "value_mgdl": value_mgdl,
+            "recorded_at": datetime.utcfromtimestamp(ts_ms / 1000).isoformat()
+        }
+        self.last_updated = datetime.now().isoformat()
     
     def _initialize_organ_health(self, data: Dict) -> OrganHealth:
         """Calculate initial organ health based on patient data"""
@@ -309,7 +323,8 @@ class DiabetesTwin:
             "lifestyle": asdict(self.lifestyle),
             "risk_factors": asdict(self.risk_factors),
             "organ_health": asdict(self.organ_health),
-            "medications": [asdict(m) for m in self.medications.current_medications]
+            "medications": [asdict(m) for m in self.medications.current_medications],
+            "latest_glucose": self.latest_glucose
         }
     
     def to_json(self, indent=2) -> str:
@@ -0,0 +1,125 @@
+"""
+Background Job Queue for MedTwin
+Runs slow agent work (e.g. action plans) on a bounded worker pool
+so HTTP requests don't have to hold the connection open.
+"""
+
+import asyncio
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+
+@dataclass
+class Job:
+    """A single unit of background work"""
+    id: str
+    key: Hashable
+    status: str = "queued"  # "queued", "running", "done", "error"
+    result: Any = None
+    error: Optional[str] = None
+    created_at: float = field(default_factory=time.time)
+    finished_at: Optional[float] = None
+    _done: threading.Event = field(default_factory=threading.Event, repr=False)
+    _future: Optional[Future] = field(default=None, repr=False)
+
+    def wait(self, timeout: float = None) -> bool:
+        """Block until the job finishes (or timeout). Returns True if finished."""
+        return self._done.wait(timeout)
+
+    async def wait_async(self, timeout: float = None) -> bool:
+        """Await the job without occupying a thread. Returns True if finished."""
+        if self._done.is_set():
+            return True
+        try:
+            await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(self._future)), timeout)
+        except asyncio.TimeoutError:
+            pass
+        return self._done.is_set()
+
+    def to_dict(self) -> Dict:
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "result": self.result,
+            "error": self.error,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at
+        }
+
+
+class JobQueue:
+    """
+    Bounded worker pool with in-flight deduplication.
+
+    Jobs submitted with a key that is already queued or running are
+    collapsed into the existing job instead of starting a new one.
+    """
+
+    def __init__(self, max_workers: int = 4, max_finished: int = 1000):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="medtwin-job")
+        self._lock = threading.Lock()
+        self._jobs: Dict[str, Job] = {}
+        self._in_flight: Dict[Hashable, Job] = {}
+        self._max_finished = max_finished
+
+    def submit(self, key: Hashable, fn: Callable, *args, **kwargs) -> Tuple[Job, bool]:
+        """
+        Queue fn(*args, **kwargs) unless an identical job is already in flight.
+
+        Returns:
+            (job, created) - created is False when an in-flight job was reused
+        """
+        with self._lock:
+            existing = self._in_flight.get(key)
+            if existing:
+                return existing, False
+
+            job = Job(id=uuid.uuid4().hex, key=key)
+            self._jobs[job.id] = job
+            self._in_flight[key] = job
+            self._prune()
+            job._future = self._executor.submit(self._run, job, fn, args, kwargs)
+
+        return job, True
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def stats(self) -> Dict[str, int]:
+        """Job counts by status"""
+        with self._lock:
+            counts = {"queued": 0, "running": 0, "done": 0, "error": 0}
+            for job in self._jobs.values():
+                counts[job.status] += 1
+            return counts
+
+    def shutdown(self, wait: bool = True):
+        self._executor.shutdown(wait=wait)
+
+    def _run(self, job: Job, fn: Callable, args, kwargs):
+        job.status = "running"
+        try:
+            job.result = fn(*args, **kwargs)
+            job.status = "done"
+        except Exception as e:
+            job.error = str(e)
+            job.status = "error"
+        finally:
+            job.finished_at = time.time()
+            with self._lock:
+                self._in_flight.pop(job.key, None)
+            job._done.set()
+
+    def _prune(self):
+        """Forget the oldest finished jobs beyond max_finished (lock held)"""
+        finished = [j for j in self._jobs.values() if j.finished_at is not None]
+        if len(finished) <= self._max_finished:
+            return
+        finished.sort(key=lambda j: j.finished_at)
+        for job in finished[:len(finished) - self._max_finished]:
+            del self._jobs[job.id]
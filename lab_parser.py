@@ -0,0 +1,335 @@
+"""
+Rule-based Lab Report Parser for MedTwin
+Turns structured report lines such as
+    - Hemoglobin: 14.2 g/dL (Reference: 13.5-17.5)
+into (analyte, value, unit, reference range, flag) records without an LLM.
+Lines that don't match are returned separately so only they need the LLM.
+"""
+
+import re
+from dataclasses import dataclass, asdict
+from typing import Callable, Dict, List, Optional, Tuple
+
+from lab_reference import interpret_lab_value, canonical_lab_name
+
+
+# ============================================================
+# ANALYTE SYNONYMS
+# ============================================================
+# canonical analyte -> (spellings seen in reports, DiabetesTwin payload key or None)
+
+ANALYTES = {
+    "HbA1c": (["hba1c", "a1c", "hemoglobin a1c", "haemoglobin a1c", "glycated hemoglobin", "glycosylated hemoglobin"], "HbA1c"),
+    "Fasting Glucose": (["glucose (fasting)", "fasting glucose", "fasting blood glucose", "fasting blood sugar", "fbg", "fbs"], "Fasting_Blood_Glucose"),
+    "Glucose": (["glucose", "blood glucose", "plasma glucose", "random glucose", "random blood glucose", "rbs"], None),
+    "Total Cholesterol": (["total cholesterol", "cholesterol, total", "cholesterol total", "cholesterol"], "Cholesterol_Total"),
+    "LDL Cholesterol": (["ldl cholesterol", "ldl-c", "ldl", "ldl cholesterol (calculated)"], "Cholesterol_LDL"),
+    "HDL Cholesterol": (["hdl cholesterol", "hdl-c", "hdl"], "Cholesterol_HDL"),
+    "Triglycerides": (["triglycerides", "tg", "trigs"], None),
+    "GGT": (["ggt", "gamma gt", "gamma-gt", "gamma-glutamyl transferase"], "GGT"),
+    "Serum Urate": (["serum urate", "uric acid", "urate"], "Serum_Urate"),
+    "BMI": (["bmi", "body mass index"], "BMI"),
+    "Blood Pressure (Systolic)": (["systolic bp", "systolic blood pressure", "blood pressure (systolic)", "sbp"], "Blood_Pressure_Systolic"),
+    "Blood Pressure (Diastolic)": (["diastolic bp", "diastolic blood pressure", "blood pressure (diastolic)", "dbp"], "Blood_Pressure_Diastolic"),
+    "WBC": (["wbc count", "wbc", "white blood cells", "white blood cell count", "leukocytes"], None),
+    "RBC": (["rbc count", "rbc", "red blood cells", "red blood cell count", "erythrocytes"], None),
+    "Hemoglobin": (["hemoglobin", "haemoglobin", "hgb", "hb"], None),
+    "Hematocrit": (["hematocrit", "haematocrit", "hct"], None),
+    "Platelets": (["platelet count", "platelets", "plt"], None),
+    "Creatinine": (["creatinine", "serum creatinine", "creat"], None),
+    "BUN": (["bun", "blood urea nitrogen", "urea nitrogen"], None),
+    "eGFR": (["egfr", "estimated gfr"], None),
+    "ALT": (["alt", "sgpt", "alanine aminotransferase"], None),
+    "AST": (["ast", "sgot", "aspartate aminotransferase"], None),
+    "Alkaline Phosphatase": (["alkaline phosphatase", "alp", "alk phos"], None),
+    "Total Bilirubin": (["total bilirubin", "bilirubin, total", "bilirubin"], None),
+    "TSH": (["tsh", "thyroid stimulating hormone"], None),
+    "Free T4": (["free t4", "ft4", "free thyroxine"], None),
+    "CO2": (["co2", "bicarbonate", "hco3", "total co2"], None),
+}
+
+SYNONYMS: Dict[str, str] = {}
+for _canonical, (_spellings, _) in ANALYTES.items():
+    SYNONYMS[_canonical.lower()] = _canonical
+    for _spelling in _spellings:
+        SYNONYMS[_spelling] = _canonical
+
+TWIN_FIELDS: Dict[str, str] = {name: field for name, (_, field) in ANALYTES.items() if field}
+
+
+def _same(value: float) -> float:
+    return value
+
+
+def _converter(factor: float) -> Callable[[float], float]:
+    return lambda value: round(value * factor, 1)
+
+
+# Units a twin field's analyte may be reported in (normalized, see normalize_unit)
+# -> conversion to the unit the twin stores (lab_reference.LAB_STANDARDS).
+# Values in any other unit, or without one, stay in lab_results only.
+TWIN_UNITS: Dict[str, Dict[str, Callable[[float], float]]] = {
+    "HbA1c": {"%": _same, "mmol/mol": lambda value: round(0.09148 * value + 2.152, 1)},  # IFCC -> NGSP
+    "Fasting Glucose": {"mg/dl": _same, "mmol/l": _converter(18.0)},
+    "Total Cholesterol": {"mg/dl": _same, "mmol/l": _converter(38.67)},
+    "LDL Cholesterol": {"mg/dl": _same, "mmol/l": _converter(38.67)},
+    "HDL Cholesterol": {"mg/dl": _same, "mmol/l": _converter(38.67)},
+    "GGT": {"u/l": _same, "iu/l": _same},
+    "Serum Urate": {"mg/dl": _same, "umol/l": _converter(1 / 59.48)},
+    "BMI": {"kg/m2": _same, "": _same},
+    "Blood Pressure (Systolic)": {"mmhg": _same},
+    "Blood Pressure (Diastolic)": {"mmhg": _same},
+}
+
+# Metadata labels: "Label: text" lines that aren't results and need no LLM
+METADATA_LABELS = {"test date", "date", "collection date", "collected", "reported", "patient", "name",
+                   "patient name", "dob", "date of birth", "physician", "doctor", "lab", "laboratory",
+                   "notes", "note", "comments", "comment", "specimen"}
+
+
+# ============================================================
+# PATTERNS (compiled once)
+# ============================================================
+
+_NUMBER = r"-?(?:\d{1,3}(?:,\d{3})+(?:\.\d+)?|\d+(?:[.,]\d+)?)"  # "1,234.5" or "5.5" / "5,5"
+THOUSANDS = re.compile(r"-?\d{1,3}(?:,\d{3})+(?:\.\d+)?")
+
+RESULT_LINE = re.compile(
+    r"^\s*(?:[-•*]\s*)?"                                        # bullet
+    r"(?P<name>[A-Za-z][A-Za-z0-9 ,./()'+-]*?)\s*:\s*"          # analyte name
+    r"(?P<qualifier>[<>]=?)?\s*(?P<value>" + _NUMBER + r")\s*"  # value (optionally "<5")
+    r"(?P<unit>[^\s(][^(]*?)??\s*"                              # unit (anything up to "(")
+    r"(?:\((?:reference|ref\.?|ref range|normal|normal range|range)?\s*:?\s*(?P<ref>[^)]*)\))?\s*"
+    r"(?P<flag>(?<=[\s)])(?:H|L|HH|LL|HIGH|LOW|CRITICAL|ABNORMAL)\b|\*)?\s*$",  # not the "L" of "mmol/L"
+    re.IGNORECASE
+)
+REF_RANGE = re.compile(r"(?P<low>" + _NUMBER + r")\s*[a-zA-Z%/^0-9]*\s*(?:-|–|to)\s*(?P<high>" + _NUMBER + r")")
+REF_UPPER = re.compile(r"^\s*(?:<|≤|<=|up to|below)\s*(?P<high>" + _NUMBER + r")", re.IGNORECASE)
+REF_LOWER = re.compile(r"^\s*(?:>|≥|>=|above)\s*(?P<low>" + _NUMBER + r")", re.IGNORECASE)
+BLOOD_PRESSURE_LINE = re.compile(
+    r"^\s*(?:[-•*]\s*)?(?P<name>(?:blood pressure|bp)[A-Za-z ()]*?)\s*:\s*"
+    r"(?P<systolic>\d{2,3})\s*/\s*(?P<diastolic>\d{2,3})\s*(?P<unit>mm\s*hg)?",
+    re.IGNORECASE
+)
+LABEL_LINE = re.compile(r"^\s*(?:[-•*]\s*)?(?P<label>[A-Za-z][A-Za-z ]*?)\s*:\s*(?P<text>.*)$")
+HEADER_LINE = re.compile(r"^[^a-z0-9]*[A-Z][A-Z0-9 ()&/,-]*:?\s*$")
+
+
+# ============================================================
+# RECORDS
+# ============================================================
+
+@dataclass
+class LabRecord:
+    """One parsed lab result"""
+    analyte: str                     # canonical name (or the name as written if unknown)
+    value: float
+    unit: str
+    qualifier: str = ""              # "<", ">", "<=" or ">=" for censored values ("<5")
+    ref_low: Optional[float] = None
+    ref_high: Optional[float] = None
+    flag: str = "UNKNOWN"            # "LOW", "NORMAL", "HIGH" or "UNKNOWN"
+    status: Optional[str] = None     # diabetes band from lab_reference, if indexed
+    name: str = ""                   # name as written in the report
+    line: int = 0
+
+    def to_dict(self) -> Dict:
+        return asdict(self)
+
+    def describe(self) -> str:
+        """'Glucose (Fasting): 118 mg/dL (High)' style summary"""
+        unit = f" {self.unit}" if self.unit else ""
+        return f"{self.name or self.analyte}: {self.qualifier}{self.value:g}{unit} ({self.flag.title()})"
+
+
+@dataclass
+class ParsedLabReport:
+    records: List[LabRecord]
+    unparsed: List[Tuple[int, str]]  # (line number, text) that need the LLM
+    metadata: Dict[str, str]
+
+    @property
+    def abnormal(self) -> List[LabRecord]:
+        return [r for r in self.records if r.flag in ("LOW", "HIGH")]
+
+
+# ============================================================
+# PARSING
+# ============================================================
+
+def _to_float(text: str) -> float:
+    """'1,234' is a thousands separator, '5,5' a decimal comma"""
+    if THOUSANDS.fullmatch(text):
+        return float(text.replace(",", ""))
+    return float(text.replace(",", "."))
+
+
+def normalize_unit(unit: str) -> str:
+    """'mg/dL' -> 'mg/dl', 'µmol/L' -> 'umol/l', 'kg/m²' -> 'kg/m2'"""
+    unit = re.sub(r"\s+", "", unit or "").lower()
+    return unit.replace("µ", "u").replace("μ", "u").replace("²", "2").replace("^2", "2")
+
+
+def twin_value(analyte: str, value: float, unit: str, qualifier: str = "") -> Optional[float]:
+    """
+    Value in the twin field's unit, or None if the analyte has no twin field,
+    the unit isn't one it can be converted from, or the value is censored ("<5").
+    """
+    convert = TWIN_UNITS.get(analyte, {}).get(normalize_unit(unit))
+    if analyte not in TWIN_FIELDS or convert is None or qualifier:
+        return None
+    return convert(value)
+
+
+def canonical_analyte(name: str) -> Optional[str]:
+    """Canonical analyte for a name as written (None if not in the synonym table)"""
+    key = re.sub(r"\s+", " ", name.strip().lower())
+    return SYNONYMS.get(key)
+
+
+def parse_reference(text: Optional[str]) -> Tuple[Optional[float], Optional[float]]:
+    """
+    Reference range as (low, high).
+    Handles "4.0-11.0", "40-70%", "<200", ">40" and multi-band strings such as
+    "<5.7% normal, 5.7-6.4% prediabetes" (the first band is the normal range).
+    """
+    if not text:
+        return None, None
+    first = re.split(r"[,;](?!\d)", text)[0]
+    match = REF_UPPER.match(first)
+    if match:
+        return None, _to_float(match.group("high"))
+    match = REF_LOWER.match(first)
+    if match:
+        return _to_float(match.group("low")), None
+    match = REF_RANGE.search(first)
+    if match:
+        return _to_float(match.group("low")), _to_float(match.group("high"))
+    return None, None
+
+
+def _flag(value: float, low: Optional[float], high: Optional[float], status: Optional[str],
+          printed: Optional[str] = None) -> str:
+    if low is not None or high is not None:
+        if low is not None and value < low:
+            return "LOW"
+        if high is not None and value > high:
+            return "HIGH"
+        return "NORMAL"
+    # No printed reference range: trust the lab's own H/L flag, then the diabetes reference bands
+    if printed:
+        printed = printed.upper()
+        if printed in ("L", "LL", "LOW"):
+            return "LOW"
+        if printed in ("H", "HH", "HIGH"):
+            return "HIGH"
+    if status in ("EXCELLENT", "NORMAL", "OPTIMAL", "NEAR OPTIMAL", "DESIRABLE", "CONTROLLED", "ACCEPTABLE"):
+        return "NORMAL"
+    if status in ("LOW", "UNDERWEIGHT"):
+        return "LOW"
+    if status and status != "UNKNOWN":
+        return "HIGH"
+    return "UNKNOWN"
+
+
+def _blood_pressure(match, line_number: int) -> List[LabRecord]:
+    records = []
+    for part, analyte in (("systolic", "Blood Pressure (Systolic)"), ("diastolic", "Blood Pressure (Diastolic)")):
+        value = float(match.group(part))
+        status = interpret_lab_value(analyte, value)["status"] if canonical_lab_name(analyte) else None
+        records.append(LabRecord(
+            analyte=analyte,
+            value=value,
+            unit="mmHg",
+            flag=_flag(value, None, None, status),
+            status=status,
+            name=analyte,
+            line=line_number
+        ))
+    return records
+
+
+def parse_line(line: str, line_number: int = 0) -> List[LabRecord]:
+    """Parse one result line (empty list if it isn't a result line)"""
+    match = BLOOD_PRESSURE_LINE.match(line)
+    if match:
+        return _blood_pressure(match, line_number)
+
+    match = RESULT_LINE.match(line)
+    if not match:
+        return []
+
+    name = match.group("name").strip()
+    if name.lower() in METADATA_LABELS:
+        return []
+
+    value = _to_float(match.group("value"))
+    unit = (match.group("unit") or "").strip()
+    qualifier = match.group("qualifier") or ""
+    ref_low, ref_high = parse_reference(match.group("ref"))
+    analyte = canonical_analyte(name) or name
+
+    # Diabetes bands are in the twin's units: classify only values that convert to them
+    status = None
+    converted = twin_value(analyte, value, unit, qualifier)
+    if converted is not None and canonical_lab_name(analyte):
+        status = interpret_lab_value(analyte, converted)["status"]
+
+    return [LabRecord(
+        analyte=analyte,
+        value=value,
+        unit=unit,
+        qualifier=qualifier,
+        ref_low=ref_low,
+        ref_high=ref_high,
+        flag=_flag(value, ref_low, ref_high, status, match.group("flag")),
+        status=status,
+        name=name,
+        line=line_number
+    )]
+
+
+def parse_lab_report(text: str) -> ParsedLabReport:
+    """
+    Split a report into parsed results, metadata and lines that still need the LLM.
+    Blank lines and section headers ("LIPID PANEL:") are skipped.
+    """
+    records, unparsed, metadata = [], [], {}
+
+    for number, line in enumerate(text.splitlines(), start=1):
+        stripped = line.strip()
+        if not stripped or HEADER_LINE.match(stripped):
+            continue
+
+        parsed = parse_line(stripped, number)
+        if parsed:
+            records.extend(parsed)
+            continue
+
+        label = LABEL_LINE.match(stripped)
+        if label and label.group("label").strip().lower() in METADATA_LABELS:
+            metadata[label.group("label").strip()] = label.group("text").strip()
+            continue
+
+        unparsed.append((number, stripped))
+
+    return ParsedLabReport(records=records, unparsed=unparsed, metadata=metadata)
+
+
+def to_agent_payload(report: ParsedLabReport) -> Dict:
+    """
+    AgentData payload for a parsed report: twin fields (e.g. "HbA1c",
+    "Cholesterol_LDL") at the top level so they update the patient's twin,
+    plus the full structured results.
+    Only values in (or convertible to) the twin field's unit are promoted;
+    others, and censored values such as "<5", stay in lab_results only.
+    """
+    payload = {}
+    for r in report.records:
+        value = twin_value(r.analyte, r.value, r.unit, r.qualifier)
+        if value is not None:
+            payload[TWIN_FIELDS[r.analyte]] = value
+    payload["lab_results"] = [r.to_dict() for r in report.records]
+    if report.metadata:
+        payload["report_metadata"] = report.metadata
+    return payload
@@ -0,0 +1,298 @@
+"""
+Lab Reference Index for MedTwin
+Diabetes-focused reference bands for common labs, compiled once into sorted
+lower-edge arrays so a value is classified with a binary search
+(bisect for single values, np.searchsorted for whole cohort columns).
+"""
+
+from bisect import bisect_right
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+
+# ============================================================
+# REFERENCE TABLE
+# ============================================================
+# Each band is (lower, upper, status, icon, explanation). When compiled, a band
+# covers [lower, next band's lower): the published bounds leave gaps (e.g. HbA1c
+# 6.4-6.5, BMI 24.9-25.0) that must still classify. The top band is open-ended.
+
+LAB_STANDARDS = {
+    "HbA1c": {
+        "unit": "%",
+        "normal_range": (4.0, 5.6),
+        "diabetes_target": (0, 7.0),
+        "ranges": [
+            (0, 5.7, "EXCELLENT", "🟢", "Normal - no diabetes"),
+            (5.7, 6.4, "PREDIABETES", "🟡", "Prediabetic range - lifestyle changes needed"),
+            (6.5, 7.0, "CONTROLLED", "🟢", "Diabetes is well-controlled (at ADA target)"),
+            (7.0, 8.0, "SUBOPTIMAL", "🟡", "Above target - medication adjustment may help"),
+            (8.0, 9.0, "POOR", "🟠", "Poor control - need treatment intensification"),
+            (9.0, 15.0, "CRITICAL", "🔴", "Very high - urgent intervention required")
+        ]
+    },
+    "Fasting Glucose": {
+        "unit": "mg/dL",
+        "normal_range": (70, 100),
+        "diabetes_target": (80, 130),
+        "ranges": [
+            (0, 70, "LOW", "🟡", "Risk of hypoglycemia - check with doctor"),
+            (70, 100, "NORMAL", "🟢", "Normal fasting glucose"),
+            (100, 125, "PREDIABETES", "🟡", "Elevated - prediabetic range"),
+            (126, 180, "HIGH", "🟠", "Elevated - indicates poor diabetes control"),
+            (180, 600, "VERY HIGH", "🔴", "Severely elevated - urgent attention needed")
+        ]
+    },
+    "LDL Cholesterol": {
+        "unit": "mg/dL",
+        "normal_range": (0, 100),
+        "diabetes_target": (0, 100),
+        "ranges": [
+            (0, 100, "OPTIMAL", "🟢", "Optimal for diabetes patients"),
+            (100, 129, "NEAR OPTIMAL", "🟢", "Near optimal - acceptable for most"),
+            (130, 159, "BORDERLINE HIGH", "🟡", "Consider statin therapy"),
+            (160, 189, "HIGH", "🟠", "High - statin strongly recommended"),
+            (190, 400, "VERY HIGH", "🔴", "Very high - aggressive lipid management needed")
+        ]
+    },
+    "HDL Cholesterol": {
+        "unit": "mg/dL",
+        "normal_range": (40, 150),
+        "diabetes_target": (40, 150),
+        "ranges": [
+            (0, 40, "LOW", "🟠", "Low HDL increases heart disease risk"),
+            (40, 59, "ACCEPTABLE", "🟡", "Acceptable but could be higher"),
+            (60, 150, "OPTIMAL", "🟢", "Optimal - protective against heart disease")
+        ]
+    },
+    "Blood Pressure (Systolic)": {
+        "unit": "mmHg",
+        "normal_range": (90, 120),
+        "diabetes_target": (0, 130),
+        "ranges": [
+            (0, 90, "LOW", "🟡", "Low blood pressure - monitor for dizziness"),
+            (90, 120, "NORMAL", "🟢", "Normal blood pressure"),
+            (120, 130, "ELEVATED", "🟡", "Elevated - lifestyle changes recommended"),
+            (130, 140, "STAGE 1 HTN", "🟠", "Stage 1 hypertension - medication may be needed"),
+            (140, 180, "STAGE 2 HTN", "🔴", "Stage 2 hypertension - medication required"),
+            (180, 250, "CRISIS", "🔴", "Hypertensive crisis - seek immediate care")
+        ]
+    },
+    "Total Cholesterol": {
+        "unit": "mg/dL",
+        "normal_range": (0, 200),
+        "diabetes_target": (0, 200),
+        "ranges": [
+            (0, 200, "DESIRABLE", "🟢", "Desirable level"),
+            (200, 239, "BORDERLINE HIGH", "🟡", "Borderline - lifestyle changes recommended"),
+            (240, 500, "HIGH", "🔴", "High - medication likely needed")
+        ]
+    },
+    "GGT": {
+        "unit": "U/L",
+        "normal_range": (0, 35),
+        "diabetes_target": (0, 40),
+        "ranges": [
+            (0, 35, "NORMAL", "🟢", "Normal liver enzyme level"),
+            (35, 50, "MILDLY ELEVATED", "🟡", "Mildly elevated - monitor kidney/liver function"),
+            (50, 100, "ELEVATED", "🟠", "Elevated - may indicate kidney stress"),
+            (100, 300, "HIGH", "🔴", "High - nephrology consultation recommended")
+        ]
+    },
+    "Serum Urate": {
+        "unit": "mg/dL",
+        "normal_range": (3.5, 7.0),
+        "diabetes_target": (0, 6.0),
+        "ranges": [
+            (0, 6.0, "NORMAL", "🟢", "Normal uric acid level"),
+            (6.0, 7.0, "BORDERLINE", "🟡", "Borderline - monitor for kidney issues"),
+            (7.0, 10.0, "HIGH", "🟠", "High - increases kidney disease risk"),
+            (10.0, 20.0, "VERY HIGH", "🔴", "Very high - urgent kidney function assessment needed")
+        ]
+    },
+    "BMI": {
+        "unit": "kg/m²",
+        "normal_range": (18.5, 24.9),
+        "diabetes_target": (18.5, 24.9),
+        "ranges": [
+            (0, 18.5, "UNDERWEIGHT", "🟡", "Underweight - nutritional assessment needed"),
+            (18.5, 24.9, "NORMAL", "🟢", "Normal weight"),
+            (25.0, 29.9, "OVERWEIGHT", "🟡", "Overweight - 5-10% weight loss beneficial"),
+            (30.0, 34.9, "OBESE CLASS I", "🟠", "Obesity - significant diabetes risk"),
+            (35.0, 80.0, "OBESE CLASS II+", "🔴", "Severe obesity - intensive intervention needed")
+        ]
+    }
+}
+
+# Labs whose diabetes target is an upper limit ("< 7.0 %") rather than a range
+UPPER_LIMIT_TARGETS = {"HbA1c", "LDL Cholesterol", "Blood Pressure (Systolic)"}
+
+UNKNOWN_STATUS = "UNKNOWN"
+UNKNOWN_ICON = "ℹ️"
+
+
+# ============================================================
+# COMPILED INDEX
+# ============================================================
+
+class CompiledLab(NamedTuple):
+    """One lab's bands as parallel arrays, ready for binary search"""
+    name: str
+    unit: str
+    edges: Tuple[float, ...]           # sorted band lower edges
+    edges_array: np.ndarray            # same, for np.searchsorted
+    statuses: Tuple[str, ...]
+    icons: Tuple[str, ...]
+    explanations: Tuple[str, ...]
+    normal_range: str
+    diabetes_target: str
+
+
+def _compile(name: str, lab: Dict) -> CompiledLab:
+    bands = sorted(lab["ranges"], key=lambda band: band[0])
+    unit = lab["unit"]
+    low, high = lab["normal_range"]
+    target_low, target_high = lab["diabetes_target"]
+    if name in UPPER_LIMIT_TARGETS:
+        target = f"< {target_high} {unit}"
+    else:
+        target = f"{target_low}-{target_high} {unit}"
+
+    edges = tuple(float(band[0]) for band in bands)
+    return CompiledLab(
+        name=name,
+        unit=unit,
+        edges=edges,
+        edges_array=np.array(edges, dtype=float),
+        statuses=tuple(band[2] for band in bands),
+        icons=tuple(band[3] for band in bands),
+        explanations=tuple(band[4] for band in bands),
+        normal_range=f"{low}-{high} {unit}",
+        diabetes_target=target
+    )
+
+
+LAB_INDEX: Dict[str, CompiledLab] = {name: _compile(name, lab) for name, lab in LAB_STANDARDS.items()}
+
+# Case-insensitive names and common spellings -> canonical lab name
+LAB_ALIASES: Dict[str, str] = {name.lower(): name for name in LAB_INDEX}
+LAB_ALIASES.update({
+    "a1c": "HbA1c",
+    "hemoglobin a1c": "HbA1c",
+    "glucose": "Fasting Glucose",
+    "glucose (fasting)": "Fasting Glucose",
+    "fasting blood glucose": "Fasting Glucose",
+    "fbg": "Fasting Glucose",
+    "ldl": "LDL Cholesterol",
+    "hdl": "HDL Cholesterol",
+    "cholesterol": "Total Cholesterol",
+    "systolic bp": "Blood Pressure (Systolic)",
+    "systolic blood pressure": "Blood Pressure (Systolic)",
+    "blood pressure": "Blood Pressure (Systolic)",
+    "uric acid": "Serum Urate",
+    "gamma-gt": "GGT",
+    "body mass index": "BMI",
+})
+
+
+def canonical_lab_name(name: str) -> Optional[str]:
+    """Canonical LAB_INDEX key for a lab name or alias (None if not indexed)"""
+    if name in LAB_INDEX:
+        return name
+    return LAB_ALIASES.get(name.strip().lower())
+
+
+# ============================================================
+# LOOKUP
+# ============================================================
+
+def band_index(lab: CompiledLab, value: float) -> int:
+    """Band position for a value (-1 if below the first band or not a number)"""
+    if value != value:  # NaN
+        return -1
+    return bisect_right(lab.edges, value) - 1
+
+
+def interpret_lab_value(name: str, value: float, unit: str = "") -> Dict:
+    """
+    Interpret a lab value and provide user-friendly explanation
+
+    Args:
+        name: Lab test name or alias (e.g., "HbA1c", "LDL Cholesterol")
+        value: Numeric value of the lab result
+        unit: Unit of measurement, used only for labs without reference bands
+
+    Returns:
+        Dictionary with interpretation including status, target, and explanation
+    """
+    canonical = canonical_lab_name(name)
+    if canonical is None:
+        return {
+            "value": value,
+            "unit": unit,
+            "status": UNKNOWN_STATUS,
+            "icon": UNKNOWN_ICON,
+            "explanation": f"Value: {value} {unit}"
+        }
+
+    lab = LAB_INDEX[canonical]
+    i = band_index(lab, value)
+    return {
+        "value": value,
+        "unit": lab.unit,
+        "status": lab.statuses[i] if i >= 0 else UNKNOWN_STATUS,
+        "icon": lab.icons[i] if i >= 0 else UNKNOWN_ICON,
+        "normal_range": lab.normal_range,
+        "diabetes_target": lab.diabetes_target,
+        "explanation": lab.explanations[i] if i >= 0 else ""
+    }
+
+
+def interpret_panel(panel: Dict[str, float]) -> Dict[str, Dict]:
+    """Interpret every analyte of one patient's panel ({name: value})"""
+    return {name: interpret_lab_value(name, value) for name, value in panel.items()}
+
+
+def interpret_column(name: str, values: Iterable[float]) -> Optional[Dict[str, List]]:
+    """
+    Interpret a whole cohort column for one lab in a single vectorized pass.
+
+    Returns:
+        {"status": [...], "icon": [...]} aligned with values, or None if the lab isn't indexed.
+        Missing values (None/NaN) and values below the first band get UNKNOWN.
+    """
+    canonical = canonical_lab_name(name)
+    if canonical is None:
+        return None
+
+    lab = LAB_INDEX[canonical]
+    try:
+        array = np.asarray(values, dtype=float)
+    except TypeError:  # None entries (missing values from JSON)
+        array = np.asarray([np.nan if v is None else v for v in values], dtype=float)
+    positions = np.searchsorted(lab.edges_array, array, side="right") - 1
+    positions[np.isnan(array)] = -1
+
+    # Slot 0 is UNKNOWN so position -1 maps to it after the +1 shift
+    statuses = np.array((UNKNOWN_STATUS,) + lab.statuses, dtype=object)
+    icons = np.array((UNKNOWN_ICON,) + lab.icons, dtype=object)
+    return {
+        "status": statuses[positions + 1].tolist(),
+        "icon": icons[positions + 1].tolist()
+    }
+
+
+def lab_legend(name: str) -> Optional[Dict]:
+    """Unit, targets and per-status explanations for one lab (for columnar responses)"""
+    canonical = canonical_lab_name(name)
+    if canonical is None:
+        return None
+    lab = LAB_INDEX[canonical]
+    return {
+        "lab": canonical,
+        "unit": lab.unit,
+        "normal_range": lab.normal_range,
+        "diabetes_target": lab.diabetes_target,
+        "explanations": dict(zip(lab.statuses, lab.explanations))
+    }
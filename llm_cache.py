@@ -0,0 +1,232 @@
+"""
+LLM Response Cache for MedTwin
+Content-addressed, persistent cache in front of the LangChain chat model.
+
+Responses are keyed by sha256(model, temperature, max_tokens, prompt) and kept in
+a small SQLite file of their own (not medtwin.db, so cache writes never take the
+application's write lock), with a TTL and LRU eviction once the cache holds more
+than max_entries responses or max_bytes of text. Hits and misses are counted in
+medtwin_cache_requests_total{cache="llm"}.
+
+    llm = CachedLLM(ChatOpenAI(...), LLMCache("llm_cache.db"))
+    llm.invoke(prompt)   # first call goes to the API, repeats are served from disk
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import AsyncIterator, Iterator, Optional
+
+import metrics
+
+DEFAULT_PATH = os.environ.get("MEDTWIN_LLM_CACHE_PATH", "llm_cache.db")
+DEFAULT_TTL_SECONDS = float(os.environ.get("MEDTWIN_LLM_CACHE_TTL_HOURS", "168")) * 3600
+DEFAULT_MAX_ENTRIES = int(os.environ.get("MEDTWIN_LLM_CACHE_MAX_ENTRIES", "20000"))
+DEFAULT_MAX_BYTES = int(os.environ.get("MEDTWIN_LLM_CACHE_MAX_MB", "100")) * 1024 * 1024
+
+# last_used is only rewritten when older than this, so hot entries don't cost a write per hit
+_TOUCH_INTERVAL = 60.0
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS llm_cache (
+    key TEXT PRIMARY KEY,
+    model TEXT,
+    response TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    expires_at REAL NOT NULL,
+    last_used REAL NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS ix_llm_cache_last_used ON llm_cache (last_used);
+"""
+
+
+def _prompt_text(prompt) -> str:
+    """Stable text form of a prompt (a string or a list of chat messages)"""
+    if isinstance(prompt, str):
+        return prompt
+    if isinstance(prompt, (list, tuple)):
+        return json.dumps([
+            [getattr(message, "type", type(message).__name__), getattr(message, "content", message)]
+            for message in prompt
+        ], default=str)
+    return str(prompt)
+
+
+def cache_key(model: str, temperature, max_tokens, prompt) -> str:
+    payload = json.dumps([model, temperature, max_tokens, _prompt_text(prompt)])
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class LLMCache:
+    """TTL + size-bounded LRU key/value store of response texts, in SQLite"""
+
+    def __init__(self, path: str = DEFAULT_PATH, ttl_seconds: float = DEFAULT_TTL_SECONDS,
+                 max_entries: int = DEFAULT_MAX_ENTRIES, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._conn.executescript(_SCHEMA)
+        self._entries, self._bytes = self._totals()
+
+    def _totals(self):
+        count, size = self._conn.execute("SELECT count(*), coalesce(sum(size), 0) FROM llm_cache").fetchone()
+        return count, size
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response, expires_at, last_used FROM llm_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            response, expires_at, last_used = row
+            if expires_at <= now:
+                self._conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                self._entries, self._bytes = self._totals()
+                return None
+            if now - last_used > _TOUCH_INTERVAL:
+                self._conn.execute("UPDATE llm_cache SET last_used = ? WHERE key = ?", (now, key))
+        return response
+
+    def put(self, key: str, response: str, model: Optional[str] = None):
+        now = time.time()
+        size = len(response.encode())
+        with self._lock:
+            previous = self._conn.execute("SELECT size FROM llm_cache WHERE key = ?", (key,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, model, response, size, created_at, expires_at, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, model, response, size, now, now + self.ttl_seconds, now)
+            )
+            if previous is None:
+                self._entries += 1
+                self._bytes += size
+            else:  # replaced an existing response
+                self._bytes += size - previous[0]
+            if self._entries > self.max_entries or self._bytes > self.max_bytes:
+                self._evict(now)
+
+    def _evict(self, now: float):
+        """Drop expired entries, then least recently used ones down to 90% of the limits"""
+        self._conn.execute("DELETE FROM llm_cache WHERE expires_at <= ?", (now,))
+        self._entries, self._bytes = self._totals()  # other processes may share the file
+        while self._entries > self.max_entries * 0.9 or self._bytes > self.max_bytes * 0.9:
+            excess = max(self._entries - int(self.max_entries * 0.9), 1)
+            self._conn.execute(
+                "DELETE FROM llm_cache WHERE key IN (SELECT key FROM llm_cache ORDER BY last_used LIMIT ?)",
+                (min(excess, 1000),)
+            )
+            self._entries, self._bytes = self._totals()
+            if not self._entries:
+                break
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM llm_cache")
+            self._entries, self._bytes = 0, 0
+
+    def stats(self):
+        return {"entries": self._entries, "bytes": self._bytes, "path": self.path}
+
+
+class CachedLLM:
+    """
+    Wraps a LangChain chat model: invoke()/ainvoke() and stream()/astream() answer
+    repeated prompts from the cache (as AIMessage / a single AIMessageChunk, with
+    no token usage). Every other attribute is passed through to the wrapped model.
+    The async methods query the cache inline: a primary-key lookup in a local
+    file takes well under a millisecond, less than handing it to a thread.
+    """
+
+    def __init__(self, llm, cache: LLMCache):
+        self.llm = llm
+        self.cache = cache
+        self.model = getattr(llm, "model_name", None) or getattr(llm, "model", None) or type(llm).__name__
+
+    def __getattr__(self, name):
+        return getattr(self.llm, name)
+
+    def _key(self, prompt) -> str:
+        return cache_key(self.model, getattr(self.llm, "temperature", None),
+                         getattr(self.llm, "max_tokens", None), prompt)
+
+    def invoke(self, prompt, *args, **kwargs):
+        from langchain_core.messages import AIMessage
+
+        key = self._key(prompt)
+        cached = self.cache.get(key)
+        metrics.record_cache("llm", cached is not None)
+        if cached is not None:
+            return AIMessage(content=cached, response_metadata={"cache": "hit", "model_name": self.model})
+
+        response = self.llm.invoke(prompt, *args, **kwargs)
+        if isinstance(response.content, str) and response.content:
+            self.cache.put(key, response.content, self.model)
+        return response
+
+    async def ainvoke(self, prompt, *args, **kwargs):
+        from langchain_core.messages import AIMessage
+
+        key = self._key(prompt)
+        cached = self.cache.get(key)
+        metrics.record_cache("llm", cached is not None)
+        if cached is not None:
+            return AIMessage(content=cached, response_metadata={"cache": "hit", "model_name": self.model})
+
+        response = await self.llm.ainvoke(prompt, *args, **kwargs)
+        if isinstance(response.content, str) and response.content:
+            self.cache.put(key, response.content, self.model)
+        return response
+
+    def stream(self, prompt, *args, **kwargs) -> Iterator:
+        from langchain_core.messages import AIMessageChunk
+
+        key = self._key(prompt)
+        cached = self.cache.get(key)
+        metrics.record_cache("llm", cached is not None)
+        if cached is not None:
+            yield AIMessageChunk(content=cached, response_metadata={"cache": "hit", "model_name": self.model})
+            return
+
+        parts = []
+        for chunk in self.llm.stream(prompt, *args, **kwargs):
+            if isinstance(chunk.content, str):
+                parts.append(chunk.content)
+            yield chunk
+        # Only complete streams are cached (an interrupted one never reaches this point)
+        if parts:
+            self.cache.put(key, "".join(parts), self.model)
+
+    async def astream(self, prompt, *args, **kwargs) -> AsyncIterator:
+        from langchain_core.messages import AIMessageChunk
+
+        key = self._key(prompt)
+        cached = self.cache.get(key)
+        metrics.record_cache("llm", cached is not None)
+        if cached is not None:
+            yield AIMessageChunk(content=cached, response_metadata={"cache": "hit", "model_name": self.model})
+            return
+
+        parts = []
+        async for chunk in self.llm.astream(prompt, *args, **kwargs):
+            if isinstance(chunk.content, str):
+                parts.append(chunk.content)
+            yield chunk
+        if parts:
+            self.cache.put(key, "".join(parts), self.model)
+
+
+def cached_llm(llm, path: Optional[str] = None) -> CachedLLM:
+    """Wrap llm with the persistent cache at path (default MEDTWIN_LLM_CACHE_PATH)"""
+    return CachedLLM(llm, LLMCache(path or DEFAULT_PATH))
@@ -5,11 +5,16 @@ Powered by DeepSeek AI
 This module contains the core agent logic for the MedTwin medical assistant.
 """
 
+import asyncio
 import os
 import json
 import re
-from typing import Dict, List, Any
-from langchain_openai import ChatOpenAI
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Any, AsyncIterator, Awaitable, Iterable, Iterator, Optional, Tuple
+
+import metrics
+from lab_parser import LabRecord, canonical_analyte, parse_lab_report
 
 
 # ============================================================
@@ -24,8 +29,13 @@ def initialize_deepseek(api_key: str = None):
         api_key: DeepSeek API key (if None, reads from environment)
     
     Returns:
-        ChatOpenAI instance
+        ChatOpenAI instance, wrapped in the persistent response cache
+        (llm_cache.CachedLLM) unless MEDTWIN_LLM_CACHE=0
     """
+    # Imported here: LangChain/OpenAI take over a second to import and
+    # modules that only need the helpers shouldn't pay for that
+    from langchain_openai import ChatOpenAI
+    
     if api_key:
         os.environ["DEEPSEEK_API_KEY"] = api_key
     
@@ -37,6 +47,10 @@ def initialize_deepseek(api_key: str = None):
         max_tokens=2000
     )
     
+    if os.environ.get("MEDTWIN_LLM_CACHE", "1") != "0":
+        from llm_cache import cached_llm
+        llm = cached_llm(llm)
+    
     return llm
 
 
@@ -94,6 +108,39 @@ def contains_root(text: str, roots: List[str]) -> bool:
     return any(root in text_lower for root in roots)
 
 
+_CODE_FENCE = re.compile(r"```(?:json)?\s*(.*?)```", re.DOTALL)
+_TRAILING_COMMA = re.compile(r",\s*([}\]])")
+
+
+def recover_json_object(llm_response: str) -> Optional[Dict[str, Any]]:
+    """
+    Extract a JSON object from LLM output, tolerating markdown code fences,
+    prose around the object and trailing commas.
+    
+    Returns:
+        The parsed dictionary, or None if no object can be recovered
+    """
+    content = (llm_response or "").strip()
+    fence = _CODE_FENCE.search(content)
+    if fence:
+        content = fence.group(1).strip()
+    
+    candidates = [content]
+    start, end = content.find("{"), content.rfind("}")
+    if start != -1 and end > start and (start, end) != (0, len(content) - 1):
+        candidates.append(content[start:end + 1])
+    
+    for candidate in candidates:
+        for attempt in (candidate, _TRAILING_COMMA.sub(r"\1", candidate)):
+            try:
+                data = json.loads(attempt)
+            except ValueError:
+                continue
+            if isinstance(data, dict):
+                return data
+    return None
+
+
 def parse_llm_output(llm_response: str) -> Dict[str, Dict[str, Any]]:
     """
     Parse LLM JSON output
@@ -104,18 +151,112 @@ def parse_llm_output(llm_response: str) -> Dict[str, Dict[str, Any]]:
     Returns:
         Parsed dictionary or empty dict on failure
     """
+    return recover_json_object(llm_response) or {}
+
+
+def invoke_llm(agent, prompt, method: str):
+    """
+    Call agent.llm.invoke and record latency, token usage and errors
+    under the agent's class name and the calling method.
+    """
+    name = type(agent).__name__
+    start = time.perf_counter()
+    try:
+        response = agent.llm.invoke(prompt)
+    except Exception:
+        metrics.LLM_ERRORS.labels(name, method).inc()
+        raise
+    finally:
+        metrics.LLM_REQUEST_SECONDS.labels(name, method).observe(time.perf_counter() - start)
+    metrics.record_llm_usage(name, method, response)
+    return response
+
+
+def stream_llm(agent, prompt, method: str) -> Iterator:
+    """Streaming counterpart of invoke_llm (latency covers the whole stream)"""
+    name = type(agent).__name__
+    start = time.perf_counter()
+    try:
+        for chunk in agent.llm.stream(prompt):
+            metrics.record_llm_usage(name, method, chunk)
+            yield chunk
+    except Exception:
+        metrics.LLM_ERRORS.labels(name, method).inc()
+        raise
+    finally:
+        metrics.LLM_REQUEST_SECONDS.labels(name, method).observe(time.perf_counter() - start)
+
+
+async def ainvoke_llm(agent, prompt, method: str):
+    """Async counterpart of invoke_llm (LangChain ``ainvoke``)"""
+    name = type(agent).__name__
+    start = time.perf_counter()
     try:
-        # Clean markdown code blocks if present
-        content = llm_response.strip()
-        if content.startswith("```json"):
-            content = content.replace("```json", "").replace("```", "").strip()
-        elif content.startswith("```"):
-            content = content.replace("```", "").strip()
-        
-        data = json.loads(content)
-        return data if isinstance(data, dict) else {}
+        response = await agent.llm.ainvoke(prompt)
     except Exception:
-        return {}
+        metrics.LLM_ERRORS.labels(name, method).inc()
+        raise
+    finally:
+        metrics.LLM_REQUEST_SECONDS.labels(name, method).observe(time.perf_counter() - start)
+    metrics.record_llm_usage(name, method, response)
+    return response
+
+
+async def astream_llm(agent, prompt, method: str) -> AsyncIterator:
+    """Async counterpart of stream_llm (LangChain ``astream``)"""
+    name = type(agent).__name__
+    start = time.perf_counter()
+    try:
+        async for chunk in agent.llm.astream(prompt):
+            metrics.record_llm_usage(name, method, chunk)
+            yield chunk
+    except Exception:
+        metrics.LLM_ERRORS.labels(name, method).inc()
+        raise
+    finally:
+        metrics.LLM_REQUEST_SECONDS.labels(name, method).observe(time.perf_counter() - start)
+
+
+DEFAULT_ASYNC_CONCURRENCY = int(os.environ.get("MEDTWIN_LLM_ASYNC_CONCURRENCY", "32"))
+
+
+async def gather_bounded(aws: Iterable[Awaitable], limit: int = DEFAULT_ASYNC_CONCURRENCY,
+                         return_exceptions: bool = False) -> List:
+    """
+    asyncio.gather with at most `limit` awaitables running at once, e.g.
+    hundreds of agent coroutines on one event loop without flooding the provider:
+
+        results = await gather_bounded((agent.aanalyze(data) for data in batch), limit=50)
+
+    Results keep the input order. The limit counts awaitables, not LLM requests:
+    a concurrent-mode apredict_all issues two. The semaphore is created per call,
+    so it belongs to the running loop.
+    """
+    semaphore = asyncio.Semaphore(limit)
+
+    async def bounded(aw):
+        async with semaphore:
+            return await aw
+
+    return await asyncio.gather(*(bounded(aw) for aw in aws), return_exceptions=return_exceptions)
+
+
+def run_in_parallel(first, second):
+    """
+    Run two blocking calls (e.g. independent LLM requests) at the same time:
+    second on a helper thread, first on the calling thread.
+    
+    Returns:
+        (first(), second())
+    """
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix="llm") as pool:
+        second_future = pool.submit(second)
+        return first(), second_future.result()
+
+
+def record_fallback(agent, method: str):
+    """Count an agent result that was replaced by its default"""
+    metrics.LLM_FALLBACKS.labels(type(agent).__name__, method).inc()
 
 
 # ============================================================
@@ -187,9 +328,8 @@ class SymptomQAAgent:
             self.extracted_info["red_flag"] = text
             self.red_flag_detected = True
 
-    def llm_synonym_extract(self, text: str):
-        """Extract symptoms using LLM for better understanding"""
-        prompt = (
+    def _synonym_prompt(self, text: str) -> str:
+        return (
             "Extract all symptoms, medical concepts, and possible intent from this message.\n"
             "Return JSON ONLY with this structure:\n"
             "{\n"
@@ -203,8 +343,9 @@ class SymptomQAAgent:
             "}\n"
             f'Message: "{text}"'
         )
-        raw = self.llm.invoke(prompt).content.strip()
-        llm_data = parse_llm_output(raw)
+
+    def _store_synonyms(self, raw: str):
+        llm_data = parse_llm_output(raw.strip())
 
         for key, data in llm_data.items():
             if isinstance(data, dict):
@@ -216,31 +357,57 @@ class SymptomQAAgent:
                     "intent": data.get("Intent", "")
                 }
 
+    def llm_synonym_extract(self, text: str):
+        """Extract symptoms using LLM for better understanding"""
+        self._store_synonyms(invoke_llm(self, self._synonym_prompt(text), "llm_synonym_extract").content)
+
+    async def allm_synonym_extract(self, text: str):
+        """Async counterpart of llm_synonym_extract"""
+        self._store_synonyms((await ainvoke_llm(self, self._synonym_prompt(text), "llm_synonym_extract")).content)
+
     def extract_info_from_text(self, text: str):
         """Extract information using both rule-based and LLM methods"""
         self.rule_based_extract(text)
         self.llm_synonym_extract(text)
 
-    def llm_condition_guess(self, text: str) -> str | None:
-        """Use LLM to guess the medical condition"""
-        prompt = (
+    async def aextract_info_from_text(self, text: str):
+        """Async counterpart of extract_info_from_text"""
+        self.rule_based_extract(text)
+        await self.allm_synonym_extract(text)
+
+    def _condition_prompt(self, text: str) -> str:
+        return (
             "Classify the main condition in this message into exactly ONE of:\n"
             "diabetes, hypertension, heart_disease, copd, none.\n"
             'Return ONLY JSON: {"condition": "...", "reason": "..."}\n\n'
             f'Message: "{text}"'
         )
-        raw = self.llm.invoke(prompt).content.strip()
 
+    def _parse_condition(self, raw: str) -> str | None:
         try:
-            data = json.loads(raw)
+            data = json.loads(raw.strip())
             cond = data.get("condition", "none")
             allowed = {"diabetes", "hypertension", "heart_disease", "copd"}
             return cond if cond in allowed else None
         except Exception:
+            record_fallback(self, "llm_condition_guess")
             return None
 
-    def identify_condition(self, patient_input: str) -> str | None:
-        """Identify the medical condition from patient input"""
+    def llm_condition_guess(self, text: str) -> str | None:
+        """Use LLM to guess the medical condition"""
+        return self._parse_condition(invoke_llm(self, self._condition_prompt(text), "llm_condition_guess").content)
+
+    async def allm_condition_guess(self, text: str) -> str | None:
+        """Async counterpart of llm_condition_guess"""
+        return self._parse_condition((await ainvoke_llm(self, self._condition_prompt(text), "llm_condition_guess")).content)
+
+    def _rule_based_condition(self, patient_input: str):
+        """
+        Keyword rules of identify_condition
+
+        Returns:
+            (decided, condition) - decided is False when the LLM has to guess
+        """
         patient_lower = patient_input.lower()
 
         synonym_parts: List[str] = []
@@ -290,34 +457,51 @@ class SymptomQAAgent:
         # Priority: diabetes
         if has_diabetes and not (has_hypertension or has_heart or has_copd):
             self.condition_type = "diabetes"
-            return self.condition_type
+            return True, self.condition_type
 
         # Priority: hypertension
         if has_hypertension and not (has_diabetes or has_heart or has_copd):
             self.condition_type = "hypertension"
-            return self.condition_type
+            return True, self.condition_type
 
         # HEART vs COPD ambiguity
         if has_heart and has_copd and not (has_diabetes or has_hypertension):
             self.condition_type = None
             self.awaiting_disambiguation = True
             self.possible_conditions = ["heart_disease", "copd"]
-            return None
+            return True, None
 
         # Unambiguous heart
         if has_heart and not has_copd:
             self.condition_type = "heart_disease"
-            return self.condition_type
+            return True, self.condition_type
 
         # Unambiguous COPD
         if has_copd and not has_heart:
             self.condition_type = "copd"
-            return self.condition_type
+            return True, self.condition_type
+
+        return False, None
+
+    def identify_condition(self, patient_input: str) -> str | None:
+        """Identify the medical condition from patient input"""
+        decided, condition = self._rule_based_condition(patient_input)
+        if decided:
+            return condition
 
         # Fallback: LLM guess
         self.condition_type = self.llm_condition_guess(patient_input)
         return self.condition_type
 
+    async def aidentify_condition(self, patient_input: str) -> str | None:
+        """Async counterpart of identify_condition"""
+        decided, condition = self._rule_based_condition(patient_input)
+        if decided:
+            return condition
+
+        self.condition_type = await self.allm_condition_guess(patient_input)
+        return self.condition_type
+
     def get_disambiguation_question(self) -> str:
         """Get question to disambiguate between heart disease and COPD"""
         return (
@@ -389,11 +573,7 @@ class SymptomQAAgent:
         self.interview_complete = True
         return None
 
-    def chat(self, user_message: str, next_question: str | None = None) -> str:
-        """Process a chat message and return response"""
-        self.full_conversation.append(f"Patient: {user_message}")
-        self.extract_info_from_text(user_message)
-
+    def _record_turn(self, next_question: str | None) -> str:
         if next_question:
             response_text = next_question
         else:
@@ -402,11 +582,20 @@ class SymptomQAAgent:
         self.full_conversation.append(f"Agent: {response_text}")
         return response_text
 
-    def start_interview(self, initial_message: str) -> str:
-        """Start the medical interview"""
-        self.extract_info_from_text(initial_message)
-        self.identify_condition(initial_message)
+    def chat(self, user_message: str, next_question: str | None = None) -> str:
+        """Process a chat message and return response"""
+        self.full_conversation.append(f"Patient: {user_message}")
+        self.extract_info_from_text(user_message)
+        return self._record_turn(next_question)
+
+    async def achat(self, user_message: str, next_question: str | None = None) -> str:
+        """Async counterpart of chat"""
+        self.full_conversation.append(f"Patient: {user_message}")
+        await self.aextract_info_from_text(user_message)
+        return self._record_turn(next_question)
 
+    def _interview_opening(self, initial_message: str) -> str | None:
+        """Reply to the first message when it doesn't lead into the questions (None if it does)"""
         if self.awaiting_disambiguation and self.possible_conditions == ["heart_disease", "copd"]:
             question = self.get_disambiguation_question()
             self.full_conversation.append(f"Patient: {initial_message}")
@@ -418,28 +607,43 @@ class SymptomQAAgent:
             return "Sorry, I can only assist with diabetes, hypertension, heart disease, or COPD."
 
         self.current_question_index = 0
-        first_q = self.get_next_question()
-        return self.chat(initial_message, first_q)
+        return None
 
-    def continue_interview(self, patient_response: str) -> str:
-        """Continue the medical interview"""
-        if self.awaiting_disambiguation and self.possible_conditions == ["heart_disease", "copd"]:
-            chosen = self.handle_disambiguation_answer(patient_response)
+    def start_interview(self, initial_message: str) -> str:
+        """Start the medical interview"""
+        self.extract_info_from_text(initial_message)
+        self.identify_condition(initial_message)
 
-            if not chosen:
-                guess = self.llm_condition_guess(patient_response)
-                if guess in ["heart_disease", "copd"]:
-                    chosen = guess
-                else:
-                    chosen = "heart_disease"
+        opening = self._interview_opening(initial_message)
+        if opening is not None:
+            return opening
+        return self.chat(initial_message, self.get_next_question())
+
+    async def astart_interview(self, initial_message: str) -> str:
+        """Async counterpart of start_interview"""
+        await self.aextract_info_from_text(initial_message)
+        await self.aidentify_condition(initial_message)
+
+        opening = self._interview_opening(initial_message)
+        if opening is not None:
+            return opening
+        return await self.achat(initial_message, self.get_next_question())
 
-            self.condition_type = chosen
-            self.awaiting_disambiguation = False
-            self.current_question_index = 0
+    def _disambiguating(self) -> bool:
+        return self.awaiting_disambiguation and self.possible_conditions == ["heart_disease", "copd"]
 
-            next_q = self.get_next_question()
-            return self.chat(patient_response, next_q)
+    def _choose_condition(self, chosen: str | None, guess: str | None = None) -> str | None:
+        """Settle heart disease vs COPD and return the first question"""
+        if not chosen:
+            chosen = guess if guess in ["heart_disease", "copd"] else "heart_disease"
 
+        self.condition_type = chosen
+        self.awaiting_disambiguation = False
+        self.current_question_index = 0
+        return self.get_next_question()
+
+    def _record_answer(self, patient_response: str) -> str | None:
+        """Store the answer to the current question and return the next one"""
         if self.condition_type:
             qs = MEDICAL_QUESTIONS.get(self.condition_type, [])
             if 0 <= self.current_question_index < len(qs):
@@ -447,8 +651,25 @@ class SymptomQAAgent:
                 self.answers[prev_q] = patient_response
 
         self.current_question_index += 1
-        next_q = self.get_next_question()
-        return self.chat(patient_response, next_q)
+        return self.get_next_question()
+
+    def continue_interview(self, patient_response: str) -> str:
+        """Continue the medical interview"""
+        if self._disambiguating():
+            chosen = self.handle_disambiguation_answer(patient_response)
+            guess = None if chosen else self.llm_condition_guess(patient_response)
+            return self.chat(patient_response, self._choose_condition(chosen, guess))
+
+        return self.chat(patient_response, self._record_answer(patient_response))
+
+    async def acontinue_interview(self, patient_response: str) -> str:
+        """Async counterpart of continue_interview"""
+        if self._disambiguating():
+            chosen = self.handle_disambiguation_answer(patient_response)
+            guess = None if chosen else await self.allm_condition_guess(patient_response)
+            return await self.achat(patient_response, self._choose_condition(chosen, guess))
+
+        return await self.achat(patient_response, self._record_answer(patient_response))
 
     def get_collected_data(self) -> Dict[str, Any]:
         """Get all collected data from the interview"""
@@ -468,28 +689,55 @@ class AnalysisAgent:
     """
     Medical analysis agent that evaluates patient data and provides
     recommendations. For COPD, it uses the official GOLD 2026 ABE Assessment Tool.
+    
+    With bucketed=True (or MEDTWIN_NARRATIVE_BUCKETS=1) the LLM only sees qa_data
+    canonicalized into clinical buckets (qa_buckets), so similar patients share one
+    cached narrative, which is then filled in with each patient's exact values.
     """
     
-    def __init__(self, llm):
+    def __init__(self, llm, bucketed: bool = None):
         self.llm = llm
+        if bucketed is None:
+            bucketed = os.environ.get("MEDTWIN_NARRATIVE_BUCKETS", "0") == "1"
+        self.bucketed = bucketed
+
+    def _prompt_qa_data(self, condition: str, qa_data: Dict):
+        """(qa_data as the LLM sees it, placeholder values or None)"""
+        if not self.bucketed or condition == "copd":
+            return qa_data, None
+        from qa_buckets import bucket_qa_data
+        return bucket_qa_data(qa_data)
 
     def estimate_severity(self, qa_data: Dict) -> str:
         """Estimate severity of patient's condition"""
         return self._estimate_severity_llm(qa_data)
 
-    def _estimate_severity_llm(self, qa_data: Dict) -> str:
-        """Use LLM to estimate severity"""
-        prompt = (
+    async def aestimate_severity(self, qa_data: Dict) -> str:
+        """Async counterpart of estimate_severity"""
+        response = await ainvoke_llm(self, self._severity_prompt(qa_data), "_estimate_severity_llm")
+        return self._parse_severity(response.content)
+
+    def _severity_prompt(self, qa_data: Dict) -> str:
+        return (
             "You are a medical AI. Based on this patient data, classify severity as:\n"
             "LOW, MODERATE, HIGH, or CRITICAL.\n\n"
             "Return ONLY the severity level (one word).\n\n"
             f"Patient Data: {qa_data}"
         )
-        response = self.llm.invoke(prompt)
-        severity = response.content.strip().upper()
+
+    def _estimate_severity_llm(self, qa_data: Dict) -> str:
+        """Use LLM to estimate severity"""
+        response = invoke_llm(self, self._severity_prompt(qa_data), "_estimate_severity_llm")
+        return self._parse_severity(response.content)
+
+    def _parse_severity(self, content: str) -> str:
+        severity = content.strip().upper()
 
         valid = {"LOW", "MODERATE", "HIGH", "CRITICAL"}
-        return severity if severity in valid else "MODERATE"
+        if severity not in valid:
+            record_fallback(self, "_estimate_severity_llm")
+            return "MODERATE"
+        return severity
 
     def analyze_gold_copd(self, qa_data: Dict) -> Dict[str, str]:
         """
@@ -560,22 +808,27 @@ class AnalysisAgent:
             "treatment_guide": treatment
         }
 
-    def generate_recommendations(self, condition: str, qa_data: Dict, severity: str, gold_data: Dict = None) -> str:
-        """Generate medical recommendations"""
-        
-        # specific prompt for COPD with GOLD data
-        if condition == "copd" and gold_data:
-            return (
-                f"{gold_data['treatment_guide']}\n\n"
-                "**General Advice:**\n"
-                "1. **Smoking Cessation:** If you smoke, this is the single most important step.\n"
-                "2. **Vaccinations:** Ensure you have Flu, COVID-19, Pneumococcal, and RSV/Shingles vaccines.\n"
-                "3. **Inhaler Technique:** Correct use of your device is crucial. Ask your pharmacist to check.\n"
-                "4. **Activity:** Keep active. Walking 20-30 minutes daily is highly beneficial."
-            )
+    def _gold_recommendations(self, gold_data: Dict) -> str:
+        """Deterministic COPD recommendations from the GOLD assessment"""
+        return (
+            f"{gold_data['treatment_guide']}\n\n"
+            "**General Advice:**\n"
+            "1. **Smoking Cessation:** If you smoke, this is the single most important step.\n"
+            "2. **Vaccinations:** Ensure you have Flu, COVID-19, Pneumococcal, and RSV/Shingles vaccines.\n"
+            "3. **Inhaler Technique:** Correct use of your device is crucial. Ask your pharmacist to check.\n"
+            "4. **Activity:** Keep active. Walking 20-30 minutes daily is highly beneficial."
+        )
 
-        prompt = (
+    def _recommendations_prompt(self, condition: str, qa_data: Dict, severity: str, simulation_context: str = None,
+                                templated: bool = False) -> str:
+        """Build the recommendations prompt (shared by the blocking and streaming paths)"""
+        context = f"Context: {simulation_context}\n" if simulation_context else ""
+        if templated:
+            from qa_buckets import PLACEHOLDER_INSTRUCTIONS
+            context += PLACEHOLDER_INSTRUCTIONS + "\n"
+        return (
             f"You are a medical AI assistant. Generate recommendations for a patient with {condition}.\n"
+            f"{context}"
             f"Severity: {severity}\n"
             f"Patient Data: {qa_data}\n\n"
             "Provide:\n"
@@ -584,24 +837,165 @@ class AnalysisAgent:
             "3. When to seek medical help\n\n"
             "Be concise and clear."
         )
-        response = self.llm.invoke(prompt)
-        return response.content
 
-    def analyze(self, collected_data: Dict) -> Dict:
+    def generate_recommendations(self, condition: str, qa_data: Dict, severity: str, gold_data: Dict = None,
+                                 simulation_context: str = None, values: Dict[str, str] = None) -> str:
+        """
+        Generate medical recommendations
+        
+        values: placeholder values when qa_data is bucketed (see _prompt_qa_data)
+        """
+        
+        # specific prompt for COPD with GOLD data
+        if condition == "copd" and gold_data:
+            return self._gold_recommendations(gold_data)
+
+        prompt = self._recommendations_prompt(condition, qa_data, severity, simulation_context, templated=bool(values))
+        response = invoke_llm(self, prompt, "generate_recommendations")
+        return self._personalize(response.content, values)
+
+    async def agenerate_recommendations(self, condition: str, qa_data: Dict, severity: str, gold_data: Dict = None,
+                                        simulation_context: str = None, values: Dict[str, str] = None) -> str:
+        """Async counterpart of generate_recommendations"""
+        if condition == "copd" and gold_data:
+            return self._gold_recommendations(gold_data)
+
+        prompt = self._recommendations_prompt(condition, qa_data, severity, simulation_context, templated=bool(values))
+        response = await ainvoke_llm(self, prompt, "generate_recommendations")
+        return self._personalize(response.content, values)
+
+    @staticmethod
+    def _personalize(content: str, values: Optional[Dict[str, str]]) -> str:
+        """Fill bucketed placeholders with the patient's values"""
+        if values:
+            from qa_buckets import fill_placeholders
+            return fill_placeholders(content, values)
+        return content
+
+    def generate_recommendations_stream(self, condition: str, qa_data: Dict, severity: str, gold_data: Dict = None,
+                                        simulation_context: str = None, values: Dict[str, str] = None) -> Iterator[str]:
+        """
+        Streaming variant of generate_recommendations.
+        Yields text chunks as the LLM produces them (LangChain ``llm.stream``).
+        """
+        if condition == "copd" and gold_data:
+            yield self._gold_recommendations(gold_data)
+            return
+
+        prompt = self._recommendations_prompt(condition, qa_data, severity, simulation_context, templated=bool(values))
+        chunks = (chunk.content for chunk in stream_llm(self, prompt, "generate_recommendations_stream") if chunk.content)
+        if values:
+            from qa_buckets import fill_placeholders_stream
+            chunks = fill_placeholders_stream(chunks, values)
+        yield from chunks
+
+    async def agenerate_recommendations_stream(self, condition: str, qa_data: Dict, severity: str,
+                                               gold_data: Dict = None, simulation_context: str = None,
+                                               values: Dict[str, str] = None) -> AsyncIterator[str]:
+        """Async counterpart of generate_recommendations_stream (LangChain ``astream``)"""
+        if condition == "copd" and gold_data:
+            yield self._gold_recommendations(gold_data)
+            return
+
+        prompt = self._recommendations_prompt(condition, qa_data, severity, simulation_context, templated=bool(values))
+        chunks = (chunk.content async for chunk in astream_llm(self, prompt, "generate_recommendations_stream")
+                  if chunk.content)
+        if values:
+            from qa_buckets import afill_placeholders_stream
+            chunks = afill_placeholders_stream(chunks, values)
+        async for text in chunks:
+            yield text
+
+    def _assess(self, condition: str, qa_data: Dict):
+        """Return (severity, gold_result) for the collected data"""
+        if condition == "copd":
+            gold_result = self.analyze_gold_copd(qa_data)
+            return gold_result["severity"], gold_result
+        return self.estimate_severity(qa_data), None
+
+    async def _aassess(self, condition: str, qa_data: Dict):
+        """Async counterpart of _assess"""
+        if condition == "copd":
+            gold_result = self.analyze_gold_copd(qa_data)
+            return gold_result["severity"], gold_result
+        return await self.aestimate_severity(qa_data), None
+
+    def analyze_stream(self, collected_data: Dict, simulation_context: str = None) -> Iterator[str]:
+        """
+        Streaming variant of analyze: severity is estimated up front,
+        then the recommendations are yielded chunk by chunk.
+        """
+        _, chunks = self.analyze_with_stream(collected_data, simulation_context)
+        yield from chunks
+
+    def analyze_with_stream(self, collected_data: Dict, simulation_context: str = None) -> Tuple[Dict, Iterator[str]]:
+        """
+        analyze for UIs that render the recommendations as they arrive.
+
+        Returns:
+            (analysis, chunks) - the analyze() result with recommendations None
+            (severity is already estimated), and an iterator over the
+            recommendation text; the LLM call starts when it is first iterated.
+        """
+        condition = collected_data.get("condition_type", "unknown")
+        qa_data = collected_data.get("qa_data", {})
+        prompt_data, values = self._prompt_qa_data(condition, qa_data)
+
+        severity, gold_result = self._assess(condition, prompt_data)
+        analysis = {
+            "condition": condition,
+            "severity": severity,
+            "gold_group": gold_result.get("group") if gold_result else None,
+            "recommendations": None,
+            "qa_data": qa_data
+        }
+        chunks = self.generate_recommendations_stream(
+            condition, prompt_data, severity, gold_result, simulation_context=simulation_context, values=values
+        )
+        return analysis, chunks
+
+    def analyze(self, collected_data: Dict, simulation_context: str = None) -> Dict:
         """Analyze collected patient data"""
         condition = collected_data.get("condition_type", "unknown")
         qa_data = collected_data.get("qa_data", {})
+        prompt_data, values = self._prompt_qa_data(condition, qa_data)
         
-        gold_result = None
-        severity = "MODERATE"
+        severity, gold_result = self._assess(condition, prompt_data)
 
-        if condition == "copd":
-            gold_result = self.analyze_gold_copd(qa_data)
-            severity = gold_result["severity"]
-        else:
-            severity = self.estimate_severity(qa_data)
+        recommendations = self.generate_recommendations(
+            condition, prompt_data, severity, gold_result, simulation_context=simulation_context, values=values
+        )
 
-        recommendations = self.generate_recommendations(condition, qa_data, severity, gold_result)
+        return {
+            "condition": condition,
+            "severity": severity,
+            "gold_group": gold_result.get("group") if gold_result else None,
+            "recommendations": recommendations,
+            "qa_data": qa_data
+        }
+
+    async def aanalyze_stream(self, collected_data: Dict, simulation_context: str = None) -> AsyncIterator[str]:
+        """Async counterpart of analyze_stream"""
+        condition = collected_data.get("condition_type", "unknown")
+        prompt_data, values = self._prompt_qa_data(condition, collected_data.get("qa_data", {}))
+
+        severity, gold_result = await self._aassess(condition, prompt_data)
+        async for text in self.agenerate_recommendations_stream(
+            condition, prompt_data, severity, gold_result, simulation_context=simulation_context, values=values
+        ):
+            yield text
+
+    async def aanalyze(self, collected_data: Dict, simulation_context: str = None) -> Dict:
+        """Async counterpart of analyze"""
+        condition = collected_data.get("condition_type", "unknown")
+        qa_data = collected_data.get("qa_data", {})
+        prompt_data, values = self._prompt_qa_data(condition, qa_data)
+
+        severity, gold_result = await self._aassess(condition, prompt_data)
+
+        recommendations = await self.agenerate_recommendations(
+            condition, prompt_data, severity, gold_result, simulation_context=simulation_context, values=values
+        )
 
         return {
             "condition": condition,
@@ -616,18 +1010,52 @@ class AnalysisAgent:
 # AGENT 3: PLANNING AGENT
 # ============================================================
 
+PLAN_MODES = ("sequential", "concurrent", "fused")
+
+
 class PlanningAgent:
     """
     Medical planning agent that creates personalized treatment plans
     based on analysis results.
+    
+    mode (default MEDTWIN_PLAN_MODE, else "concurrent") selects how
+    create_comprehensive_plan calls the LLM:
+        sequential - short-term plan, then long-term plan (two round trips)
+        concurrent - the same two calls in parallel threads
+        fused      - one call returning both plans in a single JSON object
     """
     
-    def __init__(self, llm):
+    SHORT_TERM_DEFAULT = {
+        "daily_actions": ["Follow your prescribed medication schedule", "Monitor your symptoms daily"],
+        "monitoring": ["Track your vital signs", "Note any changes in symptoms"],
+        "red_flags": ["Severe worsening of symptoms", "New concerning symptoms"]
+    }
+    LONG_TERM_DEFAULT = {
+        "lifestyle_changes": ["Maintain a healthy diet", "Exercise regularly as advised"],
+        "follow_up_schedule": ["Schedule regular check-ups with your doctor"],
+        "goals": ["Improve overall health", "Manage condition effectively"]
+    }
+    
+    def __init__(self, llm, mode: str = None):
         self.llm = llm
+        self.mode = mode or os.environ.get("MEDTWIN_PLAN_MODE", "concurrent")
+        if self.mode not in PLAN_MODES:
+            raise ValueError(f"Unknown plan mode {self.mode!r} (expected one of {', '.join(PLAN_MODES)})")
     
-    def create_short_term_plan(self, condition: str, severity: str, qa_data: Dict) -> Dict[str, List[str]]:
-        """Create a short-term action plan (1-7 days)"""
-        prompt = (
+    @property
+    def llm_calls(self) -> int:
+        """LLM calls made by create_comprehensive_plan"""
+        return 1 if self.mode == "fused" else 2
+    
+    def _plan_sections(self, plan: Optional[Dict], default: Dict[str, List[str]], method: str) -> Dict[str, List[str]]:
+        """Pick the expected keys from a parsed plan, or fall back to the default plan"""
+        if not isinstance(plan, dict):
+            record_fallback(self, method)
+            return {key: list(items) for key, items in default.items()}
+        return {key: plan.get(key, []) for key in default}
+    
+    def _short_term_prompt(self, condition: str, severity: str, qa_data: Dict) -> str:
+        return (
             f"You are a medical AI creating a SHORT-TERM action plan (1-7 days) for a patient with {condition}.\\n"
             f"Severity: {severity}\\n"
             f"Patient Data: {qa_data}\\n\\n"
@@ -637,30 +1065,18 @@ class PlanningAgent:
             '"red_flags": ["warning sign1", "warning sign2", ...]}'
         )
         
-        response = self.llm.invoke(prompt)
-        try:
-            content = response.content.strip()
-            if content.startswith("```json"):
-                content = content.replace("```json", "").replace("```", "").strip()
-            elif content.startswith("```"):
-                content = content.replace("```", "").strip()
-            
-            plan = json.loads(content)
-            return {
-                "daily_actions": plan.get("daily_actions", []),
-                "monitoring": plan.get("monitoring", []),
-                "red_flags": plan.get("red_flags", [])
-            }
-        except Exception:
-            return {
-                "daily_actions": ["Follow your prescribed medication schedule", "Monitor your symptoms daily"],
-                "monitoring": ["Track your vital signs", "Note any changes in symptoms"],
-                "red_flags": ["Severe worsening of symptoms", "New concerning symptoms"]
-            }
+    def create_short_term_plan(self, condition: str, severity: str, qa_data: Dict) -> Dict[str, List[str]]:
+        """Create a short-term action plan (1-7 days)"""
+        response = invoke_llm(self, self._short_term_prompt(condition, severity, qa_data), "create_short_term_plan")
+        return self._plan_sections(recover_json_object(response.content), self.SHORT_TERM_DEFAULT, "create_short_term_plan")
     
-    def create_long_term_plan(self, condition: str, severity: str, qa_data: Dict) -> Dict[str, List[str]]:
-        """Create a long-term management plan (1-3 months)"""
-        prompt = (
+    async def acreate_short_term_plan(self, condition: str, severity: str, qa_data: Dict) -> Dict[str, List[str]]:
+        """Async counterpart of create_short_term_plan"""
+        response = await ainvoke_llm(self, self._short_term_prompt(condition, severity, qa_data), "create_short_term_plan")
+        return self._plan_sections(recover_json_object(response.content), self.SHORT_TERM_DEFAULT, "create_short_term_plan")
+
+    def _long_term_prompt(self, condition: str, severity: str, qa_data: Dict) -> str:
+        return (
             f"You are a medical AI creating a LONG-TERM management plan (1-3 months) for a patient with {condition}.\\n"
             f"Severity: {severity}\\n"
             f"Patient Data: {qa_data}\\n\\n"
@@ -670,36 +1086,66 @@ class PlanningAgent:
             '"goals": ["goal1", "goal2", ...]}'
         )
         
-        response = self.llm.invoke(prompt)
-        try:
-            content = response.content.strip()
-            if content.startswith("```json"):
-                content = content.replace("```json", "").replace("```", "").strip()
-            elif content.startswith("```"):
-                content = content.replace("```", "").strip()
-            
-            plan = json.loads(content)
-            return {
-                "lifestyle_changes": plan.get("lifestyle_changes", []),
-                "follow_up_schedule": plan.get("follow_up_schedule", []),
-                "goals": plan.get("goals", [])
-            }
-        except Exception:
-            return {
-                "lifestyle_changes": ["Maintain a healthy diet", "Exercise regularly as advised"],
-                "follow_up_schedule": ["Schedule regular check-ups with your doctor"],
-                "goals": ["Improve overall health", "Manage condition effectively"]
-            }
+    def create_long_term_plan(self, condition: str, severity: str, qa_data: Dict) -> Dict[str, List[str]]:
+        """Create a long-term management plan (1-3 months)"""
+        response = invoke_llm(self, self._long_term_prompt(condition, severity, qa_data), "create_long_term_plan")
+        return self._plan_sections(recover_json_object(response.content), self.LONG_TERM_DEFAULT, "create_long_term_plan")
     
-    def create_comprehensive_plan(self, analysis_result: Dict) -> Dict[str, Any]:
-        """Create a comprehensive treatment plan combining short and long-term strategies"""
-        condition = analysis_result.get("condition", "unknown")
-        severity = analysis_result.get("severity", "MODERATE")
-        qa_data = analysis_result.get("qa_data", {})
+    async def acreate_long_term_plan(self, condition: str, severity: str, qa_data: Dict) -> Dict[str, List[str]]:
+        """Async counterpart of create_long_term_plan"""
+        response = await ainvoke_llm(self, self._long_term_prompt(condition, severity, qa_data), "create_long_term_plan")
+        return self._plan_sections(recover_json_object(response.content), self.LONG_TERM_DEFAULT, "create_long_term_plan")
         
-        short_term = self.create_short_term_plan(condition, severity, qa_data)
-        long_term = self.create_long_term_plan(condition, severity, qa_data)
+    def _fused_plan_prompt(self, condition: str, severity: str, qa_data: Dict) -> str:
+        return (
+            f"You are a medical AI creating a treatment plan for a patient with {condition}: "
+            "a SHORT-TERM action plan (1-7 days) and a LONG-TERM management plan (1-3 months).\n"
+            f"Severity: {severity}\n"
+            f"Patient Data: {qa_data}\n\n"
+            "Return ONLY a JSON object with these keys:\n"
+            '{"short_term_plan": {"daily_actions": ["action1", "action2", ...], '
+            '"monitoring": ["what to monitor1", "what to monitor2", ...], '
+            '"red_flags": ["warning sign1", "warning sign2", ...]}, '
+            '"long_term_plan": {"lifestyle_changes": ["change1", "change2", ...], '
+            '"follow_up_schedule": ["appointment1", "appointment2", ...], '
+            '"goals": ["goal1", "goal2", ...]}}'
+        )
         
+    def create_fused_plan(self, condition: str, severity: str, qa_data: Dict):
+        """
+        Create both plans with a single LLM call
+
+        Returns:
+            (short_term_plan, long_term_plan)
+        """
+        response = invoke_llm(self, self._fused_plan_prompt(condition, severity, qa_data), "create_fused_plan")
+        return self._parse_fused_plan(response.content)
+
+    async def acreate_fused_plan(self, condition: str, severity: str, qa_data: Dict):
+        """Async counterpart of create_fused_plan"""
+        response = await ainvoke_llm(self, self._fused_plan_prompt(condition, severity, qa_data), "create_fused_plan")
+        return self._parse_fused_plan(response.content)
+
+    def _parse_fused_plan(self, content: str):
+        data = recover_json_object(content) or {}
+        # Models sometimes drop the nesting and return the six lists at the top level
+        short_term = data.get("short_term_plan", data if "daily_actions" in data else None)
+        long_term = data.get("long_term_plan", data if "lifestyle_changes" in data else None)
+        return (
+            self._plan_sections(short_term, self.SHORT_TERM_DEFAULT, "create_fused_plan"),
+            self._plan_sections(long_term, self.LONG_TERM_DEFAULT, "create_fused_plan")
+        )
+    
+    @staticmethod
+    def _plan_inputs(analysis_result: Dict):
+        return (
+            analysis_result.get("condition", "unknown"),
+            analysis_result.get("severity", "MODERATE"),
+            analysis_result.get("qa_data", {})
+        )
+
+    @staticmethod
+    def _comprehensive_plan(condition: str, severity: str, short_term: Dict, long_term: Dict) -> Dict[str, Any]:
         return {
             "condition": condition,
             "severity": severity,
@@ -708,6 +1154,40 @@ class PlanningAgent:
             "created_at": "now"
         }
 
+    def create_comprehensive_plan(self, analysis_result: Dict) -> Dict[str, Any]:
+        """Create a comprehensive treatment plan combining short and long-term strategies"""
+        condition, severity, qa_data = self._plan_inputs(analysis_result)
+        
+        if self.mode == "fused":
+            short_term, long_term = self.create_fused_plan(condition, severity, qa_data)
+        elif self.mode == "concurrent":
+            short_term, long_term = run_in_parallel(
+                lambda: self.create_short_term_plan(condition, severity, qa_data),
+                lambda: self.create_long_term_plan(condition, severity, qa_data)
+            )
+        else:
+            short_term = self.create_short_term_plan(condition, severity, qa_data)
+            long_term = self.create_long_term_plan(condition, severity, qa_data)
+        
+        return self._comprehensive_plan(condition, severity, short_term, long_term)
+
+    async def acreate_comprehensive_plan(self, analysis_result: Dict) -> Dict[str, Any]:
+        """Async counterpart of create_comprehensive_plan (concurrent mode uses asyncio.gather)"""
+        condition, severity, qa_data = self._plan_inputs(analysis_result)
+
+        if self.mode == "fused":
+            short_term, long_term = await self.acreate_fused_plan(condition, severity, qa_data)
+        elif self.mode == "concurrent":
+            short_term, long_term = await asyncio.gather(
+                self.acreate_short_term_plan(condition, severity, qa_data),
+                self.acreate_long_term_plan(condition, severity, qa_data)
+            )
+        else:
+            short_term = await self.acreate_short_term_plan(condition, severity, qa_data)
+            long_term = await self.acreate_long_term_plan(condition, severity, qa_data)
+
+        return self._comprehensive_plan(condition, severity, short_term, long_term)
+
 
 
 
@@ -782,7 +1262,42 @@ class NotifierAgent:
         if not medications:
             return "No medications scheduled."
         
-        prompt = f"""
+        response = invoke_llm(self, self._schedule_prompt(medications), "create_medication_schedule")
+        return response.content
+
+    async def acreate_medication_schedule(self, medications: List[Dict[str, Any]]) -> str:
+        """Async counterpart of create_medication_schedule"""
+        if not medications:
+            return "No medications scheduled."
+
+        response = await ainvoke_llm(self, self._schedule_prompt(medications), "create_medication_schedule")
+        return response.content
+
+    def create_medication_schedule_stream(self, medications: List[Dict[str, Any]]) -> Iterator[str]:
+        """
+        Streaming variant of create_medication_schedule.
+        Yields text chunks as the LLM produces them (LangChain ``llm.stream``).
+        """
+        if not medications:
+            yield "No medications scheduled."
+            return
+
+        for chunk in stream_llm(self, self._schedule_prompt(medications), "create_medication_schedule_stream"):
+            if chunk.content:
+                yield chunk.content
+
+    async def acreate_medication_schedule_stream(self, medications: List[Dict[str, Any]]) -> AsyncIterator[str]:
+        """Async counterpart of create_medication_schedule_stream (LangChain ``astream``)"""
+        if not medications:
+            yield "No medications scheduled."
+            return
+
+        async for chunk in astream_llm(self, self._schedule_prompt(medications), "create_medication_schedule_stream"):
+            if chunk.content:
+                yield chunk.content
+
+    def _schedule_prompt(self, medications: List[Dict[str, Any]]) -> str:
+        return f"""
         You are a medical AI assistant. Create a clear, patient-friendly medication schedule.
         
         Medications: {medications}
@@ -806,9 +1321,6 @@ class NotifierAgent:
         
         Make it clear, organized, and easy to follow.
         """
-        
-        response = self.llm.invoke(prompt)
-        return response.content
     
     def generate_reminder_message(self, medication: Dict[str, Any]) -> str:
         """
@@ -897,7 +1409,16 @@ class NotifierAgent:
         Returns:
             Notification schedule and reminders
         """
-        prompt = f"""
+        response = invoke_llm(self, self._notification_prompt(treatment_plan), "create_notification_plan")
+        return self._parse_notification_plan(response.content)
+
+    async def acreate_notification_plan(self, treatment_plan: Dict[str, Any]) -> Dict[str, Any]:
+        """Async counterpart of create_notification_plan"""
+        response = await ainvoke_llm(self, self._notification_prompt(treatment_plan), "create_notification_plan")
+        return self._parse_notification_plan(response.content)
+
+    def _notification_prompt(self, treatment_plan: Dict[str, Any]) -> str:
+        return f"""
         You are a medical AI creating a notification and reminder plan.
         
         Treatment Plan: {treatment_plan}
@@ -925,23 +1446,17 @@ class NotifierAgent:
         }}
         """
         
-        response = self.llm.invoke(prompt)
-        try:
-            content = response.content.strip()
-            if content.startswith("```json"):
-                content = content.replace("```json", "").replace("```", "").strip()
-            elif content.startswith("```"):
-                content = content.replace("```", "").strip()
-            
-            plan = json.loads(content)
-            return plan
-        except Exception:
+    def _parse_notification_plan(self, content: str) -> Dict[str, Any]:
+        plan = recover_json_object(content)
+        if plan is None:
+            record_fallback(self, "create_notification_plan")
             return {
                 "medication_reminders": [],
                 "monitoring_reminders": [],
                 "appointment_reminders": [],
                 "lifestyle_reminders": []
             }
+        return plan
 
 
 # ============================================================
@@ -962,44 +1477,216 @@ class LabResultsAgent:
     def __init__(self, llm):
         self.llm = llm
 
-    def analyze_lab_report(self, report_text: str, condition: str = "general") -> Dict[str, Any]:
+    def analyze_lab_report(self, report_text: str, condition: str = "general",
+                           narrative: bool = True) -> Dict[str, Any]:
         """
         Analyze the text content of a lab report.
+
+        Result lines ("- Hemoglobin: 14.2 g/dL (Reference: 13.5-17.5)") are parsed
+        and flagged locally by lab_parser. The LLM only sees the lines the parser
+        could not read, plus a compact summary for the patient-facing narrative
+        (skipped when narrative=False).
         """
-        prompt = (
-            f"You are a helpful Medical AI Agent. Analyze this lab report for a patient with: {condition}.\n"
-            f"Lab Report Text:\n{report_text}\n\n"
-            "Task:\n"
-            "1. Identify key biomarkers and their values.\n"
-            "2. Flag anything OUTSIDE the normal reference range (High/Low).\n"
-            "3. Explain what these mean in simple, patient-friendly language.\n"
-            "4. Provide a 'Actionable Advice' summary.\n\n"
+        report = parse_lab_report(report_text)
+        records = list(report.records)
+
+        if report.unparsed:
+            records.extend(self._extract_unparsed(report.unparsed))
+
+        abnormal = [r for r in records if r.flag in ("LOW", "HIGH")]
+        story = self._narrate(records, abnormal, report.metadata, condition) if narrative else {}
+        return self._lab_report_result(report, records, abnormal, story)
+
+    async def aanalyze_lab_report(self, report_text: str, condition: str = "general",
+                                  narrative: bool = True) -> Dict[str, Any]:
+        """Async counterpart of analyze_lab_report"""
+        report = parse_lab_report(report_text)
+        records = list(report.records)
+
+        if report.unparsed:
+            records.extend(await self._aextract_unparsed(report.unparsed))
+
+        abnormal = [r for r in records if r.flag in ("LOW", "HIGH")]
+        story = await self._anarrate(records, abnormal, report.metadata, condition) if narrative else {}
+        return self._lab_report_result(report, records, abnormal, story)
+
+    def _lab_report_result(self, report, records, abnormal, story: Dict[str, Any]) -> Dict[str, Any]:
+        result = {
+            "summary": "",
+            "abnormalities": [r.describe() for r in abnormal],
+            "detailed_analysis": "",
+            "action_items": [],
+            "results": [r.to_dict() for r in records],
+            "metadata": report.metadata,
+            "parsed_locally": len(report.records),
+            "parsed_by_llm": len(records) - len(report.records)
+        }
+
+        if not story:
+            story = self._default_narrative(records, abnormal)
+        result.update({key: story[key] for key in ("summary", "detailed_analysis", "action_items") if story.get(key)})
+        return result
+
+    @staticmethod
+    def _extract_prompt(lines) -> Optional[str]:
+        # Free text without any number (notes, comments) has no values to extract
+        lines = [(number, text) for number, text in lines if re.search(r"\d", text)]
+        if not lines:
+            return None
+
+        return (
+            "Extract lab results from these lines of a lab report. Ignore lines that are not results.\n"
+            + "\n".join(text for _, text in lines) + "\n\n"
+            "Return ONLY JSON:\n"
+            '{"results": [{"name": "...", "value": 0.0, "unit": "...", "ref_low": null, "ref_high": null, '
+            '"flag": "LOW|NORMAL|HIGH|UNKNOWN"}]}'
+        )
+
+    def _extract_unparsed(self, lines) -> List:
+        """Ask the LLM to read only the lines the rule-based parser couldn't"""
+        prompt = self._extract_prompt(lines)
+        if prompt is None:
+            return []
+        return self._parse_extracted(invoke_llm(self, prompt, "extract_lab_lines").content)
+
+    async def _aextract_unparsed(self, lines) -> List:
+        """Async counterpart of _extract_unparsed"""
+        prompt = self._extract_prompt(lines)
+        if prompt is None:
+            return []
+        return self._parse_extracted((await ainvoke_llm(self, prompt, "extract_lab_lines")).content)
+
+    def _parse_extracted(self, content: str) -> List:
+        extracted = parse_llm_output(content).get("results")
+        if not isinstance(extracted, list):
+            record_fallback(self, "extract_lab_lines")
+            return []
+
+        records = []
+        for item in extracted:
+            try:
+                name = str(item["name"])
+                records.append(LabRecord(
+                    analyte=canonical_analyte(name) or name,
+                    value=float(item["value"]),
+                    unit=str(item.get("unit") or ""),
+                    ref_low=item.get("ref_low"),
+                    ref_high=item.get("ref_high"),
+                    flag=str(item.get("flag") or "UNKNOWN").upper(),
+                    name=name
+                ))
+            except (KeyError, TypeError, ValueError):
+                continue
+        return records
+
+    @staticmethod
+    def _narrative_prompt(records, abnormal, metadata: Dict, condition: str) -> str:
+        normal = [r.analyte for r in records if r.flag == "NORMAL"]
+        return (
+            f"You are a helpful Medical AI Agent. Explain these lab results to a patient with: {condition}.\n"
+            f"Abnormal results: {[r.describe() for r in abnormal] or 'none'}\n"
+            f"Normal results: {', '.join(normal) or 'none'}\n"
+            f"Report notes: {metadata.get('Notes', 'none')}\n\n"
+            "Use simple, patient-friendly language.\n"
             "Return JSON with keys:\n"
             "- 'summary': (String) Brief overview (e.g., 'Your kidney function looks normal, but cholesterol is high').\n"
-            "- 'abnormalities': (List of Strings) E.g. ['Glucose: 150 mg/dL (High)', 'Iron: Low'].\n"
             "- 'detailed_analysis': (String) The full explanation.\n"
             "- 'action_items': (List of Strings) What to do next."
         )
-        
-        response = self.llm.invoke(prompt)
-        return parse_llm_output(response.content)
+
+    def _narrate(self, records, abnormal, metadata: Dict, condition: str) -> Dict[str, Any]:
+        """Patient-facing explanation written from the structured results, not the raw report"""
+        if not records:
+            return {}
+        prompt = self._narrative_prompt(records, abnormal, metadata, condition)
+        return self._parse_narrative(invoke_llm(self, prompt, "analyze_lab_report").content)
+
+    async def _anarrate(self, records, abnormal, metadata: Dict, condition: str) -> Dict[str, Any]:
+        """Async counterpart of _narrate"""
+        if not records:
+            return {}
+        prompt = self._narrative_prompt(records, abnormal, metadata, condition)
+        return self._parse_narrative((await ainvoke_llm(self, prompt, "analyze_lab_report")).content)
+
+    def _parse_narrative(self, content: str) -> Dict[str, Any]:
+        story = parse_llm_output(content)
+        if not story:
+            record_fallback(self, "analyze_lab_report")
+        return story
+
+    @staticmethod
+    def _default_narrative(records, abnormal) -> Dict[str, Any]:
+        """Plain summary from the parsed results when the LLM narrative is unavailable"""
+        if not records:
+            return {
+                "summary": "No lab results could be read from this report.",
+                "detailed_analysis": "",
+                "action_items": ["Share the report with your doctor for review."]
+            }
+        if not abnormal:
+            summary = f"All {len(records)} results are within their reference ranges."
+        else:
+            summary = f"{len(abnormal)} of {len(records)} results are outside their reference ranges: " \
+                      + ", ".join(r.analyte for r in abnormal) + "."
+        return {
+            "summary": summary,
+            "detailed_analysis": "\n".join(r.describe() for r in records),
+            "action_items": [f"Discuss your {r.analyte} ({r.flag.lower()}) with your doctor." for r in abnormal]
+                            or ["Keep up your current routine and repeat labs as scheduled."]
+        }
 
 # ============================================================
 # AGENT 6: PREDICTION AGENT
 # ============================================================
 
+PREDICTION_MODES = ("sequential", "concurrent", "fused")
+
+
 class PredictionAgent:
     """
     Medical prediction agent that forecasts disease progression and
     organ impact based on patient data.
+    
+    mode (default MEDTWIN_PREDICTION_MODE, else "concurrent") selects how
+    predict_all calls the LLM:
+        sequential - progression, then organ impact (two round trips)
+        concurrent - the same two calls in parallel threads
+        fused      - one call returning both sections in a single JSON object
+    Concurrent is fastest, as output decoding dominates; fused sends qa_data once
+    and halves the calls (bench_agent_modes.py). Use concurrent where a provider's
+    answers to the combined prompt are worse.
     """
     
-    def __init__(self, llm):
+    PROGRESSION_DEFAULT = {
+        "worsening": False,
+        "progression_forecast": "Unable to predict progression at this time.",
+        "risk_factors": []
+    }
+    ORGAN_IMPACT_DEFAULT = {
+        "affected_organs": [],
+        "systemic_risks": "Unable to assess systemic risks."
+    }
+    
+    def __init__(self, llm, mode: str = None):
         self.llm = llm
+        self.mode = mode or os.environ.get("MEDTWIN_PREDICTION_MODE", "concurrent")
+        if self.mode not in PREDICTION_MODES:
+            raise ValueError(f"Unknown prediction mode {self.mode!r} (expected one of {', '.join(PREDICTION_MODES)})")
     
-    def predict_progression(self, condition: str, qa_data: Dict, current_severity: str) -> Dict[str, Any]:
-        """Predict if the case is worsening and how it might progress"""
-        prompt = (
+    @property
+    def llm_calls(self) -> int:
+        """LLM calls made by predict_all"""
+        return 1 if self.mode == "fused" else 2
+    
+    def _prediction(self, prediction: Optional[Dict], default: Dict[str, Any], method: str) -> Dict[str, Any]:
+        """A parsed prediction as returned by the model, or the default one"""
+        if not isinstance(prediction, dict):
+            record_fallback(self, method)
+            return dict(default)
+        return prediction
+    
+    def _progression_prompt(self, condition: str, qa_data: Dict, current_severity: str) -> str:
+        return (
             f"You are a medical AI specializing in disease progression. Analyze this case:\\n"
             f"Condition: {condition}\\n"
             f"Current Severity: {current_severity}\\n"
@@ -1010,25 +1697,20 @@ class PredictionAgent:
             '{"worsening": true/false, "progression_forecast": "...", "risk_factors": ["...", "..."]}'
         )
         
-        response = self.llm.invoke(prompt)
-        try:
-            content = response.content.strip()
-            if content.startswith("```json"):
-                content = content.replace("```json", "").replace("```", "").strip()
-            elif content.startswith("```"):
-                content = content.replace("```", "").strip()
-            
-            return json.loads(content)
-        except Exception:
-            return {
-                "worsening": False,
-                "progression_forecast": "Unable to predict progression at this time.",
-                "risk_factors": []
-            }
+    def predict_progression(self, condition: str, qa_data: Dict, current_severity: str) -> Dict[str, Any]:
+        """Predict if the case is worsening and how it might progress"""
+        prompt = self._progression_prompt(condition, qa_data, current_severity)
+        response = invoke_llm(self, prompt, "predict_progression")
+        return self._prediction(recover_json_object(response.content), self.PROGRESSION_DEFAULT, "predict_progression")
 
-    def predict_organ_impact(self, condition: str, qa_data: Dict) -> Dict[str, Any]:
-        """Predict which organs are likely to be affected"""
-        prompt = (
+    async def apredict_progression(self, condition: str, qa_data: Dict, current_severity: str) -> Dict[str, Any]:
+        """Async counterpart of predict_progression"""
+        prompt = self._progression_prompt(condition, qa_data, current_severity)
+        response = await ainvoke_llm(self, prompt, "predict_progression")
+        return self._prediction(recover_json_object(response.content), self.PROGRESSION_DEFAULT, "predict_progression")
+
+    def _organ_impact_prompt(self, condition: str, qa_data: Dict) -> str:
+        return (
             f"You are a medical AI. For a patient with {condition} and the following symptoms:\\n"
             f"Patient Data: {qa_data}\\n\\n"
             "Identify which specific organs are at risk or already affected.\\n"
@@ -1037,20 +1719,80 @@ class PredictionAgent:
             '"systemic_risks": "..."}'
         )
         
-        response = self.llm.invoke(prompt)
-        try:
-            content = response.content.strip()
-            if content.startswith("```json"):
-                content = content.replace("```json", "").replace("```", "").strip()
-            elif content.startswith("```"):
-                content = content.replace("```", "").strip()
-            
-            return json.loads(content)
-        except Exception:
-            return {
-                "affected_organs": [],
-                "systemic_risks": "Unable to assess systemic risks."
-            }
+    def predict_organ_impact(self, condition: str, qa_data: Dict) -> Dict[str, Any]:
+        """Predict which organs are likely to be affected"""
+        response = invoke_llm(self, self._organ_impact_prompt(condition, qa_data), "predict_organ_impact")
+        return self._prediction(recover_json_object(response.content), self.ORGAN_IMPACT_DEFAULT, "predict_organ_impact")
+
+    async def apredict_organ_impact(self, condition: str, qa_data: Dict) -> Dict[str, Any]:
+        """Async counterpart of predict_organ_impact"""
+        response = await ainvoke_llm(self, self._organ_impact_prompt(condition, qa_data), "predict_organ_impact")
+        return self._prediction(recover_json_object(response.content), self.ORGAN_IMPACT_DEFAULT, "predict_organ_impact")
+        
+    def _fused_prompt(self, condition: str, qa_data: Dict, current_severity: str) -> str:
+        return (
+            "You are a medical AI specializing in disease progression. Analyze this case:\n"
+            f"Condition: {condition}\n"
+            f"Current Severity: {current_severity}\n"
+            f"Patient Data: {qa_data}\n\n"
+            "1. Predict the likely progression of this condition if untreated or if current trends continue, "
+            "and assess if the case is currently worsening based on the symptoms provided.\n"
+            "2. Identify which specific organs are at risk or already affected.\n"
+            "Return ONLY JSON:\n"
+            '{"progression": {"worsening": true/false, "progression_forecast": "...", "risk_factors": ["...", "..."]}, '
+            '"organ_impact": {"affected_organs": [{"organ": "...", "risk_level": "...", "impact_description": "..."}], '
+            '"systemic_risks": "..."}}'
+        )
+        
+    def predict_fused(self, condition: str, qa_data: Dict, current_severity: str):
+        """
+        Progression and organ impact from a single LLM call
+
+        Returns:
+            (progression, organ_impact)
+        """
+        response = invoke_llm(self, self._fused_prompt(condition, qa_data, current_severity), "predict_fused")
+        return self._parse_fused(response.content)
+
+    async def apredict_fused(self, condition: str, qa_data: Dict, current_severity: str):
+        """Async counterpart of predict_fused"""
+        response = await ainvoke_llm(self, self._fused_prompt(condition, qa_data, current_severity), "predict_fused")
+        return self._parse_fused(response.content)
+
+    def _parse_fused(self, content: str):
+        data = recover_json_object(content) or {}
+        return (
+            self._prediction(data.get("progression"), self.PROGRESSION_DEFAULT, "predict_fused"),
+            self._prediction(data.get("organ_impact"), self.ORGAN_IMPACT_DEFAULT, "predict_fused")
+        )
+
+    def predict_all(self, condition: str, qa_data: Dict, current_severity: str):
+        """
+        Progression and organ impact, using the agent's mode
+        
+        Returns:
+            (progression, organ_impact)
+        """
+        if self.mode == "fused":
+            return self.predict_fused(condition, qa_data, current_severity)
+        if self.mode == "concurrent":
+            return run_in_parallel(
+                lambda: self.predict_progression(condition, qa_data, current_severity),
+                lambda: self.predict_organ_impact(condition, qa_data)
+            )
+        return self.predict_progression(condition, qa_data, current_severity), self.predict_organ_impact(condition, qa_data)
+
+    async def apredict_all(self, condition: str, qa_data: Dict, current_severity: str):
+        """Async counterpart of predict_all (concurrent mode uses asyncio.gather)"""
+        if self.mode == "fused":
+            return await self.apredict_fused(condition, qa_data, current_severity)
+        if self.mode == "concurrent":
+            return tuple(await asyncio.gather(
+                self.apredict_progression(condition, qa_data, current_severity),
+                self.apredict_organ_impact(condition, qa_data)
+            ))
+        return (await self.apredict_progression(condition, qa_data, current_severity),
+                await self.apredict_organ_impact(condition, qa_data))
 
     def generate_comprehensive_prediction(self, analysis_result: Dict) -> Dict[str, Any]:
         """Generate a complete prediction report"""
@@ -1058,9 +1800,20 @@ class PredictionAgent:
         severity = analysis_result.get("severity", "MODERATE")
         qa_data = analysis_result.get("qa_data", {})
         
-        progression = self.predict_progression(condition, qa_data, severity)
-        organ_impact = self.predict_organ_impact(condition, qa_data)
+        progression, organ_impact = self.predict_all(condition, qa_data, severity)
+        return self._prediction_report(progression, organ_impact)
         
+    async def agenerate_comprehensive_prediction(self, analysis_result: Dict) -> Dict[str, Any]:
+        """Async counterpart of generate_comprehensive_prediction"""
+        condition = analysis_result.get("condition", "unknown")
+        severity = analysis_result.get("severity", "MODERATE")
+        qa_data = analysis_result.get("qa_data", {})
+
+        progression, organ_impact = await self.apredict_all(condition, qa_data, severity)
+        return self._prediction_report(progression, organ_impact)
+
+    @staticmethod
+    def _prediction_report(progression: Dict[str, Any], organ_impact: Dict[str, Any]) -> Dict[str, Any]:
         return {
             "prediction_type": "progression_and_impact",
             "worsening_prediction": progression,
@@ -1092,7 +1845,15 @@ class CoordinatorAgent:
         
         # Start interview with QA Agent
         response = self.qa_agent.start_interview(initial_message)
+        return self._interview_started(response)
         
+    async def astart_consultation(self, initial_message: str) -> Dict[str, Any]:
+        """Async counterpart of start_consultation"""
+        self.workflow_state = "interviewing"
+        response = await self.qa_agent.astart_interview(initial_message)
+        return self._interview_started(response)
+
+    def _interview_started(self, response: str) -> Dict[str, Any]:
         return {
             "status": "interview_started",
             "workflow_state": self.workflow_state,
@@ -1100,17 +1861,31 @@ class CoordinatorAgent:
             "interview_complete": self.qa_agent.interview_complete
         }
     
+    @staticmethod
+    def _state_error(message: str) -> Dict[str, Any]:
+        return {
+            "status": "error",
+            "message": message
+        }
+
     def continue_consultation(self, patient_response: str) -> Dict[str, Any]:
         """Continue the consultation with patient's response"""
         if self.workflow_state != "interviewing":
-            return {
-                "status": "error",
-                "message": "Consultation not in interview state"
-            }
+            return self._state_error("Consultation not in interview state")
         
         # Continue interview
         response = self.qa_agent.continue_interview(patient_response)
+        return self._interview_progress(response)
         
+    async def acontinue_consultation(self, patient_response: str) -> Dict[str, Any]:
+        """Async counterpart of continue_consultation"""
+        if self.workflow_state != "interviewing":
+            return self._state_error("Consultation not in interview state")
+
+        response = await self.qa_agent.acontinue_interview(patient_response)
+        return self._interview_progress(response)
+
+    def _interview_progress(self, response: str) -> Dict[str, Any]:
         # Check if interview is complete
         if self.qa_agent.interview_complete:
             self.workflow_state = "analyzing"
@@ -1131,18 +1906,22 @@ class CoordinatorAgent:
     def perform_analysis(self) -> Dict[str, Any]:
         """Perform medical analysis on collected data"""
         if self.workflow_state != "analyzing":
-            return {
-                "status": "error",
-                "message": "Workflow not ready for analysis"
-            }
+            return self._state_error("Workflow not ready for analysis")
         
-        # Get collected data from QA agent
-        collected_data = self.qa_agent.get_collected_data()
+        # Get collected data from QA agent and perform analysis
+        analysis = self.analysis_agent.analyze(self.qa_agent.get_collected_data())
+        return self._analysis_complete(analysis)
         
-        # Perform analysis
-        analysis = self.analysis_agent.analyze(collected_data)
+    async def aperform_analysis(self) -> Dict[str, Any]:
+        """Async counterpart of perform_analysis"""
+        if self.workflow_state != "analyzing":
+            return self._state_error("Workflow not ready for analysis")
+
+        analysis = await self.analysis_agent.aanalyze(self.qa_agent.get_collected_data())
+        return self._analysis_complete(analysis)
+
+    def _analysis_complete(self, analysis: Dict[str, Any]) -> Dict[str, Any]:
         self.results["analysis"] = analysis
-        
         self.workflow_state = "planning"
         
         return {
@@ -1151,24 +1930,35 @@ class CoordinatorAgent:
             "analysis": analysis
         }
     
-    def create_treatment_plan(self) -> Dict[str, Any]:
-        """Create a comprehensive treatment plan"""
+    def _planning_error(self) -> Optional[Dict[str, Any]]:
         if self.workflow_state != "planning":
-            return {
-                "status": "error",
-                "message": "Workflow not ready for planning"
-            }
-        
+            return self._state_error("Workflow not ready for planning")
+
         if "analysis" not in self.results:
-            return {
-                "status": "error",
-                "message": "Analysis must be performed before planning"
-            }
+            return self._state_error("Analysis must be performed before planning")
+        return None
+
+    def create_treatment_plan(self) -> Dict[str, Any]:
+        """Create a comprehensive treatment plan"""
+        error = self._planning_error()
+        if error:
+            return error
         
         # Create comprehensive plan
         plan = self.planning_agent.create_comprehensive_plan(self.results["analysis"])
+        return self._plan_complete(plan)
+
+    async def acreate_treatment_plan(self) -> Dict[str, Any]:
+        """Async counterpart of create_treatment_plan"""
+        error = self._planning_error()
+        if error:
+            return error
+
+        plan = await self.planning_agent.acreate_comprehensive_plan(self.results["analysis"])
+        return self._plan_complete(plan)
+
+    def _plan_complete(self, plan: Dict[str, Any]) -> Dict[str, Any]:
         self.results["plan"] = plan
-        
         self.workflow_state = "complete"
         
         return {
@@ -1215,6 +2005,24 @@ class CoordinatorAgent:
             
             # Return full results
             return self.get_full_consultation_results()
+
+        return {
+            "status": "interview_incomplete",
+            "message": "More responses needed to complete interview"
+        }
+
+    async def arun_full_consultation(self, initial_message: str, patient_responses: List[str]) -> Dict[str, Any]:
+        """Async counterpart of run_full_consultation"""
+        await self.astart_consultation(initial_message)
+
+        for response in patient_responses:
+            if not self.qa_agent.interview_complete:
+                await self.acontinue_consultation(response)
+
+        if self.qa_agent.interview_complete:
+            await self.aperform_analysis()
+            await self.acreate_treatment_plan()
+            return self.get_full_consultation_results()
         
         return {
             "status": "interview_incomplete",
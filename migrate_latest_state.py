@@ -0,0 +1,37 @@
+"""
+Migration: materialized latest state per patient
+Creates patient_latest_state, its AgentData insert trigger and the
+(patient_id, timestamp) index, then rebuilds the state from the full history.
+
+The API also runs this on startup when the table is empty, so this script is
+only needed to force a rebuild (e.g. after editing AgentData rows by hand).
+
+Usage:
+    python migrate_latest_state.py
+"""
+
+import time
+
+from sqlalchemy import inspect
+
+from database import engine, ensure_latest_state, backfill_latest_state
+
+
+def migrate_latest_state():
+    print("🚀 Starting Migration: AgentData history -> patient_latest_state")
+    start = time.perf_counter()
+
+    if not inspect(engine).has_table("agent_data"):
+        print("❌ Error: no agent_data table (run import_csv_to_db.py first)")
+        return
+
+    if not ensure_latest_state(engine):
+        # Table already populated (or nothing to backfill): rebuild from scratch
+        count = backfill_latest_state(engine)
+        print(f"✅ Rebuilt patient_latest_state for {count} patients")
+
+    print(f"🎉 Done in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    migrate_latest_state()
@@ -0,0 +1,186 @@
+"""
+Clinical Bucketing of Agent Inputs for MedTwin
+Canonicalizes a patient's qa_data so that patients who differ only slightly
+(HbA1c 9.1% vs 9.2%, same risk levels) produce the same LLM prompt.
+
+Every exact number is replaced by a [[placeholder]]; the fields that drive the
+narrative are annotated with their clinical bucket instead: the lab status band
+from lab_reference for HbA1c, fasting glucose and blood pressure, and the level
+for risk scores. The narrative generated from the bucketed prompt is cached once per
+bucket signature (by llm_cache) and personalized by filling the placeholders
+back in with the patient's values:
+
+    bucketed, values = bucket_qa_data(qa_data)
+    # {"What is your current HbA1c level?": "[[HbA1c]]% (CRITICAL)", ...}, {"HbA1c": "9.1", ...}
+    text = fill_placeholders(llm_output, values)
+"""
+
+import re
+from typing import AsyncIterable, AsyncIterator, Dict, Iterable, Iterator, Optional, Tuple, Union
+
+from lab_reference import LAB_INDEX, band_index
+
+# qa_data key -> (placeholder names for the numbers in the value, bucket)
+# where bucket is a lab_reference lab (status band of the first number), a range
+# width, or None for a placeholder only. Only the fields that drive the narrative
+# are bucketed: the complication risk levels already summarize lipids, kidney
+# markers and BMI, and every extra banded field multiplies the number of distinct
+# signatures (with all nine lab bands almost no two patients share a prompt).
+QA_BUCKETS: Dict[str, Tuple[Tuple[str, ...], Union[str, int, None]]] = {
+    # twin_to_qa_data
+    "What is your current HbA1c level?": (("HbA1c",), "HbA1c"),
+    "What is your fasting blood glucose?": (("Fasting Glucose",), "Fasting Glucose"),
+    "Estimated Average Glucose": (("Average Glucose",), None),
+    "What are your blood pressure readings?": (("Systolic BP", "Diastolic BP"), "Blood Pressure (Systolic)"),
+    "Total Cholesterol": (("Total Cholesterol",), None),
+    "LDL Cholesterol": (("LDL",), None),
+    "HDL Cholesterol": (("HDL",), None),
+    "GGT Level": (("GGT",), None),
+    "Serum Urate": (("Serum Urate",), None),
+    "Daily caloric intake": (("Calories",), None),
+    "What is your age?": (("Age",), None),
+    "BMI?": (("BMI",), None),
+    "Waist circumference": (("Waist",), None),
+    # Future simulation input (api.build_narrative_input)
+    "Projected HbA1c": (("Projected HbA1c",), "HbA1c"),
+    "Projected Fasting Glucose": (("Projected Fasting Glucose",), "Fasting Glucose"),
+    "Pancreas Function": (("Pancreas Function",), 20),
+    "Kidney Function": (("Kidney Function",), None),
+    "Heart Function": (("Heart Function",), None),
+    "Eye Health": (("Eye Health",), None),
+    "Nerve Function": (("Nerve Function",), None),
+    "Patient Age": (("Age",), None),
+    "Current HbA1c": (("HbA1c",), "HbA1c"),
+    "Blood Pressure": (("Systolic BP", "Diastolic BP"), "Blood Pressure (Systolic)"),
+    "BMI": (("BMI",), None),
+}
+
+# Non-numeric answers that are templated as a whole (qa_data key -> placeholder).
+# Smoking status stays in the prompt: it changes the advice itself.
+QA_TEXT_PLACEHOLDERS: Dict[str, str] = {
+    "How is your physical activity?": "Physical Activity",
+    "Alcohol consumption": "Alcohol",
+    "What is your gender?": "Gender",
+    "Any family history of diabetes?": "Family History",
+}
+
+# Sentence for prompts built from bucketed data
+PLACEHOLDER_INSTRUCTIONS = (
+    "Values written as [[Name]] are placeholders for this patient's exact numbers; "
+    "when you cite a value, copy its placeholder verbatim (e.g. 'HbA1c of [[HbA1c]]%') "
+    "and base your reasoning on the bands given in parentheses."
+)
+
+_NUMBER = re.compile(r"-?\d+(?:\.\d+)?")
+_RISK_SCORE = re.compile(r"^(\w+) \((\d+(?:\.\d+)?)/100\)$")
+_PLACEHOLDER = re.compile(r"\[\[([^\[\]]+)\]\]")
+
+
+def _bucket_value(value: str, names: Tuple[str, ...], bucket, values: Dict[str, str]) -> str:
+    numbers = list(_NUMBER.finditer(value))
+    if not numbers:
+        return value
+
+    parts, last = [], 0
+    for i, match in enumerate(numbers):
+        name = names[i] if i < len(names) else f"{names[0]} {i + 1}"
+        values[name] = match.group()
+        parts.append(value[last:match.start()])
+        parts.append(f"[[{name}]]")
+        last = match.end()
+    parts.append(value[last:])
+    templated = "".join(parts)
+
+    first = float(numbers[0].group())
+    if isinstance(bucket, str):
+        i = band_index(LAB_INDEX[bucket], first)
+        return f"{templated} ({LAB_INDEX[bucket].statuses[i]})" if i >= 0 else templated
+    if isinstance(bucket, int):
+        low = int(first // bucket * bucket)
+        return f"{templated} (band {low}-{low + bucket - 1})"
+    return templated
+
+
+def bucket_qa_data(qa_data: Dict) -> Tuple[Dict, Dict[str, str]]:
+    """
+    Canonicalize qa_data into clinical buckets.
+
+    Returns:
+        (bucketed qa_data, {placeholder name: exact value}). Other answers
+        (smoking status, condition, ...) are kept as they are.
+    """
+    bucketed, values = {}, {}
+    for key, value in qa_data.items():
+        if key in QA_TEXT_PLACEHOLDERS:
+            name = QA_TEXT_PLACEHOLDERS[key]
+            values[name] = str(value)
+            bucketed[key] = f"[[{name}]]"
+        elif not isinstance(value, str):
+            bucketed[key] = value
+        elif key in QA_BUCKETS:
+            names, bucket = QA_BUCKETS[key]
+            bucketed[key] = _bucket_value(value, names, bucket, values)
+        elif key.endswith("Risk") and _RISK_SCORE.match(value):
+            # "HIGH (72/100)": the level is the bucket, the score a placeholder
+            level, score = _RISK_SCORE.match(value).groups()
+            name = f"{key} Score"
+            values[name] = score
+            bucketed[key] = f"{level} ([[{name}]]/100)"
+        else:
+            bucketed[key] = value
+    return bucketed, values
+
+
+def fill_placeholders(text: str, values: Dict[str, str]) -> str:
+    """Replace [[Name]] with the patient's value (unknown names lose their brackets)"""
+    return _PLACEHOLDER.sub(lambda match: values.get(match.group(1).strip(), match.group(1)), text)
+
+
+def _split_pending(text: str) -> int:
+    """Index where a possibly incomplete placeholder starts (len(text) if none)"""
+    start = text.rfind("[[")
+    if start != -1 and "]]" not in text[start:]:
+        return start
+    return len(text) - 1 if text.endswith("[") else len(text)
+
+
+def fill_placeholders_stream(chunks: Iterable[str], values: Optional[Dict[str, str]],
+                             max_pending: int = 64) -> Iterator[str]:
+    """
+    fill_placeholders for streamed text: a placeholder split across chunks is held
+    back until it is complete (or max_pending characters show it isn't one).
+    """
+    if not values:
+        yield from chunks
+        return
+
+    pending = ""
+    for chunk in chunks:
+        pending += chunk
+        cut = _split_pending(pending)
+        if len(pending) - cut > max_pending:
+            cut = len(pending)
+        if cut:
+            yield fill_placeholders(pending[:cut], values)
+            pending = pending[cut:]
+    if pending:
+        yield fill_placeholders(pending, values)
+
+
+async def afill_placeholders_stream(chunks: AsyncIterable[str], values: Optional[Dict[str, str]],
+                                    max_pending: int = 64) -> AsyncIterator[str]:
+    """Async counterpart of fill_placeholders_stream"""
+    pending = ""
+    async for chunk in chunks:
+        if not values:
+            yield chunk
+            continue
+        pending += chunk
+        cut = _split_pending(pending)
+        if len(pending) - cut > max_pending:
+            cut = len(pending)
+        if cut:
+            yield fill_placeholders(pending[:cut], values)
+            pending = pending[cut:]
+    if pending:
+        yield fill_placeholders(pending, values)
@@ -8,6 +8,41 @@ from typing import Dict, List, Tuple
 from digital_twin import DiabetesTwin
 
 
+def build_feature_columns(payloads: List[Dict]) -> Dict[str, np.ndarray]:
+    """
+    Convert patient payloads (same shape as DiabetesTwin's patient_data) into
+    column arrays for the vectorized *_batch methods.
+    Type conversions mirror DiabetesTwin so batch and per-twin results agree.
+    """
+    return {
+        "age": np.array([int(p['Age']) for p in payloads], dtype=float),
+        "gender": np.array([p['Sex'] for p in payloads], dtype=object),
+        "bmi": np.array([float(p['BMI']) for p in payloads]),
+        "waist": np.array([float(p['Waist_Circumference']) for p in payloads]),
+        "hba1c": np.array([float(p['HbA1c']) for p in payloads]),
+        "fasting_glucose": np.array([float(p['Fasting_Blood_Glucose']) for p in payloads]),
+        "bp_systolic": np.array([int(p['Blood_Pressure_Systolic']) for p in payloads], dtype=float),
+        "ldl": np.array([float(p['Cholesterol_LDL']) for p in payloads]),
+        "hdl": np.array([float(p['Cholesterol_HDL']) for p in payloads]),
+        "ggt": np.array([float(p['GGT']) for p in payloads]),
+        "serum_urate": np.array([float(p['Serum_Urate']) for p in payloads]),
+        "smoking": np.array([p['Smoking_Status'] for p in payloads], dtype=object),
+        "alcohol": np.array([p['Alcohol_Consumption'] for p in payloads], dtype=object),
+        "activity": np.array([p['Physical_Activity_Level'] for p in payloads], dtype=object),
+        "family_history": np.array([bool(p['Family_History_of_Diabetes']) for p in payloads]),
+    }
+
+
+def _risk_levels(scores: np.ndarray, high: float, moderate: float) -> np.ndarray:
+    """Vectorized 'high' / 'moderate' / 'low' classification (strict > thresholds)"""
+    return np.where(scores > high, 'high', np.where(scores > moderate, 'moderate', 'low'))
+
+
+def _clip_score(scores: np.ndarray) -> np.ndarray:
+    """Vectorized min(100, max(0, int(score)))"""
+    return np.clip(np.trunc(scores), 0, 100).astype(int)
+
+
 class GlucoseSimulator:
     """
     Simulates glucose levels and predicts future states
@@ -93,6 +128,51 @@ class GlucoseSimulator:
         
         return predicted_hba1c, explanation
     
+    @staticmethod
+    def predict_hba1c_change_batch(
+        columns: Dict[str, np.ndarray],
+        lifestyle_changes: Dict[str, any],
+        months: int = 6
+    ) -> np.ndarray:
+        """
+        Vectorized predict_hba1c_change for many patients (same scenario for all)
+        
+        Args:
+            columns: Output of build_feature_columns()
+            lifestyle_changes: Same keys as predict_hba1c_change
+            months: Time horizon for prediction
+        
+        Returns:
+            Array of predicted HbA1c values
+        """
+        predicted = columns["hba1c"].copy()
+        
+        if 'weight_loss_kg' in lifestyle_changes:
+            estimated_weight = columns["bmi"] * (1.7 ** 2)
+            weight_loss_pct = (lifestyle_changes['weight_loss_kg'] / estimated_weight) * 100
+            predicted -= (weight_loss_pct / 5) * 0.5
+        
+        if 'exercise_level_change' in lifestyle_changes:
+            predicted -= {
+                'Low_to_Moderate': 0.4,
+                'Low_to_High': 0.6,
+                'Moderate_to_High': 0.3
+            }.get(lifestyle_changes['exercise_level_change'], 0.0)
+        
+        if 'calorie_reduction' in lifestyle_changes:
+            predicted -= (lifestyle_changes['calorie_reduction'] / 500) * 0.3
+        
+        if lifestyle_changes.get('quit_smoking', False):
+            predicted -= np.where(columns["smoking"] == 'Current', 0.2, 0.0)
+        
+        if lifestyle_changes.get('reduce_alcohol', False):
+            predicted -= np.where(columns["alcohol"] == 'Heavy', 0.15, 0.0)
+        
+        if not lifestyle_changes:
+            predicted += 0.1 * (months / 6)
+        
+        return np.clip(predicted, 4.0, 15.0)
+    
     @staticmethod
     def simulate_meal_response(
         fasting_glucose: float,
@@ -340,6 +420,129 @@ class RiskAssessor:
         }
 
 
+    @staticmethod
+    def predict_complication_risk_batch(
+        columns: Dict[str, np.ndarray],
+        years_ahead: int = 5
+    ) -> Dict[str, Dict[str, np.ndarray]]:
+        """
+        Vectorized predict_complication_risk for many patients.
+        
+        Returns:
+            {complication: {"risk_score": int array, "risk_level": str array}}
+        """
+        hba1c = columns["hba1c"]
+        age = columns["age"]
+        bp_sys = columns["bp_systolic"]
+        
+        # RETINOPATHY
+        retinopathy_time_factor = years_ahead ** 1.3 if years_ahead > 0 else 0
+        retinopathy_score = (
+            np.maximum(0, (hba1c - 6.0) * 12)
+            + retinopathy_time_factor
+            + np.where(bp_sys >= 140, 15, np.where(bp_sys >= 130, 5, 0))
+        )
+        
+        # NEPHROPATHY
+        nephropathy_score = (
+            np.maximum(0, (hba1c - 6.5) * 10)
+            + np.where(bp_sys >= 140, 20, np.where(bp_sys >= 130, 10, 0))
+            + np.where(columns["ggt"] >= 50, 15, np.where(columns["ggt"] >= 35, 5, 0))
+            + np.where(columns["serum_urate"] >= 7.0, 10, 0)
+            + years_ahead * 4
+        )
+        
+        # CARDIOVASCULAR
+        ldl = columns["ldl"]
+        bmi = columns["bmi"]
+        cv_score = (
+            np.maximum(0, (age - 40) * 1.5)
+            + np.maximum(0, (hba1c - 6.0) * 8)
+            + np.where(columns["smoking"] == 'Current', 25, np.where(columns["smoking"] == 'Former', 10, 0))
+            + np.where(ldl >= 160, 20, np.where(ldl >= 130, 12, np.where(ldl >= 100, 5, 0)))
+            + np.where(columns["hdl"] < 40, 10, 0)
+            + np.where(bp_sys >= 140, 15, np.where(bp_sys >= 130, 8, 0))
+            + np.where(bmi >= 35, 12, np.where(bmi >= 30, 8, np.where(bmi >= 25, 3, 0)))
+            + np.where(columns["family_history"], 8, 0)
+            + years_ahead * 3
+        )
+        
+        # NEUROPATHY
+        neuropathy_score = (
+            np.maximum(0, (hba1c - 6.5) * 8)
+            + years_ahead * 5
+            + np.where(age > 60, 10, np.where(age > 50, 5, 0))
+            + np.where(columns["alcohol"] == 'Heavy', 8, 0)
+        )
+        
+        return {
+            'retinopathy': {"risk_score": _clip_score(retinopathy_score), "risk_level": _risk_levels(retinopathy_score, 50, 25)},
+            'nephropathy': {"risk_score": _clip_score(nephropathy_score), "risk_level": _risk_levels(nephropathy_score, 50, 25)},
+            'cardiovascular': {"risk_score": _clip_score(cv_score), "risk_level": _risk_levels(cv_score, 60, 30)},
+            'neuropathy': {"risk_score": _clip_score(neuropathy_score), "risk_level": _risk_levels(neuropathy_score, 45, 20)},
+        }
+    
+    @staticmethod
+    def predict_organ_function_batch(columns: Dict[str, np.ndarray], years_ahead: int = 0) -> Dict[str, np.ndarray]:
+        """
+        Vectorized predict_organ_function for many patients.
+        Returns {organ: array of function levels} (unrounded).
+        """
+        hba1c = columns["hba1c"]
+        bp_sys = columns["bp_systolic"]
+        age = columns["age"]
+        ggt = columns["ggt"]
+        ldl = columns["ldl"]
+        bmi = columns["bmi"]
+        smoking = columns["smoking"]
+        
+        # Pancreas beta-cell function
+        base_pancreas = np.maximum(0.3, 1.0 - ((hba1c - 5.0) * 0.07))
+        degradation_rate = 0.035 * (1 + np.maximum(0, (hba1c - 7) * 0.15))
+        pancreas_function = np.maximum(0.1, base_pancreas - years_ahead * degradation_rate)
+        
+        # Kidney function (eGFR-based proxy)
+        kidney_risk_factors = (
+            np.where(bp_sys >= 140, 0.12, np.where(bp_sys >= 130, 0.05, 0))
+            + np.where(hba1c >= 9.0, 0.10, np.where(hba1c >= 7.5, 0.05, 0))
+            + np.where(ggt >= 50, 0.08, np.where(ggt >= 35, 0.03, 0))
+            + np.where(columns["serum_urate"] >= 7.0, 0.05, 0)
+        )
+        kidney_degradation = years_ahead * 0.025 * (1 + kidney_risk_factors)
+        kidney_function = np.maximum(0.2, 1.0 - kidney_risk_factors - kidney_degradation)
+        
+        # Eye (retina) health
+        eye_risk = np.maximum(0, (hba1c - 6.0) * 0.05) + np.where(bp_sys >= 140, 0.08, np.where(bp_sys >= 130, 0.03, 0))
+        eye_function = np.maximum(0.2, 1.0 - eye_risk - years_ahead * 0.03)
+        
+        # Heart health
+        heart_risk = (
+            np.where(smoking == 'Current', 0.12, np.where(smoking == 'Former', 0.05, 0))
+            + np.where(ldl >= 160, 0.08, np.where(ldl >= 130, 0.04, 0))
+            + np.where(bp_sys >= 140, 0.06, np.where(bp_sys >= 130, 0.03, 0))
+            + np.where(bmi >= 35, 0.05, np.where(bmi >= 30, 0.03, 0))
+            + np.where(age > 60, 0.03, np.where(age > 50, 0.01, 0))
+        )
+        heart_function = np.maximum(0.3, 1.0 - heart_risk - years_ahead * 0.02)
+        
+        # Vascular health (glycation of blood vessels)
+        vessel_glycation = np.minimum(1.0, (hba1c - 5) / 10)
+        vessel_function = np.maximum(0.2, 1.0 - vessel_glycation * 0.5 - years_ahead * 0.025)
+        
+        # Nerve function (peripheral neuropathy)
+        nerve_base = np.maximum(0.4, 1.0 - ((hba1c - 6.0) * 0.06))
+        nerve_function = np.maximum(0.2, nerve_base - years_ahead * 0.04)
+        
+        return {
+            'pancreas': pancreas_function,
+            'kidneys': kidney_function,
+            'eyes': eye_function,
+            'heart': heart_function,
+            'vessels': vessel_function,
+            'nerves': nerve_function
+        }
+
+
 class MedicationSimulator:
     """
     Simulates the effect of different diabetes medications
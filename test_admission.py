@@ -0,0 +1,149 @@
+"""
+AdmissionController: which requests are admitted and which are shed, and why
+
+Run with: python -m pytest test_admission.py
+"""
+
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+import pytest
+
+import metrics
+from admission import AdmissionController, Overloaded
+
+
+def controller(**kwargs) -> AdmissionController:
+    """A controller with a unique name (its decisions get their own metric series)"""
+    options = dict(rate_per_second=100.0, burst=100.0, max_concurrent=8, per_patient_limit=1,
+                   max_waiting=16, max_wait_seconds=0.2)
+    options.update(kwargs)
+    return AdmissionController(f"test-{uuid.uuid4().hex[:8]}", **options)
+
+
+def decisions(admission: AdmissionController, decision: str, reason: str) -> float:
+    return metrics.LLM_ADMISSION_DECISIONS.labels(admission.name, decision, reason).value
+
+
+@contextmanager
+def holding(admission: AdmissionController, patient_id: str, cost: float = 1):
+    """Hold an admission slot in a background thread for the duration of the block"""
+    entered, release = threading.Event(), threading.Event()
+    errors = []
+
+    def hold():
+        try:
+            with admission.admit(patient_id, cost=cost):
+                entered.set()
+                release.wait(5)
+        except Overloaded as e:
+            errors.append(e)
+            entered.set()
+
+    thread = threading.Thread(target=hold)
+    thread.start()
+    assert entered.wait(5)
+    try:
+        yield errors
+    finally:
+        release.set()
+        thread.join()
+
+
+def test_admits_and_counts():
+    admission = controller()
+    with admission.admit("DM_00001", cost=2):
+        assert admission.stats()["in_flight"] == 1
+    assert admission.stats() == {"waiting": 0, "in_flight": 0, "admitted": 1, "shed": 0}
+    assert decisions(admission, "admitted", "none") == 1
+
+
+def test_sheds_when_wait_queue_is_full():
+    admission = controller(max_concurrent=1, max_waiting=1, max_wait_seconds=2.0)
+    with holding(admission, "DM_00001"):
+        # DM_00002 waits for the only concurrency slot and fills the wait queue
+        def wait_for_slot():
+            with admission.admit("DM_00002"):
+                pass
+
+        waiter = threading.Thread(target=wait_for_slot)
+        waiter.start()
+        deadline = time.monotonic() + 2
+        while admission.stats()["waiting"] < 1 and time.monotonic() < deadline:
+            time.sleep(0.005)
+
+        assert admission.would_shed()
+        with pytest.raises(Overloaded) as shed:
+            with admission.admit("DM_00003"):
+                pass
+        assert shed.value.reason == "queue_full"
+    waiter.join()
+    assert decisions(admission, "shed", "queue_full") == 1
+
+
+def test_sheds_second_workflow_for_same_patient():
+    admission = controller(per_patient_limit=1)
+    with holding(admission, "DM_00001") as errors:
+        assert not errors
+        assert admission.would_shed("DM_00001")
+        assert not admission.would_shed("DM_00002")
+
+        start = time.monotonic()
+        with pytest.raises(Overloaded) as shed:
+            with admission.admit("DM_00001"):
+                pass
+        assert shed.value.reason == "patient_busy"
+        assert time.monotonic() - start < 1.0  # shed after max_wait_seconds, not held indefinitely
+
+        with admission.admit("DM_00002"):  # other patients are unaffected
+            pass
+    assert decisions(admission, "shed", "patient_busy") == 1
+    assert admission.stats()["waiting"] == 0
+
+
+def test_sheds_when_rate_limit_is_exhausted():
+    admission = controller(rate_per_second=1.0, burst=3.0, max_wait_seconds=0.2)
+    with admission.admit("DM_00001", cost=3):
+        pass
+    assert admission.would_shed(cost=1)
+    with pytest.raises(Overloaded) as shed:
+        with admission.admit("DM_00002", cost=1):
+            pass
+    assert shed.value.reason == "rate_limit"
+    assert decisions(admission, "shed", "rate_limit") == 1
+
+
+def test_rate_limited_request_waits_when_tokens_arrive_in_time():
+    admission = controller(rate_per_second=20.0, burst=1.0, max_wait_seconds=0.5)
+    with admission.admit("DM_00001"):
+        pass
+    start = time.monotonic()
+    with admission.admit("DM_00002"):
+        pass
+    assert 0.02 <= time.monotonic() - start < 0.5
+
+
+def test_cost_above_burst_is_clamped_not_shed_forever(capsys):
+    admission = controller(rate_per_second=1.0, burst=3.0)
+    assert not admission.would_shed(cost=5)
+    with admission.admit("DM_00001", cost=5):
+        pass
+    assert "exceeds the burst" in capsys.readouterr().out
+    assert decisions(admission, "admitted", "none") == 1
+
+    # The whole burst was used; warned only once per cost
+    with pytest.raises(Overloaded):
+        with admission.admit("DM_00002", cost=5):
+            pass
+    assert "exceeds the burst" not in capsys.readouterr().out
+
+
+def test_decisions_are_exported_as_counter():
+    admission = controller()
+    with admission.admit("DM_00001"):
+        pass
+    rendered = "\n".join(metrics.LLM_ADMISSION_DECISIONS.render())
+    assert "# TYPE medtwin_llm_admission_decisions_total counter" in rendered
+    assert f'controller="{admission.name}",decision="admitted",reason="none"}} 1' in rendered
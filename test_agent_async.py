@@ -0,0 +1,175 @@
+"""
+Async agent paths: the a* methods return what their blocking counterparts do,
+and gather_bounded keeps at most `limit` awaitables running
+
+Run with: python -m pytest test_agent_async.py
+"""
+
+import asyncio
+
+import pytest
+from langchain_core.messages import AIMessageChunk
+
+from medtwin_agents import (PLAN_MODES, PREDICTION_MODES, AnalysisAgent, NotifierAgent, PlanningAgent,
+                            PredictionAgent, gather_bounded)
+from test_agent_modes import ANALYSIS, FakeLLM
+
+RECOMMENDATIONS = "1. Walk after meals. 2. Cut sugary drinks. 3. Seek help for chest pain."
+SCHEDULE = "MEDICATION SCHEDULE\nMorning (8:00 AM):\n- Metformin - 500mg - with breakfast"
+MEDICATIONS = [{"name": "Metformin", "dosage": "500mg", "frequency": "twice daily", "timing": ["08:00", "20:00"]}]
+COLLECTED = {"condition_type": "diabetes", "qa_data": ANALYSIS["qa_data"]}
+
+
+class FakeAsyncLLM(FakeLLM):
+    """FakeLLM with ainvoke / stream / astream; text replies for severity, advice and schedules"""
+
+    def reply(self, prompt: str):
+        if "classify severity" in prompt:
+            return "HIGH"
+        if "Generate recommendations" in prompt:
+            return RECOMMENDATIONS
+        if "medication schedule" in prompt:
+            return SCHEDULE
+        return super().reply(prompt)
+
+    async def ainvoke(self, prompt: str):
+        return await asyncio.to_thread(self.invoke, prompt)
+
+    def stream(self, prompt: str):
+        text = self.invoke(prompt).content
+        for start in range(0, len(text), 8):
+            yield AIMessageChunk(content=text[start:start + 8])
+
+    async def astream(self, prompt: str):
+        for chunk in self.stream(prompt):
+            await asyncio.sleep(0)
+            yield chunk
+
+
+def both(sync_call, async_call):
+    """(sync result, async result) each from a fresh fake LLM, plus both call counts"""
+    sync_llm, async_llm = FakeAsyncLLM(), FakeAsyncLLM()
+    sync_result = sync_call(sync_llm)
+    async_result = asyncio.run(async_call(async_llm))
+    return sync_result, async_result, sync_llm.calls, async_llm.calls
+
+
+async def collect(chunks):
+    return [chunk async for chunk in chunks]
+
+
+@pytest.mark.parametrize("bucketed", [False, True])
+def test_aanalyze_matches_analyze(bucketed):
+    sync_result, async_result, sync_calls, async_calls = both(
+        lambda llm: AnalysisAgent(llm, bucketed=bucketed).analyze(COLLECTED),
+        lambda llm: AnalysisAgent(llm, bucketed=bucketed).aanalyze(COLLECTED),
+    )
+    assert sync_result == async_result
+    assert (sync_result["severity"], sync_result["recommendations"]) == ("HIGH", RECOMMENDATIONS)
+    assert sync_calls == async_calls == 2
+
+
+def test_aanalyze_copd_needs_no_llm():
+    collected = {"condition_type": "copd",
+                 "qa_data": {"Do you ever have to stop walking just to catch your breath?": "Yes"}}
+    sync_result, async_result, sync_calls, async_calls = both(
+        lambda llm: AnalysisAgent(llm).analyze(collected),
+        lambda llm: AnalysisAgent(llm).aanalyze(collected),
+    )
+    assert sync_result == async_result
+    assert sync_result["gold_group"] == "Group B (High Symptoms)"
+    assert sync_calls == async_calls == 0
+
+
+def test_aanalyze_stream_matches_analyze_stream():
+    sync_chunks, async_chunks, _, _ = both(
+        lambda llm: list(AnalysisAgent(llm).analyze_stream(COLLECTED)),
+        lambda llm: collect(AnalysisAgent(llm).aanalyze_stream(COLLECTED)),
+    )
+    assert sync_chunks == async_chunks
+    assert len(sync_chunks) > 1 and "".join(sync_chunks) == RECOMMENDATIONS
+
+
+@pytest.mark.parametrize("mode", PLAN_MODES)
+def test_acreate_comprehensive_plan_matches_sync(mode):
+    sync_plan, async_plan, sync_calls, async_calls = both(
+        lambda llm: PlanningAgent(llm, mode=mode).create_comprehensive_plan(ANALYSIS),
+        lambda llm: PlanningAgent(llm, mode=mode).acreate_comprehensive_plan(ANALYSIS),
+    )
+    assert sync_plan == async_plan
+    assert sync_calls == async_calls == PlanningAgent(None, mode=mode).llm_calls
+
+
+@pytest.mark.parametrize("mode", PREDICTION_MODES)
+def test_agenerate_comprehensive_prediction_matches_sync(mode):
+    sync_report, async_report, sync_calls, async_calls = both(
+        lambda llm: PredictionAgent(llm, mode=mode).generate_comprehensive_prediction(ANALYSIS),
+        lambda llm: PredictionAgent(llm, mode=mode).agenerate_comprehensive_prediction(ANALYSIS),
+    )
+    assert sync_report == async_report
+    assert sync_calls == async_calls == PredictionAgent(None, mode=mode).llm_calls
+
+
+def test_single_predictions_match_sync():
+    args = ("diabetes", ANALYSIS["qa_data"], "HIGH")
+    progression, aprogression, _, _ = both(lambda llm: PredictionAgent(llm).predict_progression(*args),
+                                           lambda llm: PredictionAgent(llm).apredict_progression(*args))
+    organ_impact, aorgan_impact, _, _ = both(lambda llm: PredictionAgent(llm).predict_organ_impact(*args[:2]),
+                                             lambda llm: PredictionAgent(llm).apredict_organ_impact(*args[:2]))
+    assert progression == aprogression and progression["worsening"] is True
+    assert organ_impact == aorgan_impact and organ_impact["affected_organs"][0]["organ"] == "Kidneys"
+
+
+@pytest.mark.parametrize("medications", [MEDICATIONS, []])
+def test_medication_schedule_matches_sync(medications):
+    schedule, aschedule, _, _ = both(lambda llm: NotifierAgent(llm).create_medication_schedule(medications),
+                                     lambda llm: NotifierAgent(llm).acreate_medication_schedule(medications))
+    chunks, achunks, _, _ = both(
+        lambda llm: list(NotifierAgent(llm).create_medication_schedule_stream(medications)),
+        lambda llm: collect(NotifierAgent(llm).acreate_medication_schedule_stream(medications)),
+    )
+    assert schedule == aschedule == "".join(chunks) == "".join(achunks)
+    assert chunks == achunks
+    assert schedule == (SCHEDULE if medications else "No medications scheduled.")
+
+
+def test_async_concurrent_mode_overlaps_the_two_calls():
+    llm = FakeAsyncLLM(delay=0.05)
+    asyncio.run(PredictionAgent(llm, mode="concurrent").agenerate_comprehensive_prediction(ANALYSIS))
+    asyncio.run(PlanningAgent(llm, mode="concurrent").acreate_comprehensive_plan(ANALYSIS))
+    assert llm.max_in_flight == 2
+
+    llm = FakeAsyncLLM(delay=0.01)
+    asyncio.run(PredictionAgent(llm, mode="sequential").agenerate_comprehensive_prediction(ANALYSIS))
+    assert llm.max_in_flight == 1
+
+
+@pytest.mark.parametrize("limit", [1, 3, 20])
+def test_gather_bounded_caps_concurrency_and_keeps_order(limit):
+    running = peak = 0
+
+    async def job(i):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.01 * (10 - i))  # later jobs finish first
+        running -= 1
+        return i
+
+    results = asyncio.run(gather_bounded((job(i) for i in range(10)), limit=limit))
+    assert results == list(range(10))
+    assert peak == min(limit, 10)
+
+
+def test_gather_bounded_return_exceptions():
+    async def job(i):
+        await asyncio.sleep(0)
+        if i == 2:
+            raise ValueError(i)
+        return i
+
+    results = asyncio.run(gather_bounded((job(i) for i in range(4)), limit=2, return_exceptions=True))
+    assert results[:2] == [0, 1] and results[3] == 3
+    assert isinstance(results[2], ValueError)
+    with pytest.raises(ValueError):
+        asyncio.run(gather_bounded((job(i) for i in range(4)), limit=2))
@@ -0,0 +1,178 @@
+"""
+PlanningAgent / PredictionAgent modes: sequential, concurrent and fused give the same result shape
+
+Uses an instant fake LLM (bench_agent_modes.py measures the modes' latency).
+
+Run with: python -m pytest test_agent_modes.py
+"""
+
+import json
+import threading
+import time
+
+import pytest
+from langchain_core.messages import AIMessage
+
+import metrics
+from medtwin_agents import PLAN_MODES, PREDICTION_MODES, PlanningAgent, PredictionAgent
+
+SHORT_TERM = {"daily_actions": ["Walk after meals"], "monitoring": ["Fasting glucose"], "red_flags": ["Chest pain"]}
+LONG_TERM = {"lifestyle_changes": ["Lose 5% body weight"], "follow_up_schedule": ["HbA1c in 3 months"],
+             "goals": ["HbA1c below 7%"]}
+PROGRESSION = {"worsening": True, "progression_forecast": "Nephropathy risk rises without treatment.",
+               "risk_factors": ["Elevated HbA1c", "Hypertension"]}
+ORGAN_IMPACT = {"affected_organs": [{"organ": "Kidneys", "risk_level": "HIGH", "impact_description": "..."}],
+                "systemic_risks": "Cardiovascular events."}
+
+ANALYSIS = {"condition": "diabetes", "severity": "HIGH",
+            "qa_data": {"What is your current HbA1c level?": "9.1%"}}
+
+
+class FakeLLM:
+    """Canned JSON by prompt type; counts calls and how many run at once"""
+
+    def __init__(self, delay: float = 0.0, replies: dict = None):
+        self.delay = delay
+        self.replies = replies or {}
+        self.calls = 0
+        self.in_flight = self.max_in_flight = 0
+        self._lock = threading.Lock()
+
+    def reply(self, prompt: str):
+        if '"progression": {' in prompt:
+            kind, data = "fused_prediction", {"progression": PROGRESSION, "organ_impact": ORGAN_IMPACT}
+        elif "disease progression" in prompt:
+            kind, data = "progression", PROGRESSION
+        elif "organs are at risk" in prompt:
+            kind, data = "organ_impact", ORGAN_IMPACT
+        elif '"short_term_plan": {' in prompt:
+            kind, data = "fused_plan", {"short_term_plan": SHORT_TERM, "long_term_plan": LONG_TERM}
+        elif "SHORT-TERM" in prompt:
+            kind, data = "short_term", SHORT_TERM
+        else:
+            kind, data = "long_term", LONG_TERM
+        return self.replies.get(kind, "```json\n" + json.dumps(data) + "\n```")
+
+    def invoke(self, prompt: str):
+        with self._lock:
+            self.calls += 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            time.sleep(self.delay)
+            return AIMessage(content=self.reply(prompt))
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+
+def fallbacks(agent: str, method: str) -> float:
+    return metrics.LLM_FALLBACKS.labels(agent, method).value
+
+
+def test_default_plan_mode_is_concurrent(monkeypatch):
+    monkeypatch.delenv("MEDTWIN_PLAN_MODE", raising=False)
+    assert PlanningAgent(FakeLLM()).mode == "concurrent"
+    monkeypatch.setenv("MEDTWIN_PLAN_MODE", "fused")
+    assert PlanningAgent(FakeLLM()).mode == "fused"
+    with pytest.raises(ValueError):
+        PlanningAgent(FakeLLM(), mode="parallel")
+
+
+@pytest.mark.parametrize("mode", PLAN_MODES)
+def test_plan_modes_return_the_same_plan(mode):
+    llm = FakeLLM()
+    agent = PlanningAgent(llm, mode=mode)
+    plan = agent.create_comprehensive_plan(ANALYSIS)
+    assert plan == {
+        "condition": "diabetes",
+        "severity": "HIGH",
+        "short_term_plan": SHORT_TERM,
+        "long_term_plan": LONG_TERM,
+        "created_at": "now",
+    }
+    assert llm.calls == agent.llm_calls == (1 if mode == "fused" else 2)
+
+
+@pytest.mark.parametrize("mode, overlap", [("sequential", 1), ("concurrent", 2)])
+def test_concurrent_plan_overlaps_the_two_calls(mode, overlap):
+    llm = FakeLLM(delay=0.05)
+    PlanningAgent(llm, mode=mode).create_comprehensive_plan(ANALYSIS)
+    assert llm.max_in_flight == overlap
+
+
+def test_fused_plan_accepts_flattened_lists():
+    llm = FakeLLM(replies={"fused_plan": json.dumps({**SHORT_TERM, **LONG_TERM})})
+    plan = PlanningAgent(llm, mode="fused").create_comprehensive_plan(ANALYSIS)
+    assert (plan["short_term_plan"], plan["long_term_plan"]) == (SHORT_TERM, LONG_TERM)
+
+
+def test_fused_plan_falls_back_to_defaults_when_json_is_unrecoverable():
+    before = fallbacks("PlanningAgent", "create_fused_plan")
+    llm = FakeLLM(replies={"fused_plan": "I'm sorry, I can't help with a plan right now."})
+    agent = PlanningAgent(llm, mode="fused")
+    plan = agent.create_comprehensive_plan(ANALYSIS)
+
+    assert plan["short_term_plan"] == PlanningAgent.SHORT_TERM_DEFAULT
+    assert plan["long_term_plan"] == PlanningAgent.LONG_TERM_DEFAULT
+    assert plan["short_term_plan"]["daily_actions"] is not PlanningAgent.SHORT_TERM_DEFAULT["daily_actions"]
+    assert llm.calls == 1
+    assert fallbacks("PlanningAgent", "create_fused_plan") - before == 2
+
+
+def test_separate_plan_falls_back_per_section():
+    llm = FakeLLM(replies={"long_term": "not json"})
+    plan = PlanningAgent(llm, mode="concurrent").create_comprehensive_plan(ANALYSIS)
+    assert plan["short_term_plan"] == SHORT_TERM
+    assert plan["long_term_plan"] == PlanningAgent.LONG_TERM_DEFAULT
+
+
+def test_default_prediction_mode_is_concurrent(monkeypatch):
+    monkeypatch.delenv("MEDTWIN_PREDICTION_MODE", raising=False)
+    assert PredictionAgent(FakeLLM()).mode == "concurrent"
+    monkeypatch.setenv("MEDTWIN_PREDICTION_MODE", "sequential")
+    assert PredictionAgent(FakeLLM()).mode == "sequential"
+    with pytest.raises(ValueError):
+        PredictionAgent(FakeLLM(), mode="batched")
+
+
+@pytest.mark.parametrize("mode", PREDICTION_MODES)
+def test_prediction_modes_return_the_same_report(mode):
+    llm = FakeLLM()
+    agent = PredictionAgent(llm, mode=mode)
+    assert agent.predict_all("diabetes", ANALYSIS["qa_data"], "HIGH") == (PROGRESSION, ORGAN_IMPACT)
+    assert agent.generate_comprehensive_prediction(ANALYSIS) == {
+        "prediction_type": "progression_and_impact",
+        "worsening_prediction": PROGRESSION,
+        "organ_impact_prediction": ORGAN_IMPACT,
+    }
+    assert llm.calls == 2 * agent.llm_calls == (2 if mode == "fused" else 4)
+
+
+@pytest.mark.parametrize("mode, overlap", [("sequential", 1), ("concurrent", 2), ("fused", 1)])
+def test_concurrent_prediction_overlaps_the_two_calls(mode, overlap):
+    llm = FakeLLM(delay=0.05)
+    PredictionAgent(llm, mode=mode).predict_all("diabetes", {}, "HIGH")
+    assert llm.max_in_flight == overlap
+
+
+def test_parse_fused_prediction():
+    agent = PredictionAgent(FakeLLM(), mode="fused")
+    content = "Here is the analysis:\n" + json.dumps({"progression": PROGRESSION, "organ_impact": ORGAN_IMPACT,
+                                                      "note": "trailing"}) + "\nHope this helps."
+    assert agent._parse_fused(content) == (PROGRESSION, ORGAN_IMPACT)
+
+    before = fallbacks("PredictionAgent", "predict_fused")
+    progression, organ_impact = agent._parse_fused(json.dumps({"progression": PROGRESSION}))
+    assert progression == PROGRESSION and organ_impact == PredictionAgent.ORGAN_IMPACT_DEFAULT
+    assert fallbacks("PredictionAgent", "predict_fused") - before == 1
+
+
+def test_fused_prediction_falls_back_when_json_is_unrecoverable():
+    before = fallbacks("PredictionAgent", "predict_fused")
+    llm = FakeLLM(replies={"fused_prediction": "{not: valid json"})
+    report = PredictionAgent(llm, mode="fused").generate_comprehensive_prediction(ANALYSIS)
+    assert report["worsening_prediction"] == PredictionAgent.PROGRESSION_DEFAULT
+    assert report["organ_impact_prediction"] == PredictionAgent.ORGAN_IMPACT_DEFAULT
+    assert llm.calls == 1
+    assert fallbacks("PredictionAgent", "predict_fused") - before == 2
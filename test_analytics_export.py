@@ -0,0 +1,57 @@
+"""
+analytics_export: Parquet round trip and incremental re-export by watermark
+
+Needs the optional analytics dependencies (pip install -r requirements-analytics.txt);
+skipped without pyarrow.
+
+Run with: python -m pytest test_analytics_export.py  (scratch database, see conftest.py)
+"""
+
+from datetime import datetime
+
+import pytest
+from sqlalchemy.orm import Session
+
+pytest.importorskip("pyarrow")
+
+import analytics_export
+from database import engine, AgentData
+
+
+def test_export_round_trip_and_incremental_rerun(patients_db, tmp_path):
+    export_dir = str(tmp_path / "analytics")
+
+    first = analytics_export.export_agent_data(export_dir, chunk_size=2)
+    assert first["rows"] == 5 and first["total_rows"] == 5
+
+    # Nothing new: the watermark stops a second run from duplicating rows
+    again = analytics_export.export_agent_data(export_dir, chunk_size=2)
+    assert again["rows"] == 0 and again["last_id"] == first["last_id"]
+
+    with Session(engine) as session:
+        session.add(AgentData(patient_id="DM_00001", agent_type="LabResults",
+                              data_payload={"HbA1c": 11.4}, timestamp=datetime(2025, 2, 1)))
+        session.commit()
+    update = analytics_export.export_agent_data(export_dir, chunk_size=2)
+    assert update["rows"] == 1 and update["total_rows"] == 6
+
+    table = analytics_export.load_columns(["id", "patient_id", "agent_type", "month", "hba1c"],
+                                          export_dir=export_dir)
+    assert sorted(table["id"]) == list(range(1, 7))  # every row exactly once
+    lab = table[table["agent_type"] == "LabResults"].iloc[0]
+    assert (lab["patient_id"], lab["month"], lab["hba1c"]) == ("DM_00001", "2025-02", 11.4)
+    assert table["hba1c"].notna().all()
+
+    full = analytics_export.export_agent_data(export_dir, full=True)
+    assert full["rows"] == 6
+    assert len(analytics_export.load_columns(["id"], export_dir=export_dir)) == 6
+
+
+def test_query_runs_sql_over_the_export(patients_db, tmp_path):
+    pytest.importorskip("duckdb")
+    export_dir = str(tmp_path / "analytics")
+    analytics_export.export_agent_data(export_dir)
+
+    result = analytics_export.query("SELECT count(*) AS n, count(DISTINCT patient_id) AS patients FROM agent_data",
+                                    export_dir)
+    assert (result["n"][0], result["patients"][0]) == (5, 5)
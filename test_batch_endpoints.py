@@ -0,0 +1,105 @@
+"""
+Batch endpoints: /twin/batch/risks, /organ-function and /simulate match the
+per-patient endpoints, and handle unknown ids, duplicates and the size cap
+
+Run with: python -m pytest test_batch_endpoints.py  (scratch database, see conftest.py)
+"""
+
+import pytest
+from fastapi.testclient import TestClient
+
+import api
+
+PATIENTS = [f"DM_0000{i}" for i in range(5)]
+CHANGES = {"weight_loss_kg": 8, "exercise_level_change": "Low_to_Moderate"}
+
+
+@pytest.fixture
+def client(patients_db, monkeypatch):
+    monkeypatch.setattr(api, "AGENTS_AVAILABLE", False)  # visualization-data without the LLM
+    with TestClient(api.app) as client:
+        yield client
+
+
+def post(client, path, **body):
+    response = client.post(path, json=body)
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def rows(columns):
+    """Columnar response -> {patient_id: {column: value}}"""
+    names = [name for name in columns if name != "patient_id"]
+    return {pid: {name: columns[name][i] for name in names} for i, pid in enumerate(columns["patient_id"])}
+
+
+@pytest.mark.parametrize("years_ahead", [0, 5])
+def test_batch_risks_match_per_patient(client, years_ahead):
+    batch = post(client, "/twin/batch/risks", patient_ids=PATIENTS, years_ahead=years_ahead)
+    assert (batch["count"], batch["missing"]) == (5, [])
+    by_patient = rows(batch["columns"])
+
+    for patient_id in PATIENTS:
+        single = client.get(f"/twin/{patient_id}/risks", params={"years_ahead": years_ahead}).json()
+        assert by_patient[patient_id]["hba1c"] == single["current_status"]["hba1c"]
+        for complication, risk in single["predictions"].items():
+            assert by_patient[patient_id][f"{complication}_score"] == risk["risk_score"], (patient_id, complication)
+            assert by_patient[patient_id][f"{complication}_level"] == risk["risk_level"], (patient_id, complication)
+
+
+@pytest.mark.parametrize("years_ahead", [0, 3])
+def test_batch_organ_function_matches_per_patient(client, years_ahead):
+    batch = post(client, "/twin/batch/organ-function", patient_ids=PATIENTS, years_ahead=years_ahead)
+    by_patient = rows(batch["columns"])
+
+    for patient_id in PATIENTS:
+        response = client.get(f"/twin/{patient_id}/visualization-data", params={"years_ahead": years_ahead})
+        organs = response.json()["organs"]
+        assert len(organs) == 5
+        for organ, state in organs.items():
+            assert by_patient[patient_id][organ] == round(state["function_level"], 2), (patient_id, organ)
+
+
+def test_batch_simulate_matches_per_patient(client):
+    batch = post(client, "/twin/batch/simulate", patient_ids=PATIENTS, lifestyle_changes=CHANGES, months=6)
+    assert batch["lifestyle_changes"] == CHANGES
+    by_patient = rows(batch["columns"])
+
+    for patient_id in PATIENTS:
+        single = post(client, "/twin/simulate", patient_id=patient_id, lifestyle_changes=CHANGES, months=6)
+        assert by_patient[patient_id] == {
+            "current_hba1c": single["current_hba1c"],
+            "predicted_hba1c": single["predicted_hba1c"],
+            "change": single["change"],
+        }, patient_id
+
+
+@pytest.mark.parametrize("path, extra", [
+    ("/twin/batch/risks", {}),
+    ("/twin/batch/organ-function", {}),
+    ("/twin/batch/simulate", {"lifestyle_changes": CHANGES}),
+])
+def test_unknown_and_duplicate_ids(client, path, extra):
+    batch = post(client, path, patient_ids=["DM_00003", "NOPE", "DM_00001", "DM_00003", "NOPE"], **extra)
+    assert batch["columns"]["patient_id"] == ["DM_00003", "DM_00001"]  # first occurrence, request order
+    assert batch["count"] == 2
+    assert batch["missing"] == ["NOPE"]
+    assert all(len(values) == 2 for values in batch["columns"].values())
+
+    only_unknown = post(client, path, patient_ids=["NOPE", "ALSO_NOPE"], **extra)
+    assert only_unknown["count"] == 0 and only_unknown["missing"] == ["NOPE", "ALSO_NOPE"]
+    assert only_unknown["columns"] == {"patient_id": []}
+
+
+@pytest.mark.parametrize("path, extra", [
+    ("/twin/batch/risks", {}),
+    ("/twin/batch/organ-function", {}),
+    ("/twin/batch/simulate", {"lifestyle_changes": CHANGES}),
+])
+def test_batch_size_cap(client, path, extra):
+    at_cap = PATIENTS + [f"X_{i}" for i in range(api.MAX_BATCH_PATIENTS - len(PATIENTS))]
+    assert post(client, path, patient_ids=at_cap, **extra)["count"] == 5
+
+    response = client.post(path, json={"patient_ids": at_cap + ["DM_00000"], **extra})
+    assert response.status_code == 400
+    assert str(api.MAX_BATCH_PATIENTS) in response.json()["detail"]
@@ -0,0 +1,129 @@
+"""
+CGM ingestion: message validation, the write buffer and the glucose read path
+
+Run with: python -m pytest test_cgm_ingest.py  (scratch database, see conftest.py)
+"""
+
+import math
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import insert, select
+
+import api
+from api import parse_cgm_message
+from database import engine, GlucoseReading
+from timeseries import CGM_READINGS_DROPPED, GlucoseWriteBuffer, merge_readings, now_ms, read_glucose_range
+
+TS = 1735689600000  # 2025-01-01
+
+
+def test_parse_accepts_documented_shapes():
+    assert parse_cgm_message({"ts": TS, "value": 142}) == [(TS, 142.0)]
+    assert parse_cgm_message({"ts": "2025-01-01T00:00:00Z", "value": 142}) == [(TS, 142.0)]
+    assert parse_cgm_message({"readings": [[TS, 140], [TS + 300000, 150.5]]}) == [(TS, 140.0), (TS + 300000, 150.5)]
+    (ts, value), = parse_cgm_message({"value": 99})
+    assert abs(ts - now_ms()) < 5000 and value == 99.0
+
+
+@pytest.mark.parametrize("message", [
+    {"ts": 1e20, "value": 140},                 # float timestamp (and far out of range)
+    {"ts": 10 ** 20, "value": 140},             # int overflowing SQLite INTEGER
+    {"ts": 0, "value": 140},                    # before 2000
+    {"ts": now_ms() + 7 * 86400000, "value": 140},  # a week in the future
+    {"ts": True, "value": 140},
+    {"ts": TS, "value": float("nan")},
+    {"ts": TS, "value": float("inf")},
+    {"ts": TS, "value": -5},
+    {"ts": TS, "value": 5000},
+    {"ts": TS, "value": "140"},
+    {"readings": [[TS, 140], [TS, math.nan]]},  # one bad reading rejects the message
+    {"readings": [[TS]]},
+])
+def test_parse_rejects_implausible_readings(message):
+    with pytest.raises((KeyError, TypeError, ValueError)):
+        parse_cgm_message(message)
+
+
+def test_flush_drops_poison_row_and_writes_the_rest(temp_db):
+    buffer = GlucoseWriteBuffer(flush_interval=3600)
+    buffer.start()
+    try:
+        buffer.append("DM_00002", [(10 ** 20, 140.0)])  # bypasses the parser, as a bug would
+        buffer.append("DM_00003", [(TS, 120.0), (TS + 300000, 125.0)])
+        assert buffer.flush() == 2
+        assert buffer.total_dropped == 1
+        assert buffer.pending() == 0
+        assert buffer.flush() == 0  # nothing re-queued
+    finally:
+        buffer.stop()
+
+    with engine.connect() as conn:
+        rows = conn.execute(select(GlucoseReading.patient_id, GlucoseReading.ts_ms)).all()
+    assert sorted(rows) == [("DM_00003", TS), ("DM_00003", TS + 300000)]
+
+
+def test_flush_keeps_duplicates_out_and_counts_only_bad_rows(temp_db):
+    dropped = CGM_READINGS_DROPPED._default().value
+    buffer = GlucoseWriteBuffer(flush_interval=3600)
+    buffer._thread = object()  # flushed by hand
+    buffer.append("DM_00003", [(TS, 120.0)])
+    assert buffer.flush() == 1
+
+    # A device retry (same timestamp) and a poison row force the row-by-row path
+    buffer.append("DM_00003", [(TS, 999.0), (TS + 300000, 125.0)])
+    buffer.append("DM_00002", [(10 ** 20, 140.0)])
+    assert buffer.pending_readings("DM_00002") == [(10 ** 20, 140.0)]
+    buffer.flush()
+
+    assert buffer.total_dropped == 1
+    assert CGM_READINGS_DROPPED._default().value - dropped == 1
+    assert buffer.pending_readings("DM_00002") == [] and buffer.pending() == 0
+    assert read_glucose_range("DM_00003") == [(TS, 120.0), (TS + 300000, 125.0)]  # first write kept
+    assert read_glucose_range("DM_00002") == []
+
+
+def test_append_refuses_readings_beyond_max_pending():
+    buffer = GlucoseWriteBuffer(flush_interval=3600, max_pending=3)
+    buffer._thread = object()  # no flusher: nothing drains the buffer
+    buffer.append("DM_00001", [(TS, 100.0), (TS + 1, 101.0)])
+    with pytest.raises(api.Overloaded):
+        buffer.append("DM_00001", [(TS + 2, 102.0), (TS + 3, 103.0)])
+    assert buffer.pending() == 2
+
+
+def test_merge_readings_prefers_stored_and_keeps_order():
+    stored = [(1, 100.0), (3, 130.0)]
+    pending = [(2, 120.0), (3, 999.0), (4, 140.0), (4, 150.0)]
+    assert merge_readings(stored, pending) == [(1, 100.0), (2, 120.0), (3, 130.0), (4, 140.0)]
+
+
+def test_glucose_endpoint_includes_pending_readings_and_404s(patients_db):
+    with TestClient(api.app) as client:
+        with client.websocket_connect("/ws/cgm/DM_00002") as ws:
+            ws.send_json({"ts": 1e20, "value": 140})
+            assert ws.receive_json()["status"] == "error"
+            ws.send_json({"readings": [[TS, 140], [TS + 300000, 150]]})
+            assert ws.receive_json()["accepted"] == 2
+
+        # Served from the buffer and/or the table, without forcing a flush
+        response = client.get("/twin/DM_00002/glucose", params={"start_ms": TS})
+        assert response.status_code == 200
+        assert response.json()["ts_ms"] == [TS, TS + 300000]
+
+        assert client.get("/twin/NOPE/glucose").status_code == 404
+        assert client.get("/twin/DM_00001/glucose").json()["count"] == 0
+
+
+def test_twin_falls_back_to_stored_latest_glucose(patients_db):
+    with engine.begin() as conn:
+        conn.execute(insert(GlucoseReading.__table__), [
+            {"patient_id": "DM_00004", "ts_ms": TS, "value": 110.0},
+            {"patient_id": "DM_00004", "ts_ms": TS + 300000, "value": 118.0},
+        ])
+    api.glucose_buffer._latest.pop("DM_00004", None)  # as after a restart / on another worker
+
+    with TestClient(api.app) as client:
+        twin = client.get("/twin/DM_00004").json()
+    assert twin["latest_glucose"]["ts_ms"] == TS + 300000
+    assert twin["latest_glucose"]["value_mgdl"] == 118.0
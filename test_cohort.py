@@ -0,0 +1,93 @@
+"""
+cohort: filter parsing, cohort queries on a seeded database and their index use
+
+Run with: python -m pytest test_cohort.py  (scratch database, see conftest.py)
+"""
+
+from datetime import datetime
+
+import pytest
+from sqlalchemy import insert
+
+from cohort import CohortFilterError, cohort_count_query, cohort_query, parse_filter
+from database import engine, ACTION_PLAN_AGENT_TYPE, AgentData, Patient
+
+
+@pytest.mark.parametrize("expression, expected", [
+    ("HbA1c > 9", ("hba1c", ">", 9.0)),
+    ("a1c>=7.5", ("hba1c", ">=", 7.5)),
+    ("  LDL Cholesterol <= 100 ", ("ldl", "<=", 100.0)),
+    ("Fasting_Blood_Glucose != 126", ("fasting_glucose", "!=", 126.0)),
+    ("uric acid = 7", ("serum_urate", "=", 7.0)),
+    ("Sex = 'Female'", ("sex", "=", "Female")),
+    ('gender == "Male"', ("sex", "==", "Male")),
+    (("BMI", "<", "30"), ("bmi", "<", 30.0)),
+])
+def test_parse_filter(expression, expected):
+    assert parse_filter(expression) == expected
+
+
+@pytest.mark.parametrize("expression", [
+    "HbA1c",                # no operator
+    "HbA1c > ",             # no value
+    "Ferritin > 10",        # unknown field
+    "HbA1c > high",         # not a number
+    "HbA1c => 9",
+    ("HbA1c", "~", 9),      # unknown operator
+    ("HbA1c", ">"),         # wrong shape
+    42,
+])
+def test_parse_filter_rejects_bad_input(expression):
+    with pytest.raises(CohortFilterError):
+        parse_filter(expression)
+
+
+@pytest.fixture
+def cohort_db(temp_db):
+    history = [
+        ("DM_00001", "LegacyCSV", {"HbA1c": 9.5, "Cholesterol_LDL": 170, "Sex": "Female"}, datetime(2025, 1, 1)),
+        ("DM_00001", "LabResults", {"HbA1c": 8.1}, datetime(2025, 4, 1)),          # current HbA1c 8.1
+        ("DM_00002", None, {"HbA1c": 10.2, "Cholesterol_LDL": 165, "Sex": "Male"}, datetime(2025, 2, 1)),
+        ("DM_00003", "LegacyCSV", {"HbA1c": 6.1, "Cholesterol_LDL": 90, "Sex": "Female"}, datetime(2025, 1, 1)),
+        ("DM_00003", ACTION_PLAN_AGENT_TYPE, {"HbA1c": 12.0}, datetime(2025, 5, 1)),  # derived: never matches
+    ]
+    with engine.begin() as conn:
+        conn.execute(insert(Patient), [{"id": p} for p in ("DM_00001", "DM_00002", "DM_00003")])
+        conn.execute(insert(AgentData), [
+            {"patient_id": p, "agent_type": t, "data_payload": payload, "timestamp": ts}
+            for p, t, payload, ts in history
+        ])
+    return temp_db
+
+
+def run(query):
+    with engine.connect() as conn:
+        return conn.execute(query).all()
+
+
+def test_latest_state_cohort(cohort_db):
+    assert sorted(run(cohort_query(["HbA1c > 9"]))) == [("DM_00002", 10.2)]
+    assert sorted(run(cohort_query(["HbA1c > 8", "LDL > 160"], fields=["sex", "a1c"]))) == \
+        [("DM_00001", "Female", 8.1), ("DM_00002", "Male", 10.2)]
+    assert run(cohort_count_query(["HbA1c > 8"])) == [(2,)]
+    assert run(cohort_count_query(["Sex = 'Female'"])) == [(2,)]
+    assert len(run(cohort_query(["HbA1c > 0"], limit=1))) == 1
+
+
+def test_history_cohort_includes_null_agent_type_and_skips_derived(cohort_db):
+    rows = sorted(run(cohort_query(["HbA1c > 9"], latest_only=False)))
+    assert [(patient_id, hba1c) for patient_id, _, hba1c in rows] == [("DM_00001", 9.5), ("DM_00002", 10.2)]
+    assert run(cohort_count_query(["HbA1c > 9"], latest_only=False)) == [(2,)]
+    assert run(cohort_count_query(["HbA1c > 11"], latest_only=False)) == [(0,)]
+
+
+@pytest.mark.parametrize("latest_only, index", [
+    (True, "ix_patient_latest_state_hba1c"),
+    (False, "ix_agent_data_hba1c"),
+])
+def test_filters_use_clinical_column_index(cohort_db, latest_only, index):
+    query = cohort_count_query(["HbA1c > 9"], latest_only=latest_only)
+    sql = str(query.compile(engine, compile_kwargs={"literal_binds": True}))
+    with engine.connect() as conn:
+        plan = " ".join(row[-1] for row in conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {sql}"))
+    assert f"USING INDEX {index}" in plan or f"USING COVERING INDEX {index}" in plan, plan
@@ -0,0 +1,95 @@
+"""
+compaction: archived history decodes back to the original rows, and derived tables survive
+
+Run with: python -m pytest test_compaction.py  (scratch database, see conftest.py)
+"""
+
+from datetime import datetime, timedelta
+
+from sqlalchemy import insert, select
+
+from compaction import archived_history, compact_history, patient_history
+from database import (engine, ACTION_PLAN_AGENT_TYPE, AgentData, AgentDataArchive, LabMeasurement, Patient,
+                      PatientLatestState, backfill_lab_measurements, backfill_latest_state)
+
+NOW = datetime.utcnow().replace(microsecond=0)
+OLD = NOW - timedelta(days=200)
+
+
+def seed():
+    """Old history for three patients across two months, plus rows that must stay live"""
+    rows = []
+    for n, patient_id in enumerate(["DM_00001", "DM_00002", "DM_00003"]):
+        rows += [
+            (patient_id, "LegacyCSV", {"Age": 50 + n, "HbA1c": 7.0, "BMI": 30.5, "Smoking": True}, OLD),
+            (patient_id, "LabResults", {"HbA1c": 7.4, "Notes": None,
+                                        "lab_results": [{"analyte": "GGT", "value": 41, "unit": "U/L"}]},
+             OLD + timedelta(days=3)),
+            (patient_id, None, {"HbA1c": 7.4, "BMI": 29}, OLD + timedelta(days=35)),   # NULL agent_type, int BMI
+            (patient_id, ACTION_PLAN_AGENT_TYPE, {"plan": "old"}, OLD + timedelta(days=36)),
+            (patient_id, ACTION_PLAN_AGENT_TYPE, {"plan": "latest"}, OLD + timedelta(days=37)),
+            (patient_id, "Notes", ["free", "text"], OLD + timedelta(days=38)),           # not a JSON object
+            (patient_id, "LabResults", {"HbA1c": 6.9, "Serum_Urate": 5.5}, NOW - timedelta(days=5)),
+        ]
+    with engine.begin() as conn:
+        conn.execute(insert(Patient), [{"id": p} for p in ("DM_00001", "DM_00002", "DM_00003")])
+        conn.execute(insert(AgentData), [
+            {"patient_id": p, "agent_type": t, "data_payload": payload, "timestamp": ts}
+            for p, t, payload, ts in rows
+        ])
+
+
+def history_rows(where=None):
+    history = AgentData.__table__
+    query = select(history.c.id, history.c.patient_id, history.c.agent_type,
+                   history.c.timestamp, history.c.data_payload)
+    if where is not None:
+        query = query.where(where)
+    with engine.connect() as conn:
+        return [dict(row._mapping) for row in conn.execute(
+            query.order_by(history.c.patient_id, history.c.timestamp, history.c.id))]
+
+
+def table_rows(model):
+    with engine.connect() as conn:
+        return sorted(tuple(row) for row in conn.execute(select(model.__table__)).all())
+
+
+def test_compaction_is_lossless_and_keeps_derived_tables(temp_db):
+    seed()
+    everything = history_rows()
+    old = AgentData.__table__.c.timestamp < NOW - timedelta(days=90)
+    latest_plan_ids = {row["id"] for row in everything if row["data_payload"] == {"plan": "latest"}}
+    expected_archive = [row for row in history_rows(old) if row["id"] not in latest_plan_ids]
+    latest_state = table_rows(PatientLatestState)
+    measurements = table_rows(LabMeasurement)
+    assert len(latest_state) == 3 and measurements
+
+    stats = compact_history(older_than_days=90, block_rows=4)
+    assert stats["rows"] == len(expected_archive) == 15
+    assert stats["blocks"] >= 4  # blocks never span two months
+    assert stats["archive_bytes"] > 0
+
+    with engine.connect() as conn:
+        archived = list(archived_history(conn))
+        one_patient = list(archived_history(conn, "DM_00002"))
+    assert archived == expected_archive  # same payloads, types and timestamps, in (patient, time, id) order
+    assert one_patient == [row for row in expected_archive if row["patient_id"] == "DM_00002"]
+
+    live = history_rows()
+    assert {row["id"] for row in live} == {row["id"] for row in everything} - {row["id"] for row in expected_archive}
+    assert latest_plan_ids <= {row["id"] for row in live}
+    assert patient_history("DM_00003") == [row for row in everything if row["patient_id"] == "DM_00003"]
+
+    # Current state and lab history are untouched, and rebuilding them from the archive gives the same
+    assert table_rows(PatientLatestState) == latest_state
+    assert table_rows(LabMeasurement) == measurements
+    assert backfill_latest_state() == 3
+    assert table_rows(PatientLatestState) == latest_state
+    backfill_lab_measurements()
+    assert table_rows(LabMeasurement) == measurements
+
+    # Nothing left to archive
+    assert compact_history(older_than_days=90, block_rows=4)["rows"] == 0
+    assert table_rows(AgentDataArchive) and len(table_rows(AgentDataArchive)) == stats["blocks"]
+    assert history_rows() == live
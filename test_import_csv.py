@@ -0,0 +1,41 @@
+"""
+import_csv_to_db: re-runs are idempotent and only sync rows that changed
+
+Run with: python -m pytest test_import_csv.py  (scratch database, see conftest.py)
+"""
+
+import pandas as pd
+from sqlalchemy import func, select
+
+from conftest import DATASET
+from database import engine, AgentData, Patient, PatientLatestState
+from import_csv_to_db import migrate_csv_to_sqlite
+
+
+def count(model) -> int:
+    with engine.connect() as conn:
+        return conn.execute(select(func.count()).select_from(model.__table__)).scalar()
+
+
+def test_second_run_inserts_nothing(patients_db):
+    # patients_db already ran the importer once (5 rows); chunk boundaries don't matter
+    stats = migrate_csv_to_sqlite(str(patients_db), chunk_size=2)
+    assert stats["rows"] == 5
+    assert stats["inserted"] == 0 and stats["unchanged"] == 5
+    assert stats["changed_fingerprints"] == 0
+    assert count(Patient) == 5 and count(AgentData) == 5
+
+
+def test_changed_row_adds_one_record(patients_db):
+    df = pd.read_csv(DATASET, nrows=5)
+    df.loc[3, "HbA1c"] = 12.5
+    df.to_csv(patients_db, index=False)
+
+    stats = migrate_csv_to_sqlite(str(patients_db))
+    assert stats["inserted"] == 1 and stats["changed_fingerprints"] == 1
+    assert count(Patient) == 5 and count(AgentData) == 6
+    with engine.connect() as conn:
+        hba1c = conn.execute(select(PatientLatestState.hba1c).where(PatientLatestState.patient_id == "DM_00003"))
+        assert hba1c.scalar() == 12.5
+
+    assert migrate_csv_to_sqlite(str(patients_db))["inserted"] == 0
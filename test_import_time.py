@@ -0,0 +1,103 @@
+"""
+Startup budget for the MedTwin API
+
+Importing api.py must stay cheap: the LangChain/DeepSeek stack is loaded
+lazily on the first LLM request, not at import time.
+
+Run with pytest, or directly:  python test_import_time.py
+Budgets can be overridden with MEDTWIN_IMPORT_BUDGET_MS / MEDTWIN_COLD_START_BUDGET_MS.
+"""
+
+import os
+import subprocess
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+IMPORT_BUDGET_MS = float(os.environ.get("MEDTWIN_IMPORT_BUDGET_MS", "1500"))
+COLD_START_BUDGET_MS = float(os.environ.get("MEDTWIN_COLD_START_BUDGET_MS", "1000"))
+
+# Modules that must only be imported when an agent is actually needed
+LAZY_MODULES = ("langchain_openai", "langchain_core", "openai")
+
+
+def measure_import(module: str = "api"):
+    """
+    Import `module` in a fresh interpreter with -X importtime.
+
+    Returns:
+        (cumulative_ms, {imported module name: cumulative_us})
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=HERE, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr[-2000:]}")
+
+    modules = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        modules[name.strip()] = int(cumulative)
+    return modules[module] / 1000, modules
+
+
+def measure_cold_start() -> float:
+    """Milliseconds from `import api` to the first /twin/{id} response, in a fresh interpreter"""
+    script = (
+        "import os, time\n"
+        "import httpx  # test client transport, not part of the server's startup\n"
+        "if not os.path.exists('medtwin.db'): print('SKIP'); raise SystemExit\n"
+        "start = time.perf_counter()\n"
+        "import api\n"
+        "from fastapi.testclient import TestClient\n"
+        "from sqlalchemy import inspect\n"
+        "from database import engine, SessionLocal, Patient\n"
+        "if not inspect(engine).has_table('patients'): print('SKIP'); raise SystemExit\n"
+        "db = SessionLocal(); patient = db.query(Patient.id).first(); db.close()\n"
+        "if patient is None: print('SKIP'); raise SystemExit\n"
+        "response = TestClient(api.app).get(f'/twin/{patient[0]}')\n"
+        "assert response.status_code == 200, response.text\n"
+        "print((time.perf_counter() - start) * 1000)\n"
+    )
+    result = subprocess.run([sys.executable, "-c", script], cwd=HERE, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"cold start failed:\n{result.stderr[-2000:]}")
+    last = result.stdout.strip().splitlines()[-1]
+    return None if last == "SKIP" else float(last)
+
+
+def test_api_import_within_budget():
+    elapsed_ms, _ = measure_import("api")
+    assert elapsed_ms <= IMPORT_BUDGET_MS, f"import api took {elapsed_ms:.0f} ms (budget {IMPORT_BUDGET_MS:.0f} ms)"
+
+
+def test_llm_stack_not_imported_eagerly():
+    _, modules = measure_import("api")
+    eager = [m for m in LAZY_MODULES if m in modules]
+    assert not eager, f"import api pulled in {eager}; import them inside the agent initializer"
+
+
+def test_cold_start_to_first_twin_response():
+    elapsed_ms = measure_cold_start()
+    if elapsed_ms is None:
+        import pytest
+        pytest.skip("no patients in the database (run import_csv_to_db.py)")
+    assert elapsed_ms <= COLD_START_BUDGET_MS, \
+        f"first /twin response after {elapsed_ms:.0f} ms (budget {COLD_START_BUDGET_MS:.0f} ms)"
+
+
+if __name__ == "__main__":
+    elapsed_ms, modules = measure_import("api")
+    print(f"import api: {elapsed_ms:.0f} ms (budget {IMPORT_BUDGET_MS:.0f} ms)")
+    slowest = sorted(modules.items(), key=lambda kv: kv[1], reverse=True)[:10]
+    for name, us in slowest:
+        print(f"   {us / 1000:8.1f} ms  {name}")
+    print(f"eager LLM imports: {[m for m in LAZY_MODULES if m in modules] or 'none'}")
+
+    cold_ms = measure_cold_start()
+    if cold_ms is None:
+        print("cold start: skipped (no patients in the database, run import_csv_to_db.py)")
+    else:
+        print(f"cold start to first /twin response: {cold_ms:.0f} ms (budget {COLD_START_BUDGET_MS:.0f} ms)")
@@ -0,0 +1,87 @@
+"""
+JobQueue: in-flight deduplication and pruning of finished jobs
+
+Run with: python -m pytest test_jobs.py
+"""
+
+import asyncio
+import threading
+
+import pytest
+
+from jobs import JobQueue
+
+
+@pytest.fixture
+def queue():
+    q = JobQueue(max_workers=2, max_finished=2)
+    yield q
+    q.shutdown()
+
+
+def test_same_key_in_flight_joins_existing_job(queue):
+    release = threading.Event()
+    calls = []
+
+    def work(value):
+        calls.append(value)
+        release.wait(5)
+        return value * 2
+
+    first, created = queue.submit(("plan", "DM_00001"), work, 21)
+    second, created_again = queue.submit(("plan", "DM_00001"), work, 99)
+    other, other_created = queue.submit(("plan", "DM_00002"), work, 1)
+    assert created and not created_again and other_created
+    assert second is first and other is not first
+
+    release.set()
+    assert first.wait(5) and other.wait(5)
+    assert first.status == "done" and first.result == 42
+    assert sorted(calls) == [1, 21]  # the duplicate never ran
+
+
+def test_key_is_free_again_once_job_finishes(queue):
+    first, _ = queue.submit("key", lambda: 1)
+    assert first.wait(5)
+    second, created = queue.submit("key", lambda: 2)
+    assert created and second is not first
+    assert second.wait(5) and second.result == 2
+
+
+def test_failed_job_records_error_and_releases_key(queue):
+    def fail():
+        raise RuntimeError("LLM unavailable")
+
+    job, _ = queue.submit("key", fail)
+    assert job.wait(5)
+    assert job.status == "error" and job.error == "LLM unavailable"
+    assert queue.submit("key", lambda: None)[1]
+
+
+def test_oldest_finished_jobs_are_pruned(queue):
+    finished = []
+    for i in range(4):
+        job, _ = queue.submit(i, lambda i=i: i)
+        assert job.wait(5)
+        finished.append(job)
+
+    # Pruning runs on submit, keeping the newest max_finished finished jobs
+    last, _ = queue.submit("last", lambda: None)
+    assert last.wait(5)
+    assert queue.get(finished[0].id) is None and queue.get(finished[1].id) is None
+    assert queue.get(finished[2].id) is finished[2] and queue.get(finished[3].id) is finished[3]
+    assert queue.get(last.id) is last
+    assert sum(queue.stats().values()) == 3
+
+
+def test_wait_async_awaits_result(queue):
+    release = threading.Event()
+    job, _ = queue.submit("key", lambda: release.wait(5) and "plan")
+
+    async def scenario():
+        assert not await job.wait_async(timeout=0.05)
+        release.set()
+        return await job.wait_async(timeout=5)
+
+    assert asyncio.run(scenario())
+    assert job.result == "plan"
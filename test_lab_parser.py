@@ -0,0 +1,122 @@
+"""
+lab_parser: rule-based parsing of lab report lines and the twin payload built from them
+
+Run with: python -m pytest test_lab_parser.py
+"""
+
+import os
+
+import pytest
+
+from lab_parser import parse_lab_report, parse_line, parse_reference, to_agent_payload
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def only(line: str):
+    records = parse_line(line)
+    assert len(records) == 1, records
+    return records[0]
+
+
+def test_sample_report_parses_without_llm():
+    with open(os.path.join(HERE, "sample_lab_results.txt")) as f:
+        report = parse_lab_report(f.read())
+
+    assert report.unparsed == []
+    assert report.metadata["Test Date"] == "December 28, 2024"
+    assert len(report.records) == 31
+
+    by_name = {r.name: r for r in report.records}
+    wbc = by_name["WBC Count"]
+    assert (wbc.analyte, wbc.value, wbc.unit, wbc.ref_low, wbc.ref_high, wbc.flag) == \
+        ("WBC", 12.5, "x10^9/L", 4.0, 11.0, "HIGH")
+    assert by_name["Lymphocytes"].flag == "LOW"
+    assert by_name["HDL Cholesterol"].ref_low == 40.0 and by_name["HDL Cholesterol"].flag == "NORMAL"
+    hba1c = by_name["HbA1c"]
+    assert (hba1c.value, hba1c.unit, hba1c.ref_high, hba1c.flag) == (6.2, "%", 5.7, "HIGH")
+
+    payload = to_agent_payload(report)
+    assert {k: v for k, v in payload.items() if k not in ("lab_results", "report_metadata")} == {
+        "Fasting_Blood_Glucose": 118.0, "Cholesterol_Total": 220.0, "Cholesterol_LDL": 145.0,
+        "Cholesterol_HDL": 45.0, "HbA1c": 6.2,
+    }
+    assert len(payload["lab_results"]) == 31
+
+
+@pytest.mark.parametrize("line, unit, flag", [
+    ("Fasting Glucose: 6.0 mmol/L", "mmol/L", "HIGH"),    # the "L" of the unit is not a LOW flag
+    ("Potassium: 4.2 mmol/l", "mmol/l", "UNKNOWN"),
+    ("WBC: 3.1 x10^9/L", "x10^9/L", "UNKNOWN"),
+    ("Hemoglobin: 11 g/dL L", "g/dL", "LOW"),
+    ("Hemoglobin: 11 L", "", "LOW"),
+    ("WBC: 12.5 x10^9/L H", "x10^9/L", "HIGH"),
+    ("HbA1c: 6.2 %", "%", "HIGH"),
+])
+def test_unit_only_lines_keep_unit_and_flag(line, unit, flag):
+    record = only(line)
+    assert (record.unit, record.flag) == (unit, flag)
+
+
+@pytest.mark.parametrize("line, value", [
+    ("Total Cholesterol: 1,234 mg/dL", 1234.0),     # thousands separator
+    ("Platelets: 1,250,000 /uL", 1250000.0),
+    ("Fasting Glucose: 5,5 mmol/L", 5.5),            # decimal comma
+    ("Total Cholesterol: 1,234.5 mg/dL", 1234.5),
+])
+def test_number_separators(line, value):
+    assert only(line).value == value
+
+
+def test_reference_ranges():
+    assert parse_reference("4.0-11.0") == (4.0, 11.0)
+    assert parse_reference("<200") == (None, 200.0)
+    assert parse_reference(">40") == (40.0, None)
+    assert parse_reference("<5.7% normal, 5.7-6.4% prediabetes") == (None, 5.7)
+    assert parse_reference("1,000-2,000") == (1000.0, 2000.0)
+    assert parse_reference("4,0-11,0") == (4.0, 11.0)
+
+
+def test_plain_glucose_is_not_fasting_glucose():
+    record = only("Glucose: 180 mg/dL")
+    assert record.analyte == "Glucose"
+    assert "Fasting_Blood_Glucose" not in to_agent_payload(parse_lab_report("Glucose: 180 mg/dL"))
+    assert only("Glucose (Fasting): 118 mg/dL").analyte == "Fasting Glucose"
+
+
+def test_twin_fields_are_converted_to_twin_units():
+    report = parse_lab_report("\n".join([
+        "Fasting Glucose: 5,5 mmol/L",
+        "HbA1c: 48 mmol/mol",
+        "Total Cholesterol: 5.2 mmol/L",
+        "BMI: 31.2",
+    ]))
+    payload = to_agent_payload(report)
+    assert payload["Fasting_Blood_Glucose"] == 99.0
+    assert payload["HbA1c"] == 6.5
+    assert payload["Cholesterol_Total"] == 201.1
+    assert payload["BMI"] == 31.2
+
+    # Raw values stay as reported in lab_results; bands are judged on the converted value
+    hba1c = payload["lab_results"][1]
+    assert (hba1c["value"], hba1c["unit"], hba1c["status"]) == (48.0, "mmol/mol", "CONTROLLED")
+
+
+def test_unknown_units_and_censored_values_stay_in_lab_results():
+    payload = to_agent_payload(parse_lab_report("\n".join([
+        "HbA1c: 6.2",                   # no unit
+        "Fasting Glucose: 100 mg%",     # unit we don't convert
+        "LDL Cholesterol: <50 mg/dL",   # censored
+    ])))
+    assert set(payload) == {"lab_results"}
+    ldl = payload["lab_results"][2]
+    assert (ldl["qualifier"], ldl["value"], ldl["status"]) == ("<", 50.0, None)
+    assert only("eGFR: >90 mL/min").describe() == "eGFR: >90 mL/min (Unknown)"
+
+
+def test_blood_pressure_and_unparsed_lines():
+    report = parse_lab_report("Blood Pressure: 142/91 mmHg\nUrine: trace protein, see comment\nLIPID PANEL:")
+    assert [(r.analyte, r.value) for r in report.records] == \
+        [("Blood Pressure (Systolic)", 142.0), ("Blood Pressure (Diastolic)", 91.0)]
+    assert report.unparsed == [(2, "Urine: trace protein, see comment")]
+    assert to_agent_payload(report)["Blood_Pressure_Systolic"] == 142.0
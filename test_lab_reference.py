@@ -0,0 +1,77 @@
+"""
+lab_reference: band lookup (gaps between published bands, band edges) and the batch paths
+
+Run with: python -m pytest test_lab_reference.py
+"""
+
+import math
+
+import pytest
+from fastapi.testclient import TestClient
+
+import api
+from lab_reference import LAB_INDEX, LAB_STANDARDS, interpret_column, interpret_lab_value
+
+
+@pytest.mark.parametrize("name, value, status", [
+    ("HbA1c", 6.45, "PREDIABETES"),   # between 6.4 and 6.5: was unclassified
+    ("BMI", 24.95, "NORMAL"),         # between 24.9 and 25.0
+    ("BMI", 29.95, "OVERWEIGHT"),
+    ("Fasting Glucose", 125.5, "PREDIABETES"),
+    ("LDL Cholesterol", 129.5, "NEAR OPTIMAL"),
+])
+def test_values_between_published_bands_are_classified(name, value, status):
+    assert interpret_lab_value(name, value)["status"] == status
+
+
+def edge_cases():
+    """Every band's lower edge (belongs to that band) and the value just below it"""
+    for name, lab in LAB_STANDARDS.items():
+        bands = sorted(lab["ranges"], key=lambda band: band[0])
+        for i, (lower, _, status, _, _) in enumerate(bands):
+            yield name, float(lower), status
+            if i:
+                yield name, lower - 0.01, bands[i - 1][2]
+
+
+@pytest.mark.parametrize("name, value, status", list(edge_cases()))
+def test_band_edges(name, value, status):
+    assert interpret_lab_value(name, value)["status"] == status
+
+
+def test_top_band_is_open_ended_and_bad_values_are_unknown():
+    assert interpret_lab_value("HbA1c", 16.0)["status"] == "CRITICAL"
+    assert interpret_lab_value("HbA1c", -1.0)["status"] == "UNKNOWN"
+    assert interpret_lab_value("HbA1c", math.nan)["status"] == "UNKNOWN"
+    unknown = interpret_lab_value("Ferritin", 80, "ng/mL")
+    assert (unknown["status"], unknown["unit"]) == ("UNKNOWN", "ng/mL")
+    assert interpret_lab_value("a1c", 7.5)["status"] == "SUBOPTIMAL"  # alias
+
+
+def test_interpret_column_matches_single_lookups():
+    for name, lab in LAB_INDEX.items():
+        values = [v for edge in lab.edges for v in (edge - 0.05, edge, edge + 0.05)] + [-1.0, 10_000.0]
+        column = interpret_column(name, values)
+        single = [interpret_lab_value(name, v) for v in values]
+        assert column["status"] == [r["status"] for r in single], name
+        assert column["icon"] == [r["icon"] for r in single], name
+
+
+def test_interpret_column_missing_values_and_unknown_labs():
+    assert interpret_column("HbA1c", [None, 7.2, float("nan")])["status"] == ["UNKNOWN", "SUBOPTIMAL", "UNKNOWN"]
+    assert interpret_column("Ferritin", [1, 2]) is None
+
+
+def test_labs_interpret_endpoint():
+    client = TestClient(api.app)
+    response = client.post("/labs/interpret", json={
+        "panel": {"HbA1c": 6.45, "BMI": 24.95, "Ferritin": 80},
+        "columns": {"LDL Cholesterol": [95, 131, 201, None], "Ferritin": [1]},
+    })
+    assert response.status_code == 200
+    body = response.json()
+    assert body["panel"]["HbA1c"]["status"] == "PREDIABETES"
+    assert body["panel"]["BMI"]["status"] == "NORMAL"
+    assert body["columns"]["LDL Cholesterol"]["status"] == ["OPTIMAL", "BORDERLINE HIGH", "VERY HIGH", "UNKNOWN"]
+    assert body["legend"]["LDL Cholesterol"]["unit"] == "mg/dL"
+    assert sorted(body["unknown"]) == ["Ferritin", "Ferritin"]
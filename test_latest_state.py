@@ -0,0 +1,65 @@
+"""
+patient_latest_state: the trigger merges newer clinical rows and ignores older ones
+
+Run with: python -m pytest test_latest_state.py  (scratch database, see conftest.py)
+"""
+
+from datetime import datetime
+
+from sqlalchemy.orm import Session
+
+from database import engine, ACTION_PLAN_AGENT_TYPE, AgentData, Patient, PatientLatestState, backfill_latest_state
+
+
+def add_record(session, payload, timestamp, agent_type="LabResults") -> int:
+    record = AgentData(patient_id="DM_00001", agent_type=agent_type, data_payload=payload, timestamp=timestamp)
+    session.add(record)
+    session.commit()
+    return record.id
+
+
+def latest(session) -> PatientLatestState:
+    session.expire_all()
+    return session.get(PatientLatestState, "DM_00001")
+
+
+def test_trigger_merges_newer_rows_and_ignores_older_ones(temp_db):
+    with Session(engine) as session:
+        session.add(Patient(id="DM_00001"))
+        session.commit()
+
+        first_id = add_record(session, {"HbA1c": 7.2, "BMI": 31.0}, datetime(2025, 3, 1))
+        merged_id = add_record(session, {"HbA1c": 6.8, "GGT": 40.0}, datetime(2025, 4, 1))
+        state = latest(session)
+        assert state.source_id == merged_id and first_id != merged_id
+        assert state.data_payload == {"HbA1c": 6.8, "BMI": 31.0, "GGT": 40.0}
+        assert (state.hba1c, state.bmi, state.ggt) == (6.8, 31.0, 40.0)
+
+        # A backdated row (e.g. an old lab report uploaded late) must not overwrite newer values
+        add_record(session, {"HbA1c": 9.9, "BMI": 25.0, "Serum_Urate": 5.0}, datetime(2024, 1, 1))
+        state = latest(session)
+        assert state.source_id == merged_id
+        assert state.updated_at == datetime(2025, 4, 1)
+        assert state.data_payload == {"HbA1c": 6.8, "BMI": 31.0, "GGT": 40.0}
+        assert (state.hba1c, state.bmi, state.serum_urate) == (6.8, 31.0, None)
+
+        # Derived agent output (action plans) never reaches the latest state
+        add_record(session, {"HbA1c": 5.0}, datetime(2026, 1, 1), agent_type=ACTION_PLAN_AGENT_TYPE)
+        assert latest(session).source_id == merged_id
+
+
+def test_backfill_replays_history_like_the_trigger(temp_db):
+    with Session(engine) as session:
+        session.add(Patient(id="DM_00001"))
+        session.commit()
+        add_record(session, {"HbA1c": 7.2, "BMI": 31.0}, datetime(2025, 3, 1))
+        merged_id = add_record(session, {"HbA1c": 6.8}, datetime(2025, 4, 1))
+        add_record(session, {"HbA1c": 9.9}, datetime(2024, 1, 1))
+        expected = latest(session).data_payload
+
+        session.query(PatientLatestState).delete()
+        session.commit()
+        assert backfill_latest_state() == 1
+        state = latest(session)
+        assert state.source_id == merged_id
+        assert state.data_payload == expected == {"HbA1c": 6.8, "BMI": 31.0}
@@ -0,0 +1,153 @@
+"""
+llm_cache: hits and misses, TTL expiry, LRU eviction and CachedLLM replay
+
+Run with: python -m pytest test_llm_cache.py
+"""
+
+import asyncio
+import time
+
+import pytest
+from langchain_core.messages import AIMessage, AIMessageChunk
+
+import llm_cache
+import metrics
+from llm_cache import CachedLLM, LLMCache
+
+
+class FakeChatModel:
+    """Counts calls; answers every prompt with the same text, streamed in three chunks"""
+    model_name = "fake-model"
+    temperature = 0.2
+    max_tokens = 256
+
+    def __init__(self, text="Walk 30 minutes after dinner."):
+        self.text = text
+        self.calls = 0
+
+    def _chunks(self):
+        third = len(self.text) // 3
+        return [self.text[:third], self.text[third:2 * third], self.text[2 * third:]]
+
+    def invoke(self, prompt, *args, **kwargs):
+        self.calls += 1
+        return AIMessage(content=self.text)
+
+    async def ainvoke(self, prompt, *args, **kwargs):
+        return self.invoke(prompt)
+
+    def stream(self, prompt, *args, **kwargs):
+        self.calls += 1
+        for part in self._chunks():
+            yield AIMessageChunk(content=part)
+
+    async def astream(self, prompt, *args, **kwargs):
+        for chunk in self.stream(prompt):
+            yield chunk
+
+
+@pytest.fixture
+def cache_path(tmp_path):
+    return str(tmp_path / "llm_cache.db")
+
+
+def lookups(result: str) -> float:
+    return metrics.CACHE_REQUESTS.labels("llm", result).value
+
+
+def test_get_put_and_replacing_a_key(cache_path):
+    cache = LLMCache(cache_path)
+    assert cache.get("a") is None
+    cache.put("a", "first")
+    cache.put("b", "second")
+    assert cache.get("a") == "first"
+
+    cache.put("a", "replaced!")  # same key: one entry, size updated
+    assert cache.get("a") == "replaced!"
+    assert cache.stats()["entries"] == 2
+    assert cache.stats()["bytes"] == len("replaced!") + len("second")
+    assert LLMCache(cache_path).stats()["entries"] == 2  # totals match a fresh count
+
+
+def test_expired_entries_are_misses(cache_path):
+    cache = LLMCache(cache_path, ttl_seconds=0.05)
+    cache.put("a", "soon gone")
+    assert cache.get("a") == "soon gone"
+    time.sleep(0.1)
+    assert cache.get("a") is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_least_recently_used_entries_are_evicted(cache_path, monkeypatch):
+    monkeypatch.setattr(llm_cache, "_TOUCH_INTERVAL", 0.0)  # every hit refreshes last_used
+    cache = LLMCache(cache_path, max_entries=10)
+    for i in range(10):
+        cache.put(f"k{i}", f"response {i}")
+        time.sleep(0.002)
+    assert cache.get("k0") == "response 0"  # now the most recently used
+
+    cache.put("k10", "response 10")  # over the limit: trimmed to 90% (9 entries)
+    assert cache.stats()["entries"] == 9
+    assert cache.get("k1") is None and cache.get("k2") is None
+    assert cache.get("k0") == "response 0" and cache.get("k10") == "response 10"
+
+
+def test_repeated_puts_do_not_trigger_eviction(cache_path):
+    cache = LLMCache(cache_path, max_entries=3)
+    for _ in range(10):
+        cache.put("same", "response")
+    cache.put("other", "response")
+    assert cache.stats()["entries"] == 2
+    assert cache.get("same") == "response"
+
+
+def test_cached_llm_invoke_replays_from_cache(cache_path):
+    model = FakeChatModel()
+    llm = CachedLLM(model, LLMCache(cache_path))
+    hits, misses = lookups("hit"), lookups("miss")
+
+    first = llm.invoke("Plan for DM_00001")
+    second = llm.invoke("Plan for DM_00001")
+    assert model.calls == 1
+    assert first.content == second.content == model.text
+    assert second.response_metadata["cache"] == "hit"
+    assert (lookups("hit") - hits, lookups("miss") - misses) == (1, 1)
+
+    llm.invoke("Plan for DM_00002")  # different prompt
+    assert model.calls == 2
+    assert CachedLLM(model, LLMCache(cache_path)).invoke("Plan for DM_00001").content == model.text  # persisted
+    assert model.calls == 2
+    assert llm.temperature == 0.2  # other attributes pass through
+
+
+def test_cached_llm_stream_replays_complete_streams(cache_path):
+    model = FakeChatModel()
+    llm = CachedLLM(model, LLMCache(cache_path))
+
+    chunks = [chunk.content for chunk in llm.stream("Explain HbA1c")]
+    assert len(chunks) == 3 and "".join(chunks) == model.text
+
+    replay = list(llm.stream("Explain HbA1c"))
+    assert [chunk.content for chunk in replay] == [model.text]
+    assert model.calls == 1
+    assert llm.invoke("Explain HbA1c").content == model.text  # shared with invoke
+    assert model.calls == 1
+
+    # An abandoned stream isn't cached
+    next(iter(llm.stream("Interrupted")))
+    assert llm.cache.get(llm._key("Interrupted")) is None
+
+
+def test_cached_llm_async_paths(cache_path):
+    model = FakeChatModel()
+    llm = CachedLLM(model, LLMCache(cache_path))
+
+    async def scenario():
+        streamed = [chunk.content async for chunk in llm.astream("Async prompt")]
+        replayed = [chunk.content async for chunk in llm.astream("Async prompt")]
+        invoked = await llm.ainvoke("Async prompt")
+        return streamed, replayed, invoked.content
+
+    streamed, replayed, invoked = asyncio.run(scenario())
+    assert len(streamed) == 3 and replayed == [model.text] and invoked == model.text
+    assert model.calls == 1
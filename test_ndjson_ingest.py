@@ -0,0 +1,141 @@
+"""
+NDJSON bulk ingestion: chunking at INGEST_CHUNK_SIZE rows, per-line errors and
+the latest-state merge of the ingested rows
+
+Run with: python -m pytest test_ndjson_ingest.py  (scratch database, see conftest.py)
+"""
+
+import json
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import func, select
+
+import api
+from database import engine, ACTION_PLAN_AGENT_TYPE, AgentData, PatientLatestState
+
+PATIENTS = [f"DM_0000{i}" for i in range(5)]
+START = datetime(2030, 1, 1)  # after the imported rows
+
+
+def line(patient_id, payload, minutes, **extra):
+    timestamp = (START + timedelta(minutes=minutes)).isoformat()
+    return json.dumps({"patient_id": patient_id, "data_payload": payload, "timestamp": timestamp, **extra})
+
+
+@pytest.fixture
+def client(patients_db):
+    with TestClient(api.app) as client:
+        yield client
+
+
+@pytest.fixture
+def chunk_sizes(monkeypatch):
+    """Row counts of each ingest_ndjson_chunk call (one transaction each)"""
+    sizes = []
+    ingest = api.ingest_ndjson_chunk
+
+    def recording(lines, default_agent_type):
+        sizes.append(len(lines))
+        return ingest(lines, default_agent_type)
+
+    monkeypatch.setattr(api, "ingest_ndjson_chunk", recording)
+    return sizes
+
+
+def ingest(client, body, agent_type="LabResults"):
+    response = client.post("/twin/ingest/ndjson", params={"agent_type": agent_type}, content=body)
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def agent_data_count():
+    with engine.connect() as conn:
+        return conn.execute(select(func.count()).select_from(AgentData)).scalar()
+
+
+def latest_payload(patient_id):
+    with engine.connect() as conn:
+        return conn.execute(
+            select(PatientLatestState.data_payload).where(PatientLatestState.patient_id == patient_id)
+        ).scalar_one()
+
+
+@pytest.mark.parametrize("rows, expected", [
+    (api.INGEST_CHUNK_SIZE - 1, [api.INGEST_CHUNK_SIZE - 1]),
+    (api.INGEST_CHUNK_SIZE, [api.INGEST_CHUNK_SIZE]),
+    (2 * api.INGEST_CHUNK_SIZE + 1, [api.INGEST_CHUNK_SIZE, api.INGEST_CHUNK_SIZE, 1]),
+])
+def test_one_body_is_committed_in_chunks(client, chunk_sizes, rows, expected):
+    before = agent_data_count()
+    body = "\n".join(line(PATIENTS[i % 5], {"Glucose_Reading": 100 + i % 50}, i) for i in range(rows)) + "\n"
+    result = ingest(client, body)
+
+    assert chunk_sizes == expected
+    assert (result["status"], result["received"], result["inserted"], result["failed"]) == \
+        ("success", rows, rows, 0)
+    assert agent_data_count() - before == rows
+
+
+def test_lines_split_across_body_chunks(client, chunk_sizes, monkeypatch):
+    monkeypatch.setattr(api, "INGEST_CHUNK_SIZE", 3)
+    body = "".join(line(PATIENTS[i % 5], {"seq": i}, i) + "\n" for i in range(7)).encode()
+    pieces = [body[i:i + 50] for i in range(0, len(body), 50)]  # every line spans body chunks
+
+    result = ingest(client, iter(pieces))
+    assert (result["received"], result["inserted"]) == (7, 7)
+    assert chunk_sizes == [3, 3, 1]
+
+
+def test_malformed_lines_are_reported_by_line_number(client, monkeypatch):
+    monkeypatch.setattr(api, "INGEST_CHUNK_SIZE", 4)  # errors on both sides of chunk boundaries
+    lines = [
+        line("DM_00001", {"HbA1c": 7.0}, 1),                        # 1
+        "{not json",                                                # 2
+        "",                                                         # 3 blank: skipped, still counted
+        "[1, 2]",                                                   # 4
+        line("NOPE", {"HbA1c": 7.0}, 2),                            # 5
+        json.dumps({"data_payload": {"HbA1c": 7.0}}),               # 6
+        line("DM_00002", "7.0", 3),                                 # 7
+        line("DM_00002", {"HbA1c": 7.0}, 4),                        # 8
+        json.dumps({"patient_id": "DM_00003", "data_payload": {}, "timestamp": "yesterday"}),  # 9
+        line("DM_00003", {"HbA1c": 7.0}, 5),                        # 10, no trailing newline
+    ]
+    before = agent_data_count()
+    result = ingest(client, "\n".join(lines))
+
+    assert result["status"] == "partial"
+    assert (result["received"], result["inserted"], result["failed"]) == (9, 3, 6)
+    assert [error["line"] for error in result["errors"]] == [2, 4, 5, 6, 7, 9]
+    assert result["errors"][0]["error"].startswith("Invalid JSON")
+    assert result["errors"][2]["error"] == "Patient NOPE not found"
+    assert not result["errors_truncated"]
+    assert agent_data_count() - before == 3
+
+    missing_type = client.post("/twin/ingest/ndjson", content=line("DM_00001", {"HbA1c": 7.0}, 6)).json()
+    assert missing_type["errors"] == [{"line": 1, "error": "Missing 'agent_type'"}]
+
+
+def test_error_report_is_capped(client, monkeypatch):
+    monkeypatch.setattr(api, "MAX_REPORTED_INGEST_ERRORS", 5)
+    result = ingest(client, "\n".join(["oops"] * 12))
+    assert result["failed"] == 12 and len(result["errors"]) == 5 and result["errors_truncated"]
+
+
+def test_ingested_rows_merge_into_latest_state(client, monkeypatch):
+    monkeypatch.setattr(api, "INGEST_CHUNK_SIZE", 2)
+    imported = latest_payload("DM_00001")
+    body = "\n".join([
+        line("DM_00001", {"HbA1c": 8.4, "Glucose_Reading": 180}, 10),
+        line("DM_00002", {"HbA1c": 6.2}, 10),
+        line("DM_00001", {"HbA1c": 7.9}, 20),                   # newer: wins, in a later chunk
+        line("DM_00001", {"HbA1c": 12.0, "Stale": True}, 5),    # older than the state: ignored
+        line("DM_00001", {"Note": "post-visit"}, 30, agent_type=ACTION_PLAN_AGENT_TYPE),  # derived: not merged
+    ])
+    assert ingest(client, body)["inserted"] == 5
+
+    state = latest_payload("DM_00001")
+    assert state == {**imported, "HbA1c": 7.9, "Glucose_Reading": 180}
+    assert latest_payload("DM_00002")["HbA1c"] == 6.2
+    assert client.get("/twin/DM_00001").json()["metabolic_profile"]["hba1c_percent"] == 7.9
@@ -0,0 +1,117 @@
+"""
+qa_buckets: nearby patients share a prompt, and placeholders are filled back exactly
+
+Run with: python -m pytest test_qa_buckets.py
+"""
+
+import asyncio
+
+import pytest
+
+from medtwin_agents import AnalysisAgent
+from qa_buckets import afill_placeholders_stream, bucket_qa_data, fill_placeholders, fill_placeholders_stream
+
+
+def qa_data(hba1c="9.1", glucose="152", bp="132/84", age="54", bmi="31.2", gender="Female",
+            activity="Low", cv_risk="HIGH (72/100)"):
+    return {
+        "What is your current HbA1c level?": f"{hba1c}%",
+        "What is your fasting blood glucose?": f"{glucose} mg/dL",
+        "Estimated Average Glucose": "214 mg/dL",
+        "What are your blood pressure readings?": f"{bp} mmHg",
+        "LDL Cholesterol": "141 mg/dL",
+        "Do you smoke?": "Never",
+        "How is your physical activity?": activity,
+        "What is your age?": age,
+        "What is your gender?": gender,
+        "BMI?": bmi,
+        "Cardiovascular Risk": cv_risk,
+        "Nephropathy Risk": "MODERATE",
+        "Condition": "Type 2 Diabetes Mellitus",
+    }
+
+
+def test_nearby_patients_get_identical_prompts():
+    first, first_values = bucket_qa_data(qa_data())
+    second, second_values = bucket_qa_data(qa_data(hba1c="9.2", glucose="171", bp="138/88", age="61", bmi="28.4",
+                                                   gender="Male", activity="Moderate", cv_risk="HIGH (79/100)"))
+    assert first == second
+    assert first_values != second_values
+    assert first["What is your current HbA1c level?"] == "[[HbA1c]]% (CRITICAL)"
+    assert first["What are your blood pressure readings?"] == "[[Systolic BP]]/[[Diastolic BP]] mmHg (STAGE 1 HTN)"
+    assert first["Cardiovascular Risk"] == "HIGH ([[Cardiovascular Risk Score]]/100)"
+    assert first["Do you smoke?"] == "Never"  # changes the advice: kept verbatim
+
+    agent = AnalysisAgent(llm=None, bucketed=True)
+    prompts = [agent._recommendations_prompt("diabetes", bucketed, "HIGH", templated=True)
+               for bucketed in (first, second)]
+    assert prompts[0] == prompts[1]
+    assert "9.1" not in prompts[0] and "9.2" not in prompts[0]
+
+
+def test_different_bands_get_different_prompts():
+    base, _ = bucket_qa_data(qa_data(hba1c="9.1"))
+    lower, _ = bucket_qa_data(qa_data(hba1c="7.4"))
+    assert lower["What is your current HbA1c level?"] == "[[HbA1c]]% (SUBOPTIMAL)"
+    assert base != lower
+
+
+def test_placeholders_restore_exact_values():
+    original = qa_data(hba1c="9.15", bp="141/92")
+    bucketed, values = bucket_qa_data(original)
+    assert values["HbA1c"] == "9.15"
+    assert values["Systolic BP"] == "141" and values["Diastolic BP"] == "92"
+    for key, value in original.items():
+        filled = fill_placeholders(str(bucketed[key]), values)
+        assert filled == value or filled.startswith(value + " ("), (key, filled)
+
+    text = "Your HbA1c of [[HbA1c]]% and BP of [[Systolic BP]]/[[Diastolic BP]] need attention, [[Gender]] patient."
+    assert fill_placeholders(text, values) == "Your HbA1c of 9.15% and BP of 141/92 need attention, Female patient."
+    assert fill_placeholders("See [[Unknown]].", values) == "See Unknown."
+
+
+NARRATIVE = "With an HbA1c of [[HbA1c]]% at age [[Age]], aim for [[Projected HbA1c]]% by [[Month]]."
+VALUES = {"HbA1c": "9.1", "Age": "54", "Projected HbA1c": "7.8"}
+FILLED = "With an HbA1c of 9.1% at age 54, aim for 7.8% by Month."
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 5, 7, 11, 16])
+def test_stream_fill_matches_whole_text_for_any_chunking(size):
+    chunks = [NARRATIVE[i:i + size] for i in range(0, len(NARRATIVE), size)]
+    out = list(fill_placeholders_stream(chunks, VALUES))
+    assert "".join(out) == FILLED
+    assert len(out) > 1  # still streamed, not buffered to the end
+
+
+def test_stream_fill_split_inside_brackets():
+    chunks = ["HbA1c: [", "[HbA", "1c]", "]% (was [[", "Age]])"]
+    out = list(fill_placeholders_stream(chunks, VALUES))
+    assert "".join(out) == "HbA1c: 9.1% (was 54)"
+    assert all("[" not in part and "]" not in part for part in out)
+
+
+def test_stream_fill_unterminated_placeholder_at_end():
+    assert "".join(fill_placeholders_stream(["Target: [[HbA1c]]% then [[Proj", "ected"], VALUES)) == \
+        "Target: 9.1% then [[Projected"
+    assert "".join(fill_placeholders_stream(["ends with [", "["], VALUES)) == "ends with [["
+
+    # An opening "[[" that is never closed is released after max_pending characters
+    long_tail = ["[[" + "x" * 10] + ["y" * 10] * 10
+    out = list(fill_placeholders_stream(long_tail, VALUES, max_pending=32))
+    assert "".join(out) == "".join(long_tail)
+    assert len(out) > 1
+
+
+def test_stream_without_values_passes_chunks_through():
+    assert list(fill_placeholders_stream(["a [[", "b]]"], None)) == ["a [[", "b]]"]
+
+
+def test_async_stream_fill_matches_sync():
+    async def chunks():
+        for i in range(0, len(NARRATIVE), 4):
+            yield NARRATIVE[i:i + 4]
+
+    async def collect():
+        return [part async for part in afill_placeholders_stream(chunks(), VALUES)]
+
+    assert "".join(asyncio.run(collect())) == FILLED
@@ -0,0 +1,107 @@
+"""
+Streaming: the SSE endpoints and the agents' stream methods yield the LLM's
+chunks one by one instead of one block at the end
+
+Run with: python -m pytest test_streaming.py  (scratch database, see conftest.py)
+"""
+
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+from langchain_core.messages import AIMessage, AIMessageChunk
+
+import api
+from medtwin_agents import AnalysisAgent, NotifierAgent
+
+ADVICE = ["Walk ", "30 minutes ", "after ", "dinner ", "and ", "check ", "your ", "feet ", "daily."]
+SCHEDULE = ["MEDICATION SCHEDULE\n", "Morning (8:00 AM):\n", "- Metformin - 500mg - with breakfast\n"]
+MEDICATIONS = [{"name": "Metformin", "dosage": "500mg", "frequency": "twice daily", "timing": ["08:00"]}]
+
+
+class StreamingLLM:
+    """Answers severity prompts with HIGH and streams canned chunks; `produced` counts chunks handed out"""
+
+    def __init__(self):
+        self.produced = 0
+
+    def invoke(self, prompt):
+        return AIMessage(content="HIGH")
+
+    def stream(self, prompt):
+        for text in SCHEDULE if "medication schedule" in prompt else ADVICE:
+            self.produced += 1
+            yield AIMessageChunk(content=text)
+
+
+def sse_events(body: str):
+    """[(event, data)] from a text/event-stream body"""
+    events = []
+    for message in body.strip().split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in message.splitlines())
+        events.append((fields["event"], json.loads(fields["data"])))
+    return events
+
+
+@pytest.fixture
+def fake_agents(monkeypatch):
+    llm = StreamingLLM()
+    monkeypatch.setattr(api, "AGENTS_AVAILABLE", True)
+    monkeypatch.setattr(api, "analysis_agent", AnalysisAgent(llm, bucketed=False))
+    monkeypatch.setattr(api, "notifier_agent", NotifierAgent(llm))
+    return llm
+
+
+def test_analyze_with_stream_yields_incrementally():
+    llm = StreamingLLM()
+    analysis, chunks = AnalysisAgent(llm, bucketed=False).analyze_with_stream(
+        {"condition_type": "diabetes", "qa_data": {"What is your current HbA1c level?": "9.1%"}}
+    )
+    assert analysis["severity"] == "HIGH" and analysis["recommendations"] is None
+    assert llm.produced == 0  # the stream starts on first iteration
+
+    assert next(chunks) == ADVICE[0]
+    assert llm.produced == 1
+    assert [ADVICE[0]] + list(chunks) == ADVICE
+    assert llm.produced == len(ADVICE)
+
+
+def test_medication_schedule_stream_yields_incrementally():
+    llm = StreamingLLM()
+    chunks = NotifierAgent(llm).create_medication_schedule_stream(MEDICATIONS)
+    assert next(chunks) == SCHEDULE[0]
+    assert llm.produced == 1
+    assert [SCHEDULE[0]] + list(chunks) == SCHEDULE
+    assert list(NotifierAgent(llm).create_medication_schedule_stream([])) == ["No medications scheduled."]
+
+
+def test_recommendations_stream_endpoint_sends_each_chunk(patients_db, fake_agents):
+    with TestClient(api.app) as client:
+        with client.stream("GET", "/twin/DM_00001/recommendations/stream") as response:
+            assert response.status_code == 200
+            assert response.headers["content-type"].startswith("text/event-stream")
+            events = sse_events(response.read().decode())
+
+    assert [event for event, _ in events] == ["token"] * len(ADVICE) + ["done"]
+    assert [data["text"] for _, data in events[:-1]] == ADVICE
+    assert fake_agents.produced == len(ADVICE)
+
+
+def test_medication_schedule_stream_endpoint_sends_each_chunk(patients_db, fake_agents):
+    with TestClient(api.app) as client:
+        response = client.post("/twin/DM_00001/medication-schedule/stream", json={"medications": MEDICATIONS})
+        assert response.status_code == 200
+        events = sse_events(response.text)
+        assert client.post("/twin/NOPE/medication-schedule/stream", json={"medications": []}).status_code == 404
+
+    assert [event for event, _ in events] == ["token"] * len(SCHEDULE) + ["done"]
+    assert "".join(data["text"] for _, data in events[:-1]) == "".join(SCHEDULE)
+
+
+def test_stream_endpoints_fall_back_when_agents_are_offline(patients_db, monkeypatch):
+    monkeypatch.setattr(api, "AGENTS_AVAILABLE", False)
+    with TestClient(api.app) as client:
+        events = sse_events(client.post("/twin/DM_00001/medication-schedule/stream",
+                                        json={"medications": MEDICATIONS}).text)
+    assert events == [("fallback", {"text": "• Metformin - 500mg - twice daily", "reason": "offline"}),
+                      ("done", {})]
@@ -0,0 +1,120 @@
+"""
+Lab trends: /twin/{patient_id}/trend buckets lab_measurements into at most
+max_points fixed-width windows (mean, min, max, n per non-empty bucket)
+
+Run with: python -m pytest test_trend.py  (scratch database, see conftest.py)
+"""
+
+import random
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import insert
+
+import api
+from database import engine, AgentData, Patient
+
+T0 = datetime(2025, 1, 1)
+T0_MS = 1735689600000
+DAY_MS = 86400000
+
+
+def seed(patient_id, measurements):
+    """measurements: [(days after T0, payload)] inserted as AgentData (the trigger fills lab_measurements)"""
+    with engine.begin() as conn:
+        conn.execute(insert(AgentData), [
+            {"patient_id": patient_id, "agent_type": "LabResults", "data_payload": payload,
+             "timestamp": T0 + timedelta(days=days)}
+            for days, payload in measurements
+        ])
+
+
+@pytest.fixture
+def client(temp_db):
+    with engine.begin() as conn:
+        conn.execute(insert(Patient), [{"id": "DM_00001"}, {"id": "DM_00002"}])
+    with TestClient(api.app) as client:
+        yield client
+
+
+def trend(client, analyte="HbA1c", patient_id="DM_00001", **params):
+    response = client.get(f"/twin/{patient_id}/trend", params={"analyte": analyte, **params})
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def test_buckets_aggregate_and_skip_empty_windows(client):
+    seed("DM_00001", [(0, {"HbA1c": 7.0}), (1, {"HbA1c": 8.0}), (4, {"HbA1c": 9.0}),
+                      (8, {"HbA1c": 6.0}), (9, {"HbA1c": 6.5})])
+    result = trend(client, start_ms=T0_MS, end_ms=T0_MS + 10 * DAY_MS - 1, max_points=5)
+
+    assert result["bucket_ms"] == 2 * DAY_MS
+    assert result["unit"] == "%"
+    assert result["ts_ms"] == [T0_MS + DAY_MS // 2, T0_MS + 4 * DAY_MS, T0_MS + 17 * DAY_MS // 2]
+    assert result["value"] == [7.5, 9.0, 6.25]
+    assert result["min"] == [7.0, 9.0, 6.0]
+    assert result["max"] == [8.0, 9.0, 6.5]
+    assert result["n"] == [2, 1, 2]
+    assert result["count"] == 5
+
+
+def test_range_edges_are_inclusive(client):
+    seed("DM_00001", [(0, {"HbA1c": 7.0}), (2, {"HbA1c": 8.0}), (4, {"HbA1c": 9.0})])
+    result = trend(client, start_ms=T0_MS + 2 * DAY_MS, end_ms=T0_MS + 4 * DAY_MS, max_points=200)
+    assert result["ts_ms"] == [T0_MS + 2 * DAY_MS, T0_MS + 4 * DAY_MS]  # single measurements unchanged
+    assert result["value"] == [8.0, 9.0]
+
+    inside = trend(client, start_ms=T0_MS + 1, end_ms=T0_MS + 4 * DAY_MS - 1)
+    assert inside["value"] == [8.0]
+
+
+def test_defaults_cover_the_whole_history(client):
+    seed("DM_00001", [(0, {"HbA1c": 7.0}), (30, {"HbA1c": 8.0}), (60, {"HbA1c": 9.0})])
+    result = trend(client)
+    assert result["start_ms"] == T0_MS
+    assert result["count"] == 3 and result["n"] == [1, 1, 1]
+
+    one = trend(client, max_points=1)
+    assert (one["value"], one["min"], one["max"], one["n"]) == ([8.0], [7.0], [9.0], [3])
+    assert one["bucket_ms"] >= one["end_ms"] - one["start_ms"] + 1
+
+
+@pytest.mark.parametrize("max_points", [1, 7, 50, 2000])
+def test_matches_reference_bucketing(client, max_points):
+    rng = random.Random(max_points)
+    days = sorted(rng.uniform(0, 90) for _ in range(400))
+    seed("DM_00001", [(d, {"Fasting_Blood_Glucose": round(rng.uniform(80, 250), 1)}) for d in days])
+    start_ms, end_ms = T0_MS, T0_MS + 90 * DAY_MS
+    result = trend(client, analyte="Fasting_Blood_Glucose", start_ms=start_ms, end_ms=end_ms, max_points=max_points)
+    assert result["analyte"] == "Fasting Glucose" and result["unit"] == "mg/dL"
+
+    bucket_ms = -(-(end_ms - start_ms + 1) // max_points)
+    with engine.connect() as conn:
+        stored = conn.exec_driver_sql(
+            "SELECT measured_at, value FROM lab_measurements WHERE analyte = 'Fasting Glucose' ORDER BY measured_at"
+        ).all()
+    buckets = {}
+    for ts, value in stored:
+        buckets.setdefault((ts - start_ms) // bucket_ms, []).append(value)
+    expected = [buckets[key] for key in sorted(buckets)]
+
+    assert result["bucket_ms"] == bucket_ms
+    assert len(result["n"]) == len(expected) <= max_points
+    assert result["n"] == [len(values) for values in expected]
+    assert result["min"] == [min(values) for values in expected]
+    assert result["max"] == [max(values) for values in expected]
+    assert result["value"] == pytest.approx([round(sum(v) / len(v), 2) for v in expected], abs=0.006)
+    assert result["count"] == 400
+
+
+def test_errors_and_empty_trends(client):
+    seed("DM_00001", [(0, {"HbA1c": 7.0})])
+    for max_points in (0, api.MAX_TREND_POINTS + 1):
+        assert client.get("/twin/DM_00001/trend", params={"analyte": "HbA1c", "max_points": max_points}) \
+            .status_code == 400
+    assert client.get("/twin/NOPE/trend", params={"analyte": "HbA1c"}).status_code == 404
+
+    empty = trend(client, patient_id="DM_00002")  # known patient, no measurements
+    assert (empty["count"], empty["ts_ms"], empty["bucket_ms"], empty["unit"]) == (0, [], None, None)
+    assert trend(client, start_ms=T0_MS + DAY_MS, end_ms=T0_MS)["ts_ms"] == []  # reversed range
@@ -0,0 +1,57 @@
+"""
+WriteBehindWriter: group commit, per-row retry and draining on stop()
+
+Run with: python -m pytest test_write_behind.py  (scratch database, see conftest.py)
+"""
+
+import pytest
+from sqlalchemy import func, insert, select
+
+from admission import Overloaded
+from database import engine, GlucoseReading
+from write_behind import WriteBehindWriter
+
+TS = 1735689600000  # 2025-01-01
+
+
+def reading(offset: int, value: float = 100.0) -> dict:
+    return {"patient_id": "DM_00001", "ts_ms": TS + offset, "value": value}
+
+
+def stored_count() -> int:
+    with engine.connect() as conn:
+        return conn.execute(select(func.count()).select_from(GlucoseReading.__table__)).scalar()
+
+
+def test_bad_row_fails_only_its_own_future(temp_db):
+    with engine.begin() as conn:
+        conn.execute(insert(GlucoseReading.__table__), [reading(1)])
+
+    writer = WriteBehindWriter(GlucoseReading.__table__, "test", max_delay=0.5)
+    futures = [writer.submit(reading(offset)) for offset in (0, 1, 2)]  # offset 1 is a duplicate key
+    writer.stop()
+
+    assert futures[0].result(5) is True and futures[2].result(5) is True
+    with pytest.raises(Exception, match="UNIQUE"):
+        futures[1].result(5)
+    assert writer.stats() == {"pending": 0, "committed": 2, "failed": 1, "batches": 1}
+    assert stored_count() == 3
+
+
+def test_stop_commits_everything_already_queued(temp_db):
+    writer = WriteBehindWriter(GlucoseReading.__table__, "test", max_batch=1)
+    futures = [writer.submit(reading(offset)) for offset in range(50)]
+    writer.stop()
+
+    assert all(future.done() and future.result() for future in futures)
+    assert writer.committed == 50 and writer.pending() == 0
+    assert stored_count() == 50
+
+
+def test_submit_refuses_rows_when_queue_is_full():
+    writer = WriteBehindWriter(GlucoseReading.__table__, "test", max_queue=2)
+    writer._thread = object()  # no writer thread: nothing drains the queue
+    writer.submit(reading(0))
+    writer.submit(reading(1))
+    with pytest.raises(Overloaded):
+        writer.submit(reading(2))
@@ -0,0 +1,230 @@
+"""
+Time-Series Storage for MedTwin
+Write-buffered, append-only storage for high-frequency glucose readings,
+and downsampled trend queries over the lab measurement history.
+"""
+
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import cast, func, insert, select, Integer
+
+import metrics
+from admission import Overloaded
+from database import engine, GlucoseReading, LabMeasurement
+
+CGM_READINGS_DROPPED = metrics.counter(
+    "medtwin_cgm_readings_dropped_total",
+    "CGM readings that could not be written and were discarded"
+)
+
+
+class GlucoseWriteBuffer:
+    """
+    Buffers glucose readings in memory and appends them to the
+    glucose_readings table in batches from a single background thread.
+
+    Also keeps the latest reading per patient so twins can be updated
+    without touching the database.
+
+    max_buffer readings wake the flusher early; append() refuses new readings
+    (Overloaded) once max_pending are waiting, so a stalled database can't
+    grow the buffer without limit.
+    """
+
+    def __init__(self, flush_interval: float = 1.0, max_buffer: int = 5000, max_pending: int = 100000):
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+        self.max_pending = max_pending
+        self._buffer: List[Dict] = []
+        self._flushing: List[Dict] = []  # batch being written (still visible to pending_readings)
+        self._latest: Dict[str, Tuple[int, float]] = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.total_written = 0
+        self.total_dropped = 0
+
+    def start(self):
+        """Create the table if needed and start the flusher thread"""
+        if self._thread and self._thread.is_alive():
+            return
+        GlucoseReading.__table__.create(bind=engine, checkfirst=True)
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name="medtwin-cgm-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Flush remaining readings and stop the flusher thread"""
+        self._stopped.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def append(self, patient_id: str, readings: List[Tuple[int, float]]):
+        """
+        Queue (ts_ms, value) readings for a patient
+
+        Raises:
+            Overloaded: max_pending readings are already waiting to be written
+        """
+        if not readings:
+            return
+        if not self._thread:
+            self.start()
+
+        with self._lock:
+            if len(self._buffer) + len(readings) > self.max_pending:
+                raise Overloaded(f"CGM buffer full ({len(self._buffer)} readings waiting)")
+            self._buffer.extend(
+                {"patient_id": patient_id, "ts_ms": ts_ms, "value": value}
+                for ts_ms, value in readings
+            )
+            newest = max(readings)
+            current = self._latest.get(patient_id)
+            if current is None or newest[0] >= current[0]:
+                self._latest[patient_id] = newest
+            full = len(self._buffer) >= self.max_buffer
+
+        if full:
+            self._wake.set()
+
+    def latest(self, patient_id: str) -> Optional[Tuple[int, float]]:
+        """Most recent (ts_ms, value) seen for a patient, if any"""
+        with self._lock:
+            return self._latest.get(patient_id)
+
+    def pending(self) -> int:
+        """Number of readings waiting to be written"""
+        with self._lock:
+            return len(self._buffer)
+
+    def pending_readings(self, patient_id: str, start_ms: int = 0, end_ms: int = None) -> List[Tuple[int, float]]:
+        """(ts_ms, value) readings for a patient that are not in the table yet"""
+        with self._lock:
+            rows = self._flushing + self._buffer
+        return [
+            (row["ts_ms"], row["value"]) for row in rows
+            if row["patient_id"] == patient_id and row["ts_ms"] >= start_ms
+            and (end_ms is None or row["ts_ms"] <= end_ms)
+        ]
+
+    def flush(self) -> int:
+        """
+        Write all buffered readings in one transaction. Returns rows written.
+
+        If the batch fails it is retried row by row, and rows that still fail are
+        dropped (counted in medtwin_cgm_readings_dropped_total), so one bad reading
+        can't hold back everyone else's.
+        """
+        with self._lock:
+            batch, self._buffer = self._buffer, []
+            self._flushing = batch
+        if not batch:
+            return 0
+
+        # Duplicate (patient, timestamp) pairs from device retries are ignored
+        statement = insert(GlucoseReading.__table__).prefix_with("OR IGNORE")
+        written = 0
+        try:
+            with engine.begin() as conn:
+                conn.execute(statement, batch)
+            written = len(batch)
+        except Exception:
+            for row in batch:
+                try:
+                    with engine.begin() as conn:
+                        conn.execute(statement, [row])
+                    written += 1
+                except Exception as e:
+                    self.total_dropped += 1
+                    CGM_READINGS_DROPPED.inc()
+                    print(f"⚠️  CGM reading dropped ({row['patient_id']} @ {row['ts_ms']}): {e}")
+        finally:
+            with self._lock:
+                self._flushing = []
+        self.total_written += written
+        return written
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"⚠️  CGM flush failed: {e}")
+
+
+def glucose_range_query(patient_id: str, start_ms: int = 0, end_ms: int = None):
+    """SELECT of (ts_ms, value) readings for a patient in a time range (one primary-key range scan)"""
+    query = select(GlucoseReading.ts_ms, GlucoseReading.value)\
+        .where(GlucoseReading.patient_id == patient_id)\
+        .where(GlucoseReading.ts_ms >= start_ms)\
+        .order_by(GlucoseReading.ts_ms)
+    if end_ms is not None:
+        query = query.where(GlucoseReading.ts_ms <= end_ms)
+    return query
+
+
+def latest_glucose_query(patient_id: str):
+    """SELECT of a patient's newest (ts_ms, value) reading (a primary-key prefix seek)"""
+    return select(GlucoseReading.ts_ms, GlucoseReading.value)\
+        .where(GlucoseReading.patient_id == patient_id)\
+        .order_by(GlucoseReading.ts_ms.desc())\
+        .limit(1)
+
+
+def read_glucose_range(patient_id: str, start_ms: int = 0, end_ms: int = None) -> List[Tuple[int, float]]:
+    """Read (ts_ms, value) readings for a patient in a time range (one index range scan)"""
+    with engine.connect() as conn:
+        return [(ts_ms, value) for ts_ms, value in conn.execute(glucose_range_query(patient_id, start_ms, end_ms))]
+
+
+def merge_readings(stored: List[Tuple[int, float]], pending: List[Tuple[int, float]]) -> List[Tuple[int, float]]:
+    """Stored readings plus pending ones, in time order (a stored timestamp wins, like INSERT OR IGNORE)"""
+    if not pending:
+        return stored
+    merged = dict(pending[::-1])  # first pending reading per timestamp, as the insert keeps it
+    merged.update(stored)
+    return sorted(merged.items())
+
+
+def first_lab_measurement_query(patient_id: str, analyte: str):
+    """SELECT for the earliest measured_at of one analyte (an index seek, not a scan)"""
+    return select(func.min(LabMeasurement.measured_at))\
+        .where(LabMeasurement.patient_id == patient_id)\
+        .where(LabMeasurement.analyte == analyte)
+
+
+def lab_trend_query(patient_id: str, analyte: str, start_ms: int, end_ms: int, bucket_ms: int):
+    """
+    SELECT for a downsampled trend: one range scan of the lab_measurements primary key,
+    aggregated into fixed-width time buckets starting at start_ms.
+
+    Rows: (ts_ms, value, min, max, n, unit) per non-empty bucket, in time order.
+    ts_ms is the mean time of the bucket's measurements, value their mean, so a bucket
+    holding a single measurement returns it unchanged.
+    """
+    bucket = (LabMeasurement.measured_at - start_ms) // bucket_ms
+    return select(
+            cast(func.avg(LabMeasurement.measured_at), Integer),
+            func.avg(LabMeasurement.value),
+            func.min(LabMeasurement.value),
+            func.max(LabMeasurement.value),
+            func.count(),
+            func.max(LabMeasurement.unit)
+        )\
+        .where(LabMeasurement.patient_id == patient_id)\
+        .where(LabMeasurement.analyte == analyte)\
+        .where(LabMeasurement.measured_at.between(start_ms, end_ms))\
+        .group_by(bucket)\
+        .order_by(bucket)
+
+
+def now_ms() -> int:
+    return int(time.time() * 1000)
@@ -0,0 +1,182 @@
+"""
+Write-Behind Writer for MedTwin
+A single writer thread drains an in-memory queue of rows and commits them to
+SQLite in groups, so concurrent writers share one transaction (and one WAL
+sync) per batch instead of contending for the write lock row by row.
+"""
+
+import asyncio
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import insert
+
+import metrics
+from admission import Overloaded
+from database import engine
+
+# Durability modes
+DURABILITY_ENQUEUE = "enqueue"  # acknowledge once queued (lost if the process dies before the commit)
+DURABILITY_COMMIT = "commit"    # acknowledge once the batch holding the row is committed
+DURABILITY_MODES = (DURABILITY_ENQUEUE, DURABILITY_COMMIT)
+
+_STOP = object()
+
+
+class WriteBehindWriter:
+    """
+    Group-commit writer for one table.
+
+    Rows are queued with submit(); the writer thread takes everything that is
+    waiting (up to max_batch rows, waiting at most max_delay for more) and
+    inserts it in one transaction. Each row gets a Future that resolves when
+    its batch commits, or fails with that row's error.
+    """
+
+    def __init__(self, table, name: str, max_batch: int = 500, max_delay: float = 0.002,
+                 max_queue: int = 10000):
+        self.table = table
+        self.name = name
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._queue: "queue.Queue" = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self.committed = 0
+        self.failed = 0
+        self.batches = 0
+
+    def start(self):
+        """Start the writer thread"""
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name=f"medtwin-writer-{self.name}", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Commit everything queued so far and stop the writer thread"""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread:
+            self._queue.put(_STOP)
+            thread.join()
+
+    def submit(self, row: Dict) -> Future:
+        """
+        Queue one row for insertion.
+
+        Raises:
+            Overloaded: the queue is full (the writer can't keep up)
+        """
+        if not self._thread:
+            self.start()
+        future: Future = Future()
+        try:
+            self._queue.put_nowait((row, future))
+        except queue.Full:
+            raise Overloaded(f"{self.name}: write queue full ({self._queue.maxsize} rows waiting)")
+        return future
+
+    async def write(self, row: Dict, durability: str = DURABILITY_COMMIT) -> bool:
+        """
+        Queue a row from async code; with DURABILITY_COMMIT, await its commit.
+
+        Returns:
+            True if the row is committed, False if it was only queued
+        """
+        future = self.submit(row)
+        if durability == DURABILITY_ENQUEUE:
+            return False
+        await asyncio.wrap_future(future)
+        return True
+
+    def pending(self) -> int:
+        """Rows waiting to be written"""
+        return self._queue.qsize()
+
+    def stats(self) -> Dict[str, int]:
+        return {"pending": self.pending(), "committed": self.committed,
+                "failed": self.failed, "batches": self.batches}
+
+    # ------------------------------------------------------------------
+
+    def _next_batch(self) -> Tuple[List, bool]:
+        """Block for the first row, then collect whatever arrives within max_delay"""
+        batch, stopping = [], False
+        item = self._queue.get()
+        if item is _STOP:
+            return batch, True
+        batch.append(item)
+
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.max_batch:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+            if item is _STOP:
+                stopping = True
+                break
+            batch.append(item)
+        return batch, stopping
+
+    def _commit(self, batch: List):
+        rows = [row for row, _ in batch]
+        start = time.perf_counter()
+        try:
+            with engine.begin() as conn:
+                conn.execute(insert(self.table), rows)
+        except Exception:
+            # Commit row by row so one bad row doesn't fail the whole batch
+            for row, future in batch:
+                try:
+                    with engine.begin() as conn:
+                        conn.execute(insert(self.table), [row])
+                except Exception as e:
+                    self.failed += 1
+                    future.set_exception(e)
+                else:
+                    self.committed += 1
+                    future.set_result(True)
+        else:
+            self.committed += len(batch)
+            for _, future in batch:
+                future.set_result(True)
+        finally:
+            self.batches += 1
+            metrics.WRITE_BATCH_ROWS.labels(self.name).observe(len(batch))
+            metrics.WRITE_COMMIT_SECONDS.labels(self.name).observe(time.perf_counter() - start)
+
+    def _run(self):
+        while True:
+            batch, stopping = self._next_batch()
+            if batch:
+                try:
+                    self._commit(batch)
+                except Exception as e:
+                    print(f"⚠️  {self.name} writer failed: {e}")
+                    for _, future in batch:
+                        if not future.done():
+                            future.set_exception(e)
+            if stopping:
+                # Drain what was queued before stop() so acknowledged rows aren't lost
+                leftover = []
+                while True:
+                    try:
+                        leftover.append(self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+                leftover = [item for item in leftover if item is not _STOP]
+                if leftover:
+                    self._commit(leftover)
+                return